@@ -0,0 +1,1016 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on 18 Oct 2026
+
+@author: agent
+
+Copyright © 2026 agent, Delmic
+
+This file is part of Odemis.
+
+Odemis is free software: you can redistribute it and/or modify it under the terms of the GNU General Public License version 2 as published by the Free Software Foundation.
+
+Odemis is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with Odemis. If not, see http://www.gnu.org/licenses/.
+
+Performance benchmarks of the main hot paths of Odemis, run on the simulated
+microscopes. The results are stored as a JSON file, so that they can be
+compared between commits.
+
+run as:
+./benchmark.py --output results.json
+./benchmark.py --only dataflow,va --compare previous.json
+
+Warning: the backend is (re)started with the simulator configuration needed by
+each benchmark, so any running backend is stopped.
+"""
+
+import argparse
+import datetime
+import json
+import logging
+import math
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import numpy
+
+import odemis
+from odemis import model
+from odemis.util import testing, img
+
+CONFIG_PATH = os.path.join(os.path.dirname(odemis.__file__), "../../install/linux/usr/share/odemis/sim/")
+SECOM_CONFIG = "secom-sim.odm.yaml"
+SPARC2_CONFIG = "sparc2-sim-scanner.odm.yaml"
+METEOR_CONFIG = "meteor-sim.odm.yaml"
+METEOR_TFS3_CONFIG = "meteor-tfs3-sim.odm.yaml"  # with a stigmator
+
+# Metrics whose name ends with one of these suffixes are better when higher.
+# All the other ones (durations) are better when lower.
+HIGHER_IS_BETTER = ("_fps", "_per_s")
+
+
+def _wait_frames(df, n, timeout):
+    """
+    Receive n frames from the dataflow
+    return (list of (float, DataArray)): reception time and data of each frame
+    """
+    frames = []
+    done = threading.Event()
+
+    def on_data(df, data):
+        frames.append((time.time(), data))
+        if len(frames) >= n:
+            done.set()
+
+    df.subscribe(on_data)
+    try:
+        if not done.wait(timeout):
+            logging.warning("Only received %d frames out of %d after %g s", len(frames), n, timeout)
+    finally:
+        df.unsubscribe(on_data)
+    return frames[:n]
+
+
+def _dataflow_stats(frames, frame_dur):
+    """
+    frames (list of (float, DataArray)): as returned by _wait_frames()
+    frame_dur (float): expected duration of the acquisition of a frame
+    return (float, float, float): frames per second, median & 95th percentile latency (ms)
+    """
+    if len(frames) < 2:
+        return 0, float("nan"), float("nan")
+    fps = (len(frames) - 1) / (frames[-1][0] - frames[0][0])
+    # Latency = time between the end of the acquisition and the reception
+    lats = [(t - d.metadata[model.MD_ACQ_DATE] - frame_dur) * 1e3 for t, d in frames
+            if model.MD_ACQ_DATE in d.metadata]
+    if not lats:
+        return fps, float("nan"), float("nan")
+    return fps, statistics.median(lats), float(numpy.percentile(lats, 95))
+
+
+def bench_dataflow():
+    """
+    Frame rate and latency of the camera and the SEM dataflows
+    """
+    ccd = model.getComponent(role="ccd")
+    ebeam = model.getComponent(role="e-beam")
+    sed = model.getComponent(role="se-detector")
+    res = {}
+
+    ccd.binning.value = ccd.binning.clip((2, 2))
+    ccd.exposureTime.value = ccd.exposureTime.clip(0.01)
+    frames = _wait_frames(ccd.data, 50, timeout=60)
+    fps, lat, lat95 = _dataflow_stats(frames, ccd.exposureTime.value)
+    res["ccd_fps"] = fps
+    res["ccd_latency_ms"] = lat
+    res["ccd_latency_p95_ms"] = lat95
+
+    ebeam.scale.value = ebeam.scale.clip((4, 4))
+    ebeam.dwellTime.value = ebeam.dwellTime.range[0]
+    frame_dur = ebeam.dwellTime.value * numpy.prod(ebeam.resolution.value)
+    frames = _wait_frames(sed.data, 20, timeout=60)
+    fps, lat, lat95 = _dataflow_stats(frames, frame_dur)
+    res["sem_fps"] = fps
+    res["sem_latency_ms"] = lat
+    res["sem_latency_p95_ms"] = lat95
+    return res
+
+
+def bench_va(n=200):
+    """
+    Round-trip time of reading, writing and getting notified of a remote VA
+    """
+    ccd = model.getComponent(role="ccd")
+    va = ccd.exposureTime
+    vals = (va.clip(0.01), va.clip(0.02))
+    res = {}
+
+    durs = []
+    for i in range(n):
+        start = time.perf_counter()
+        va.value
+        durs.append(time.perf_counter() - start)
+    res["get_us"] = statistics.median(durs) * 1e6
+
+    durs = []
+    for i in range(n):
+        start = time.perf_counter()
+        va.value = vals[i % 2]
+        durs.append(time.perf_counter() - start)
+    res["set_us"] = statistics.median(durs) * 1e6
+
+    # Time from the setting of the value to the reception of the notification
+    notified = threading.Event()
+
+    def on_value(v):
+        notified.set()
+
+    va.subscribe(on_value)
+    try:
+        durs = []
+        for i in range(n):
+            notified.clear()
+            start = time.perf_counter()
+            va.value = vals[i % 2]
+            if not notified.wait(5):
+                logging.warning("No notification of the VA change received")
+                continue
+            durs.append(time.perf_counter() - start)
+    finally:
+        va.unsubscribe(on_value)
+    if durs:
+        res["notify_us"] = statistics.median(durs) * 1e6
+    return res
+
+
+def bench_semccdmd():
+    """
+    Overhead per pixel of the SEM + CCD (spectrum) synchronized acquisition
+    """
+    from odemis.acq import stream
+
+    ebeam = model.getComponent(role="e-beam")
+    sed = model.getComponent(role="se-detector")
+    spec = model.getComponent(role="spectrometer")
+
+    sems = stream.SEMStream("bench sem", sed, sed.data, ebeam)
+    specs = stream.SpectrumSettingsStream("bench spec", spec, spec.data, ebeam,
+                                          detvas={"exposureTime"})
+    sps = stream.SEMSpectrumMDStream("bench sem-spec", [sems, specs])
+
+    res = {}
+    for exp in (0.001, 0.01):
+        specs.detExposureTime.value = specs.detExposureTime.clip(exp)
+        exp = specs.detExposureTime.value
+        specs.repetition.value = (20, 20)
+        rep = specs.repetition.value
+        npx = rep[0] * rep[1]
+        estimated = sps.estimateAcquisitionTime()
+
+        start = time.time()
+        f = sps.acquire()
+        f.result(timeout=10 + 3 * estimated)
+        dur = time.time() - start
+
+        name = "exp%gms" % (exp * 1e3,)
+        res[name + "_duration_s"] = dur
+        res[name + "_overhead_per_px_ms"] = (dur - npx * exp) / npx * 1e3
+        res[name + "_estimated_s"] = estimated
+    return res
+
+
+def bench_tiled_acquisition():
+    """
+    Throughput of the tiled acquisition (acquisition + stitching) on the simulator
+    """
+    from odemis.acq import stream
+    from odemis.acq.stitching import (acquireTiledArea, estimateTiledAcquisitionTime,
+                                      WEAVER_MEAN, REGISTER_GLOBAL_SHIFT)
+
+    ccd = model.getComponent(role="ccd")
+    light = model.getComponent(role="light")
+    light_filter = model.getComponent(role="filter")
+    stage = model.getComponent(role="stage")
+
+    ccd.binning.value = ccd.binning.clip((1, 1))
+    ccd.exposureTime.value = ccd.exposureTime.clip(0.02)
+    fs = stream.FluoStream("bench fluo", ccd, ccd.data, light, light_filter)
+
+    md = ccd.getMetadata()
+    pxs = md.get(model.MD_PIXEL_SIZE, (1e-6, 1e-6))
+    fov = ccd.resolution.value[0] * pxs[0], ccd.resolution.value[1] * pxs[1]
+    ntiles = 3
+    overlap = 0.2
+    side = (ntiles - (ntiles - 1) * overlap) * 0.99
+    area = (0, 0, fov[0] * side, fov[1] * side)
+    stage.moveAbs({"x": 0, "y": 0}).result()
+
+    estimated = estimateTiledAcquisitionTime([fs], stage, area, overlap=overlap)
+    start = time.time()
+    f = acquireTiledArea([fs], stage, area, overlap=overlap,
+                         registrar=REGISTER_GLOBAL_SHIFT, weaver=WEAVER_MEAN)
+    data = f.result(timeout=60 + 3 * estimated)
+    dur = time.time() - start
+    return {"tiles_per_s": ntiles ** 2 / dur,
+            "duration_s": dur,
+            "output_mpx": data[0].size / 1e6 if data else 0}
+
+
+def _bench_acq_order(streams, nacq):
+    """
+    Hardware reconfiguration time when acquiring several times the same streams
+    (eg, like for each tile of a tiled acquisition)
+    streams (list of Streams): the streams to acquire
+    nacq (int): number of acquisitions in a row
+    return (dict str -> float): the reconfiguration time predicted with the
+      fixed priority order of the streams, and the one predicted and measured
+      with the order picked by the planner.
+    """
+    from odemis.acq import acqmng
+    from odemis.acq.planner import AcquisitionPlanner
+
+    acq_planner = AcquisitionPlanner(streams)
+    fixed_order = acqmng.sortStreams(streams) * nacq
+    fixed = sum(acq_planner.estimateReconfiguration(fixed_order))
+
+    predicted = actual = 0
+    estimated = acqmng.estimateTime(streams)
+    start = time.time()
+    for i in range(nacq):
+        f = acqmng.acquire(streams)
+        data, exp = f.result(timeout=60 + 3 * estimated)
+        if exp:
+            raise exp
+        predicted += sum(t["predicted"] for t in f.reconf_timings.values())
+        actual += sum(t["actual"] for t in f.reconf_timings.values())
+    dur = time.time() - start
+
+    return {"fixed_order_reconf_s": fixed,
+            "predicted_reconf_s": predicted,
+            "actual_reconf_s": actual,
+            "duration_s": dur}
+
+
+def bench_acq_order_secom():
+    """
+    Reconfiguration time of the emission filter wheel between fluorescence streams.
+    The fluorescence streams are always acquired by decreasing emission wavelength,
+    so the order is the same as the fixed one: it mostly checks the prediction.
+    """
+    from odemis.acq import stream
+
+    ccd = model.getComponent(role="ccd")
+    light = model.getComponent(role="light")
+    light_filter = model.getComponent(role="filter")
+    ebeam = model.getComponent(role="e-beam")
+    sed = model.getComponent(role="se-detector")
+
+    ccd.binning.value = ccd.binning.clip((4, 4))
+    ccd.exposureTime.value = ccd.exposureTime.clip(0.01)
+    ebeam.scale.value = ebeam.scale.clip((8, 8))
+    ebeam.dwellTime.value = ebeam.dwellTime.range[0]
+    streams = [stream.SEMStream("bench sem", sed, sed.data, ebeam)]
+    for i in range(3):
+        fs = stream.FluoStream("bench fluo %d" % i, ccd, ccd.data, light, light_filter)
+        fs.emission.value = sorted(fs.emission.choices)[i]
+        streams.append(fs)
+
+    # Start from a filter position which is not used by any stream
+    light_filter.moveAbsSync({"band": max(light_filter.axes["band"].choices)})
+    return _bench_acq_order(streams, 3)
+
+
+def bench_acq_order_sparc():
+    """
+    Reconfiguration time of the optical path between AR and spectrum acquisitions
+    """
+    from odemis.acq import stream, path
+
+    ebeam = model.getComponent(role="e-beam")
+    sed = model.getComponent(role="se-detector")
+    ccd = model.getComponent(role="ccd")
+    spec = model.getComponent(role="spectrometer")
+    opm = path.OpticalPathManager(model.getMicroscope())
+
+    ccd.binning.value = ccd.binning.clip((4, 4))
+    ccd.exposureTime.value = ccd.exposureTime.clip(0.01)
+    semsur = stream.SEMStream("bench sem survey", sed, sed.data, ebeam)
+    sems = stream.SEMStream("bench sem cl", sed, sed.data, ebeam)
+    ars = stream.ARSettingsStream("bench ar", ccd, ccd.data, ebeam, opm=opm)
+    ars.repetition.value = (2, 2)
+    specs = stream.SpectrumSettingsStream("bench spec", spec, spec.data, ebeam, opm=opm)
+    specs.repetition.value = (2, 2)
+    streams = [semsur,
+               stream.SEMARMDStream("bench sem-ar", [sems, ars]),
+               stream.SEMSpectrumMDStream("bench sem-spec", [sems, specs])]
+
+    opm.setPath("mirror-align").result()
+    return _bench_acq_order(streams, 3)
+
+
+def bench_stitching(ntiles=4, tile_size=1024, overlap=0.2):
+    """
+    Throughput of the registration and weaving of tiles
+    """
+    from odemis.acq.stitching import register, weave, REGISTER_GLOBAL_SHIFT, WEAVER_MEAN
+
+    step = int(tile_size * (1 - overlap))
+    size = step * (ntiles - 1) + tile_size
+    full = _fake_image((size, size))
+    pxs = 1e-7
+    tiles = []
+    for i in range(ntiles):
+        for j in range(ntiles):
+            sub = full[i * step:i * step + tile_size, j * step:j * step + tile_size]
+            center = ((j * step + tile_size / 2) * pxs, -(i * step + tile_size / 2) * pxs)
+            md = {model.MD_PIXEL_SIZE: (pxs, pxs), model.MD_POS: center,
+                  model.MD_DIMS: "YX"}
+            tiles.append(model.DataArray(sub.copy(), md))
+
+    start = time.time()
+    reg_tiles = register(tiles, method=REGISTER_GLOBAL_SHIFT)
+    reg_dur = time.time() - start
+    start = time.time()
+    weave(reg_tiles, WEAVER_MEAN)
+    weave_dur = time.time() - start
+    mpx = len(tiles) * tile_size ** 2 / 1e6
+    return {"register_s": reg_dur,
+            "weave_s": weave_dur,
+            "mpx_per_s": mpx / (reg_dur + weave_dur)}
+
+
+def _fake_image(shape, dtype=numpy.uint16):
+    """
+    Generate an image with some structure (so that compression and registration
+    behave like on real data)
+    """
+    rng = numpy.random.default_rng(0)
+    y, x = numpy.ogrid[0:shape[0], 0:shape[1]]
+    im = 1000 + 500 * numpy.sin(x / 23) * numpy.cos(y / 37) + rng.normal(0, 50, shape)
+    for cy, cx in rng.integers(0, min(shape), (50, 2)):
+        im[max(0, cy - 20):cy + 20, max(0, cx - 20):cx + 20] += 2000
+    return im.clip(0, numpy.iinfo(dtype).max).astype(dtype)
+
+
+def bench_tiff(size=4096):
+    """
+    Speed of writing and reading a pyramidal TIFF file
+    """
+    from odemis.dataio import tiff
+
+    md = {model.MD_PIXEL_SIZE: (1e-7, 1e-7), model.MD_POS: (0, 0),
+          model.MD_DIMS: "YX", model.MD_ACQ_DATE: time.time()}
+    da = model.DataArray(_fake_image((size, size)), md)
+    mpx = da.size / 1e6
+    res = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        fn = os.path.join(tmpdir, "bench.ome.tiff")
+        start = time.time()
+        tiff.export(fn, da, pyramid=True)
+        dur = time.time() - start
+        res["export_s"] = dur
+        res["export_mpx_per_s"] = mpx / dur
+        res["file_mb"] = os.path.getsize(fn) / 1e6
+
+        start = time.time()
+        acd = tiff.open_data(fn)
+        das = acd.content[0]
+        res["open_ms"] = (time.time() - start) * 1e3
+
+        # Read a tile at the full resolution, and at the lowest resolution
+        start = time.time()
+        das.getTile(0, 0, 0)
+        res["tile_full_ms"] = (time.time() - start) * 1e3
+        start = time.time()
+        das.getTile(0, 0, das.maxzoom)
+        res["tile_lowest_ms"] = (time.time() - start) * 1e3
+
+        start = time.time()
+        das.getData()
+        dur = time.time() - start
+        res["read_full_s"] = dur
+        res["read_mpx_per_s"] = mpx / dur
+    return res
+
+
+def bench_tiff_index(ntiles=50000, size=64):
+    """
+    Speed of opening a TIFF file containing many images (eg, a tiled acquisition),
+    with and without index file
+    """
+    from odemis.dataio import tiff
+
+    im = _fake_image((size, size))
+    data = []
+    for i in range(ntiles):
+        md = {model.MD_PIXEL_SIZE: (1e-7, 1e-7),
+              model.MD_POS: ((i % 100) * size * 1e-7, (i // 100) * size * 1e-7),
+              model.MD_DESCRIPTION: "tile %d" % (i,),
+              model.MD_DIMS: "YX", model.MD_ACQ_DATE: time.time()}
+        data.append(model.DataArray(im, md))
+
+    res = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        fn = os.path.join(tmpdir, "bench.ome.tiff")
+        start = time.time()
+        tiff.export(fn, data, pyramid=True, index=True)
+        res["export_s"] = time.time() - start
+
+        start = time.time()
+        tiff.AcquisitionDataTIFF(fn, use_index=False)
+        res["open_noindex_s"] = time.time() - start
+
+        start = time.time()
+        acd = tiff.AcquisitionDataTIFF(fn)
+        res["open_index_s"] = time.time() - start
+        if len(acd.content) != ntiles:
+            raise ValueError("Opened %d images instead of %d" % (len(acd.content), ntiles))
+    return res
+
+
+def bench_projection(size=2048, n=10):
+    """
+    Speed of converting an image to RGB, directly and via a stream projection
+    """
+    from odemis.acq.stream import StaticFluoStream, RGBSpatialProjection
+
+    md = {model.MD_PIXEL_SIZE: (1e-7, 1e-7), model.MD_POS: (0, 0),
+          model.MD_IN_WL: (500e-9, 520e-9), model.MD_OUT_WL: (600e-9, 630e-9),
+          model.MD_DIMS: "YX"}
+    da = model.DataArray(_fake_image((size, size)), md)
+    res = {}
+
+    durs = []
+    for i in range(n):
+        start = time.perf_counter()
+        hist, edges = img.histogram(da)
+        irange = img.findOptimalRange(hist, edges, 1 / 256)
+        durs.append(time.perf_counter() - start)
+    res["histogram_ms"] = statistics.median(durs) * 1e3
+
+    durs = []
+    for i in range(n):
+        start = time.perf_counter()
+        img.DataArray2RGB(da, irange, tint=(255, 0, 0))
+        durs.append(time.perf_counter() - start)
+    res["rgb_ms"] = statistics.median(durs) * 1e3
+
+    # Full projection, as done by the GUI, triggered by a change of settings
+    fs = StaticFluoStream("bench fluo", da)
+    proj = RGBSpatialProjection(fs)
+    updated = threading.Event()
+
+    def on_image(im):
+        updated.set()
+
+    proj.image.subscribe(on_image)
+    try:
+        durs = []
+        for i in range(n):
+            updated.clear()
+            start = time.perf_counter()
+            fs.tint.value = (255, i * 20, 0)
+            if not updated.wait(30):
+                logging.warning("Stream projection not updated after 30 s")
+                continue
+            durs.append(time.perf_counter() - start)
+    finally:
+        proj.image.unsubscribe(on_image)
+    if durs:
+        res["stream_update_ms"] = statistics.median(durs) * 1e3
+    res["rgb_mpx_per_s"] = da.size / 1e6 / (res["rgb_ms"] / 1e3)
+    return res
+
+
+def _bench_actuator(actuator, axis, step, n=20):
+    """
+    Latency of small relative moves through a stack of (wrapper) actuators
+    actuator (Actuator): the actuator to move
+    axis (str): the axis to move
+    step (float): distance of each move
+    n (int): number of moves
+    """
+    res = {}
+    call_durs = []
+    move_durs = []
+    for i in range(n):
+        shift = {axis: step if i % 2 else -step}
+        start = time.perf_counter()
+        f = actuator.moveRel(shift)
+        call_durs.append(time.perf_counter() - start)
+        f.result(timeout=60)
+        move_durs.append(time.perf_counter() - start)
+    res["call_ms"] = statistics.median(call_durs) * 1e3
+    res["move_ms"] = statistics.median(move_durs) * 1e3
+
+    # Many moves queued at once (like small steps requested by the GUI)
+    start = time.perf_counter()
+    fs = [actuator.moveRel({axis: step if i % 2 else -step}) for i in range(n)]
+    for f in fs:
+        f.result(timeout=60)
+    res["queued_moves_ms"] = (time.perf_counter() - start) * 1e3
+    return res
+
+
+def bench_meteor_stage():
+    """
+    Latency of the stage moves on the METEOR (MultiplexActuator -> ConvertStage -> TMCM driver)
+    """
+    stage = model.getComponent(role="stage")
+    return _bench_actuator(stage, "y", 1e-6)
+
+
+def bench_zlocalization(nfiducials=4):
+    """
+    Duration of the z localization (SuperZ) of a POI and multiple fiducials on the METEOR
+    """
+    from odemis.acq import stream
+    from odemis.acq.align import z_localization
+    from odemis.acq.feature import Target, TargetType
+    from odemis.acq.move import MicroscopePostureManager
+    from odemis.util import comp
+
+    if not z_localization.psf_extractor:
+        logging.warning("psf_extractor not available, cannot benchmark the z localization")
+        return {}
+
+    ccd = model.getComponent(role="ccd")
+    light = model.getComponent(role="light")
+    light_filter = model.getComponent(role="filter")
+    stigmator = model.getComponent(role="stigmator")
+    focus = model.getComponent(role="focus")
+    z_localization.ensure_stig_calib_format(stigmator)
+    sizes = sorted(stigmator.getMetadata()[model.MD_CALIB].keys())
+
+    posture_manager = MicroscopePostureManager(microscope=model.getMicroscope())
+    pos = posture_manager.sample_stage.position.value
+    fov = comp.compute_camera_fov(ccd)
+    fs = stream.FluoStream("bench fluo", ccd, ccd.data, light, light_filter, focuser=focus)
+    z = focus.position.value["z"]
+
+    pois = [Target(x=pos["x"], y=pos["y"], z=z, name="POI-1", index=1,
+                   type=TargetType.PointOfInterest, fm_focus_position=z)]
+    fiducials = [Target(x=pos["x"] + fov[0] * (i - nfiducials / 2) / (nfiducials + 2),
+                        y=pos["y"] + fov[1] / 8, z=z, name="Fiducial-%d" % (i + 1), index=i + 1,
+                        type=TargetType.Fiducial, fm_focus_position=z)
+                 for i in range(nfiducials)]
+
+    start = time.perf_counter()
+    f = z_localization.measure_z_multi_targets(stigmator, focus, fs, sizes[0], pois,
+                                               sizes[-1], fiducials)
+    f.result(600)
+    dur = time.perf_counter() - start
+    return {"duration_s": dur,
+            "per_target_s": dur / (len(pois) + len(fiducials))}
+
+
+def bench_sparc_mirror():
+    """
+    Latency of the mirror moves on the SPARC (ConvertStage -> TMCM driver)
+    """
+    mirror = model.getComponent(role="mirror-xy")
+    return _bench_actuator(mirror, "x", 1e-6)
+
+
+def bench_tttr(nsyncs=200_000_000, npixels=10000, nbins=256):
+    """
+    Speed and memory usage of decoding the time-tagged events of a (simulated)
+    HydraHarp, and building the lifetime histogram of each pixel
+    """
+    import tracemalloc
+    from odemis.driver.picoquant import FakeT3Generator
+    from odemis.util import tttr
+
+    gen = FakeT3Generator(pixel_syncs=nsyncs // npixels)
+    records = gen.generate(nsyncs)  # ~10M events
+    res = {}
+
+    tracemalloc.start()
+    try:
+        start = time.perf_counter()
+        events, _ = tttr.decode_hh_t3(records)
+        dur_decode = time.perf_counter() - start
+        start = time.perf_counter()
+        hist = tttr.lifetime_histograms(events, npixels, nbins, rebin=16)
+        dur_hist = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    if hist.sum() == 0:
+        raise ValueError("No photon found in the histograms")
+    res["decode_events_per_s"] = records.size / dur_decode
+    res["histogram_events_per_s"] = events.size / dur_hist
+    res["peak_memory_mb"] = peak / 2 ** 20
+    return res
+
+
+def bench_downsample(res=(1024, 256), margin=32, osr=40, nchannels=2, chunk=100000):
+    """
+    Speed of downsampling the over-sampled analog input of the NI DAQ SEM driver,
+    with the numpy and the optimised versions
+    """
+    from odemis.driver.semnidaq import Acquirer, downsample_fast
+    from odemis.util import get_best_dtype_for_acc
+
+    nsamples = res[1] * (res[0] + margin) * osr
+    buffer = numpy.random.randint(-3000, 3000, (nchannels, nsamples), dtype=numpy.int16)
+    acc_dtype = get_best_dtype_for_acc(buffer.dtype, osr)
+    res_metrics = {}
+
+    data = numpy.empty((nchannels, res[1], res[0]), dtype=buffer.dtype)
+    samples_n, samples_sum = [0] * nchannels, [0] * nchannels
+    start = time.perf_counter()
+    for i in range(0, nsamples, chunk):
+        for c in range(nchannels):
+            samples_n[c], samples_sum[c] = Acquirer._downsample_data(
+                data[c], res, margin, i, osr, buffer[c, i:i + chunk],
+                samples_n[c], samples_sum[c], acc_dtype)
+    res_metrics["numpy_samples_per_s"] = buffer.size / (time.perf_counter() - start)
+
+    if downsample_fast:
+        samples_n, samples_sum = [0] * nchannels, [0] * nchannels
+        start = time.perf_counter()
+        for i in range(0, nsamples, chunk):
+            samples_n, samples_sum = downsample_fast.downsample(
+                data, buffer[:, i:i + chunk], margin, i, osr, samples_n, samples_sum)
+        res_metrics["fast_samples_per_s"] = buffer.size / (time.perf_counter() - start)
+    else:
+        logging.warning("downsample_fast not available, only benchmarking the numpy version")
+
+    return res_metrics
+
+
+def bench_linespectrum(shape=(1024, 500, 500), width=3, n=10):
+    """
+    Latency of computing the spectrum along a line, while the line is dragged
+    over a spectrum cube (shape CYX), with scipy's map_coordinates (as done
+    previously), and with the precomputed sampling geometry
+    """
+    from scipy import ndimage
+
+    cube = numpy.random.randint(0, 4000, shape, dtype=numpy.uint16)
+    res = {}
+
+    # The end of the line moves a bit at every step, as when dragged by the user
+    start = (shape[2] * 0.1, shape[1] * 0.2)
+    ends = [(shape[2] * 0.8 - i, shape[1] * 0.7 + i / 2) for i in range(n)]
+
+    durs = []
+    for end in ends:
+        t0 = time.perf_counter()
+        v = (end[0] - start[0], end[1] - start[1])
+        l = math.hypot(*v)
+        npts = 1 + int(l)
+        pv = (-v[1] / l, v[0] / l)
+        spread = (width - 1) / 2
+        coord = numpy.empty((3, width, npts, shape[0]))
+        coord[0] = numpy.arange(shape[0])
+        coord[2] = (numpy.linspace(start[0], end[0], npts)[:, None] +
+                    numpy.linspace(pv[0] * -spread, pv[0] * spread, width)[:, None, None])
+        coord[1] = (numpy.linspace(start[1], end[1], npts)[:, None] +
+                    numpy.linspace(pv[1] * -spread, pv[1] * spread, width)[:, None, None])
+        ndimage.map_coordinates(cube, coord, output=float, order=1).mean(axis=0)
+        durs.append(time.perf_counter() - t0)
+    res["map_coordinates_ms"] = statistics.median(durs) * 1e3
+
+    durs = []
+    for end in ends:
+        t0 = time.perf_counter()
+        sampling = img.get_line_sampling(shape[1:], start, end, width)
+        img.apply_spatial_sampling(cube, sampling).T / width
+        durs.append(time.perf_counter() - t0)
+    res["sampling_ms"] = statistics.median(durs) * 1e3
+
+    # Temporal/angular spectrum: mean of a spot, at every step on a different position
+    durs = []
+    for end in ends:
+        t0 = time.perf_counter()
+        img.mean_within_circle(cube, end, 5)
+        durs.append(time.perf_counter() - t0)
+    res["circle_mean_ms"] = statistics.median(durs) * 1e3
+
+    return res
+
+
+def bench_spot_grid(n=10):
+    """
+    Speed of finding a grid of spots (as for the multibeam and overlay
+    calibrations), with a full resolution search, a search on a binned image,
+    and a search around the previous positions. The maximum difference (px)
+    with the full resolution search is reported, as accuracy guard.
+    """
+    from odemis.util import spot, synthetic
+    from odemis.util.registration import estimate_grid_orientation_from_img, unit_gridpoints
+    from odemis.util.transform import AffineTransform, SimilarityTransform
+
+    rng = numpy.random.default_rng(0)
+    res = {}
+
+    def sorted_ji(ji):
+        return ji[numpy.lexsort((ji[:, 1], ji[:, 0]))]
+
+    def time_search(name, image, sigma, num_spots, ref, **kwargs):
+        durs = []
+        for i in range(n):
+            start = time.perf_counter()
+            ji = spot.find_spot_positions(image, sigma, threshold_rel=0.2, num_spots=num_spots, **kwargs)
+            durs.append(time.perf_counter() - start)
+        res[name + "_ms"] = statistics.median(durs) * 1e3
+        if ref is not None:
+            ji = sorted_ji(ji)
+            if ji.shape != ref.shape:
+                logging.warning("%s found %d spots instead of %d", name, len(ji), len(ref))
+                res[name + "_max_error_px"] = float("inf")
+            else:
+                res[name + "_max_error_px"] = float(numpy.abs(ji - ref).max())
+        return ji
+
+    # 8x8 grid, on the full diagnostic camera (as in the FASTEM beam shift correction)
+    sigma = 1.45
+    tform = AffineTransform(matrix=numpy.array([(33, -3), (5, 41)]), translation=numpy.array([770, 1030]))
+    loc = tform.apply(unit_gridpoints((8, 8), mode="ji"))
+    image = synthetic.psf_gaussian((1542, 2056), loc, sigma)
+    image = (image / image.max() * 1000 + rng.poisson(20, image.shape)).astype(numpy.uint16)
+    ref = sorted_ji(time_search("grid8x8_full", image, sigma, 64, None))
+    time_search("grid8x8_binned", image, sigma, 64, ref, binning=4)
+    time_search("grid8x8_seeded", image, sigma, 64, ref, seed=loc + rng.uniform(-3, 3, loc.shape))
+
+    durs = []
+    prior = SimilarityTransform(matrix=numpy.array([(35, -4), (4, 35)]), translation=numpy.array([770, 1030]))
+    for i in range(n):
+        start = time.perf_counter()
+        estimate_grid_orientation_from_img(image, (8, 8), AffineTransform, sigma, prior=prior)
+        durs.append(time.perf_counter() - start)
+    res["grid8x8_orientation_seeded_ms"] = statistics.median(durs) * 1e3
+
+    # 64 randomly placed spots (as in the overlay calibration)
+    sigma = 2.0
+    loc = rng.uniform(40, 984, (64, 2))
+    loc = loc[numpy.all(numpy.hypot(*(loc[:, None] - loc[None]).transpose(2, 0, 1)) + 1000 * numpy.eye(len(loc)) > 25, axis=1)]
+    image = synthetic.psf_gaussian((1024, 1024), loc, sigma)
+    image = (image / image.max() * 1000 + rng.poisson(20, image.shape)).astype(numpy.uint16)
+    ref = sorted_ji(time_search("spots64_full", image, sigma, len(loc), None, min_distance=12))
+    time_search("spots64_binned", image, sigma, len(loc), ref, min_distance=12, binning=4)
+    time_search("spots64_seeded", image, sigma, len(loc), ref, min_distance=12,
+                seed=loc + rng.uniform(-3, 3, loc.shape))
+
+    return res
+
+
+def bench_simsem(n=50):
+    """
+    Frame rate of the SEM simulator, when sending the frames as soon as they are
+    generated (ie, without waiting for the scanning duration), for various scan
+    settings and with defocus. It's the maximum frame rate that the rest of the
+    acquisition pipeline can be tested with.
+    """
+    from odemis.driver import simsem
+
+    sem = simsem.SimSEM("SEM", "sem", image="simsem-fake-output.h5",
+                        children={"scanner": {"name": "EBeam", "role": "e-beam"},
+                                  "detector0": {"name": "SED", "role": "se-detector", "max_rate": True},
+                                  "focus": {"name": "EBeam focus", "role": "ebeam-focus"}})
+    try:
+        ebeam = next(c for c in sem.children.value if c.role == "e-beam")
+        sed = next(c for c in sem.children.value if c.role == "se-detector")
+        focus = next(c for c in sem.children.value if c.role == "ebeam-focus")
+        max_res = ebeam.resolution.range[1]
+        res = {}
+
+        for name, scale in (("full", 1), ("scale4", 4), ("fractional", 1.5)):
+            ebeam.scale.value = (scale, scale)
+            ebeam.resolution.value = (int(max_res[0] / scale), int(max_res[1] / scale))
+            frames = _wait_frames(sed.data, n, timeout=60)
+            res["sim_%s_fps" % name] = _dataflow_stats(frames, 0)[0]
+
+        focus.moveRel({"z": 1e-4}).result()  # => the image is blurred
+        frames = _wait_frames(sed.data, n, timeout=60)
+        res["sim_defocus_fps"] = _dataflow_stats(frames, 0)[0]
+    finally:
+        sem.terminate()
+
+    return res
+
+
+# name -> (simulator config file, or None if no backend is needed, function)
+BENCHMARKS = {
+    "dataflow": (SECOM_CONFIG, bench_dataflow),
+    "va": (SECOM_CONFIG, bench_va),
+    "tiledacq": (SECOM_CONFIG, bench_tiled_acquisition),
+    "acqorder_secom": (SECOM_CONFIG, bench_acq_order_secom),
+    "acqorder_sparc": (SPARC2_CONFIG, bench_acq_order_sparc),
+    "semccdmd": (SPARC2_CONFIG, bench_semccdmd),
+    "sparcmirror": (SPARC2_CONFIG, bench_sparc_mirror),
+    "meteorstage": (METEOR_CONFIG, bench_meteor_stage),
+    "zlocalization": (METEOR_TFS3_CONFIG, bench_zlocalization),
+    "stitching": (None, bench_stitching),
+    "tiff": (None, bench_tiff),
+    "tiffindex": (None, bench_tiff_index),
+    "projection": (None, bench_projection),
+    "tttr": (None, bench_tttr),
+    "downsample": (None, bench_downsample),
+    "linespectrum": (None, bench_linespectrum),
+    "spotgrid": (None, bench_spot_grid),
+    "simsem": (None, bench_simsem),
+}
+
+
+def _get_commit():
+    """
+    return (str or None): the git commit of the odemis source code, if available
+    """
+    try:
+        out = subprocess.check_output(["git", "describe", "--always", "--dirty"],
+                                      cwd=os.path.dirname(odemis.__file__),
+                                      stderr=subprocess.DEVNULL)
+        return out.decode("utf-8").strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(names, config_path, repeat=1):
+    """
+    Run the given benchmarks, grouped by simulator configuration
+    names (list of str): benchmarks to run
+    config_path (str): directory containing the simulator configuration files
+    repeat (int): number of times each benchmark is run. The median of each metric is reported.
+    return (dict str -> dict str -> float): benchmark name -> metric name -> value
+    """
+    results = {}
+    # Run the benchmarks which don't need a backend first, then group by config,
+    # to avoid restarting the backend too often.
+    ordered = sorted(names, key=lambda n: BENCHMARKS[n][0] or "")
+    backend_started = False
+    try:
+        for name in ordered:
+            config, fn = BENCHMARKS[name]
+            if config:
+                testing.start_backend(os.path.join(config_path, config))
+                backend_started = True
+            logging.info("Running benchmark %s...", name)
+            runs = []
+            for i in range(repeat):
+                try:
+                    runs.append(fn())
+                except Exception:
+                    logging.exception("Benchmark %s failed", name)
+                    break
+            if runs:
+                results[name] = {k: float(statistics.median(r[k] for r in runs if k in r))
+                                 for k in runs[0]}
+                for k, v in sorted(results[name].items()):
+                    logging.info("%s.%s = %g", name, k, v)
+    finally:
+        if backend_started:
+            testing.stop_backend()
+
+    return results
+
+
+def compare_results(old, new, tolerance):
+    """
+    Print the difference between two benchmark results
+    old (dict): previous results (as stored in the JSON file)
+    new (dict): current results
+    tolerance (0<float): ratio above which a change is considered a regression
+    return (list of str): the metrics (as "benchmark.metric") which regressed
+    """
+    regressions = []
+    print("%-45s %12s %12s %8s" % ("metric", "previous", "current", "change"))
+    for bname, metrics in sorted(new["results"].items()):
+        old_metrics = old.get("results", {}).get(bname, {})
+        for mname, val in sorted(metrics.items()):
+            full_name = "%s.%s" % (bname, mname)
+            if mname not in old_metrics:
+                print("%-45s %12s %12.4g" % (full_name, "-", val))
+                continue
+            prev = old_metrics[mname]
+            change = (val - prev) / abs(prev) if prev else 0
+            if mname.endswith(HIGHER_IS_BETTER):
+                worse = change < -tolerance
+            else:
+                worse = change > tolerance
+            print("%-45s %12.4g %12.4g %+7.1f%%%s" % (full_name, prev, val, change * 100,
+                                                     " REGRESSION" if worse else ""))
+            if worse:
+                regressions.append(full_name)
+    return regressions
+
+
+def main(args):
+    """
+    Handles the command line arguments
+    args is the list of arguments passed
+    return (int): value to return to the OS as program exit code
+    """
+    parser = argparse.ArgumentParser(description="Benchmark Odemis on simulated microscopes")
+    parser.add_argument("--only", dest="only",
+                        help="comma separated list of the benchmarks to run, among: %s (default: all)" %
+                             (", ".join(BENCHMARKS),))
+    parser.add_argument("--output", "-o", dest="output",
+                        help="JSON file where to store the results")
+    parser.add_argument("--compare", "-c", dest="compare",
+                        help="JSON file of previous results, to compare with")
+    parser.add_argument("--tolerance", dest="tolerance", type=float, default=0.2,
+                        help="relative change considered a regression when comparing (default: 0.2)")
+    parser.add_argument("--repeat", "-r", dest="repeat", type=int, default=1,
+                        help="number of runs of each benchmark (default: 1)")
+    parser.add_argument("--config-path", dest="config_path", default=CONFIG_PATH,
+                        help="directory of the simulator configuration files")
+    parser.add_argument("--log-level", dest="loglev", metavar="<level>", type=int,
+                        default=1, help="set verbosity level (0-2, default = 1)")
+
+    options = parser.parse_args(args[1:])
+
+    # Set up logging before everything else
+    if options.loglev < 0:
+        logging.error("Log-level must be positive.")
+        return 127
+    loglev_names = [logging.WARNING, logging.INFO, logging.DEBUG]
+    loglev = loglev_names[min(len(loglev_names) - 1, options.loglev)]
+    logging.getLogger().setLevel(loglev)
+
+    try:
+        if options.only:
+            names = [n.strip() for n in options.only.split(",")]
+            for n in names:
+                if n not in BENCHMARKS:
+                    raise ValueError("Unknown benchmark %s" % (n,))
+        else:
+            names = list(BENCHMARKS)
+
+        old = None
+        if options.compare:
+            with open(options.compare) as f:
+                old = json.load(f)
+
+        results = {
+            "date": datetime.datetime.now().isoformat(),
+            "commit": _get_commit(),
+            "version": odemis.__version__,
+            "host": platform.node(),
+            "python": platform.python_version(),
+            "cpus": os.cpu_count(),
+            "results": run_benchmarks(names, options.config_path, options.repeat),
+        }
+
+        if options.output:
+            with open(options.output, "w") as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+            logging.info("Results saved to %s", options.output)
+        else:
+            json.dump(results, sys.stdout, indent=2, sort_keys=True)
+            print()
+
+        if old is not None:
+            regressions = compare_results(old, results, options.tolerance)
+            if regressions:
+                logging.warning("%d metrics regressed: %s", len(regressions), ", ".join(regressions))
+                return 1
+    except KeyboardInterrupt:
+        logging.info("Interrupted before the end of the execution")
+        return 1
+    except ValueError as exp:
+        logging.error("%s", exp)
+        return 127
+    except Exception:
+        logging.exception("Unexpected error while performing action.")
+        return 127
+
+    return 0
+
+
+if __name__ == '__main__':
+    ret = main(sys.argv)
+    logging.shutdown()
+    exit(ret)
@@ -124,7 +124,13 @@ extensions = [
         [os.path.join("src", "odemis", "util", "img_fast.pyx")],
         define_macros=[("NPY_NO_DEPRECATED_API", "NPY_1_7_API_VERSION")],
         include_dirs=[numpy.get_include()]
-    )
+    ),
+    Extension(
+        "odemis.util.downsample_fast",
+        [os.path.join("src", "odemis", "util", "downsample_fast.pyx")],
+        define_macros=[("NPY_NO_DEPRECATED_API", "NPY_1_7_API_VERSION")],
+        include_dirs=[numpy.get_include()]
+    ),
 ]
 
 dist = setup(name='Odemis',
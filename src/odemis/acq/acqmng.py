@@ -28,21 +28,24 @@ from collections.abc import Iterable
 from concurrent.futures import CancelledError
 import logging
 import os
+import queue
 import threading
 from typing import Set, Dict
 
 from odemis import model
 from odemis.acq import _futures
+from odemis.acq.planner import AcquisitionPlanner, orderZLevels
 from odemis.acq.stream import FluoStream, SEMCCDMDStream, SEMMDStream, SEMTemporalMDStream, \
     OverlayStream, OpticalStream, EMStream, ScannedFluoStream, ScannedFluoMDStream, \
-    ScannedRemoteTCStream, ScannedTCSettingsStream
+    ScannedRemoteTCStream, ScannedTCSettingsStream, LiveStream
 from odemis.util import img, fluo, executeAsyncTask, almost_equal
 import time
 import copy
+import numpy
 from odemis.model import prepare_to_listen_to_more_vas
 from concurrent.futures._base import CANCELLED, FINISHED, RUNNING
 from odemis.util.driver import guessActuatorMoveDuration
-from odemis.util.img import assembleZCube
+from odemis.util.img import assembleZCube, zCubeToDataArray
 
 # This is the "manager" of an acquisition. The basic idea is that you give it
 # a list of streams to acquire, and it will acquire them in the best way in the
@@ -69,6 +72,9 @@ def acquire(streams, settings_obs=None):
         to receive the result of the task, which is a tuple:
             (list of model.DataArray): the raw acquisition data
             (Exception or None): exception raised during the acquisition
+        It has an extra attribute .reconf_timings (dict str -> dict str -> float),
+        which contains for each stream name, the "predicted" and "actual" duration
+        of the reconfiguration of the hardware before acquiring the stream.
     """
 
     # create a future
@@ -77,6 +83,7 @@ def acquire(streams, settings_obs=None):
     # create a task
     task = AcquisitionTask(streams, future, settings_obs)
     future.task_canceller = task.cancel # let the future cancel the task
+    future.reconf_timings = task.reconf_timings
 
     # connect the future to the task and run in a thread
     executeAsyncTask(future, task.run)
@@ -85,21 +92,29 @@ def acquire(streams, settings_obs=None):
     return future
 
 
-def acquireZStack(streams, zlevels, settings_obs=None):
+def acquireZStack(streams, zlevels, settings_obs=None, hot=False):
     """
     The acquisition manager of a zstack
     streams (list of Stream): the streams to be acquired
     zlevels (dict Stream -> list of floats): a dictionary containing the streams and the
     corresponding lists of actuator z positions
     settings_obs (SettingsObserver): VAs to be integrated in the acquired data as metadata
-    return (ProgressiveFuture): the future that will be executing the task
+    hot (bool): if True, the streams which support it are prepared only once,
+      and their detector is kept armed (software triggered) for all the z levels.
+      The next focus move is started as soon as a plane is received. Streams
+      which do not support it are acquired the standard way.
+    return (ProgressiveFuture): the future that will be executing the task.
+      It has an extra attribute .plane_timings (dict str -> list of dict str -> float),
+      which contains for each stream name acquired in hot mode, the duration
+      of each step ("move", "acquire", "store") for every z level.
     """
     # create future
     future = model.ProgressiveFuture()
     # create acquisition task
-    acqui_task = ZStackAcquisitionTask(future, streams, zlevels, settings_obs)
+    acqui_task = ZStackAcquisitionTask(future, streams, zlevels, settings_obs, hot)
     # add the ability of cancelling the future during execution
     future.task_canceller = acqui_task.cancel
+    future.plane_timings = acqui_task.plane_timings
 
     # set the progress of the future
     total_duration = acqui_task.estimate_total_duration()
@@ -116,7 +131,7 @@ class ZStackAcquisitionTask(object):
     This class represents an acquisition task for a zstack of data.
     """
 
-    def __init__(self, future, streams, zlevels, settings_obs):
+    def __init__(self, future, streams, zlevels, settings_obs, hot=False):
         """
         The class constructor
         future (ProgressiveFuture): the future that will execute the task asynchronously
@@ -124,15 +139,21 @@ class ZStackAcquisitionTask(object):
         zlevels (dict Stream -> list of floats): a dictionary containing the streams and the
         corresponding lists of actuator z positions
         settings_obs (SettingsObserver): VAs to be integrated in the acquired data as metadata
+        hot (bool): if True, acquire the zstack of the compatible streams while
+          keeping the stream active and the detector armed (see acquireZStack())
         """
         self._main_future = future
         self._future_lock = threading.Lock()
         self._actuator_f = None
         self._single_acqui_f = None
         self._future_state = RUNNING
-        self._streams = sortStreams(streams)
+        self._streams = sortStreams(streams)  # Final order computed when running
         self._zlevels = zlevels
         self._settings_obs = settings_obs
+        self._hot = hot
+        self._hot_queue = None  # queue.Queue receiving the frames during a hot zstack
+        # stream name -> list of dict (step -> duration in s), for each plane acquired in hot mode
+        self.plane_timings = {}
         self._zstep_duration = {}
         for s, z in zlevels.items():
             if len(z) > 1:
@@ -151,6 +172,9 @@ class ZStackAcquisitionTask(object):
             self._actuator_f.cancel()
         if self._single_acqui_f:
             self._single_acqui_f.cancel()
+        hot_queue = self._hot_queue
+        if hot_queue:
+            hot_queue.put(None)  # wake up the hot zstack acquisition
         return True
 
     def estimate_total_duration(self):
@@ -166,6 +190,10 @@ class ZStackAcquisitionTask(object):
         """
         remaining_t = self.estimate_total_duration()
         acquired_data = []
+        exp = None
+        # Reorder the streams to minimize the hardware reconfiguration. Done here,
+        # and not at init, as it reads the hardware state.
+        self._streams = AcquisitionPlanner(self._streams).plan(_weight_stream)[0]
         # iterate through streams
         for stream in self._streams:
             zstack = []
@@ -199,9 +227,21 @@ class ZStackAcquisitionTask(object):
                 remaining_t -= stream.estimateAcquisitionTime()
                 self._main_future.set_progress(remaining_time=remaining_t)
 
+            elif self._hot and self._can_acquire_hot(stream):
+                try:
+                    zcube, remaining_t = self._acquire_hot_zstack(stream, remaining_t)
+                except CancelledError:
+                    raise
+                except Exception as e:
+                    logging.exception("The hot zstack acquisition of stream %s failed", stream.name.value)
+                    return acquired_data, e
+                acquired_data.append(zcube)
+
             else:
-                # for each stream, iterate through zlevels
-                for i, z in enumerate(self._zlevels[stream]):
+                # for each stream, iterate through zlevels, starting from the
+                # closest end of the stack
+                zlevels = orderZLevels(self._zlevels[stream], self._get_focus_pos(stream))
+                for i, z in enumerate(zlevels):
                     # move the focuser
                     self._actuator_f = stream.focuser.moveAbs({"z": z})
                     self._actuator_f.result()
@@ -211,7 +251,7 @@ class ZStackAcquisitionTask(object):
                         raise CancelledError()
 
                     # subtract one zstep time
-                    if i != len(self._zlevels[stream]) - 1:
+                    if i != len(zlevels) - 1:
                         remaining_t -= self._zstep_duration[stream]
                         self._main_future.set_progress(remaining_time=remaining_t)
 
@@ -246,7 +286,7 @@ class ZStackAcquisitionTask(object):
                     remaining_t -= stream.estimateAcquisitionTime()
                     self._main_future.set_progress(remaining_time=remaining_t)
 
-                zcube = assembleZCube(zstack, self._zlevels[stream])
+                zcube = assembleZCube(zstack, zlevels)
                 acquired_data.append(zcube)
 
         # state that the future has finished
@@ -255,6 +295,150 @@ class ZStackAcquisitionTask(object):
 
         return acquired_data, exp
 
+    @staticmethod
+    def _get_focus_pos(stream):
+        """
+        return (float or None): the current position of the focus of the stream,
+          or None if it cannot be read
+        """
+        try:
+            return stream.focuser.position.value["z"]
+        except Exception:
+            logging.warning("Failed to read the focus position of %s", stream.name.value)
+            return None
+
+    @staticmethod
+    def _can_acquire_hot(stream):
+        """
+        Check whether a stream can be acquired with the detector kept armed
+        return (bool): True if the stream can be used in hot mode
+        """
+        if not isinstance(stream, LiveStream) or stream.focuser is None:
+            return False
+        if stream.leeches:
+            # The leeches expect one series per acquisition => use the standard way
+            logging.debug("Stream %s has leeches, will not acquire it in hot mode", stream.name.value)
+            return False
+        trigger = getattr(stream.detector, "softwareTrigger", None)
+        if not isinstance(trigger, model.EventBase):
+            logging.debug("Detector %s has no softwareTrigger, will not acquire stream %s in hot mode",
+                          stream.detector.name, stream.name.value)
+            return False
+        return True
+
+    def _on_hot_frame(self, df, data):
+        self._hot_queue.put(data)
+
+    def _acquire_hot_zstack(self, stream, remaining_t):
+        """
+        Acquire all the z levels of a stream, with the stream prepared only once,
+        and the detector synchronized on its software trigger. A frame is
+        triggered after each focus move, and as soon as it is received, the
+        focuser starts moving to the next z level, while the frame is copied
+        into the (pre-allocated) cube.
+        stream (LiveStream): the stream to acquire. It must pass _can_acquire_hot().
+        remaining_t (float): the estimated remaining time of the whole task (s)
+        return:
+            zcube (DataArray of shape ZYX): the data acquired
+            remaining_t (float): the updated remaining time (s)
+        raise:
+            CancelledError: if the task was cancelled
+            TimeoutError: if a frame was not received in time
+        """
+        zlevels = orderZLevels(self._zlevels[stream], self._get_focus_pos(stream))
+        nz = len(zlevels)
+        df = stream._dataflow
+        trigger = stream.detector.softwareTrigger
+        timings = []
+        self.plane_timings[stream.name.value] = timings
+        cube = None
+        md = None
+
+        # Move to the first z level while the optical path is set
+        start_move = time.time()
+        self._actuator_f = stream.focuser.moveAbs({"z": zlevels[0]})
+        stream.prepare().result()
+        self._actuator_f.result()
+        move_dur = time.time() - start_move
+
+        # Only use the light when acquiring
+        has_light_ctrl = hasattr(stream, "_setup_excitation") and hasattr(stream, "_stop_light")
+
+        self._hot_queue = queue.Queue()
+        df.synchronizedOn(trigger)
+        # Activating the stream applies its settings, and subscribes to the
+        # dataflow, so the live view is updated with each plane.
+        stream.is_active.value = True
+        df.subscribe(self._on_hot_frame)
+        try:
+            for i, z in enumerate(zlevels):
+                if self._future_state == CANCELLED:
+                    raise CancelledError()
+
+                # The stream estimate is a little pessimistic, as it includes a set-up overhead
+                timeout = 10 * stream.estimateAcquisitionTime() + 5
+                start_acq = time.time()
+                if has_light_ctrl:
+                    stream._setup_excitation()
+                trigger.notify()
+                try:
+                    data = self._hot_queue.get(timeout=timeout)
+                except queue.Empty:
+                    raise TimeoutError("Acquisition of %s at z = %s timed out after %g s" %
+                                       (stream.name.value, z, timeout))
+                if data is None:  # cancelled
+                    raise CancelledError()
+                if has_light_ctrl:
+                    stream._stop_light()
+                acq_dur = time.time() - start_acq
+
+                # Start moving to the next plane, and store the data meanwhile
+                start_move = time.time()
+                if i < nz - 1:
+                    self._actuator_f = stream.focuser.moveAbs({"z": zlevels[i + 1]})
+
+                start_store = time.time()
+                if cube is None:
+                    md = data.metadata
+                    cube = numpy.empty((nz,) + data.shape[-2:], dtype=data.dtype)
+                cube[i] = data.reshape(data.shape[-2:])
+                store_dur = time.time() - start_store
+
+                timings.append({"move": move_dur, "acquire": acq_dur, "store": store_dur})
+                logging.debug("Plane %d/%d of %s acquired: move %g s, acquire %g s, store %g s",
+                              i + 1, nz, stream.name.value, move_dur, acq_dur, store_dur)
+
+                remaining_t -= stream.estimateAcquisitionTime()
+                if i < nz - 1:
+                    self._actuator_f.result()
+                    move_dur = time.time() - start_move
+                    remaining_t -= self._zstep_duration[stream]
+                self._main_future.set_progress(remaining_time=max(0, remaining_t))
+        finally:
+            df.unsubscribe(self._on_hot_frame)
+            df.synchronizedOn(None)
+            stream.is_active.value = False
+            self._hot_queue = None
+
+        tot_move = sum(t["move"] for t in timings)
+        tot_acq = sum(t["acquire"] for t in timings)
+        logging.info("Hot zstack of %s acquired with %d planes: %g s moving, %g s acquiring",
+                     stream.name.value, nz, tot_move, tot_acq)
+
+        # The metadata of the first frame has already been completed by the
+        # stream, as the stream received it (in the same thread) before the next frame.
+        # Apply the correction metadata, as AcquisitionTask does.
+        md = md.copy()
+        if isinstance(stream, (OpticalStream, EMStream)):
+            img.mergeMetadata(md)
+        zcube = zCubeToDataArray(cube, md, zlevels)
+        if self._settings_obs:
+            zcube.metadata[model.MD_EXTRA_SETTINGS] = copy.deepcopy(self._settings_obs.get_all_settings())
+        if model.MD_DESCRIPTION not in zcube.metadata:
+            zcube.metadata[model.MD_DESCRIPTION] = stream.name.value
+
+        return zcube, remaining_t
+
 
 def estimateZStackAcquisitionTime(streams, zlevels):
     """
@@ -474,7 +658,10 @@ def _weight_stream(stream):
 
 def sortStreams(streams):
     """
-    Sorts a list of streams based on the order they will be acquired
+    Sorts a list of streams based on the order they will be acquired.
+    Note that streams of the same kind (eg, several fluorescence streams) might be
+    acquired in a different order, to reduce the time to reconfigure the hardware
+    (see AcquisitionPlanner).
     streams (acq.stream.Stream): a list of streams to be sorted
     returns (acq.stream.Stream): a list of sorted streams
     """
@@ -487,8 +674,14 @@ class AcquisitionTask(object):
         self._future = future
         self._settings_obs = settings_obs
 
-        # order the streams for optimal acquisition
-        self._streams = sorted(streams, key=_weight_stream, reverse=True)
+        # order the streams for optimal acquisition. The final order, which also
+        # minimizes the hardware reconfiguration time, is only computed when
+        # running, as it needs to read the hardware state (which can be slow).
+        self._streams = sortStreams(streams)
+        self._planner = None
+        self._predicted_reconf = {}  # Stream -> float
+        # stream name -> dict "predicted"/"actual" -> duration (s)
+        self.reconf_timings = {}
 
         # get the estimated time for each streams
         self._streamTimes = {} # Stream -> float (estimated time)
@@ -523,6 +716,10 @@ class AcquisitionTask(object):
         # acquired. Not absolutely needed, but nice for the user in some cases.
         raw_images = OrderedDict()  # stream -> list of raw images
         try:
+            self._planner = AcquisitionPlanner(self._streams)
+            self._streams, predicted = self._planner.plan(_weight_stream)
+            self._predicted_reconf = dict(zip(self._streams, predicted))
+
             # Tell the leeches that the acquisition is starting
             for s in self._streams:
                 try:
@@ -540,6 +737,19 @@ class AcquisitionTask(object):
                 logging.info("Acquisition task has no SettingsObserver, not saving extra "
                              "metadata.")
             for s in self._streams:
+                # Explicitly set the hardware for the stream (instead of letting
+                # the stream do it) to measure how long it takes.
+                if hasattr(s, "prepare"):
+                    start_reconf = time.time()
+                    self._planner.reconfigure(s)
+                    self.reconf_timings[s.name.value] = {"predicted": self._predicted_reconf[s],
+                                                         "actual": time.time() - start_reconf}
+                    logging.debug("Reconfiguration for %s took %g s (predicted %g s)",
+                                  s.name.value, self.reconf_timings[s.name.value]["actual"],
+                                  self._predicted_reconf[s])
+                    if self._cancelled:
+                        raise CancelledError()
+
                 # Get the future of the acquisition, depending on the Stream type
                 if hasattr(s, "acquire"):
                     f = s.acquire()
@@ -596,6 +806,11 @@ class AcquisitionTask(object):
                     # No leeches
                     pass
 
+            if self.reconf_timings:
+                logging.info("Hardware reconfiguration took %g s (predicted %g s)",
+                             sum(t["actual"] for t in self.reconf_timings.values()),
+                             sum(t["predicted"] for t in self.reconf_timings.values()))
+
         except CancelledError:
             raise
         except Exception as ex:
@@ -609,6 +824,8 @@ class AcquisitionTask(object):
         finally:
             # Don't hold references to the streams once it's over
             self._streams = []
+            self._planner = None
+            self._predicted_reconf = {}
             self._streams_left.clear()
             self._streamTimes = {}
             self._current_stream = None
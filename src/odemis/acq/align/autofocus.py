@@ -24,7 +24,7 @@ import logging
 import threading
 import time
 from collections.abc import Iterable
-from concurrent.futures import TimeoutError, CancelledError
+from concurrent.futures import TimeoutError, CancelledError, ThreadPoolExecutor
 from concurrent.futures._base import CANCELLED, FINISHED, RUNNING
 from typing import Any, Dict, List, Optional, Tuple, Union, Callable
 
@@ -35,14 +35,17 @@ from odemis.acq.align import light
 from odemis.model import InstantaneousFuture
 from odemis.util import executeAsyncTask, almost_equal
 from odemis.util.driver import guessActuatorMoveDuration
-from odemis.util.focus import MeasureSEMFocus, Measure1d, MeasureSpotsFocus, AssessFocus
+from odemis.util.focus import MeasureSEMFocus, Measure1d, MeasureSpotsFocus, AssessFocus, FitFocusCurve
 from odemis.util.img import Subtract
 
 MTD_BINARY = 0
 MTD_EXHAUSTIVE = 1
+MTD_CURVE_FIT = 2
 
 MAX_STEPS_NUMBER = 100  # Max steps to perform autofocus
 MAX_BS_NUMBER = 1  # Maximum number of applying binary search with a smaller max_step
+CURVE_FIT_SAMPLES = 7  # Number of focus positions measured at each iteration of the curve fitting
+CURVE_FIT_MAX_ITERATIONS = 8  # Max number of zoom-in iterations of the curve fitting
 
 
 def getNextImage(det: model.Detector, timeout: Optional[float] = None) -> model.DataArray:
@@ -115,6 +118,61 @@ def _discard_data(df: Any, data: Any) -> None:
     pass
 
 
+def _getDepthOfField(detector: model.Detector, emt: Optional[model.Emitter]) -> float:
+    """
+    Find the depth of field of the detector, or of the emitter if it's an e-beam
+    detector: Detector on which to improve the focus quality
+    emt: In case of a SED this is the scanner used
+    return (0<float): depth of field in m
+    """
+    avail_depths = (detector, emt)
+    if model.hasVA(emt, "dwellTime"):
+        # Hack in case of using the e-beam with a DigitalCamera detector.
+        # All the digital cameras have a depthOfField, which is updated based
+        # on the optical lens properties... but the depthOfField in this
+        # case depends on the e-beam lens.
+        # TODO: or better rely on which component the focuser affects? If it
+        # affects (also) the emitter, use this one first? (but in the
+        # current models the focusers affects nothing)
+        avail_depths = (emt, detector)
+    for c in avail_depths:
+        if model.hasVA(c, "depthOfField"):
+            return c.depthOfField.value
+
+    logging.debug("No depth of field info found")
+    return 1e-6  # m, not too bad value
+
+
+def _getMeasureFunction(detector: model.Detector, measure_func: Optional[Callable] = None) -> Callable:
+    """
+    Pick the function to measure the focus level on the images of the detector
+    detector: Detector on which to improve the focus quality
+    measure_func: if provided, the function to use
+    return (callable DataArray -> float): the function to measure the focus level
+    """
+    # Pick measurement method based on the heuristics that SEM detectors
+    # are typically just a point (ie, shape == data depth).
+    # TODO: is this working as expected? Alternatively, we could check
+    # MD_DET_TYPE.
+    if measure_func is None:
+        if len(detector.shape) > 1:
+            if detector.role == 'diagnostic-ccd':
+                logging.debug("Using Spot method to estimate focus")
+                return MeasureSpotsFocus
+            elif detector.resolution.value[1] == 1:
+                logging.debug("Using 1d method to estimate focus")
+                return Measure1d
+            else:
+                logging.debug("Using Spot method to estimate focus")
+                return MeasureSpotsFocus
+        else:
+            logging.debug("Using SEM method to estimate focus")
+            return MeasureSEMFocus
+    else:
+        logging.debug(f"Using measure function {measure_func.__name__} to estimate focus")
+        return measure_func
+
+
 def _DoBinaryFocus(
         future: model.ProgressiveFuture,
         detector: model.Detector,
@@ -173,23 +231,7 @@ def _DoBinaryFocus(
         timeout = 3 + 2 * estimateAcquisitionTime(detector, emt)
 
         # use the .depthOfField on detector or emitter as maximum stepsize
-        avail_depths = (detector, emt)
-        if model.hasVA(emt, "dwellTime"):
-            # Hack in case of using the e-beam with a DigitalCamera detector.
-            # All the digital cameras have a depthOfField, which is updated based
-            # on the optical lens properties... but the depthOfField in this
-            # case depends on the e-beam lens.
-            # TODO: or better rely on which component the focuser affects? If it
-            # affects (also) the emitter, use this one first? (but in the
-            # current models the focusers affects nothing)
-            avail_depths = (emt, detector)
-        for c in avail_depths:
-            if model.hasVA(c, "depthOfField"):
-                dof = c.depthOfField.value
-                break
-        else:
-            logging.debug("No depth of field info found")
-            dof = 1e-6  # m, not too bad value
+        dof = _getDepthOfField(detector, emt)
         min_step = dof / 2
 
         # adjust to rng_focus if provided
@@ -213,27 +255,7 @@ def _DoBinaryFocus(
         best_fm = 0
         last_pos = None
 
-        # Pick measurement method based on the heuristics that SEM detectors
-        # are typically just a point (ie, shape == data depth).
-        # TODO: is this working as expected? Alternatively, we could check
-        # MD_DET_TYPE.
-        if measure_func is None:
-            if len(detector.shape) > 1:
-                if detector.role == 'diagnostic-ccd':
-                    logging.debug("Using Spot method to estimate focus")
-                    Measure = MeasureSpotsFocus
-                elif detector.resolution.value[1] == 1:
-                    logging.debug("Using 1d method to estimate focus")
-                    Measure = Measure1d
-                else:
-                    logging.debug("Using Spot method to estimate focus")
-                    Measure = MeasureSpotsFocus
-            else:
-                logging.debug("Using SEM method to estimate focus")
-                Measure = MeasureSEMFocus
-        else:
-            logging.debug(f"Using measure function {measure_func.__name__} to estimate focus")
-            Measure = measure_func
+        Measure = _getMeasureFunction(detector, measure_func)
 
         step_factor = 2 ** 7
         if good_focus is not None:
@@ -429,44 +451,10 @@ def _DoExhaustiveFocus(
         # Big timeout, most important being that it's shorter than eternity
         timeout = 3 + 2 * estimateAcquisitionTime(detector, emt)
 
-        # use the .depthOfField on detector or emitter as maximum stepsize
-        avail_depths = (detector, emt)
-        if model.hasVA(emt, "dwellTime"):
-            # Hack in case of using the e-beam with a DigitalCamera detector.
-            # All the digital cameras have a depthOfField, which is updated based
-            # on the optical lens properties... but the depthOfField in this
-            # case depends on the e-beam lens.
-            avail_depths = (emt, detector)
-        for c in avail_depths:
-            if model.hasVA(c, "depthOfField"):
-                dof = c.depthOfField.value
-                break
-        else:
-            logging.debug("No depth of field info found")
-            dof = 1e-6  # m, not too bad value
+        dof = _getDepthOfField(detector, emt)
         logging.debug("Depth of field is %.7g", dof)
 
-        # Pick measurement method based on the heuristics that SEM detectors
-        # are typically just a point (ie, shape == data depth).
-        # TODO: is this working as expected? Alternatively, we could check
-        # MD_DET_TYPE.
-        if measure_func is None:
-            if len(detector.shape) > 1:
-                if detector.role == 'diagnostic-ccd':
-                    logging.debug("Using Spot method to estimate focus")
-                    Measure = MeasureSpotsFocus
-                elif detector.resolution.value[1] == 1:
-                    logging.debug("Using 1d method to estimate focus")
-                    Measure = Measure1d
-                else:
-                    logging.debug("Using Spot method to estimate focus")
-                    Measure = MeasureSpotsFocus
-            else:
-                logging.debug("Using SEM method to estimate focus")
-                Measure = MeasureSEMFocus
-        else:
-            logging.debug(f"Using measure function {measure_func.__name__} to estimate focus")
-            Measure = measure_func
+        Measure = _getMeasureFunction(detector, measure_func)
 
         # adjust to rng_focus if provided
         rng = focus.axes["z"].range
@@ -552,6 +540,223 @@ def _DoExhaustiveFocus(
             future._autofocus_state = FINISHED
 
 
+def _measureFocusLevels(
+        future: model.ProgressiveFuture,
+        detector: model.Detector,
+        dfbkg: Optional[model.DataFlow],
+        focus: model.Actuator,
+        positions: List[float],
+        Measure: Callable,
+        timeout: float,
+        executor: ThreadPoolExecutor
+) -> List[Tuple[float, float]]:
+    """
+    Acquire an image at each focus position, and measure its focus level. The
+    focus level of an image is computed in the executor, while the focus moves
+    to the next position.
+    positions: the focus positions (m), in the order to visit them
+    Measure: function to measure the focus level on an image
+    timeout: maximum time to wait for an image
+    executor: where the focus levels are computed
+    returns: for each position, the actual focus position (m) and the focus level
+    raises:
+            CancelledError if cancelled
+            IOError if the acquisition failed
+    """
+    measures = []  # (float, Future) for each position
+    move_f = focus.moveAbs({"z": positions[0]})
+    for i in range(len(positions)):
+        move_f.result()
+        if future._autofocus_state == CANCELLED:
+            raise CancelledError()
+        pos = focus.position.value["z"]
+        image = AcquireNoBackground(detector, dfbkg, timeout)
+        if i + 1 < len(positions):
+            move_f = focus.moveAbs({"z": positions[i + 1]})
+        measures.append((pos, executor.submit(Measure, image)))
+
+    levels = []
+    for pos, f in measures:
+        fm = f.result()
+        logging.debug("Focus level at %.7g is %.7g", pos, fm)
+        levels.append((pos, fm))
+    return levels
+
+
+def _DoCurveFitFocus(
+        future: model.ProgressiveFuture,
+        detector: model.Detector,
+        emt: Optional[model.Emitter],
+        focus: model.Actuator,
+        dfbkg: Optional[model.DataFlow],
+        good_focus: Optional[float],
+        rng_focus: Optional[Tuple[float, float]],
+        measure_func: Optional[Callable] = None
+) -> Tuple[float, float, float]:
+    """
+    Measures the focus level at a few positions within a window, fits a focus
+    curve on them to predict the best focus position, and zooms in the window
+    around it, until the focus curve is sampled finely enough. Compared to the
+    binary search, it needs much fewer images when the focus curve is smooth.
+    future: Progressive future provided by the wrapper
+    detector: Detector on which to improve the focus quality
+    emt: In case of a SED this is the scanner used
+    focus: The focus actuator (with a "z" axis)
+    dfbkg: dataflow of se- or bs- detector
+    good_focus: if provided, an already known good focus position, around
+      which the search is started
+    rng_focus: if provided, the search of the best focus position is limited
+      within this range
+    measure_func: function to measure the focus level on the image,
+      for instance MeasureSEMFocus. If None the focus metric used is based
+      on the detector.
+    returns:
+        (float): Focus position (m)
+        (float): Focus level
+        (float): Focus confidence (0<=f<=1, 0 is not in focus and 1 is the best possible focus)
+    raises:
+            CancelledError if cancelled
+            IOError if procedure failed
+    """
+    logging.debug("Starting curve-fit autofocus on detector %s...", detector.name)
+
+    best_pos = focus.position.value['z']
+    # Only one worker: the focus level of an image is computed while the next
+    # image is being acquired, which is slower anyway.
+    executor = ThreadPoolExecutor(max_workers=1)
+    try:
+        # Big timeout, most important being that it's shorter than eternity
+        timeout = 3 + 2 * estimateAcquisitionTime(detector, emt)
+        dof = _getDepthOfField(detector, emt)
+        min_step = dof / 2
+        Measure = _getMeasureFunction(detector, measure_func)
+
+        # adjust to rng_focus if provided
+        rng = focus.axes["z"].range
+        if rng_focus:
+            rng = (max(rng[0], rng_focus[0]), min(rng[1], rng_focus[1]))
+        if rng[1] <= rng[0]:
+            raise ValueError("Unexpected focus range %s" % (rng,))
+
+        # Same initial search window as the binary search
+        if good_focus is not None:
+            center = good_focus
+            half_width = 2 ** 4 * min_step
+        else:
+            center = best_pos
+            half_width = 2 ** 7 * min_step
+        half_width = min(half_width, (rng[1] - rng[0]) / 2)
+        min_half_width = min_step * (CURVE_FIT_SAMPLES - 1) / 2
+        logging.debug("Depth of field is %.7g. Searching within z=%s, starting at %g ± %g m",
+                      dof, rng, center, half_width)
+
+        focus_levels = {}  # focus pos (float) -> focus level (float)
+        gaussian = False
+        fitted = False  # True once a focus curve could be fitted
+        converged = False
+        for i in range(CURVE_FIT_MAX_ITERATIONS):
+            # Keep the window within the range
+            center = min(max(center, rng[0] + half_width), rng[1] - half_width)
+            lo, hi = center - half_width, center + half_width
+            step = (hi - lo) / (CURVE_FIT_SAMPLES - 1)
+
+            # Don't reacquire positions already measured
+            positions = [p for p in numpy.linspace(lo, hi, CURVE_FIT_SAMPLES)
+                         if not any(abs(p - fp) < step / 4 for fp in focus_levels)]
+            if positions:
+                # Start from the side closest to the current position
+                current_pos = focus.position.value["z"]
+                if abs(current_pos - hi) < abs(current_pos - lo):
+                    positions.reverse()
+                for pos, fm in _measureFocusLevels(future, detector, dfbkg, focus, positions,
+                                                   Measure, timeout, executor):
+                    focus_levels[pos] = fm
+
+            if future._autofocus_state == CANCELLED:
+                raise CancelledError()
+
+            best_pos = max(focus_levels, key=focus_levels.get)
+            # Only fit the measurements within the window, as far from the best
+            # focus the focus curve typically doesn't follow a Gaussian anymore.
+            win_pos = [p for p in focus_levels if lo - step / 2 <= p <= hi + step / 2]
+            try:
+                fit_pos, width, gaussian = FitFocusCurve(win_pos, [focus_levels[p] for p in win_pos])
+            except ValueError as ex:
+                logging.debug("Failed to fit focus curve (%s), best focus level so far at %g m", ex, best_pos)
+                on_border = (best_pos <= lo + step / 2 and lo > rng[0]) or (best_pos >= hi - step / 2 and hi < rng[1])
+                if on_border:
+                    # The best focus is probably outside of the window => move it
+                    center = best_pos
+                    logging.debug("Shifting focus window to %g m", center)
+                elif fitted:
+                    # The window is so small that the peak cannot be distinguished
+                    # from the noise anymore => the previous fit is as good as it gets
+                    converged = True
+                    break
+                elif half_width < (rng[1] - rng[0]) / 2:
+                    # Probably so far from the focus that it's all noise => look further
+                    half_width = min(half_width * 2, (rng[1] - rng[0]) / 2)
+                    logging.debug("Widening focus window to %g ± %g m", center, half_width)
+                else:
+                    logging.info("No focus peak found within the whole range")
+                    center = best_pos
+                    break
+                continue
+
+            logging.debug("Focus curve (%s) fitted with best focus at %g m, width %g m",
+                          "Gaussian" if gaussian else "parabola", fit_pos, width)
+            fitted = True
+            center = fit_pos
+            if gaussian and step <= width:
+                # The peak is sampled finely enough to trust the fit
+                converged = True
+                break
+            half_width = max(min(half_width / 2, 2 * width), min_half_width)
+
+            if step <= min_step:
+                converged = True
+                break
+        else:
+            logging.info("Curve-fit autofocus reached the maximum number of iterations")
+
+        # Go to the predicted best position, and check it's actually good
+        best_fm = focus_levels[best_pos]
+        pos, fm = _measureFocusLevels(future, detector, dfbkg, focus, [center],
+                                      Measure, timeout, executor)[0]
+        focus_levels[pos] = fm
+        if fm >= best_fm * 0.9:
+            best_pos, best_fm = pos, fm
+        else:
+            logging.debug("Predicted focus level %g @ %g m is worse than measured, going back to %g m",
+                          fm, pos, best_pos)
+            focus.moveAbsSync({"z": best_pos})
+
+        worst_fm = min(focus_levels.values())
+        if not converged:
+            logging.info("Auto focus gave up after %d images @ %g m", len(focus_levels), best_pos)
+            confidence = 0.1
+        elif (best_fm - worst_fm) < best_fm * 0.5:
+            logging.info("Auto focus indecisive but picking level %g @ %g m (lowest = %g)",
+                         best_fm, best_pos, worst_fm)
+            confidence = 0.2
+        else:
+            logging.info("Auto focus found best level %g @ %g m after %d images",
+                         best_fm, best_pos, len(focus_levels))
+            confidence = 0.8 if gaussian else 0.6
+
+        return best_pos, best_fm, confidence
+
+    except CancelledError:
+        # Go to the best position known so far
+        focus.moveAbsSync({"z": best_pos})
+    finally:
+        executor.shutdown(wait=False)
+        with future._autofocus_lock:
+            if future._autofocus_state == CANCELLED:
+                raise CancelledError()
+            future._autofocus_state = FINISHED
+
+
 def _CancelAutoFocus(future: model.ProgressiveFuture) -> bool:
     """
     Canceller of AutoFocus task.
@@ -615,7 +820,11 @@ def estimateAutoFocusTime(
     move_time = guessActuatorMoveDuration(focus, "z", distance) + 2 * guessActuatorMoveDuration(focus, "z",
                                                                                                 distance / 2)
     # pessimistic guess
-    acquisition_time = MAX_STEPS_NUMBER * estimateAcquisitionTime(detector, emt)
+    if method == MTD_CURVE_FIT:
+        n_images = CURVE_FIT_MAX_ITERATIONS * CURVE_FIT_SAMPLES + 1
+    else:
+        n_images = MAX_STEPS_NUMBER
+    acquisition_time = n_images * estimateAcquisitionTime(detector, emt)
     return move_time + acquisition_time
 
 
@@ -1068,7 +1277,9 @@ def AutoFocus(
     rng_focus: if provided, the search of the best focus position is limited
       within this range
     method (MTD_*): focusing method, if BINARY we follow a dichotomic method while in
-      case of EXHAUSTIVE we iterate through the whole provided range
+      case of EXHAUSTIVE we iterate through the whole provided range. In case of
+      CURVE_FIT, a focus curve is fitted on a few measurements to predict the best
+      position.
     measure_func: function to measure the focus level on the image,
       for instance MeasureSEMFocus. If None the focus metric used is based
       on the detector.
@@ -1078,7 +1289,7 @@ def AutoFocus(
     """
     # Create ProgressiveFuture and update its state to RUNNING
     f = model.ProgressiveFuture(remaining_time=estimateAutoFocusTime(detector, emt, focus, dfbkg, good_focus,
-                                                                 rng_focus))
+                                                                 rng_focus, method))
     f._autofocus_state = RUNNING
     f._autofocus_lock = threading.Lock()
     f.task_canceller = _CancelAutoFocus
@@ -1088,6 +1299,8 @@ def AutoFocus(
         autofocus_fn = _DoExhaustiveFocus
     elif method == MTD_BINARY:
         autofocus_fn = _DoBinaryFocus
+    elif method == MTD_CURVE_FIT:
+        autofocus_fn = _DoCurveFitFocus
     else:
         raise ValueError("Unknown autofocus method")
 
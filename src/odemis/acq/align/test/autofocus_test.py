@@ -29,7 +29,8 @@ from odemis.dataio import tiff
 from odemis import model, acq
 import odemis
 from odemis.acq import align, stream
-from odemis.acq.align.autofocus import Sparc2AutoFocus, MTD_BINARY
+from odemis.acq.align.autofocus import Sparc2AutoFocus, MTD_BINARY, MTD_CURVE_FIT, _getMeasureFunction, \
+    _getDepthOfField
 from odemis.dataio import hdf5
 from odemis.util import testing, timeout, img
 import os
@@ -132,6 +133,111 @@ class TestAutofocus(unittest.TestCase):
         self.assertGreater(foc_lev, 0)
 
 
+class AutofocusBenchmarkMixin:
+    """
+    Compares the curve fitting autofocus method to the binary one
+    """
+
+    def _run_autofocus(self, method, detector, emt, focus, start_pos):
+        """
+        return (float, float, int): focus position, duration, number of images
+        """
+        focus.moveAbs({"z": start_pos}).result()
+        measure = _getMeasureFunction(detector)
+        n_images = 0
+
+        def counting_measure(image):
+            nonlocal n_images
+            n_images += 1
+            return measure(image)
+
+        tstart = time.time()
+        f = align.AutoFocus(detector, emt, focus, method=method, measure_func=counting_measure)
+        foc_pos, foc_lev, _ = f.result(timeout=900)
+        return foc_pos, time.time() - tstart, n_images
+
+    def _benchmark(self, detector, emt, focus, good_focus, offset):
+        """
+        Run both methods from the same (out of focus) position, and check the
+        curve fitting is as precise, with fewer images
+        """
+        # Both methods stop searching when the focus step is smaller than the depth of field
+        precision = 2 * _getDepthOfField(detector, emt)
+        res = {}
+        for method, name in ((MTD_BINARY, "binary"), (MTD_CURVE_FIT, "curve fit")):
+            foc_pos, dur, n_images = self._run_autofocus(method, detector, emt, focus, good_focus + offset)
+            logging.info("Autofocus %s on %s: found %g m (expected %g m) in %g s with %d images",
+                         name, detector.name, foc_pos, good_focus, dur, n_images)
+            self.assertAlmostEqual(foc_pos, good_focus, delta=precision)
+            res[method] = dur, n_images
+
+        self.assertLess(res[MTD_CURVE_FIT][1], res[MTD_BINARY][1])
+
+        logging.info("Curve fit autofocus on %s took %d%% of the images and %d%% of the time of the binary one",
+                     detector.name, 100 * res[MTD_CURVE_FIT][1] / res[MTD_BINARY][1],
+                     100 * res[MTD_CURVE_FIT][0] / res[MTD_BINARY][0])
+        return res
+
+
+class TestAutofocusCurveFitSecom(AutofocusBenchmarkMixin, unittest.TestCase):
+    """
+    Benchmark of the curve fitting autofocus on the SECOM
+    """
+    @classmethod
+    def setUpClass(cls):
+        testing.start_backend(SECOM_CONFIG)
+
+        cls.ebeam = model.getComponent(role="e-beam")
+        cls.sed = model.getComponent(role="se-detector")
+        cls.ccd = model.getComponent(role="ccd")
+        cls.focus = model.getComponent(role="focus")
+        cls.efocus = model.getComponent(role="ebeam-focus")
+
+        # The good focus positions are at the start up positions
+        cls._opt_good_focus = cls.focus.position.value["z"]
+        cls._sem_good_focus = cls.efocus.position.value["z"]
+
+    @classmethod
+    def tearDownClass(cls):
+        # Leave the focus as it was found
+        cls.focus.moveAbs({"z": cls._opt_good_focus}).result()
+        cls.efocus.moveAbs({"z": cls._sem_good_focus}).result()
+
+    @timeout(2000)
+    def test_benchmark_opt(self):
+        self.ccd.exposureTime.value = self.ccd.exposureTime.range[0]
+        self._benchmark(self.ccd, self.ebeam, self.focus, self._opt_good_focus, -400e-6)
+
+    @timeout(2000)
+    def test_benchmark_sem(self):
+        self.ebeam.dwellTime.value = self.ebeam.dwellTime.range[0]
+        self._benchmark(self.sed, self.ebeam, self.efocus, self._sem_good_focus, -100e-6)
+
+
+class TestAutofocusCurveFitSparc2(AutofocusBenchmarkMixin, unittest.TestCase):
+    """
+    Benchmark of the curve fitting autofocus on the SPARCv2
+    """
+    @classmethod
+    def setUpClass(cls):
+        testing.start_backend(SPARC_CONFIG)
+
+        cls.ccd = model.getComponent(role="ccd")
+        cls.focus = model.getComponent(role="focus")
+
+        # The good focus position is the start up position
+        cls._good_focus = cls.focus.position.value["z"]
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.focus.moveAbs({"z": cls._good_focus}).result()
+
+    @timeout(2000)
+    def test_benchmark_ccd(self):
+        self.ccd.exposureTime.value = self.ccd.exposureTime.range[0]
+        self._benchmark(self.ccd, None, self.focus, self._good_focus, -200e-6)
+
+
 class TestSparc2AutoFocus(unittest.TestCase):
     """
         Test Sparc2Autofocus for sp-ccd
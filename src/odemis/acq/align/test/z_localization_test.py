@@ -30,7 +30,8 @@ from concurrent.futures._base import CancelledError
 import odemis
 from odemis import model
 from odemis.acq import stream
-from odemis.acq.align.z_localization import determine_z_position, ensure_stig_calib_format, measure_z_multi_targets
+from odemis.acq.align.z_localization import determine_z_position, ensure_stig_calib_format, measure_z_multi_targets, \
+    huang, solve_z_positions
 from odemis.acq.feature import Target, TargetType
 from odemis.acq.move import MicroscopePostureManager
 from odemis.dataio.tiff import read_data
@@ -114,6 +115,21 @@ class TestDetermineZPosition(unittest.TestCase):
         self.assertEqual(warning, 4)
         self.assertAlmostEqual(expected_outcome_image_3, z, delta=PRECISION)
 
+    def test_solve_z_positions(self):
+        """
+        Test solving the z positions of multiple features at once gives the same result as one by one
+        """
+        zs = [200, 600, 900, 1300]  # nm, from z_least_confusion
+        sizes = [(huang(z, CALIB_DATA["x"]) / CALIB_DATA["upsample_factor"],
+                  huang(z, CALIB_DATA["y"]) / CALIB_DATA["upsample_factor"]) for z in zs]
+        results = solve_z_positions(sizes, CALIB_DATA)
+        self.assertEqual(len(results), len(zs))
+        for z, s, (z_pos, warning) in zip(zs, sizes, results):
+            self.assertAlmostEqual(z_pos, CALIB_DATA["z_least_confusion"] - z * 1e-9, delta=PRECISION)
+            self.assertIsNone(warning)
+            z_single, _ = solve_z_positions([s], CALIB_DATA)[0]
+            self.assertAlmostEqual(z_pos, z_single, delta=PRECISION)
+
     def test_key_error(self):
         image = read_data(os.path.join(IMG_PATH, "super_z_single_beed_semi_in_focus.tif"))[0]
 
@@ -22,7 +22,7 @@ Odemis. If not, see http://www.gnu.org/licenses/.
 import threading
 import logging
 import math
-from concurrent.futures import CancelledError
+from concurrent.futures import CancelledError, ThreadPoolExecutor
 
 import numpy
 from Pyro4.futures import FINISHED, CANCELLED, RUNNING
@@ -34,7 +34,7 @@ from odemis.acq.feature import Target, TargetType
 from odemis.acq.stream import FluoStream
 from odemis.model import ProgressiveFuture
 import time
-from typing import Optional, List
+from typing import Optional, List, Sequence, Tuple
 
 from odemis.util.filename import create_filename
 
@@ -51,6 +51,7 @@ except ImportError as exp:
 
 MAX_ITERATIONS = 3  # Maximum number of iterations to determine the z position of the target
 SUPERZ_THRESHOLD = 50e-9  # 50 nm, if the difference is less than this, we consider it to be good enough
+FMIN_CG_GTOL = 1e-5  # Default gradient tolerance of fmin_cg(), to check the convergence
 
 
 def huang(z, calibration_data):
@@ -116,38 +117,29 @@ def solve_psf(z, obs_x, obs_y, calibration_data, model_function=huang):
     cal_y = model_function(z, calibration_data["y"])
     return (obs_x ** 0.5 - cal_x ** 0.5) ** 2 + (obs_y ** 0.5 - cal_y ** 0.5) ** 2
 
-def determine_z_position(image, calibration_data, fit_tol=0.1):
+def _solve_psf_sum(z, obs_x, obs_y, calibration_data, model_function=huang):
     """
-    Function to determine the z position of feature in an image that was taken with a lens with astigmatism and
-    corresponding calibration data. Via a Gaussian fit the width and height of the feature are determined. Using a
-    fit on the equation of Huang the z position is then approximated. The function includes various warning flags
-    that may be raised when the calculation seems to give inaccurate results.
+    Least squares error of multiple (independent) features, as one value. See solve_psf().
+    :param z (numpy.array): z position of each feature
+    :param obs_x (numpy.array): Observed sigma_x of each feature
+    :param obs_y (numpy.array): Observed sigma_y of each feature
+    :return (float): sum of the least squares error of all the features
+    """
+    return numpy.sum(solve_psf(z, obs_x, obs_y, calibration_data, model_function))
 
-    :param image (numpy.array): 2d array containing only the feature to be analyzed.
-    :param calibration_data (dict): contains the data from the calibration performed using the jupyter notebook with the
-                                    following keys:
-                                    x (dict) --> a, b ,c, d, w0 (floats), fit on the equation of Huang in x direction
-                                    y (dict) --> a, b ,c, d, w0 (floats), fit on the equation of Huang in y direction
-                                    feature_angle (float) angle of the ellipsoidal shapes w.r.t. the positive Y axis (anti-clockwise is positive)
-                                    upsample_factor (int) number with which the data is up sampled during the calibration
-                                    z_least_confusion (float) location in z in meters where the least confusion is present in the image (in focus)
-                                    z_calibration_range (tuple) --> (min, max) floats of the min and max z value in meters w.r.t. the z_least_confusion
+def measure_feature_size(image, calibration_data, fit_tol=0.1):
+    """
+    Determine the size of the feature in the image, via a Gaussian fit. That's the first step of determine_z_position().
 
-    :param fit_tol (float): factor to assess the precision of the Gaussian fit. A lower value means a stricter
-                            assessment on the precision, range from 0 --> 1.
+    :param image (numpy.array): 2d array containing only the feature to be analyzed.
+    :param calibration_data (dict): see determine_z_position()
+    :param fit_tol (float): see determine_z_position()
     :return:
-        z_position (float): determined z position of the feature in meter
-        warning (int/None): None = No warnings
-                        1 = from fmin_cg(scipy) max number of iterations exceeded
-                        2 = from fmin_cg(scipy) gradient and/or function calls were not changing
-                        3 = from fmin_cg(scipy) NaN result encountered
-                        4 = Outputted Z position is outside the defined maximum range from the calibration, output is inaccurate
-                        5 = The Gaussian fit is not precise enough, probably because the image contains too much noise
-                        6 = The Gaussian fit found a feature to big for the current feature, the size > 85%
+        sigma_x (float): size of the feature in x direction (px)
+        sigma_y (float): size of the feature in y direction (px)
+        warning (int/None): None = No warnings, 5 or 6 (see determine_z_position())
     :raises:
             ModuleNotFoundError if the module psf_extractor is not found.
-            KeyError if the calibration data is incomplete and does not include all the keys
-
     """
     warning = None  # Set the warning level to None, no warnings
 
@@ -174,39 +166,113 @@ def determine_z_position(image, calibration_data, fit_tol=0.1):
                         f"Current results may be inaccurate.")
         warning = 6
 
+    return sigma_x, sigma_y, warning
+
+def solve_z_positions(sizes: Sequence[Tuple[float, float]], calibration_data) -> List[Tuple[float, Optional[int]]]:
+    """
+    Determine the z position of multiple features, based on their size, in a single solve. That's the second step of
+    determine_z_position(). All the features must have been acquired with the same calibration data.
+
+    :param sizes: sigma_x, sigma_y of each feature, as returned by measure_feature_size()
+    :param calibration_data (dict): see determine_z_position()
+    :return: for each feature:
+        z_position (float): determined z position of the feature in meter
+        warning (int/None): None = No warnings, 1, 2, 3 or 4 (see determine_z_position())
+    """
+    sizes = numpy.asarray(sizes, dtype=float).reshape(-1, 2)
+    sigma_x, sigma_y = sizes[:, 0], sizes[:, 1]
+
     # Determine the z position using the shape of the features (sigma_x/sigma_y)
     max_range = calibration_data["z_calibration_range"][1] - calibration_data["z_calibration_range"][0]
     fine_z = numpy.linspace(0, max_range, 200)
     est_func = huang(fine_z, calibration_data["x"]) - huang(fine_z, calibration_data["y"])
-    x0 = fine_z[numpy.abs(est_func - (sigma_x - sigma_y)).argmin()]  # A raw initial estimate of the z position
+    # A raw initial estimate of the z position of each feature
+    x0 = fine_z[numpy.abs(est_func - (sigma_x - sigma_y)[:, numpy.newaxis]).argmin(axis=1)]
 
     # Apply the up sample factor just as done in the calibration
-    sigma_x *= calibration_data['upsample_factor']
-    sigma_y *= calibration_data['upsample_factor']
-    zopt, _, _, _, warn_flag, _ = fmin_cg(solve_psf,
+    sigma_x = sigma_x * calibration_data['upsample_factor']
+    sigma_y = sigma_y * calibration_data['upsample_factor']
+    # The features are independent, so minimizing the sum of their errors finds the z position of
+    # each of them, at once.
+    zopt, _, _, _, warn_flag, _ = fmin_cg(_solve_psf_sum,
                                           x0=x0,
                                           args=(sigma_x, sigma_y, calibration_data, huang),
-                                          maxiter=2000, disp=False, full_output=True,
+                                          gtol=FMIN_CG_GTOL, maxiter=2000 * len(x0), disp=False, full_output=True,
                                           retall=True,
                                           )
 
+    # fmin_cg reports a single warning flag for all the features. Only report it for the features which
+    # did not converge, according to the same criterion as fmin_cg (the gradient). As the features are
+    # independent, the gradient of each of them only depends on its own z position.
+    not_converged = numpy.zeros(len(zopt), dtype=bool)
     if warn_flag > 0:
-        logging.warning(f"Inaccuracy observed during when determining the Z position, the warning flag {warn_flag}"
-                        f"was raised. Current results may be inaccurate")
-        # fmin_cg output the warning flags 1, 2 and 3. The warnings of fmin_cg may be te result of previously found
-        # warning, therefore the warnings of fmin_cg are considered less important.
-        if not(warning):
+        eps = numpy.sqrt(numpy.finfo(float).eps)
+        grad = (solve_psf(zopt + eps, sigma_x, sigma_y, calibration_data, huang) -
+                solve_psf(zopt - eps, sigma_x, sigma_y, calibration_data, huang)) / (2 * eps)
+        not_converged = ~(numpy.abs(grad) <= FMIN_CG_GTOL)  # NaN => not converged
+        if len(zopt) == 1:  # Same as fmin_cg
+            not_converged[:] = True
+
+    results = []
+    for i, z in enumerate(zopt):
+        # fmin_cg output the warning flags 1, 2 and 3.
+        warning = None
+        if not_converged[i]:
+            logging.warning(f"Inaccuracy observed during when determining the Z position of feature {i}, the warning "
+                            f"flag {warn_flag} was raised. Current results may be inaccurate")
             warning = warn_flag
+        z_position = calibration_data["z_least_confusion"] - z * 1e-9
+
+        if not(calibration_data["z_calibration_range"][0] < z_position < calibration_data["z_calibration_range"][1]):
+            # Always log this warning but only update this error if no other cause of the error is found.
+            logging.warning(f"The determined z position is out of the specified max_range."
+                            f"The found z position is {z_position} while the range is {calibration_data['z_calibration_range']} meters. \n"
+                            f"The outputted z position is inaccurate.")
+            if not(warning):
+                warning = 4
+        results.append((z_position, warning))
+
+    return results
+
+def determine_z_position(image, calibration_data, fit_tol=0.1):
+    """
+    Function to determine the z position of feature in an image that was taken with a lens with astigmatism and
+    corresponding calibration data. Via a Gaussian fit the width and height of the feature are determined. Using a
+    fit on the equation of Huang the z position is then approximated. The function includes various warning flags
+    that may be raised when the calculation seems to give inaccurate results.
 
-    z_position = calibration_data["z_least_confusion"] - zopt[0] * 1e-9
+    :param image (numpy.array): 2d array containing only the feature to be analyzed.
+    :param calibration_data (dict): contains the data from the calibration performed using the jupyter notebook with the
+                                    following keys:
+                                    x (dict) --> a, b ,c, d, w0 (floats), fit on the equation of Huang in x direction
+                                    y (dict) --> a, b ,c, d, w0 (floats), fit on the equation of Huang in y direction
+                                    feature_angle (float) angle of the ellipsoidal shapes w.r.t. the positive Y axis (anti-clockwise is positive)
+                                    upsample_factor (int) number with which the data is up sampled during the calibration
+                                    z_least_confusion (float) location in z in meters where the least confusion is present in the image (in focus)
+                                    z_calibration_range (tuple) --> (min, max) floats of the min and max z value in meters w.r.t. the z_least_confusion
 
-    if not(calibration_data["z_calibration_range"][0] < z_position < calibration_data["z_calibration_range"][1]):
-        # Always log this warning but only update this error if no other cause of the error is found.
-        logging.warning(f"The determined z position is out of the specified max_range."
-                        f"The found z position is {z_position} while the range is {calibration_data['z_calibration_range']} meters. \n"
-                        f"The outputted z position is inaccurate.")
-        if not(warning):
-            warning = 4
+    :param fit_tol (float): factor to assess the precision of the Gaussian fit. A lower value means a stricter
+                            assessment on the precision, range from 0 --> 1.
+    :return:
+        z_position (float): determined z position of the feature in meter
+        warning (int/None): None = No warnings
+                        1 = from fmin_cg(scipy) max number of iterations exceeded
+                        2 = from fmin_cg(scipy) gradient and/or function calls were not changing
+                        3 = from fmin_cg(scipy) NaN result encountered
+                        4 = Outputted Z position is outside the defined maximum range from the calibration, output is inaccurate
+                        5 = The Gaussian fit is not precise enough, probably because the image contains too much noise
+                        6 = The Gaussian fit found a feature to big for the current feature, the size > 85%
+    :raises:
+            ModuleNotFoundError if the module psf_extractor is not found.
+            KeyError if the calibration data is incomplete and does not include all the keys
+
+    """
+    sigma_x, sigma_y, warning = measure_feature_size(image, calibration_data, fit_tol)
+    z_position, solve_warning = solve_z_positions([(sigma_x, sigma_y)], calibration_data)[0]
+    # The warnings of fmin_cg may be te result of previously found warning, therefore the warnings of
+    # fmin_cg (and the range check) are considered less important.
+    if not(warning):
+        warning = solve_warning
 
     return z_position, warning
 
@@ -302,10 +368,15 @@ def _run_measure_z_multi_targets(f: ProgressiveFuture, stigmator, focus,
                         fiducial_size: Optional[float] = None) -> List[Target]:
     """
     Run the SuperZ manager (automate) on the given targets of the currently selected feature and stream.
+    The targets which share the same calibration (ie, same stigmator angle) are localized together: for each
+    iteration, all the targets are acquired one after another, while the feature size of the previous target is
+    measured in a separate thread. Then the z positions of all the targets are solved at once.
     see measure_z_multi_targets() for parameters
     """
+    # Measure the feature size of a target while the next one is acquired
+    executor = ThreadPoolExecutor(max_workers=1)
+    sizes_f = []  # Futures returning the size of each target
     try:
-        exporter = None
         targets = []
         calib_dict = {TargetType.PointOfInterest: {},
                       TargetType.Fiducial: {}}
@@ -328,8 +399,18 @@ def _run_measure_z_multi_targets(f: ProgressiveFuture, stigmator, focus,
         # We arbitrarily take a width of 20 x the supposed PSF FWHM.
         # The PSF includes the binning, so need for any extra tweak
         half_width = int(math.ceil(10 * stream.detector.pointSpreadFunctionSize.value))  # px
-        for target in targets:
-            calib = calib_dict[target.type.value]
+        exporter = dataio.get_converter("TIFF")
+
+        # To report the progress: number of acquisitions expected (the same as in the estimation) and their duration
+        acq_left = (MAX_ITERATIONS - 1) * len(targets)
+        acq_dur = 3 + acqmng.estimateTime([stream])  # s, same as in estimate_measure_z_multi_targets()
+        localized = 0
+
+        for ttype in (TargetType.PointOfInterest, TargetType.Fiducial):
+            group = [t for t in targets if t.type.value == ttype]
+            if not group:
+                continue
+            calib = calib_dict[ttype]
             # Change the stigmator angle
             with f._task_lock:
                 if f._task_state == CANCELLED:
@@ -339,65 +420,87 @@ def _run_measure_z_multi_targets(f: ProgressiveFuture, stigmator, focus,
 
             # Iterate for maximum 3 times
             for iteration in range(MAX_ITERATIONS):
-                # Move the focus to the set target position
-                with f._task_lock:
-                    if f._task_state == CANCELLED:
-                        raise CancelledError
-                    f.running_subf = focus.moveAbs({"z": target.coordinates.value[2]})
-                f.running_subf.result(timeout=600)
-                # Acquire an image of the spot
-                # Typically ex is always None as we acquire only one stream (an error will directly raise a exception)
-                # so we don't check it.
-                with f._task_lock:
-                    if f._task_state == CANCELLED:
-                        raise CancelledError
-                    f.running_subf = acqmng.acquire([stream])
-                data, ex = f.running_subf.result(timeout=600)
-                im = data[0]
-                if len(data) != 1:
-                    logging.warning("Unexpected extra DataArray from acquisition: %s", data)
-
-                pos = target.coordinates.value[0:2]  # (X, Y) in metres of the sample plane
-                pos_px = stream.getPixelCoordinates(pos, check_bbox=True)  # pixels<---metres
-                if pos_px is None:
-                    raise ValueError(f"Target {target.name.value} position {pos} is outside of "
-                                     f"current FoV {stream.getBoundingBox()}")
-                pos_px = tuple(map(int, pos_px))
-                logging.debug("Target %s is at %s, corresponding to %s px, will crop %s pixels around",
-                              target.name.value, pos, pos_px, 2 * half_width)
-                sub_im = im[max(0, pos_px[1] - half_width):pos_px[1] + half_width,  # Y
-                            max(0, pos_px[0] - half_width):pos_px[0] + half_width]  # X
-
-                logging.debug(f"RoI for target {target.name.value} has shape {sub_im.shape}")
-
-                # Store the acquisition somewhere, for debugging purposes
-                acq_conf = conf.get_acqui_conf()
-                fn = create_filename(acq_conf.pj_last_path, "{datelng}-{timelng}-superz", ".ome.tiff")
-                if not exporter:
-                    exporter = dataio.get_converter("TIFF")
-                exporter.export(fn, data + [sub_im])
+                sizes_f = []  # Futures returning the size of each target
+                for target in group:
+                    acq_start = time.time()
+                    # Move the focus to the set target position
+                    with f._task_lock:
+                        if f._task_state == CANCELLED:
+                            raise CancelledError
+                        f.running_subf = focus.moveAbs({"z": target.coordinates.value[2]})
+                    f.running_subf.result(timeout=600)
+                    # Acquire an image of the spot
+                    # Typically ex is always None as we acquire only one stream (an error will directly raise a exception)
+                    # so we don't check it.
+                    with f._task_lock:
+                        if f._task_state == CANCELLED:
+                            raise CancelledError
+                        f.running_subf = acqmng.acquire([stream])
+                    data, ex = f.running_subf.result(timeout=600)
+                    im = data[0]
+                    if len(data) != 1:
+                        logging.warning("Unexpected extra DataArray from acquisition: %s", data)
+
+                    pos = target.coordinates.value[0:2]  # (X, Y) in metres of the sample plane
+                    pos_px = stream.getPixelCoordinates(pos, check_bbox=True)  # pixels<---metres
+                    if pos_px is None:
+                        raise ValueError(f"Target {target.name.value} position {pos} is outside of "
+                                         f"current FoV {stream.getBoundingBox()}")
+                    pos_px = tuple(map(int, pos_px))
+                    logging.debug("Target %s is at %s, corresponding to %s px, will crop %s pixels around",
+                                  target.name.value, pos, pos_px, 2 * half_width)
+                    sub_im = im[max(0, pos_px[1] - half_width):pos_px[1] + half_width,  # Y
+                                max(0, pos_px[0] - half_width):pos_px[0] + half_width]  # X
+
+                    logging.debug(f"RoI for target {target.name.value} has shape {sub_im.shape}")
+
+                    # Store the acquisition somewhere, for debugging purposes
+                    acq_conf = conf.get_acqui_conf()
+                    fn = create_filename(acq_conf.pj_last_path, "{datelng}-{timelng}-superz", ".ome.tiff")
+                    sizes_f.append(executor.submit(_measure_target_size, exporter, fn, data + [sub_im],
+                                                   sub_im, calib))
+
+                    # Update the estimated remaining time, based on the actual duration of the acquisitions
+                    acq_left = max(1, acq_left - 1)
+                    acq_dur = (acq_dur + (time.time() - acq_start)) / 2
+                    f.set_progress(remaining_time=acq_left * acq_dur)
 
                 # Perform the localization
+                sizes = [sf.result() for sf in sizes_f]
                 with f._task_lock:
                     if f._task_state == CANCELLED:
                         raise CancelledError
-                zshift, warning = determine_z_position(sub_im, calib)
-                new_focus_position = target.coordinates.value[2] + zshift
-
-                if abs(zshift) > SUPERZ_THRESHOLD:
-                    target.superz_focused = False
-                else:
-                    target.superz_focused = True
-
-                # Update Z position of the target and check the SuperZ accuracy to determine if we need to carry on
-                # the superz process for the third time, otherwise we can stop and continue with the next target.
-                logging.debug(f"Target {target.name.value}, z shift is {zshift} m, iteration {iteration + 1}, "
-                              f"old focus position is {target.coordinates.value[2]} m, "
-                              f"new focus position is {new_focus_position} m, "
-                              f"accuracy <= {SUPERZ_THRESHOLD} is {target.superz_focused}")
-                target.coordinates.value[2] = new_focus_position
-
-                if abs(zshift) <= SUPERZ_THRESHOLD and iteration > 0:
+                zpositions = solve_z_positions([(sx, sy) for sx, sy, _ in sizes], calib)
+
+                for target, (_, _, size_warning), (zshift, solve_warning) in zip(group, sizes, zpositions):
+                    # Same as determine_z_position(): the warnings of the solve may be the result of the
+                    # warnings of the size measurement, so these ones are more important.
+                    warning = size_warning or solve_warning
+                    if warning:
+                        logging.warning("Z position of target %s at iteration %d may be inaccurate (warning %s)",
+                                        target.name.value, iteration + 1, warning)
+                    new_focus_position = target.coordinates.value[2] + zshift
+
+                    if abs(zshift) > SUPERZ_THRESHOLD:
+                        target.superz_focused = False
+                    else:
+                        target.superz_focused = True
+
+                    # Update Z position of the target and check the SuperZ accuracy to determine if we need to carry on
+                    # the superz process for the third time, otherwise we can stop with this target.
+                    logging.debug(f"Target {target.name.value}, z shift is {zshift} m, iteration {iteration + 1}, "
+                                  f"old focus position is {target.coordinates.value[2]} m, "
+                                  f"new focus position is {new_focus_position} m, "
+                                  f"accuracy <= {SUPERZ_THRESHOLD} is {target.superz_focused}")
+                    target.coordinates.value[2] = new_focus_position
+
+                    if (abs(zshift) <= SUPERZ_THRESHOLD and iteration > 0) or iteration == MAX_ITERATIONS - 1:
+                        localized += 1
+                        logging.info("Target %s localized (%d/%d)", target.name.value, localized, len(targets))
+
+                if iteration > 0:
+                    group = [t for t, (zshift, _) in zip(group, zpositions) if abs(zshift) > SUPERZ_THRESHOLD]
+                if not group:
                     break
 
         return targets
@@ -407,12 +510,31 @@ def _run_measure_z_multi_targets(f: ProgressiveFuture, stigmator, focus,
         raise
 
     finally:
+        # Don't measure the targets not yet measured (shutdown(cancel_futures) requires Python 3.9+)
+        for sf in sizes_f:
+            sf.cancel()
+        executor.shutdown(wait=False)
         stigmator.moveAbs({"rz": 0}).result(timeout=600)
         with f._task_lock:
             if f._task_state == CANCELLED:
                 raise CancelledError()
             f._task_state = FINISHED
 
+def _measure_target_size(exporter, fn: str, das: List[model.DataArray], sub_im: model.DataArray,
+                         calib: dict) -> Tuple[float, float, Optional[int]]:
+    """
+    Store the acquisition (for debugging purposes), and measure the size of the feature of the target.
+    Runs in a separate thread, while the next target is acquired.
+    :param exporter: the module to export the data
+    :param fn: the name of the file where to store the data
+    :param das: the data to store
+    :param sub_im: the part of the image containing the target
+    :param calib: the calibration data of the stigmator
+    :return: sigma_x, sigma_y, warning, see measure_feature_size()
+    """
+    exporter.export(fn, das)
+    return measure_feature_size(sub_im, calib)
+
 def _cancel_localization(future) -> bool:
     """
     Canceler of Z Localization.
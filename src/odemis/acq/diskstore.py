@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+"""
+Created on 18 Oct 2026
+
+@author: agent
+
+Copyright © 2026 agent, Delmic
+
+This file is part of Odemis.
+
+Odemis is free software: you can redistribute it and/or modify it under the terms
+of the GNU General Public License version 2 as published by the Free Software
+Foundation.
+
+Odemis is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+Odemis. If not, see http://www.gnu.org/licenses/.
+"""
+# Storage of the data of a (long) acquisition directly on disk, while it is acquired.
+# Each array is a standard .npy file, memory-mapped, so that the data written is immediately handed
+# over to the OS, and the memory usage stays bounded whatever the size of the acquisition.
+# In addition, a "progress" array records which positions are fully acquired, and an index file
+# records the metadata and the settings of the acquisition. If the acquisition is interrupted
+# (cancelled, error, or even crash of the backend), the data acquired so far can be read back, and
+# the acquisition can be resumed, by only acquiring the positions not yet acquired.
+
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy
+from numpy.lib.format import open_memmap
+
+from odemis import model
+
+INDEX_FILENAME = "index.json"
+PROGRESS_FILENAME = "progress.npy"
+FLUSH_PERIOD = 10  # s, maximum time between two synchronisations of the data to the disk
+
+
+def _encode_json(o: Any) -> Any:
+    """
+    Converts the objects which are not directly supported by JSON, but commonly found in the metadata
+    """
+    if isinstance(o, numpy.ndarray):
+        return {"__ndarray__": o.tolist(), "dtype": o.dtype.str}
+    elif isinstance(o, numpy.generic):
+        return o.item()
+    raise TypeError("Object of type %s is not JSON serializable" % (type(o).__name__,))
+
+
+def _decode_json(d: Dict[str, Any]) -> Any:
+    if "__ndarray__" in d:
+        return numpy.array(d["__ndarray__"], dtype=d["dtype"])
+    return d
+
+
+def _to_tuples(v: Any) -> Any:
+    """
+    Convert (recursively) all the lists into tuples, as JSON doesn't make the difference, and the
+    metadata typically uses tuples.
+    """
+    if isinstance(v, list):
+        return tuple(_to_tuples(i) for i in v)
+    elif isinstance(v, dict):
+        return {k: _to_tuples(i) for k, i in v.items()}
+    return v
+
+
+def _serialize_md(md: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    :return: the metadata which can be stored as JSON. Non-serializable values are dropped.
+    """
+    smd = {}
+    for k, v in md.items():
+        try:
+            json.dumps(v, default=_encode_json)
+        except (TypeError, ValueError):
+            logging.warning("Metadata %s of type %s cannot be stored on disk, will be dropped", k, type(v))
+            continue
+        smd[k] = v
+    return smd
+
+
+def _normalize_settings(settings: Dict[str, Any]) -> Any:
+    """
+    :return: the settings, as they would be after being read back from the index file
+    """
+    return json.loads(json.dumps(settings, default=_encode_json))
+
+
+class AcquisitionDiskStore(object):
+    """
+    Stores the data of an acquisition on disk, as it is acquired.
+    The data is stored in a directory, containing one .npy file per array (which can be read with
+    numpy.load(), even while the acquisition is still running), a progress.npy file, and an
+    index.json file, with the metadata and settings.
+    """
+
+    def __init__(self, path: str, settings: Dict[str, Any], progress_shape: Tuple[int, ...],
+                 resume: bool = True):
+        """
+        :param path: directory where the data is stored. It's created if it doesn't exist.
+        :param settings: (JSON-serializable) values identifying the acquisition. An acquisition
+          already (partially) stored in the directory is only resumed if its settings are identical.
+        :param progress_shape: shape of the positions of the acquisition (eg, polarizations, Y, X)
+        :param resume: if False, any previous acquisition in the directory is discarded.
+        """
+        self.path = path
+        self._settings = _normalize_settings(settings)
+        self._arrays_info: Dict[str, Dict[str, Any]] = {}  # key -> filename, shape, dtype, metadata
+        self._arrays: Dict[str, model.DataArray] = {}
+        self._last_flush = time.time()
+        self.resumed = False
+
+        os.makedirs(path, exist_ok=True)
+        index = None
+        if resume:
+            try:
+                index = self._read_index()
+            except FileNotFoundError:
+                pass
+            except Exception:
+                logging.exception("Failed to read the acquisition index in %s, will start from scratch", path)
+
+        if (index and not index["complete"] and index["settings"] == self._settings
+                and tuple(index["progress_shape"]) == tuple(progress_shape)):
+            try:
+                self._progress = open_memmap(self._get_filename(PROGRESS_FILENAME), mode="r+")
+                for key, info in index["arrays"].items():
+                    self._arrays[key] = self._open_array(info, mode="r+")
+                    self._arrays_info[key] = info
+                self.resumed = True
+                logging.info("Resuming acquisition stored in %s, with %d/%d positions already acquired",
+                             path, numpy.count_nonzero(self._progress), self._progress.size)
+            except Exception:
+                logging.exception("Failed to open the previous acquisition in %s, will start from scratch", path)
+                self._arrays.clear()
+                self._arrays_info.clear()
+
+        if not self.resumed:
+            if index:
+                self._delete_files(index)
+            self._progress = open_memmap(self._get_filename(PROGRESS_FILENAME), mode="w+",
+                                         dtype=bool, shape=tuple(progress_shape))
+            self._write_index(complete=False)
+
+    def _get_filename(self, fn: str) -> str:
+        return os.path.join(self.path, fn)
+
+    def _read_index(self) -> Dict[str, Any]:
+        with open(self._get_filename(INDEX_FILENAME), "r") as f:
+            return json.load(f, object_hook=_decode_json)
+
+    def _write_index(self, complete: bool):
+        index = {"settings": self._settings,
+                 "progress_shape": self._progress.shape,
+                 "arrays": self._arrays_info,
+                 "complete": complete,
+                 }
+        # Write to a temporary file, so that the index is never half-written
+        fn = self._get_filename(INDEX_FILENAME)
+        with open(fn + ".tmp", "w") as f:
+            json.dump(index, f, default=_encode_json, indent=1)
+        os.replace(fn + ".tmp", fn)
+
+    def _delete_files(self, index: Dict[str, Any]):
+        """
+        Remove the files of a previous acquisition
+        """
+        fns = [info["filename"] for info in index.get("arrays", {}).values()] + [PROGRESS_FILENAME]
+        for fn in fns:
+            try:
+                os.remove(self._get_filename(fn))
+            except FileNotFoundError:
+                pass
+
+    def _open_array(self, info: Dict[str, Any], mode: str = "r+") -> model.DataArray:
+        mm = open_memmap(self._get_filename(info["filename"]), mode=mode)
+        if mm.shape != tuple(info["shape"]) or mm.dtype != numpy.dtype(info["dtype"]):
+            raise ValueError("Array %s has shape %s and dtype %s, while expected %s %s" %
+                             (info["filename"], mm.shape, mm.dtype, info["shape"], info["dtype"]))
+        return model.DataArray(mm, _to_tuples(info["metadata"]))
+
+    def get_array(self, key: str) -> Optional[model.DataArray]:
+        """
+        :return: the array previously created (or resumed), or None if there is no such array.
+        """
+        return self._arrays.get(key)
+
+    def create_array(self, key: str, shape: Tuple[int, ...], dtype, md: Dict[str, Any]) -> model.DataArray:
+        """
+        Create a new array, stored on disk, and initialized with zeros. If the array already exists
+        (because the acquisition is resumed) with the same shape and dtype, it is returned as-is.
+        :param key: name of the array, unique within the acquisition
+        :param shape: shape of the array
+        :param dtype: numpy dtype of the array
+        :param md: metadata of the array (only the JSON-serializable values are stored on disk)
+        :return: a DataArray, backed by the file on disk
+        """
+        dtype = numpy.dtype(dtype)
+        da = self._arrays.get(key)
+        if da is not None:
+            if da.shape == tuple(shape) and da.dtype == dtype:
+                return da
+            logging.warning("Array %s stored with shape %s %s, but requested %s %s, will overwrite it",
+                            key, da.shape, da.dtype, shape, dtype)
+
+        info = {"filename": "%s.npy" % (key,),
+                "shape": tuple(shape),
+                "dtype": dtype.str,
+                "metadata": _serialize_md(md),
+                }
+        mm = open_memmap(self._get_filename(info["filename"]), mode="w+", dtype=dtype, shape=tuple(shape))
+        da = model.DataArray(mm, md)
+        self._arrays[key] = da
+        self._arrays_info[key] = info
+        self._write_index(complete=False)
+        return da
+
+    def is_done(self, idx: Tuple[int, ...]) -> bool:
+        """
+        :param idx: the position (within progress_shape)
+        :return: True if the position has already been completely acquired
+        """
+        return bool(self._progress[idx])
+
+    def mark_done(self, idx: Tuple[int, ...]):
+        """
+        Record that the data of the given position is completely acquired. The data is regularly
+        synchronized to the disk.
+        :param idx: the position (within progress_shape)
+        """
+        self._progress[idx] = True
+        if time.time() > self._last_flush + FLUSH_PERIOD:
+            self.flush()
+
+    def flush(self):
+        """
+        Synchronise all the data to the disk
+        """
+        # Data first, and then only the progress, so that the progress never indicates data not yet written
+        for da in self._arrays.values():
+            base = da.base
+            while base is not None and not isinstance(base, numpy.memmap):
+                base = base.base
+            if base is not None:
+                base.flush()
+        self._progress.flush()
+        self._last_flush = time.time()
+
+    def close(self, complete: bool):
+        """
+        Synchronize all the data to the disk and update the index. The arrays returned can still
+        be used afterwards (they stay backed by the files).
+        :param complete: True if the acquisition is finished, in which case it will not be resumed.
+        """
+        self.flush()
+        self._write_index(complete=complete)
+
+
+def open_store(path: str) -> Tuple[List[model.DataArray], numpy.ndarray]:
+    """
+    Read the data of an acquisition stored on disk (which might be partially acquired).
+    :param path: directory of the acquisition
+    :return:
+        data: the arrays, in the order they were created (read-only)
+        progress: boolean array, True for each position fully acquired
+    :raises IOError: if the directory doesn't contain an acquisition
+    """
+    try:
+        with open(os.path.join(path, INDEX_FILENAME), "r") as f:
+            index = json.load(f, object_hook=_decode_json)
+    except FileNotFoundError:
+        raise IOError("No acquisition stored in %s" % (path,))
+
+    data = []
+    for info in index["arrays"].values():
+        mm = numpy.load(os.path.join(path, info["filename"]), mmap_mode="r")
+        data.append(model.DataArray(mm, _to_tuples(info["metadata"])))
+    progress = numpy.load(os.path.join(path, PROGRESS_FILENAME))
+    return data, progress
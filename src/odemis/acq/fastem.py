@@ -43,11 +43,11 @@ except ImportError as err:
 import odemis.acq.stream as acqstream
 from odemis import model, util
 from odemis.acq import fastem_conf, stitching
+from odemis.acq.fastem_beamshift import BeamShiftModel, DEFAULT_MAX_STD
 from odemis.acq.align.fastem import align, estimate_calibration_time
 from odemis.acq.stitching import REGISTER_IDENTITY, FocusingMethod, WEAVER_COLLAGE
 from odemis.acq.stream import SEMStream
 from odemis.util import transform
-from odemis.util.driver import guessActuatorMoveDuration
 from odemis.util.registration import estimate_grid_orientation_from_img
 from odemis.util.transform import SimilarityTransform, to_physical_space
 
@@ -55,6 +55,18 @@ from odemis.util.transform import SimilarityTransform, to_physical_space
 _executor = model.CancellableThreadPoolExecutor(max_workers=1)
 
 DEFAULT_PITCH = 3.2e-6  # distance between spots in m
+# Maximum error (RMS, in px) of the grid found around its expected position, above which the whole image is searched
+MAX_PRIOR_GRID_ERROR = 1.0
+
+# Fill level of the ASM offload queue (in %) above which no new field is scanned, until it goes below the low level.
+OFFLOAD_QUEUE_HIGH_LEVEL = 90
+OFFLOAD_QUEUE_LOW_LEVEL = 70
+OFFLOAD_QUEUE_CHECK_PERIOD = 10  # Number of fields between two checks of the offload queue fill level
+OFFLOAD_QUEUE_MAX_WAIT = 3600  # s, maximum time to wait for the offload queue to be emptied
+
+# With a reliable beam shift model, the beam shift is only measured on one out of this number of the regular
+# beam shift correction fields, to validate the predictions.
+BEAM_SHIFT_VALIDATION_PERIOD = 5
 
 # TODO: Normally we do not use component names in code, only roles. Store in the roles in the SETTINGS_SELECTION,
 #  and at init lookup the role -> name conversion (using model.getComponent(role=role)).
@@ -161,7 +173,8 @@ def estimate_acquisition_time(roa, pre_calibrations=None, acq_dwell_time: Option
 
 def acquire(roa, path, username, scanner, multibeam, descanner, detector, stage, scan_stage, ccd, beamshift, lens,
             se_detector, ebeam_focus, pre_calibrations=None, save_full_cells=False, settings_obs=None,
-            spot_grid_thresh=0.5, blank_beam=True, stop_acq_on_failure=True, acq_dwell_time: Optional[float] = None):
+            spot_grid_thresh=0.5, blank_beam=True, stop_acq_on_failure=True, acq_dwell_time: Optional[float] = None,
+            beam_shift_model: Optional[BeamShiftModel] = None, beam_shift_max_std: float = DEFAULT_MAX_STD):
     """
     Start a megafield acquisition task for a given region of acquisition (ROA).
 
@@ -199,10 +212,19 @@ def acquire(roa, path, username, scanner, multibeam, descanner, detector, stage,
     :param stop_acq_on_failure: (bool) If true the acquisition will be stopped based on the raised exception,
         if false the acquisition will be skipped on failure.
     :param acq_dwell_time: (float or None) The acquisition dwell time.
+    :param beam_shift_model: (BeamShiftModel or None) Model of the beam shift as a function of the stage position,
+        typically the one of the scintillator of the ROA (see BeamShiftModel.for_scintillator()). If provided, the
+        beam shift is predicted for every field, and measured only when the prediction is not reliable enough, on
+        the first field, and on a few of the regular beam shift correction fields, to validate the predictions. The
+        model is updated with the new measurements, and saved at the end of the acquisition.
+    :param beam_shift_max_std: (float) Maximum uncertainty (standard deviation, in m) of a beam shift prediction
+        for it to be used. If it's higher, the beam shift is measured with the diagnostic camera.
     :return: (ProgressiveFuture) Acquisition future object, which can be cancelled. The result of the future is
              a tuple that contains:
                 (model.DataArray): The acquisition data, which depends on the value of the detector.dataContent VA.
                 (Exception or None): Exception raised during the acquisition or None.
+             It also has a .field_timings attribute (dict (int, int) -> dict str -> float), which contains for
+             each field index the time spent in each step of the acquisition ("move", "settle", "offload", "scan").
 
     """
 
@@ -213,9 +235,11 @@ def acquire(roa, path, username, scanner, multibeam, descanner, detector, stage,
     # Create a task that acquires the megafield image.
     task = AcquisitionTask(scanner, multibeam, descanner, detector, stage, scan_stage, ccd, beamshift, lens,
                            se_detector, ebeam_focus, roa, path, username, pre_calibrations, save_full_cells,
-                           settings_obs, spot_grid_thresh, blank_beam, stop_acq_on_failure, f)
+                           settings_obs, spot_grid_thresh, blank_beam, stop_acq_on_failure, f,
+                           beam_shift_model, beam_shift_max_std)
 
     f.task_canceller = task.cancel  # lets the future know how to cancel the task.
+    f.field_timings = task.field_timings
 
     # Connect the future to the task and run it in a thread.
     # task.run is executed by the executor and runs as soon as no other task is executed
@@ -232,7 +256,7 @@ class AcquisitionTask(object):
 
     def __init__(self, scanner, multibeam, descanner, detector, stage, scan_stage, ccd, beamshift, lens, se_detector,
                  ebeam_focus, roa, path, username, pre_calibrations, save_full_cells, settings_obs, spot_grid_thresh,
-                 blank_beam, stop_acq_on_failure, future):
+                 blank_beam, stop_acq_on_failure, future, beam_shift_model=None, beam_shift_max_std=DEFAULT_MAX_STD):
         """
         :param scanner: (xt_client.Scanner) Scanner component connecting to the XT adapter.
         :param multibeam: (technolution.EBeamScanner) The multibeam scanner component of the acquisition server module.
@@ -272,6 +296,11 @@ class AcquisitionTask(object):
                             (model.DataArray): The acquisition data, which depends on the value of the
                                                detector.dataContent VA.
                             (Exception or None): Exception raised during the acquisition or None.
+        :param beam_shift_model: (BeamShiftModel or None) Model used to predict the beam shift at each field. If None,
+            the beam shift is measured at the fields selected by _calculate_beam_shift_cor_indices(). With a model,
+            it is measured when the prediction is not reliable, on the first field, and only on one out of
+            BEAM_SHIFT_VALIDATION_PERIOD of these fields. The measurements update the model.
+        :param beam_shift_max_std: (float) Maximum uncertainty (in m) of a beam shift prediction for it to be used.
         """
         self._scanner = scanner
         self._multibeam = multibeam
@@ -297,6 +326,8 @@ class AcquisitionTask(object):
         self._spot_grid_thresh = spot_grid_thresh
         self._blank_beam = blank_beam
         self._stop_acq_on_failure = stop_acq_on_failure
+        self._beam_shift_model = beam_shift_model
+        self._beam_shift_max_std = beam_shift_max_std
         self._total_roa_time = 0
         # flag which when set to True can be used to force returns the run() function and skip the acquisition
         self._skip_roa_acq = False
@@ -315,6 +346,8 @@ class AcquisitionTask(object):
         exp_pitch_px = self._exp_pitch_m * lens_mag / ccd_px_size[0]
         # 0.75 is a safety factor to allow for some variation in spot positions
         self._min_dist_spots = int(0.75 * exp_pitch_px)
+        # Expected orientation of the grid on the diagnostic camera, based on the last beam shift correction
+        self._grid_prior = None
 
         beam_shift_path = fastem_util.create_image_dir("beam-shift-correction")
         # If there is a project name the path will be
@@ -346,6 +379,11 @@ class AcquisitionTask(object):
         # Threading event, which keeps track of when image data has been received from the detector.
         self._data_received = threading.Event()
 
+        # The acquisition server, which reports the fill level of the offload queue. It's the parent of the MPPC.
+        self._asm = getattr(detector, "parent", None)
+        # field index -> dict step -> duration (s): time spent in each step of the acquisition of each field
+        self.field_timings = {}
+
     def run(self):
         """
         Runs the acquisition of one ROA (megafield).
@@ -452,6 +490,12 @@ class AcquisitionTask(object):
             # Blank the beam after the acquisition is done.
             self._scanner.blanker.value = True
 
+            if self._beam_shift_model is not None:
+                try:
+                    self._beam_shift_model.save()
+                except Exception:
+                    logging.exception("Failed to save the beam shift model")
+
             # Finish the megafield also if an exception was raised, in order to enable a new acquisition.
             logging.debug("Finish ROA acquisition.")
             dataflow.unsubscribe(self.image_received)
@@ -467,6 +511,10 @@ class AcquisitionTask(object):
     def acquire_roa(self, dataflow):
         """
         Acquire the single field images that resemble the region of acquisition (ROA, megafield image).
+        The acquisition is pipelined: as soon as the scan of a field is finished, the stage starts moving to the
+        next field, and the bookkeeping of the field which was just scanned is done during the move. The offload of
+        the field images to the external storage is done by the ASM in the background. If the offload queue gets
+        full, the acquisition waits for it to be emptied, instead of failing.
         :param dataflow: (model.DataFlow) The dataflow on the detector.
         """
         beam_shift_indices = self._calculate_beam_shift_cor_indices()
@@ -476,20 +524,51 @@ class AcquisitionTask(object):
         # Use 5 times the total field time to have a wide margin.
         timeout = 5 * total_field_time + 2
         beam_shift_failed = False
+        n_predicted_cor_fields = 0  # Number of beam shift correction fields where the prediction was reliable
+
+        # Compute all the stage positions at once, so that the next move can be started without delay.
+        field_indices = self._roa.field_indices
+        positions = self._get_all_abs_stage_movements(field_indices)
+        move_f = self._start_stage_move(positions[0])
+
         # Acquire all single field images, which are automatically offloaded to the external storage.
-        for field_idx in self._roa.field_indices:
+        for i, field_idx in enumerate(field_indices):
             # Reset the event that waits for the image being received (puts flag to false).
             self._data_received.clear()
             self.field_idx = field_idx
             logging.debug("Acquiring field with index: %s", field_idx)
+            timing = {}
+
+            # Wait for the stage to reach the field position (move started at the end of the previous scan)
+            t = time.time()
+            try:
+                move_f.result()
+            except CancelledError:
+                if self._cancelled:
+                    raise
+                raise IOError(f"Stage move to field {field_idx} was unexpectedly cancelled")
+            timing["move"] = time.time() - t
 
-            self.move_stage_to_next_tile()  # move stage to next field image position
-            if self._blank_beam or field_idx == self._roa.field_indices[0]:
+            t = time.time()
+            if self._blank_beam or i == 0:
                 logging.debug("unblank the beam")
                 self._scanner.blanker.value = False  # unblank the beam
 
             prev_beam_shift = self._beamshift.shift.value
-            if field_idx in beam_shift_indices or beam_shift_failed:
+            measure_beam_shift = field_idx in beam_shift_indices or beam_shift_failed
+            predicted_beam_shift = None
+            if self._beam_shift_model is not None:
+                # Use the prediction, and only measure when it is not reliable. Still measure on the first field,
+                # to detect changes since the previous ROA (eg, recalibration), and on a few of the regular fields,
+                # to validate the predictions.
+                predicted_beam_shift = self._predict_beam_shift(positions[i])
+                if predicted_beam_shift is None or i == 0:
+                    measure_beam_shift = True
+                elif field_idx in beam_shift_indices and not beam_shift_failed:
+                    n_predicted_cor_fields += 1
+                    measure_beam_shift = (n_predicted_cor_fields % BEAM_SHIFT_VALIDATION_PERIOD == 0)
+
+            if measure_beam_shift:
                 logging.debug(f"Will run beam shift correction for field index {field_idx}")
                 try:
                     new_beam_shift = self.correct_beam_shift()
@@ -500,34 +579,152 @@ class AcquisitionTask(object):
                             f"Previous beam shift: {prev_beam_shift}, new beam shift: {new_beam_shift}"
                         )
                     beam_shift_failed = False
+                    if self._beam_shift_model is not None:
+                        if predicted_beam_shift is not None:
+                            self._validate_beam_shift_prediction(predicted_beam_shift, new_beam_shift)
+                        self._beam_shift_model.add_measurement(positions[i], new_beam_shift)
                 except Exception:
                     logging.exception("Correcting the beam shift failed, check if the image quality is still good.")
                     # In case of failure save the ccd image
                     ccd_image = self._ccd.data.get(asap=False)
                     fastem_util.save_image(self.beam_shift_path, f"{self.field_idx}_after.tiff", ccd_image)
                     beam_shift_failed = True
+            timing["settle"] = time.time() - t
+
+            # Don't scan if the offload queue is (nearly) full, as the scan would fail.
+            t = time.time()
+            if i % OFFLOAD_QUEUE_CHECK_PERIOD == 0:
+                self._wait_offload_queue()
+            timing["offload"] = time.time() - t
 
+            t = time.time()
             dataflow.next(field_idx)  # acquire the next field image.
 
             # Wait until single field image data has been received (image_received sets flag to True).
-            if not self._data_received.wait(timeout):
-                # TODO here we often timeout when actually just the offload queue is full
-                #  need to handle offload queue error differently to just wait a bit instead of timing out
-                #   -> check if finish megafield is called in finally when hitting here
-                raise TimeoutError("Timeout while waiting for field image.")
+            self._wait_field_data(timeout)
+            timing["scan"] = time.time() - t
 
+            # The scan is over => immediately start moving to the next field.
             if self._blank_beam:
                 logging.debug("blank the beam")
                 self._scanner.blanker.value = True  # blank the beam after the acquisition
+            if i + 1 < len(field_indices):
+                move_f = self._start_stage_move(positions[i + 1])
+
             self._fields_remaining.discard(field_idx)
+            self.field_timings[field_idx] = timing
+            logging.debug("Field %s acquired in %g s (move: %g s, settle: %g s, offload: %g s, scan: %g s)",
+                          field_idx, sum(timing.values()), timing["move"], timing["settle"],
+                          timing["offload"], timing["scan"])
 
             # In case the acquisition was cancelled by a client, before the future returned, raise cancellation error.
             # Note: The acquisition of the current single field image (tile) is still finished though.
             if self._cancelled:
+                move_f.cancel()
                 raise CancelledError()
 
+        self._log_field_timings()
         logging.debug("Successfully acquired all fields of ROA.")
 
+    def _predict_beam_shift(self, stage_pos):
+        """
+        Use the beam shift model to set the beam shift at the given stage position.
+        :param stage_pos: (float, float) The (target) position of the scan-stage in m.
+        :return: (float, float) or None: The beam shift predicted and set, in m, or None if the prediction is not
+            reliable, and so the beam shift should be measured instead.
+        """
+        bs, std = self._beam_shift_model.predict(stage_pos)
+        if bs is None or std > self._beam_shift_max_std:
+            logging.debug("Beam shift prediction at %s not reliable enough (std = %g m)", stage_pos, std)
+            return None
+
+        logging.debug("Setting predicted beam shift %s m (std = %g m)", bs, std)
+        self._beamshift.shift.value = bs
+        return bs
+
+    def _validate_beam_shift_prediction(self, predicted, measured):
+        """
+        Compare the beam shift predicted by the model to the one measured, and warn if the model is wrong.
+        :param predicted: (float, float) The beam shift predicted in m.
+        :param measured: (float, float) The beam shift measured in m.
+        """
+        error = math.hypot(measured[0] - predicted[0], measured[1] - predicted[1])
+        if error > 2 * self._beam_shift_max_std:
+            logging.warning("Beam shift predicted %s m, but measured %s m (error = %g m), the model will be updated",
+                            predicted, measured, error)
+        else:
+            logging.debug("Beam shift prediction error: %g m", error)
+
+    def _start_stage_move(self, pos):
+        """
+        Start moving the scan-stage to a field position.
+        :param pos: (float, float) The absolute stage x and y position in meter.
+        :return: (Future) The move future.
+        """
+        logging.debug(f"Moving to scan-stage position x: {pos[0]}, y: {pos[1]}")
+        return self._stage_scan.moveAbs({'x': pos[0], 'y': pos[1]})
+
+    def _wait_field_data(self, timeout):
+        """
+        Wait until the image data of the field has been received. If it takes longer than the timeout, but the
+        offload queue is (nearly) full, the ASM is just slowed down by the offloading, so keep waiting.
+        :param timeout: (float) Maximum time to wait for the field data, when the offload queue is not full (s).
+        :raise: (TimeoutError) If the field data is not received in time.
+        """
+        start = time.time()
+        while not self._data_received.wait(timeout):
+            fill_level = self._get_offload_queue_fill_level()
+            if (fill_level is None or fill_level < OFFLOAD_QUEUE_HIGH_LEVEL
+                    or time.time() - start > OFFLOAD_QUEUE_MAX_WAIT):
+                raise TimeoutError("Timeout while waiting for field image.")
+            logging.warning("Field image not received after %g s, but offload queue is %s %% full, will wait longer.",
+                            time.time() - start, fill_level)
+
+    def _wait_offload_queue(self):
+        """
+        Block while the offload queue of the ASM is (nearly) full, until enough field images have been offloaded.
+        :raise: (CancelledError) If the acquisition is cancelled while waiting.
+                (TimeoutError) If the offload queue is not emptied within OFFLOAD_QUEUE_MAX_WAIT.
+        """
+        fill_level = self._get_offload_queue_fill_level()
+        if fill_level is None or fill_level < OFFLOAD_QUEUE_HIGH_LEVEL:
+            return
+
+        logging.warning("Offload queue is %s %% full, waiting for it to go below %s %% before scanning.",
+                        fill_level, OFFLOAD_QUEUE_LOW_LEVEL)
+        start = time.time()
+        while fill_level is not None and fill_level > OFFLOAD_QUEUE_LOW_LEVEL:
+            if self._cancelled:
+                raise CancelledError()
+            if time.time() - start > OFFLOAD_QUEUE_MAX_WAIT:
+                raise TimeoutError(f"Offload queue still {fill_level} % full after {OFFLOAD_QUEUE_MAX_WAIT} s.")
+            time.sleep(1)
+            fill_level = self._get_offload_queue_fill_level()
+        logging.info("Offload queue emptied to %s %% after %g s, resuming acquisition.",
+                     fill_level, time.time() - start)
+
+    def _get_offload_queue_fill_level(self):
+        """
+        :return: (0 <= float <= 100 or None) The fill level of the ASM offload queue in percent, or None if it
+            cannot be read.
+        """
+        try:
+            return float(self._asm.getFillLevelOffloadingQueue())
+        except Exception as ex:
+            logging.debug("Failed to read the offload queue fill level: %s", ex)
+            return None
+
+    def _log_field_timings(self):
+        """Log the average time spent in each step of the field acquisitions."""
+        if not self.field_timings:
+            return
+        n = len(self.field_timings)
+        avg = {step: sum(t[step] for t in self.field_timings.values()) / n
+               for step in ("move", "settle", "offload", "scan")}
+        logging.info("Acquired %d fields, average time per field: %g s (move: %g s, settle: %g s, "
+                     "offload: %g s, scan: %g s)", n, sum(avg.values()),
+                     avg["move"], avg["settle"], avg["offload"], avg["scan"])
+
     def pre_calibrate(self, pre_calibrations):
         """
         Run optical multiprobe autofocus and image translation pre-alignment before the ROA acquisition.
@@ -652,14 +849,28 @@ class AcquisitionTask(object):
         px_size = self._multibeam.pixelSize.value
         # When saving the full cells, the stage should still move based on the cropped cells.
         field_res = self._multibeam.resolution.value if not self._save_full_cells else self._old_res
+        return self._field_idx_to_stage_pos(self.field_idx, px_size, field_res)
 
-        rel_move_hor = self.field_idx[0] * px_size[0] * field_res[0] * (1 - self._roa.overlap)  # in meter
-        rel_move_vert = self.field_idx[1] * px_size[1] * field_res[1] * (1 - self._roa.overlap)  # in meter
+    def _get_all_abs_stage_movements(self, field_indices):
+        """
+        Calculate the stage positions of all the given fields, reading the hardware settings only once.
+        :param field_indices: (list of (int, int)) The field indices.
+        :return: (list of (float, float)) The absolute stage x and y positions in meter, in the same order.
+        """
+        px_size = self._multibeam.pixelSize.value
+        # When saving the full cells, the stage should still move based on the cropped cells.
+        field_res = self._multibeam.resolution.value if not self._save_full_cells else self._old_res
+        return [self._field_idx_to_stage_pos(idx, px_size, field_res) for idx in field_indices]
 
-        # Acceleration unknown, guessActuatorMoveDuration uses a default acceleration
-        estimated_time_x = guessActuatorMoveDuration(self._stage_scan, "x", abs(rel_move_hor))  # s
-        estimated_time_y = guessActuatorMoveDuration(self._stage_scan, "y", abs(rel_move_hor))  # s
-        logging.debug(f"Estimated time for stage movement: {estimated_time_x + estimated_time_y} s")
+    def _field_idx_to_stage_pos(self, field_idx, px_size, field_res):
+        """
+        :param field_idx: (float, float) The field index.
+        :param px_size: (float, float) The pixel size of the multibeam scanner in meter.
+        :param field_res: (int, int) The resolution of a field, not including the full cells.
+        :return: (float, float) The absolute stage x and y position of the center of the field in meter.
+        """
+        rel_move_hor = field_idx[0] * px_size[0] * field_res[0] * (1 - self._roa.overlap)  # in meter
+        rel_move_vert = field_idx[1] * px_size[1] * field_res[1] * (1 - self._roa.overlap)  # in meter
 
         # With role="stage", move positive in x direction, because the second field should be right of the first,
         # and move negative in y direction, because the second field should be bottom of the first.
@@ -701,10 +912,26 @@ class AcquisitionTask(object):
         sigma = self._ccd.pointSpreadFunctionSize.value
         # asap=False: wait until new image is acquired (don't read from buffer)
         ccd_image = self._ccd.data.get(asap=False)
-        tform, error = estimate_grid_orientation_from_img(ccd_image, (8, 8), SimilarityTransform, sigma,
-                                                          threshold_rel=self._spot_grid_thresh,
-                                                          min_distance=self._min_dist_spots,
-                                                          )
+        tform = None
+        if self._grid_prior is not None:
+            # The beams are expected close to where they were moved by the previous correction, so first
+            # only look for the spots around these positions.
+            try:
+                tform, error = estimate_grid_orientation_from_img(ccd_image, (8, 8), SimilarityTransform, sigma,
+                                                                  threshold_rel=self._spot_grid_thresh,
+                                                                  min_distance=self._min_dist_spots,
+                                                                  prior=self._grid_prior,
+                                                                  )
+                if error > MAX_PRIOR_GRID_ERROR:
+                    logging.debug("Grid found around the previous position has a large error (%s px)", error)
+                    tform = None
+            except (ValueError, IndexError) as ex:
+                logging.debug("Failed to find the grid around the previous position: %s", ex)
+        if tform is None:
+            tform, error = estimate_grid_orientation_from_img(ccd_image, (8, 8), SimilarityTransform, sigma,
+                                                              threshold_rel=self._spot_grid_thresh,
+                                                              min_distance=self._min_dist_spots,
+                                                              )
         logging.debug(f"Found center of grid at {tform.translation}, error: {error}.")
 
         # Determine the shift of the spots, by subtracting the good multiprobe position from the average (center)
@@ -723,6 +950,8 @@ class AcquisitionTask(object):
 
         good_mp_position = numpy.array([j, i])
         shift = good_mp_position - tform.translation  # [px]
+        # After the correction, the grid should be at the good multiprobe position
+        self._grid_prior = SimilarityTransform(tform.matrix, good_mp_position)
         shift_m = to_physical_space(shift, pixel_size=pixel_size)  # [m]
 
         # FIXME A positive xy-shift of the beamshift component moves the pattern to the left bottom
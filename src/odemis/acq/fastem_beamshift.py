@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""
+Created on 18 Oct 2026
+
+@author: agent
+
+Copyright © 2026 agent, Delmic
+
+This file is part of Odemis.
+
+Odemis is free software: you can redistribute it and/or modify it under the terms
+of the GNU General Public License version 2 as published by the Free Software
+Foundation.
+
+Odemis is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+Odemis. If not, see http://www.gnu.org/licenses/.
+"""
+# Model of the beam shift correction as a function of the stage position.
+# The stage creates a parasitic magnetic field, which shifts the beams by an amount which depends
+# (smoothly) on the stage position. Instead of measuring the shift with the diagnostic camera at
+# every field, the past measurements are used to fit a 2D polynomial (one per beam shift axis).
+# The fit is a Bayesian linear regression, which provides the uncertainty of each prediction, so
+# that a new measurement is only needed when the prediction is not reliable enough.
+
+import json
+import logging
+import os
+import time
+from typing import Optional, Tuple
+
+import numpy
+
+DEFAULT_DIRECTORY = os.path.join(os.path.expanduser("~"), ".config", "odemis")
+MAX_MEASUREMENTS = 1000  # Only the latest measurements are kept (the beam shift slowly drifts over time)
+DEFAULT_DEGREE = 2  # Degree of the polynomial
+DEFAULT_NOISE_STD = 100e-9  # m, noise of a measurement, used until there are enough measurements
+# Default maximum uncertainty (standard deviation) of a prediction for it to be used instead of a measurement
+DEFAULT_MAX_STD = 200e-9  # m
+REGULARIZATION = 1e-3  # Weight of the prior on the (normalized) polynomial coefficients
+
+
+class BeamShiftModel(object):
+    """
+    Predicts the beam shift as a function of the stage position, based on previous measurements.
+    """
+
+    def __init__(self, path: Optional[str] = None, degree: int = DEFAULT_DEGREE,
+                 max_measurements: int = MAX_MEASUREMENTS):
+        """
+        :param path: JSON file where the measurements are stored. If it exists, the measurements are
+          loaded from it. If None, the model is not persistent.
+        :param degree: degree of the polynomial of the stage position.
+        :param max_measurements: maximum number of measurements kept (the oldest are discarded).
+        """
+        self.path = path
+        self.degree = degree
+        self.max_measurements = max_measurements
+        # Each measurement is (time, stage x, stage y, beam shift x, beam shift y)
+        self._measurements = []
+        self._coefs = None  # ndarray of shape (P, 2), with P the number of polynomial terms
+        self._cov = None  # ndarray of shape (P, P), inverse of the (regularized) normal matrix
+        self._noise_var = DEFAULT_NOISE_STD ** 2
+        self._pos_center = numpy.zeros(2)
+        self._pos_scale = numpy.ones(2)
+
+        if path and os.path.exists(path):
+            try:
+                self.load()
+            except Exception:
+                logging.exception("Failed to load beam shift model from %s, starting from scratch", path)
+                self._measurements = []
+                self._fit()
+
+    @classmethod
+    def for_scintillator(cls, scintillator_number: int, directory: str = DEFAULT_DIRECTORY, **kwargs):
+        """
+        Create the model associated to a given scintillator, persisted in the given directory.
+        :param scintillator_number: the number of the scintillator
+        :param directory: the directory where the model file is stored
+        :return: (BeamShiftModel)
+        """
+        path = os.path.join(directory, "fastem-beam-shift-scintillator-%d.json" % (scintillator_number,))
+        return cls(path, **kwargs)
+
+    @property
+    def n_measurements(self) -> int:
+        return len(self._measurements)
+
+    def add_measurement(self, stage_pos: Tuple[float, float], beam_shift: Tuple[float, float],
+                        timestamp: Optional[float] = None):
+        """
+        Add a new measurement and update the model.
+        :param stage_pos: position of the stage (x, y), in m
+        :param beam_shift: beam shift measured as correct at that stage position (x, y), in m
+        :param timestamp: time of the measurement (s since epoch). If None, the current time is used.
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        self._measurements.append((timestamp, stage_pos[0], stage_pos[1], beam_shift[0], beam_shift[1]))
+        if len(self._measurements) > self.max_measurements:
+            self._measurements = self._measurements[-self.max_measurements:]
+        self._fit()
+
+    def predict(self, stage_pos: Tuple[float, float]) -> Tuple[Optional[Tuple[float, float]], float]:
+        """
+        Predict the beam shift at a given stage position.
+        :param stage_pos: position of the stage (x, y), in m
+        :return:
+            beam_shift: the predicted beam shift (x, y), in m, or None if there is no measurement at all
+            std: the standard deviation of the prediction, in m (inf if there is no measurement)
+        """
+        if self._coefs is None:
+            return None, float("inf")
+
+        phi = self._features(numpy.array([stage_pos], dtype=float))[0]
+        bs = phi @ self._coefs
+        var = self._noise_var * (1 + phi @ self._cov @ phi)
+        return (float(bs[0]), float(bs[1])), float(numpy.sqrt(var))
+
+    def _features(self, pos: numpy.ndarray) -> numpy.ndarray:
+        """
+        :param pos: ndarray of shape (N, 2): the stage positions
+        :return: ndarray of shape (N, P): the polynomial terms of each (normalized) position
+        """
+        npos = (pos - self._pos_center) / self._pos_scale
+        x, y = npos[:, 0], npos[:, 1]
+        terms = []
+        for d in range(self.degree + 1):
+            for i in range(d + 1):
+                terms.append(x ** (d - i) * y ** i)
+        return numpy.stack(terms, axis=1)
+
+    def _fit(self):
+        """
+        Update the polynomial coefficients and their covariance based on the measurements.
+        """
+        if not self._measurements:
+            self._coefs = None
+            self._cov = None
+            self._noise_var = DEFAULT_NOISE_STD ** 2
+            return
+
+        m = numpy.array(self._measurements, dtype=float)
+        pos = m[:, 1:3]
+        shifts = m[:, 3:5]
+        self._pos_center = pos.mean(axis=0)
+        # Use a scale of at least 1 mm, to avoid blowing up the terms when all the positions are close by
+        self._pos_scale = numpy.maximum(pos.std(axis=0), 1e-3)
+
+        phi = self._features(pos)
+        n, p = phi.shape
+        # The constant term is not regularized, as the average beam shift is arbitrary
+        reg = REGULARIZATION * numpy.eye(p)
+        reg[0, 0] = 0
+        a = phi.T @ phi + reg
+        self._cov = numpy.linalg.inv(a)
+        self._coefs = self._cov @ phi.T @ shifts
+
+        # Estimate the measurement noise from the residuals, as soon as there are more measurements than terms
+        if n > p:
+            res = shifts - phi @ self._coefs
+            self._noise_var = max(float(numpy.sum(res ** 2) / (2 * (n - p))), (DEFAULT_NOISE_STD / 10) ** 2)
+        else:
+            self._noise_var = DEFAULT_NOISE_STD ** 2
+
+    def save(self):
+        """
+        Store the measurements into the file of the model (if it has one).
+        """
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, "w") as f:
+            json.dump({"degree": self.degree, "measurements": self._measurements}, f, indent=2)
+        logging.debug("Saved %d beam shift measurements to %s", len(self._measurements), self.path)
+
+    def load(self):
+        """
+        Read the measurements from the file of the model, and update the model.
+        """
+        with open(self.path, "r") as f:
+            data = json.load(f)
+        self.degree = int(data.get("degree", self.degree))
+        self._measurements = [tuple(float(v) for v in m) for m in data["measurements"]][-self.max_measurements:]
+        self._fit()
+        logging.debug("Loaded %d beam shift measurements from %s", len(self._measurements), self.path)
@@ -592,6 +592,104 @@ class OpticalPathManager:
 
         return f
 
+    def getPathMoves(self, path, detector=None):
+        """
+        Computes the positions the actuators would be moved to by setPath(),
+        without moving anything. It's an approximation, mostly useful to estimate
+        the time it would take to change the optical path: the positions which
+        depend on the previous modes (eg, the restoration of the positions after
+        an alignment mode) are not taken into account.
+        path (stream.Stream or str): The stream or the optical path mode
+        detector (Component or None): The detector which will be targeted on this
+          path (see setPath()).
+        return (dict Component -> dict str -> value): for each actuator, the
+          position of each axis. Empty if the stream doesn't require any optical
+          path change.
+        raises:
+            ValueError if the given mode does not exist
+        """
+        if isinstance(path, stream.Stream):
+            try:
+                mode = self.guessMode(path)
+                target = self.getStreamDetector(path)
+            except LookupError:
+                return {}
+        else:
+            mode = path
+            if mode not in self._modes:
+                raise ValueError("Mode '%s' does not exist" % (mode,))
+            if detector is None:
+                target = self._getComponent(self._modes[mode][0])
+            else:
+                target = detector
+
+        moves = {}  # Component -> dict axis -> pos
+        targets = {target.name} | set(target.affects.value)
+        for comp_role, conf in self._modes[mode][1].items():
+            try:
+                comp = self._getComponent(comp_role)
+            except LookupError:
+                continue
+            if not hasattr(comp, "axes") or not isinstance(comp.axes, dict):
+                continue
+            if not any(self.affects(comp.name, n) for n in targets):
+                continue
+
+            mv = {}
+            for axis, pos in conf.items():
+                if axis not in comp.axes:
+                    continue  # Also skips "power", which is not an axis
+                if isinstance(pos, tuple):
+                    for position in pos:
+                        if isinstance(position, str) and position.startswith("MD:"):
+                            try:
+                                pos = self.mdToValue(comp, position[3:])[axis]
+                                break
+                            except KeyError:
+                                pass
+                        else:
+                            pos = position
+                            break
+                    else:
+                        continue
+                if isinstance(pos, str) and pos.startswith("MD:"):
+                    try:
+                        pos = self.mdToValue(comp, pos[3:])[axis]
+                    except KeyError:
+                        continue
+
+                choices = getattr(comp.axes[axis], "choices", None)
+                if axis == "grating" and pos == "mirror":
+                    for key, value in choices.items():
+                        if value == "mirror":
+                            pos = key
+                            break
+                    else:
+                        axis, pos = "wavelength", 0  # zero order
+                elif axis == "grating" and pos == GRATING_NOT_MIRROR:
+                    cur_pos = comp.position.value[axis]
+                    if choices[cur_pos] != "mirror":
+                        continue  # no change
+                    pos = self._stored.get((comp_role, axis), self.findNonMirror(choices))
+                elif pos == MAX_POSITION:
+                    pos = comp.axes[axis].range[1]
+                elif isinstance(choices, dict) and pos not in choices:
+                    for key, value in choices.items():
+                        if value == pos:
+                            pos = key
+                            break
+                    else:
+                        continue  # Not present => left as-is
+                mv[axis] = pos
+
+            if mv:
+                moves[comp] = mv
+
+        for comp, mv in self._selectorsMoves(target.name):
+            moves.setdefault(comp, {}).update(mv)
+
+        return moves
+
     def _doSetPath(self, path, detector):
         """
         Actual implementation of setPath()
@@ -851,6 +949,21 @@ class OpticalPathManager:
           future, the component, and the new position requested
         """
         fmoves = []
+        for comp, mv in self._selectorsMoves(target):
+            logging.debug("Move %s added so %s targets to %s", mv, comp.name, target)
+            fmoves.append((comp.moveAbs(mv), comp, mv))
+
+        return fmoves
+
+    def _selectorsMoves(self, target):
+        """
+        Computes the positions of the selectors so the optical path leads to the
+        target component. Nothing is moved.
+        target (str): component name
+        return (list of tuple (Component, dict)): for each move: the component,
+          and the new position
+        """
+        moves = []
         for comp in self._actuators:
             # TODO: pre-cache this as comp/target -> axis/pos
             # TODO: don't do moves already done
@@ -873,12 +986,11 @@ class OpticalPathManager:
                 mv.update(comp_md[model.MD_FAV_POS_DEACTIVE])
 
             if mv:
-                logging.debug("Move %s added so %s targets to %s", mv, comp.name, target)
-                fmoves.append((comp.moveAbs(mv), comp, mv))
+                moves.append((comp, mv))
                 # make sure this component is also on the optical path
-                fmoves.extend(self.selectorsToPath(comp.name))
+                moves.extend(self._selectorsMoves(comp.name))
 
-        return fmoves
+        return moves
 
     def _compute_role_to_mode(self, modes: Dict[str, Tuple]) -> Tuple[Tuple[str, str]]:
         """
@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+"""
+Created on 18 Oct 2026
+
+@author: agent
+
+Copyright © 2026 agent, Delmic
+
+This file is part of Odemis.
+
+Odemis is free software: you can redistribute it and/or modify it under the terms of the GNU
+General Public License version 2 as published by the Free Software Foundation.
+
+Odemis is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even
+the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General
+Public License for more details.
+
+You should have received a copy of the GNU General Public License along with Odemis. If not,
+see http://www.gnu.org/licenses/.
+
+"""
+
+# Chooses the order in which the streams are acquired, so that the time spent
+# reconfiguring the hardware (optical path, filter wheels, focus...) between
+# the streams is as short as possible.
+
+import itertools
+import logging
+import math
+import numbers
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from odemis import model
+from odemis.util.driver import guessActuatorMoveDuration
+
+# Time to switch an axis between two positions, when it cannot be computed
+# from the speed of the axis (eg, a filter wheel with only named positions) (s)
+DEFAULT_SWITCH_DURATION = 1.0
+# Above this number of streams of the same priority, the order is not searched
+# exhaustively anymore (as there are n! orders), but greedily.
+MAX_EXHAUSTIVE_STREAMS = 7
+
+
+def estimateAxisMoveDuration(actuator: model.Actuator, axis: str, start, end) -> float:
+    """
+    Estimate the time it takes to move an axis between two positions.
+    :param actuator: the component to move
+    :param axis: the name of the axis
+    :param start: the initial position
+    :param end: the final position
+    :return: the estimated duration (s)
+    """
+    if start == end:
+        return 0
+    # For axes with choices (eg, filter wheels), the "distance" between the
+    # positions is meaningless.
+    ad = actuator.axes.get(axis)
+    if (not hasattr(ad, "choices") and
+        isinstance(start, numbers.Real) and isinstance(end, numbers.Real)):
+        return guessActuatorMoveDuration(actuator, axis, abs(end - start))
+    return DEFAULT_SWITCH_DURATION
+
+
+def orderZLevels(zlevels: Sequence[float], pos: Optional[float]) -> List[float]:
+    """
+    Pick the direction to scan the z levels, so that the first one is the closest
+    to the current position. When acquiring several z-stacks in a row, this scans
+    them back and forth (aka "snake" order), instead of going back to the same
+    end of the stack every time.
+    :param zlevels: the focus positions
+    :param pos: the current focus position. If None, the order is not changed.
+    :return: the zlevels, possibly in reverse order
+    """
+    zlevels = list(zlevels)
+    if pos is not None and len(zlevels) > 1:
+        if abs(zlevels[-1] - pos) < abs(zlevels[0] - pos):
+            zlevels.reverse()
+    return zlevels
+
+
+class AcquisitionPlanner(object):
+    """
+    Estimates the time to reconfigure the hardware between the acquisition of
+    each stream, and finds the order of acquisition which minimizes it.
+    The hardware settings taken into account are the optical path (as defined by
+    the OpticalPathManager modes), the emission filter of the fluorescence
+    streams, and the axes linked to the streams (eg, the grating of a spectrometer).
+    The light sources are not considered, as they switch (nearly) instantaneously.
+    """
+
+    def __init__(self, streams: Sequence):
+        """
+        :param streams: (Streams) the streams which will be acquired. The hardware
+          settings of each stream and the current position of the hardware are
+          read once, at initialisation.
+        """
+        self._streams = list(streams)
+        self._components = {}  # str (name) -> Component
+        self._durations = {}  # (str, str, start, end) -> float: cache of the axis moves durations
+        # Stream -> dict str -> dict str -> value: moves done by the stream itself
+        # (ie, not via the optical path manager): component name -> axis -> position
+        self._stream_moves = {}
+        # Stream -> dict (str, str) -> value: (component name, axis) -> position required
+        self._settings = {s: self._getStreamSettings(s) for s in self._streams}
+
+        # The initial state is the current hardware state. So repeated acquisitions
+        # (eg, one per tile) naturally alternate the order of the streams.
+        self._initial_state = {}  # (str, str) -> value
+        for cname, comp in self._components.items():
+            try:
+                pos = comp.position.value
+            except Exception:
+                logging.warning("Failed to read the position of %s", cname, exc_info=True)
+                continue
+            for s_settings in self._settings.values():
+                for (c, axis) in s_settings:
+                    if c == cname and axis in pos:
+                        self._initial_state[c, axis] = pos[axis]
+
+    def _getStreamSettings(self, stream) -> Dict[Tuple[str, str], Any]:
+        """
+        :return: (component name, axis) -> position required by the stream
+        """
+        settings = {}
+        opm = getattr(stream, "_opm", None)
+        if opm is not None:
+            try:
+                for comp, mv in opm.getPathMoves(stream).items():
+                    self._components[comp.name] = comp
+                    for axis, pos in mv.items():
+                        settings[comp.name, axis] = pos
+            except Exception:
+                logging.warning("Failed to compute the optical path of %s", stream.name.value,
+                                exc_info=True)
+
+        moves = {}  # component name -> axis -> position
+        # A MultipleDetectorStream has the settings of all its streams
+        for s in getattr(stream, "streams", [stream]):
+            for va_name, (axis, actuator) in getattr(s, "_axis_map", {}).items():
+                try:
+                    moves.setdefault(actuator.name, {})[axis] = s._axis_vas[va_name].value
+                    self._components[actuator.name] = actuator
+                except (AttributeError, KeyError):
+                    logging.debug("Failed to read axis %s of stream %s", va_name, s.name.value)
+
+            em_filter = getattr(s, "_em_filter", None)
+            if em_filter is not None and hasattr(s, "_emission_to_idx"):
+                try:
+                    moves.setdefault(em_filter.name, {})["band"] = s._emission_to_idx[s.emission.value]
+                    self._components[em_filter.name] = em_filter
+                except KeyError:
+                    logging.debug("Failed to find emission filter position of stream %s", s.name.value)
+
+        self._stream_moves[stream] = moves
+        for cname, mv in moves.items():
+            for axis, pos in mv.items():
+                settings[cname, axis] = pos
+        return settings
+
+    def _axisDuration(self, cname: str, axis: str, start, end) -> float:
+        key = (cname, axis, start, end)
+        try:
+            return self._durations[key]
+        except (KeyError, TypeError):  # TypeError if a position is unhashable (eg, list)
+            pass
+
+        try:
+            dur = estimateAxisMoveDuration(self._components[cname], axis, start, end)
+        except Exception:
+            logging.debug("Failed to estimate move of %s.%s, using the default duration",
+                          cname, axis, exc_info=True)
+            dur = DEFAULT_SWITCH_DURATION
+        try:
+            self._durations[key] = dur
+        except TypeError:
+            pass
+        return dur
+
+    def estimateTransitionDuration(self, state: Dict[Tuple[str, str], Any], stream) -> float:
+        """
+        Estimate the time to reconfigure the hardware for a stream.
+        :param state: (component name, axis) -> position of the hardware before the stream
+        :param stream: the stream to be acquired next
+        :return: the estimated duration (s). The components are expected to move
+          in parallel, and the axes of each component one after another.
+        """
+        durs = {}  # component name -> duration
+        for (cname, axis), pos in self._settings[stream].items():
+            try:
+                start = state[cname, axis]
+            except KeyError:
+                continue  # Unknown => assume it doesn't need to move
+            durs[cname] = durs.get(cname, 0) + self._axisDuration(cname, axis, start, pos)
+        return max(durs.values(), default=0)
+
+    def _estimateOrderDuration(self, state, order) -> Tuple[float, List[float]]:
+        """
+        :return: total duration, and the duration of each transition
+        """
+        state = dict(state)
+        durs = []
+        for s in order:
+            durs.append(self.estimateTransitionDuration(state, s))
+            state.update(self._settings[s])
+        return sum(durs), durs
+
+    def _searchExhaustive(self, state, streams):
+        best_order, best_dur = None, math.inf
+        # The permutations are generated in lexicographic order, so in case of
+        # equal duration, the one closest to the original order is kept.
+        for order in itertools.permutations(streams):
+            dur, _ = self._estimateOrderDuration(state, order)
+            if dur < best_dur - 1e-9:
+                best_order, best_dur = order, dur
+        return list(best_order)
+
+    def _searchGreedy(self, state, streams):
+        state = dict(state)
+        remaining = list(streams)
+        order = []
+        while remaining:
+            s = min(remaining, key=lambda s: self.estimateTransitionDuration(state, s))
+            remaining.remove(s)
+            order.append(s)
+            state.update(self._settings[s])
+        return order
+
+    def plan(self, priority: Optional[Callable[[Any], float]] = None) -> Tuple[List, List[float]]:
+        """
+        Find the order of acquisition of the streams with the shortest reconfiguration time.
+        :param priority: function returning the priority of a stream (the higher,
+          the earlier it should be acquired). The streams are always acquired by
+          decreasing priority (eg, the fluorescence streams by decreasing emission
+          wavelength). Only the order of the streams of equal priority is chosen
+          based on the reconfiguration time.
+        :return:
+          streams: the streams, in the order they should be acquired
+          durations: the estimated reconfiguration time before each stream (s)
+        """
+        streams = self._streams
+        if priority is not None:
+            streams = sorted(streams, key=priority, reverse=True)
+            classes = itertools.groupby(streams, key=priority)
+        else:
+            classes = [(0, streams)]
+
+        state = self._initial_state
+        order = []
+        for _, group in classes:
+            group = list(group)
+            if len(group) <= MAX_EXHAUSTIVE_STREAMS:
+                group_order = self._searchExhaustive(state, group)
+            else:
+                group_order = self._searchGreedy(state, group)
+            state = dict(state)
+            for s in group_order:
+                state.update(self._settings[s])
+            order.extend(group_order)
+
+        return order, self.estimateReconfiguration(order)
+
+    def estimateReconfiguration(self, order: Sequence) -> List[float]:
+        """
+        Estimate the time to reconfigure the hardware for acquiring the streams
+        in a given order, starting from the current hardware state.
+        :param order: the streams in the order of acquisition. They must be part
+          of the streams passed at initialisation. The same stream can be present
+          multiple times.
+        :return: the estimated reconfiguration time before each stream (s)
+        """
+        return self._estimateOrderDuration(self._initial_state, order)[1]
+
+    def reconfigure(self, stream):
+        """
+        Move the hardware to the settings of the stream: optical path, emission
+        filter and linked axes. That's normally done by the stream when it's
+        acquired, but doing it explicitly allows to measure the actual
+        reconfiguration time. Blocks until all the moves are finished.
+        :param stream: the stream which will be acquired next
+        """
+        fpath = stream.prepare()
+        fmoves = []
+        for cname, mv in self._stream_moves[stream].items():
+            fmoves.append(self._components[cname].moveAbs(mv))
+        fpath.result()
+        for f in fmoves:
+            f.result()
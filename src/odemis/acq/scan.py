@@ -24,6 +24,8 @@ import math
 from typing import Tuple, Dict, Any, Optional
 
 import numpy
+import scipy.interpolate
+import scipy.ndimage
 
 from odemis import model
 from odemis.model import MD_PIXEL_SIZE_COR, MD_ROTATION_COR, MD_POS_COR
@@ -225,3 +227,98 @@ def shift_scan_vector(scanner: model.HwComponent,
     scan_vector = scan_vector + clipped_shift  # New numpy array
 
     return scan_vector, clipped_shift
+
+
+def generate_sparse_mask(res: Tuple[int, int], n: float) -> numpy.ndarray:
+    """
+    Select a regular subset of the pixels of the scanning area, to be used as first pass of a
+    sparse scan.
+    :param res: X/Y (>0) of the scanning area (in pixels)
+    :param n: (>0) approximate number of pixels to select. At least the four corners are always
+    selected (so that the whole area can be interpolated).
+    :return: boolean array of shape (Y, X), True for the pixels selected
+    """
+    # Same ratio along each dimension (which has more than one pixel)
+    ndims = max(1, sum(1 for r in res if r > 1))
+    ratio = min(1.0, (n / (res[0] * res[1])) ** (1 / ndims))
+    mask = numpy.zeros((res[1], res[0]), dtype=bool)
+    idx = []
+    for r in res:
+        nr = min(r, max(2, round(r * ratio)))
+        idx.append(numpy.unique(numpy.linspace(0, r - 1, nr).round().astype(int)))
+    mask[numpy.ix_(idx[1], idx[0])] = True
+    return mask
+
+
+def interpolate_sparse_data(data: numpy.ndarray, mask: numpy.ndarray) -> numpy.ndarray:
+    """
+    Estimate the value of the pixels not scanned, by linear interpolation of the scanned pixels.
+    :param data: 2D array (Y, X). Only the values where mask is True are used.
+    :param mask: boolean array of the same shape as data, True for the pixels scanned.
+    It should contain at least one pixel.
+    :return: float array of the same shape as data, with the scanned pixels unchanged
+    """
+    est = data.astype(float)  # Always a copy
+    missing = ~mask
+    if not missing.any():
+        return est
+
+    if 1 in data.shape:
+        # Only one line => simple 1D interpolation
+        est_flat = est.reshape(-1)
+        mask_flat = mask.reshape(-1)
+        idx = numpy.flatnonzero(mask_flat)
+        est_flat[~mask_flat] = numpy.interp(numpy.flatnonzero(~mask_flat), idx, est_flat[idx])
+        return est
+
+    pts = numpy.argwhere(mask)
+    values = est[mask]
+    try:
+        est[missing] = scipy.interpolate.griddata(pts, values, numpy.argwhere(missing), method="linear")
+    except RuntimeError:  # Qhull error, if the points are all aligned
+        est[missing] = numpy.nan
+
+    # Outside of the convex hull of the scanned pixels, there is no linear interpolation
+    outside = numpy.isnan(est)
+    if outside.any():
+        est[outside] = scipy.interpolate.griddata(pts, values, numpy.argwhere(outside), method="nearest")
+    return est
+
+
+def select_sparse_pixels(estimate: numpy.ndarray, mask: numpy.ndarray, n: int) -> numpy.ndarray:
+    """
+    Pick the next pixels to scan during a sparse scan. The pixels are selected where the estimated
+    image varies the most (strong gradient), or where the estimation is the most uncertain (far from
+    any scanned pixel).
+    :param estimate: 2D array (Y, X) with the current estimation of the image, as returned by
+    interpolate_sparse_data().
+    :param mask: boolean array of the same shape, True for the pixels already scanned
+    :param n: (>0) maximum number of pixels to select
+    :return: (N, 2) int array with the Y, X indices of the pixels selected, in raster order
+    (ie, sorted by Y, then X). N <= n, and N < n only if there are fewer pixels left to scan.
+    """
+    n = min(n, int(numpy.count_nonzero(~mask)))
+    if n <= 0:
+        return numpy.empty((0, 2), dtype=int)
+
+    # Gradient (only along the dimensions which have more than one pixel)
+    grad = numpy.zeros(estimate.shape, dtype=float)
+    for axis, length in enumerate(estimate.shape):
+        if length > 1:
+            grad += numpy.gradient(estimate, axis=axis) ** 2
+    grad = numpy.sqrt(grad)
+
+    # Uncertainty: distance to the closest scanned pixel
+    dist = scipy.ndimage.distance_transform_edt(~mask)
+
+    # Both criteria are normalized, so that they have the same weight
+    score = numpy.zeros(estimate.shape, dtype=float)
+    for crit in (grad, dist):
+        cmax = crit.max()
+        if cmax > 0:
+            score += crit / cmax
+    score[mask] = -1  # Never select the pixels already scanned
+
+    flat_idx = numpy.argpartition(score.reshape(-1), -n)[-n:]
+    flat_idx.sort()  # Raster order, to limit the distance between two consecutive pixels
+    return numpy.column_stack(numpy.unravel_index(flat_idx, mask.shape))
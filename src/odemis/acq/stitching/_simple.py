@@ -22,11 +22,31 @@ from odemis.acq.stitching._registrar import ShiftRegistrar, IdentityRegistrar, G
 from odemis.acq.stitching._weaver import MeanWeaver, CollageWeaver, CollageWeaverReverse
 
 
+def _set_tile_pos(tile, pos):
+    """
+    Create a tile with the same data, but a different MD_POS
+    tile (DataArray or DataArrayShadow): the original tile
+    pos (tuple of 2 floats): the new position
+    return (DataArray or DataArrayShadow): same type as the tile. The data is not copied.
+      A DataArrayShadow must support copy.copy() (eg, TileFileShadow).
+    """
+    md = copy.deepcopy(tile.metadata)
+    md[model.MD_POS] = pos
+    if isinstance(tile, model.DataArrayShadow):
+        # Don't read the data, so that it can be loaded later, only when needed
+        new_tile = copy.copy(tile)
+        new_tile.metadata = md
+        return new_tile
+    else:
+        return model.DataArray(tile, md)
+
+
 def register(tiles, method=REGISTER_GLOBAL_SHIFT):
     """
     tiles (list of DataArray of shape YX or tuples of DataArrays): The tiles to compute the registration.
     If it's tuples, the first tile of each tuple is the “main tile”, and the following ones are
-    dependent tiles.
+    dependent tiles. The dependent tiles can be DataArrayShadows, and if the method is REGISTER_IDENTITY,
+    the main tiles too, as only their metadata is used.
     method (REGISTER_*): REGISTER_SHIFT → ShiftRegistrar, REGISTER_IDENTITY → IdentityRegistrar
     returns:
         tiles (list of DataArray of shape YX or tuples of DataArrays): The tiles as passed, but with updated
@@ -65,32 +85,30 @@ def register(tiles, method=REGISTER_GLOBAL_SHIFT):
             dep_tiles = ts[1:]
 
             # Update main tile
-            md = copy.deepcopy(tile.metadata)
-            md[model.MD_POS] = positions[i]
-            tileUpd = model.DataArray(tile, md)
+            tileUpd = _set_tile_pos(tile, positions[i])
 
             # Update dependent tiles
             tilesNew = [tileUpd]
             for j, t in enumerate(dep_tiles):
-                md = copy.deepcopy(t.metadata)
-                md[model.MD_POS] = dep_positions[i][j]
-                tilesNew.append(model.DataArray(t, md))
+                tilesNew.append(_set_tile_pos(t, dep_positions[i][j]))
             tileUpd = tuple(tilesNew)
 
         else:
-            md = copy.deepcopy(ts.metadata)
-            md[model.MD_POS] = positions[i]
-            tileUpd = model.DataArray(ts, md)
+            tileUpd = _set_tile_pos(ts, positions[i])
 
         updatedTiles.append(tileUpd)
 
     return updatedTiles
 
 
-def weave(tiles, method=WEAVER_MEAN, adjust_brightness=False):
+def weave(tiles, method=WEAVER_MEAN, adjust_brightness=False, tiles_data=None):
     """
     tiles (list of DataArray or DataArrayShadow of shape YX): The tiles to draw
     method (WEAVER_*): WEAVER_MEAN → MeanWeaver, WEAVER_COLLAGE → CollageWeaver
+    tiles_data (None or iterable of DataArray of shape YX): the data of the tiles,
+      in the same order as tiles. If provided, only the metadata and shape of the
+      tiles are used, and the data is consumed one tile at a time, so that the
+      tiles don't all have to be in memory at the same time.
     return:
         image (DataArray of shape Y'X'): A large image containing all the tiles
     """
@@ -104,6 +122,11 @@ def weave(tiles, method=WEAVER_MEAN, adjust_brightness=False):
     else:
         raise ValueError("Invalid weaver %s" % (method,))
 
+    if tiles_data is not None:
+        for t in tiles:
+            weaver.addTileLayout(t)
+        return weaver.getFullImage(tiles_data)
+
     for t in tiles:
         if isinstance(t, model.DataArrayShadow):
             t =  t.getData()
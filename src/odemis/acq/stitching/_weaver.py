@@ -66,11 +66,33 @@ class Weaver(metaclass=ABCMeta):
         img.mergeMetadata(tile.metadata)
         self.tiles.append(tile)
 
-    def getFullImage(self):
+    def addTileLayout(self, tile):
+        """
+        Adds the position of one tile to the weaver, without its data. The data
+        must then be passed to getFullImage(), which allows to read it only when needed.
+        tile (DataArray or DataArrayShadow): only the metadata, the shape of the
+          last 2 dimensions and the dtype are used. The metadata must have at
+          least MD_POS and MD_PIXEL_SIZE.
+        """
+        # A read-only array of the right shape, which takes (almost) no memory
+        layout = numpy.broadcast_to(numpy.zeros((), dtype=tile.dtype), tile.shape[-2:])
+        layout = model.DataArray(layout, tile.metadata.copy())
+        img.mergeMetadata(layout.metadata)
+        self.tiles.append(layout)
+
+    def getFullImage(self, tiles_data=None):
         """
         Assembles the tiles into a large image.
+        tiles_data (None or iterable of 2D arrays): the data of the tiles, in the
+          same order as they were added with addTileLayout(). If None, the tiles
+          added with addTile() are used. The iterable is consumed one tile at a time,
+          so that only the tile being woven needs to be in memory.
+          Not compatible with the brightness adjustment, which needs all the tiles.
         return (2D DataArray): same dtype as the tiles, with shape corresponding to the bounding box of the tiles.
         """
+        if tiles_data is not None and self.adjust_brt:
+            raise ValueError("Brightness adjustment requires all the tiles at once")
+
         # NOTE on rotation:
         # Total image rotation is the sum of the "standard" rotation, relative to the sample coordinates, and the scan rotation.
         # The scan rotation is not used when displaying the images, because it causes images to be displayed 'upside down' from
@@ -89,18 +111,47 @@ class Weaver(metaclass=ABCMeta):
         self.tiles = tiles
 
         self.tbbx_px, self.gbbx_px, self.gbbx_phy, self.stage_bare_pos = self.get_bounding_boxes(self.tiles)
-        im = self.weave_tiles()
+        if tiles_data is None:
+            tiles_data = self.tiles
+        im = self.weave_tiles(tiles_data)
         md = self.get_final_metadata(self.tiles[0].metadata.copy())
         weaved_image = img.rotate_img_metadata(model.DataArray(im, md), rotation, center_of_rot)
 
         return weaved_image
 
-    @abstractmethod
-    def weave_tiles(self):
+    def weave_tiles(self, tiles):
         """
         Weave the tiles into a single image.
+        tiles (iterable of 2D arrays): the data of the tiles, in the same order as self.tiles
         return (2D DataArray): The weaved image.
         """
+        logging.debug("Generating global image of size %dx%d px",
+                      self.gbbx_px[-2], self.gbbx_px[-1])
+        im = numpy.zeros((self.gbbx_px[-1], self.gbbx_px[-2]), dtype=self.tiles[0].dtype)
+        # Parts of the image which already contain data (True), the rest is still empty
+        mask = numpy.zeros((self.gbbx_px[-1], self.gbbx_px[-2]), dtype=bool)
+
+        # Each tile is only needed while it's pasted, so that they don't all have to be in memory
+        bg = None
+        for b, t in zip(self.tbbx_px, tiles):
+            tmin = numpy.amin(t)
+            bg = tmin if bg is None else min(bg, tmin)
+            self.paste_tile(im, mask, b, t)
+
+        # The background of the image is the minimum value of all the tiles
+        im[~mask] = bg
+        return im
+
+    @abstractmethod
+    def paste_tile(self, im, mask, bbx, tile):
+        """
+        Insert one tile into the global image.
+        im (2D array): the global image, updated in place
+        mask (2D array of bool): the parts of the global image already containing
+          data, to be updated in place
+        bbx (tuple of 4 ints): the ltrb bounding box of the tile in pixel coordinates
+        tile (2D array): the data of the tile
+        """
         pass
 
     @staticmethod
@@ -237,24 +288,15 @@ class CollageWeaver(Weaver):
       the bounding box.
     """
 
-    def weave_tiles(self):
+    def paste_tile(self, im, mask, bbx, tile):
         """
-        Weave tiles by pasting the tiles where their center position is.
-        return (2D DataArray): The weaved image.
+        Paste the tile where its center position is.
         """
-        # Paste each tile
-        logging.debug("Generating global image of size %dx%d px",
-                      self.gbbx_px[-2], self.gbbx_px[-1])
-
-        # Create a background of the image using the minimum value of self.tiles
-        im = numpy.ones((self.gbbx_px[-1], self.gbbx_px[-2]), dtype=self.tiles[0].dtype) * numpy.amin(self.tiles)
-
-        for b, t in zip(self.tbbx_px, self.tiles):
-            if self.adjust_brt:
-                t = self._adjust_brightness(t, self.tiles)
-            im[b[1]:b[1] + t.shape[0], b[0]:b[0] + t.shape[1]] = t
-            # TODO: border
-        return im
+        if self.adjust_brt:
+            tile = self._adjust_brightness(tile, self.tiles)
+        im[bbx[1]:bbx[1] + tile.shape[0], bbx[0]:bbx[0] + tile.shape[1]] = tile
+        mask[bbx[1]:bbx[1] + tile.shape[0], bbx[0]:bbx[0] + tile.shape[1]] = True
+        # TODO: border
 
 
 class CollageWeaverReverse(Weaver):
@@ -265,34 +307,22 @@ class CollageWeaverReverse(Weaver):
     with the last tile and pastes the older tiles in reverse order of acquisition.
     """
 
-    def weave_tiles(self):
+    def paste_tile(self, im, mask, bbx, tile):
         """
-        Weave tiles by filling parts of the global image that are still empty with the new tile.
-        return (2D DataArray): The weaved image.
+        Fill the parts of the global image that are still empty with the tile.
         """
-        # Paste each tile
-        logging.debug("Generating global image of size %dx%d px",
-                      self.gbbx_px[-2], self.gbbx_px[-1])
-        # Create a background of the image using the minimum value of self.tiles
-        im = numpy.ones((self.gbbx_px[-1], self.gbbx_px[-2]), dtype=self.tiles[0].dtype) * numpy.amin(self.tiles)
-
-        # The mask is multiplied with the tile, thereby creating a tile with a gradient
-        mask = numpy.zeros((self.gbbx_px[-1], self.gbbx_px[-2]), dtype=bool)
+        # Part of image overlapping with tile
+        roi = im[bbx[1]:bbx[1] + tile.shape[0], bbx[0]:bbx[0] + tile.shape[1]]
+        moi = mask[bbx[1]:bbx[1] + tile.shape[0], bbx[0]:bbx[0] + tile.shape[1]]
 
-        for b, t in zip(self.tbbx_px, self.tiles):
-            # Part of image overlapping with tile
-            roi = im[b[1]:b[1] + t.shape[0], b[0]:b[0] + t.shape[1]]
-            moi = mask[b[1]:b[1] + t.shape[0], b[0]:b[0] + t.shape[1]]
+        if self.adjust_brt:
+            tile = self._adjust_brightness(tile, self.tiles)
 
-            if self.adjust_brt:
-                t = self._adjust_brightness(t, self.tiles)
+        # Insert image at positions that are still empty
+        roi[~moi] = tile[~moi]
 
-            # Insert image at positions that are still empty
-            roi[~moi] = t[~moi]
-
-            # Update mask
-            mask[b[1]:b[1] + t.shape[0], b[0]:b[0] + t.shape[1]] = True
-        return im
+        # Update mask
+        mask[bbx[1]:bbx[1] + tile.shape[0], bbx[0]:bbx[0] + tile.shape[1]] = True
 
 
 class MeanWeaver(Weaver):
@@ -301,10 +331,9 @@ class MeanWeaver(Weaver):
     average of the pixel of each tile.
     """
 
-    def weave_tiles(self):
+    def paste_tile(self, im, mask, bbx, tile):
         """
-        Weave tiles by using a smooth gradient.
-        return (2D DataArray): The weaved image.
+        Insert the tile, using a smooth gradient where it overlaps with the previous tiles.
         """
         #  The part of the tile that does not overlap
         # with any previous tiles is inserted into the part of the
@@ -323,48 +352,37 @@ class MeanWeaver(Weaver):
         # the ovv image are added, so the resulting image contains a gradient in the overlapping regions
         # between all the tiles that have been inserted before and the newly inserted tile.
 
-        # Paste each tile
-        logging.debug("Generating global image of size %dx%d px",
-                      self.gbbx_px[-2], self.gbbx_px[-1])
-        # Create a background of the image using the minimum value of self.tiles
-        im = numpy.ones((self.gbbx_px[-1], self.gbbx_px[-2]), dtype=self.tiles[0].dtype) * numpy.amin(self.tiles)
-
-        # The mask is multiplied with the tile, thereby creating a tile with a gradient
-        mask = numpy.zeros((self.gbbx_px[-1], self.gbbx_px[-2]), dtype=bool)
-
-        for b, t in zip(self.tbbx_px, self.tiles):
-            # Part of image overlapping with tile
-            roi = im[b[1]:b[1] + t.shape[0], b[0]:b[0] + t.shape[1]]
-            moi = mask[b[1]:b[1] + t.shape[0], b[0]:b[0] + t.shape[1]]
-
-            if self.adjust_brt:
-                self._adjust_brightness(t, self.tiles)
-            # Insert image at positions that are still empty
-            roi[~moi] = t[~moi]
-
-            # Create gradient in overlapping region. Ratio between old image and new tile values determined by
-            # distance to the center of the tile
-
-            # Create weight matrix with decreasing values from its center that
-            # has the same size as the tile.
-            sz = numpy.array(roi.shape)
-            hh, hw = sz / 2  # half-height, half-width
-            x = numpy.linspace(-hw, hw, sz[1])
-            y = numpy.linspace(-hh, hh, sz[0])
-            xx, yy = numpy.meshgrid((x / hw) ** 6, (y / hh) ** 6)
-            w = numpy.maximum(xx, yy)
-            # Hardcoding a weight function is quite arbitrary and might result in
-            # suboptimal solutions in some cases.
-            # Alternatively, different weights might be used. One option would be to select
-            # a fixed region on the sides of the image, e.g. 20% (expected overlap), and
-            # only apply a (linear) gradient to these parts, while keeping the new tile for the
-            # rest of the region. However, this approach does not solve the hardcoding problem
-            # since the overlap region is still arbitrary. Future solutions might adaptively
-            # select this region.
-
-            # Use weights to create gradient in overlapping region
-            roi[moi] = (t * (1 - w))[moi] + (roi * w)[moi]
-
-            # Update mask
-            mask[b[1]:b[1] + t.shape[0], b[0]:b[0] + t.shape[1]] = True
-        return im
+        # Part of image overlapping with tile
+        roi = im[bbx[1]:bbx[1] + tile.shape[0], bbx[0]:bbx[0] + tile.shape[1]]
+        moi = mask[bbx[1]:bbx[1] + tile.shape[0], bbx[0]:bbx[0] + tile.shape[1]]
+
+        if self.adjust_brt:
+            self._adjust_brightness(tile, self.tiles)
+        # Insert image at positions that are still empty
+        roi[~moi] = tile[~moi]
+
+        # Create gradient in overlapping region. Ratio between old image and new tile values determined by
+        # distance to the center of the tile
+
+        # Create weight matrix with decreasing values from its center that
+        # has the same size as the tile.
+        sz = numpy.array(roi.shape)
+        hh, hw = sz / 2  # half-height, half-width
+        x = numpy.linspace(-hw, hw, sz[1])
+        y = numpy.linspace(-hh, hh, sz[0])
+        xx, yy = numpy.meshgrid((x / hw) ** 6, (y / hh) ** 6)
+        w = numpy.maximum(xx, yy)
+        # Hardcoding a weight function is quite arbitrary and might result in
+        # suboptimal solutions in some cases.
+        # Alternatively, different weights might be used. One option would be to select
+        # a fixed region on the sides of the image, e.g. 20% (expected overlap), and
+        # only apply a (linear) gradient to these parts, while keeping the new tile for the
+        # rest of the region. However, this approach does not solve the hardcoding problem
+        # since the overlap region is still arbitrary. Future solutions might adaptively
+        # select this region.
+
+        # Use weights to create gradient in overlapping region
+        roi[moi] = (tile * (1 - w))[moi] + (roi * w)[moi]
+
+        # Update mask
+        mask[bbx[1]:bbx[1] + tile.shape[0], bbx[0]:bbx[0] + tile.shape[1]] = True
@@ -200,6 +200,44 @@ class WeaverBaseTest:
 
         numpy.testing.assert_equal(outd, exp_out)
 
+    def test_tiles_data(self):
+        """
+        Test that passing the data of the tiles separately, as an iterator, gives the same result
+        as adding the tiles directly
+        """
+        if self.weaver_type == WEAVER_COLLAGE:
+            weaver_class = CollageWeaver
+        elif self.weaver_type == WEAVER_COLLAGE_REVERSE:
+            weaver_class = CollageWeaverReverse
+        elif self.weaver_type == WEAVER_MEAN:
+            weaver_class = MeanWeaver
+
+        img = numpy.random.randint(100, 4000, size=(300, 400)).astype(numpy.uint16)
+        tiles, _ = decompose_image(img, 0.3, 3, "horizontalZigzag", False)
+
+        weaver = weaver_class()
+        for t in tiles:
+            weaver.addTile(t)
+        exp_out = weaver.getFullImage()
+
+        weaver = weaver_class()
+        for t in tiles:
+            weaver.addTileLayout(t)
+        # Only the layout is stored, not the data
+        for lt in weaver.tiles:
+            self.assertEqual(lt.strides, (0, 0))
+        outd = weaver.getFullImage(iter(tiles))
+
+        numpy.testing.assert_equal(outd, exp_out)
+        self.assertEqual(outd.metadata[model.MD_POS], exp_out.metadata[model.MD_POS])
+
+        # The brightness adjustment needs all the tiles at once
+        weaver = weaver_class(adjust_brightness=True)
+        for t in tiles:
+            weaver.addTileLayout(t)
+        with self.assertRaises(ValueError):
+            weaver.getFullImage(iter(tiles))
+
     def test_rotated_tiles(self):
         """Verify that the correct rotation is set on the weaved image."""
         numTiles = [2, 3, 4]
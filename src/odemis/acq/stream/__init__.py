@@ -31,6 +31,7 @@ from ._live import *
 from ._static import *
 from ._sync import *
 from ._projection import *
+from ._scheduler import *
 
 import sys
 import abc
@@ -16,13 +16,10 @@ You should have received a copy of the GNU General Public License along with Ode
 '''
 
 import functools
-import gc
 import logging
 import math
 import numbers
 import threading
-import time
-import weakref
 from collections.abc import Iterable
 from typing import List, Tuple, Optional
 
@@ -39,6 +36,7 @@ from odemis.model import (MD_POS, MD_PIXEL_SIZE, MD_ROTATION, MD_ACQ_DATE,
                           MD_POL_DS2N, MD_POL_DS3N, MD_POL_S1N, MD_POL_S2N, MD_POL_S3N, TINT_FIT_TO_RGB, TINT_RGB_AS_IS,
                           UNDEFINED_ROI)
 from odemis.util import img
+from odemis.acq.stream._scheduler import UpdateRequest
 # TODO: move to odemis.acq (once it doesn't depend on odemis.acq.stream)
 # Contains the base of the streams. Can be imported from other stream modules.
 from odemis.util.transform import AffineTransform, alt_transformation_matrix_from_implicit
@@ -156,6 +154,7 @@ class Stream(object):
         # TODO: We need to reorganise everything so that the
         # image display is done via a dataflow (in a separate thread), instead
         # of a VA.
+        # Replaced by an UpdateRequest if the stream computes the image by itself
         self._im_needs_recompute = threading.Event()
         self._init_thread()
 
@@ -288,13 +287,10 @@ class Stream(object):
         self.intensityRange.subscribe(self._onIntensityRange)
 
     def _init_thread(self, period=0.1):
-        """ Initialize the thread that updates the image
+        """ Initialize the update of the image (on the shared update threads)
+        period (float > 0): minimum time in second between two image updates
         """
-        self._imthread = threading.Thread(target=self._image_thread,
-                                          args=(weakref.ref(self), period),
-                                          name="Image computation of %s" % self.name.value)
-        self._imthread.daemon = True
-        self._imthread.start()
+        self._im_needs_recompute = UpdateRequest(self._updateImage, period, stream=self)
 
     # No __del__: subscription should be automatically stopped when the object
     # disappears, and the user should stop the update first anyway.
@@ -822,12 +818,14 @@ class Stream(object):
                 self._unlinkHwAxes()
         return active
 
-    def _updateDRange(self, data=None):
+    def _updateDRange(self, data=None, minmax=None):
         """
         Update the ._drange, with whatever data is known so far.
         data (None or DataArray): data on which to base the detection. If None,
           it will try to use .raw, and if there is nothing, will just use the
           detector information.
+        minmax (None or tuple of 2 int): minimum and maximum values of the data,
+          if already known. It avoids scanning the data again.
         """
         # Note: it feels like live and static streams could have a separate
         # version, but detecting a stream has no detector is really not costly
@@ -875,8 +873,11 @@ class Stream(object):
                     if (drange[1] - drange[0] > 4095 and
                             (prev_drange is None or
                              prev_drange[1] - prev_drange[0] < drange[1] - drange[0])):
-                        mn = int(data.view(numpy.ndarray).min())
-                        mx = int(data.view(numpy.ndarray).max())
+                        if minmax is not None:
+                            mn, mx = minmax
+                        else:
+                            mn = int(data.view(numpy.ndarray).min())
+                            mx = int(data.view(numpy.ndarray).max())
 
                         # Try to find a range that contain the whole data, and also if the detector generate
                         # new data mostly still fit. We also don't want a too big range.
@@ -1059,46 +1060,6 @@ class Stream(object):
         # synchronization allows to delay it (without accumulation).
         self._im_needs_recompute.set()
 
-    @staticmethod
-    def _image_thread(wstream, period=0.1):
-        """ Called as a separate thread, and recomputes the image whenever it receives an event
-        asking for it.
-
-        Args:
-            wstream (Weakref to a Stream): the stream to follow
-            period ( float > 0) (Seconds): Minimum time in second between two image updates
-        """
-        try:
-            stream = wstream()
-            name = stream.name.value
-            im_needs_recompute = stream._im_needs_recompute
-            # Only hold a weakref to allow the stream to be garbage collected
-            # On GC, trigger im_needs_recompute so that the thread can end too
-            wstream = weakref.ref(stream, lambda o: im_needs_recompute.set())
-            while True:
-                del stream
-                im_needs_recompute.wait()  # wait until a new image is available
-                stream = wstream()
-
-                if stream is None:
-                    logging.debug("Stream %s disappeared so ending image update thread", name)
-                    break
-
-                tnext = time.time() + period  #running with a period of max "period", optional arg standard is 10 Hz
-                im_needs_recompute.clear()
-                stream._updateImage()
-
-                tnow = time.time()
-                # sleep a bit to avoid refreshing too fast
-                tsleep = tnext - tnow
-                if tsleep > 0.0001:
-                    time.sleep(tsleep)
-        except Exception:
-            logging.exception("Image update thread failed")
-
-        gc.collect()
-
-
     def _updateImage(self):
         """ Recomputes the image with all the raw data available
         """
@@ -1201,6 +1162,13 @@ class Stream(object):
     def _onIntensityRange(self, irange):
         self._shouldUpdateImage()
 
+    def _getHistogramMaxSamples(self):
+        """
+        return (None or 0<int): maximum number of pixels to use to compute the
+          histogram, or None to use all the pixels.
+        """
+        return None
+
     def _updateHistogram(self, data=None):
         """
         data (DataArray): the raw data to use, default to .raw[0] - background
@@ -1226,11 +1194,27 @@ class Stream(object):
                 except Exception as ex:
                     logging.info("Failed to subtract background when computing histogram: %s", ex)
 
-        # Depth can change at each image (depends on hardware settings)
-        self._updateDRange(data)
+        max_samples = self._getHistogramMaxSamples()
+        if data.dtype.kind in "iu" and data.itemsize <= 2:
+            # The histogram over the whole range of the type costs the same as over
+            # a part of it, and it directly provides the min/max of the data, so
+            # there is no need to scan the data again to find the drange.
+            full_hist, full_edges = img.histogram(data, max_samples=max_samples)
+            minmax = None
+            if max_samples is None or data.size <= max_samples:
+                nz = numpy.flatnonzero(full_hist)
+                if nz.size:
+                    minmax = (full_edges[0] + int(nz[0]), full_edges[0] + int(nz[-1]))
+
+            # Depth can change at each image (depends on hardware settings)
+            self._updateDRange(data, minmax)
+            hist, edges = img.cropHistogram(full_hist, full_edges, self._drange)
+        else:
+            # Depth can change at each image (depends on hardware settings)
+            self._updateDRange(data)
 
-        # Initially, _drange might be None, in which case it will be guessed
-        hist, edges = img.histogram(data, irange=self._drange)
+            # Initially, _drange might be None, in which case it will be guessed
+            hist, edges = img.histogram(data, irange=self._drange, max_samples=max_samples)
         if hist.size > 256:
             chist = img.compactHistogram(hist, 256)
         else:
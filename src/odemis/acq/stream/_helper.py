@@ -781,8 +781,7 @@ class SpectrumSettingsStream(CCDSettingsStream):
         self.image.value = im
 
     # No histogram => no need to do anything to update it
-    @staticmethod
-    def _histogram_thread(wstream):
+    def _shouldUpdateHistogram(self):
         pass
 
     def _onNewData(self, dataflow, data):
@@ -2103,8 +2102,7 @@ class ScannedTemporalSettingsStream(CCDSettingsStream):
         self.image.value = im
 
     # No histogram => no need to do anything to update it
-    @staticmethod
-    def _histogram_thread(wstream):
+    def _shouldUpdateHistogram(self):
         pass
 
     def _onNewData(self, dataflow, data):
@@ -20,7 +20,6 @@ You should have received a copy of the GNU General Public License along with Ode
 
 from concurrent import futures
 from concurrent.futures.thread import ThreadPoolExecutor
-import gc
 import logging
 import numpy
 from odemis import model, util
@@ -29,12 +28,17 @@ from odemis.acq.align import FindEbeamCenter
 from odemis.acq import fastem_conf
 from odemis.model import MD_POS_COR, VigilantAttributeBase, hasVA
 from odemis.util import img, conversion, fluo, executeAsyncTask
-import threading
 import time
-import weakref
 
 
 from ._base import Stream
+from ._scheduler import UpdateRequest
+
+# Minimum time between two updates of the histogram (s)
+HISTOGRAM_PERIOD = 0.25
+# Maximum number of pixels used to compute the histogram, when the images arrive
+# faster than the histogram is updated
+HISTOGRAM_MAX_SAMPLES = 2 ** 18
 
 
 class LiveStream(Stream):
@@ -62,16 +66,16 @@ class LiveStream(Stream):
                                          range=((0, 0, 0, 0), (1, 1, 1, 1)),
                                          cls=(int, float))
 
-        self._ht_needs_recompute = threading.Event()
-        self._hthread = threading.Thread(target=self._histogram_thread,
-                                         args=(weakref.ref(self),),
-                                         name="Histogram computation")
-        self._hthread.daemon = True
-        self._hthread.start()
+        # max 4 Hz, and not using too much CPU
+        self._ht_needs_recompute = UpdateRequest(self._updateHistogram, HISTOGRAM_PERIOD,
+                                                 adaptive=True, stream=self)
 
         self._prev_dur = None
         self._prep_future = model.InstantaneousFuture()
 
+        self._last_data_time = None  # time of reception of the last data, or None
+        self._data_period = None  # time between the two last data received (s), or None
+
     def _find_metadata(self, md):
         simpl_md = super(LiveStream, self)._find_metadata(md)
 
@@ -96,6 +100,8 @@ class LiveStream(Stream):
         else:
             self._prep_future.cancel()
             self._prepared = False
+            self._last_data_time = None
+            self._data_period = None
             msg = "Unsubscribing from dataflow of component %s"
             logging.debug(msg, self._detector.name)
             self._dataflow.unsubscribe(self._onNewData)
@@ -170,43 +176,20 @@ class LiveStream(Stream):
         # synchronization allows to delay it (without accumulation).
         self._ht_needs_recompute.set()
 
-    @staticmethod
-    def _histogram_thread(wstream):
-        """
-        Called as a separate thread, and recomputes the histogram whenever
-        it receives an event asking for it.
-        wself (Weakref to a stream): the stream to follow
-        """
-        try:
-            stream = wstream()
-            name = stream.name.value
-            ht_needs_recompute = stream._ht_needs_recompute
-            # Only hold a weakref to allow the stream to be garbage collected
-            # On GC, trigger im_needs_recompute so that the thread can end too
-            wstream = weakref.ref(stream, lambda o: ht_needs_recompute.set())
-
-            while True:
-                del stream
-                ht_needs_recompute.wait()  # wait until a new image is available
-                stream = wstream()
-                if stream is None:
-                    logging.debug("Stream %s disappeared so ending histogram update thread", name)
-                    break
-
-                tstart = time.time()
-                ht_needs_recompute.clear()
-                stream._updateHistogram()
-                tend = time.time()
-
-                # sleep as much, to ensure we are not using too much CPU
-                tsleep = max(0.25, tend - tstart)  # max 4 Hz
-                time.sleep(tsleep)
-        except Exception:
-            logging.exception("Histogram update thread failed")
-
-        gc.collect()
+    def _getHistogramMaxSamples(self):
+        # If the images arrive faster than the histogram is updated, most of them
+        # are never seen in the histogram anyway. In such case, only a subset of the
+        # pixels is used, which is good enough to find the intensity range.
+        if self._data_period is not None and self._data_period < HISTOGRAM_PERIOD:
+            return HISTOGRAM_MAX_SAMPLES
+        return None
 
     def _onNewData(self, dataflow, data):
+        now = time.time()
+        if self._last_data_time is not None:
+            self._data_period = now - self._last_data_time
+        self._last_data_time = now
+
         if model.MD_ACQ_TYPE not in data.metadata and self.acquisitionType.value is not None:
             data.metadata[model.MD_ACQ_TYPE] = self.acquisitionType.value
 
@@ -20,16 +20,13 @@ You should have received a copy of the GNU General Public License along with
 Odemis. If not, see http://www.gnu.org/licenses/.
 '''
 
-import threading
-import weakref
 import logging
-import time
 import math
-import gc
 import numpy
 
 from typing import Tuple, Dict, Union
 from odemis.acq.stream import POL_POSITIONS
+from odemis.acq.stream._scheduler import UpdateRequest
 from odemis.model import TINT_FIT_TO_RGB
 
 try:
@@ -38,8 +35,7 @@ except ImportError:
     pass  # The projection using this module should never be instantiated then.
 
 from odemis import model
-from odemis.util import img, angleres
-from scipy import ndimage
+from odemis.util import img, angleres, peak
 from odemis.model import MD_PIXEL_SIZE, MD_POL_EPHI, MD_POL_EX, MD_POL_EY, MD_POL_EZ, MD_POL_ETHETA, MD_POL_DS0, \
     MD_POL_S0, MD_POL_DOP, MD_POL_DOLP, MD_POL_UP
 from odemis.acq.stream._static import StaticSpectrumStream
@@ -54,13 +50,8 @@ class DataProjection(object):
         '''
         self.stream = stream
         self.name = stream.name
-        self._im_needs_recompute = threading.Event()
-        weak = weakref.ref(self)
-        self._imthread = threading.Thread(target=self._image_thread,
-                                          args=(weak,),
-                                          name="Image computation")
-        self._imthread.daemon = True
-        self._imthread.start()
+        # max 10 Hz
+        self._im_needs_recompute = UpdateRequest(self._updateImage, 0.1, stream=stream)
 
         # DataArray or None: RGB projection of the raw data
         self.image = model.VigilantAttribute(None)
@@ -76,49 +67,6 @@ class DataProjection(object):
         """
         return None
 
-    @staticmethod
-    def _image_thread(wprojection):
-        """ Called as a separate thread, and recomputes the image whenever it receives an event
-        asking for it.
-
-        Args:
-            wprojection (Weakref to a DataProjection): the data projection to follow
-
-        """
-
-        try:
-            projection = wprojection()
-            name = "%s:%x" % (projection.stream.name.value, id(projection))
-            im_needs_recompute = projection._im_needs_recompute
-            # Only hold a weakref to allow the stream to be garbage collected
-            # On GC, trigger im_needs_recompute so that the thread can end too
-            wprojection = weakref.ref(projection, lambda o: im_needs_recompute.set())
-
-            tnext = 0
-            while True:
-                del projection
-                im_needs_recompute.wait()  # wait until a new image is available
-                projection = wprojection()
-
-                if projection is None:
-                    logging.debug("Projection %s disappeared so ending image update thread", name)
-                    break
-
-                tnow = time.time()
-
-                # sleep a bit to avoid refreshing too fast
-                tsleep = tnext - tnow
-                if tsleep > 0.0001:
-                    time.sleep(tsleep)
-
-                tnext = time.time() + 0.1  # max 10 Hz
-                im_needs_recompute.clear()
-                projection._updateImage()
-        except Exception:
-            logging.exception("image update thread failed")
-
-        gc.collect()
-
     def _shouldUpdateImage(self):
         """
         Ensures that the image VA will be updated in the "near future".
@@ -1398,13 +1346,107 @@ class RGBSpatialSpectrumProjection(RGBSpatialProjection):
             logging.exception("Updating %s %s image", self.__class__.__name__, self.stream.name.value)
 
 
+class PeakMapProjection(RGBProjection):
+    """
+    Projects a spectrum cube to a map of one parameter (position, width or amplitude) of the
+    strongest peak of each spectrum. The peaks of all the spectra are fitted in the background,
+    only when the image is needed, and again each time the data changes.
+    """
+
+    def __init__(self, stream):
+        super().__init__(stream)
+        self.peakParameter = model.StringEnumerated("position", {"position", "width", "amplitude"})
+        self.fitType = model.StringEnumerated("gaussian_space", set(peak.PEAK_FUNCTIONS.keys()))
+        self._maps = None  # list of 3 DataArrays: position, width, amplitude (or None if not yet computed)
+        # The fitting is only started when the image is computed, as it needs a process pool
+        self._fit_future = None
+
+        self.peakParameter.subscribe(self._on_parameter)
+        self.fitType.subscribe(self._on_new_data)
+        stream.calibrated.subscribe(self._on_new_data)
+        self._shouldUpdateImage()
+
+    def _on_parameter(self, _):
+        self._shouldUpdateImage()
+
+    def _on_new_data(self, _):
+        self.cancel()
+        self._maps = None
+        self._shouldUpdateImage()
+
+    def cancel(self):
+        """
+        Stop the fitting, if it's running
+        """
+        if self._fit_future is not None:
+            self._fit_future.cancel()
+            self._fit_future = None
+
+    def _start_fit(self):
+        try:
+            self._fit_future = peak.FitCube(self.stream.calibrated.value, self.fitType.value)
+        except Exception:
+            logging.exception("Failed to start the peak fitting of %s", self.stream.name.value)
+            return
+        self._fit_future.add_done_callback(self._on_fit_done)
+
+    def _on_fit_done(self, f):
+        if f is not self._fit_future or f.cancelled():
+            return
+        try:
+            self._maps = f.result()
+        except Exception:
+            logging.exception("Failed to fit the peaks of %s", self.stream.name.value)
+            return
+        self._shouldUpdateImage()
+
+    def projectAsRaw(self):
+        """
+        return (DataArray or None): the map of the selected peak parameter, or None if the fitting
+          is not yet finished
+        """
+        if self._maps is None:
+            return None
+        i = ("position", "width", "amplitude").index(self.peakParameter.value)
+        return self._maps[i]
+
+    def _updateImage(self):
+        try:
+            data = self.projectAsRaw()
+            if data is None:
+                if self._fit_future is None:
+                    self._start_fit()
+                return
+
+            # The fitting failed for some pixels => display them with the lowest value
+            valid = data[numpy.isfinite(data)]
+            if valid.size == 0:
+                logging.warning("Peak fitting failed for all the pixels of %s", self.stream.name.value)
+                return
+            irange = (valid.min(), valid.max())
+            data = numpy.nan_to_num(data, nan=irange[0])
+
+            tint = self.stream.tint.value
+            if tint == TINT_FIT_TO_RGB:
+                tint = (255, 255, 255)
+            rgbim = img.DataArray2RGB(data, irange, tint)
+            rgbim.flags.writeable = False
+            md = self._find_metadata(data.metadata)
+            md[model.MD_DIMS] = "YXC"  # RGB format
+            self.image.value = model.DataArray(rgbim, md)
+        except Exception:
+            logging.exception("Updating %s %s image", self.__class__.__name__, self.stream.name.value)
+
+
 class LineSpectrumProjection(RGBProjection):
     """
     Project a spectrum from the selected_line of the stream.
     """
 
     def __init__(self, stream):
-
+        # (key, sparse matrix): the sampling of the last line, as computed by
+        # img.get_line_sampling(), with the key of its geometry
+        self._line_sampling = None
         super(LineSpectrumProjection, self).__init__(stream)
 
         if model.hasVA(self.stream, "selected_time"):
@@ -1469,37 +1511,27 @@ class LineSpectrumProjection(RGBProjection):
         # requested width is an even number, the output is empty (because all
         # the interpolated points are outside of the data.
 
-        # Coordinates of each point: ndim of data (5-2), pos on line (Y), spectrum (X)
-        # The line is scanned from the end till the start so that the spectra
-        # closest to the origin of the line are at the bottom.
-        coord = numpy.empty((3, width, n, spec2d.shape[0]))
-        coord[0] = numpy.arange(spec2d.shape[0])  # spectra = all
-        coord_spc = coord.swapaxes(2, 3)  # just a view to have (line) space as last dim
-        coord_spc[-1] = numpy.linspace(start[0], end[0], n)  # X axis
-        coord_spc[-2] = numpy.linspace(start[1], end[1], n)  # Y axis
-
-        # Spread over the width
-        # perpendicular unit vector
-        pv = (-v[1] / l, v[0] / l)
-        width_coord = numpy.empty((2, width))
-        spread = (width - 1) / 2
-        width_coord[-1] = numpy.linspace(pv[0] * -spread, pv[0] * spread, width)  # X axis
-        width_coord[-2] = numpy.linspace(pv[1] * -spread, pv[1] * spread, width)  # Y axis
-
-        coord_cw = coord[1:].swapaxes(0, 2).swapaxes(1, 3)  # view with coordinates and width as last dims
-        coord_cw += width_coord
-
-        # Interpolate the values based on the data
+        # The sampling geometry only depends on the line, so when only the data
+        # changes (eg, another time/angle is selected), it's reused.
+        key = (spec2d.shape[-2:], start, end, width)
+        if self._line_sampling is None or self._line_sampling[0] != key:
+            sampling = img.get_line_sampling(spec2d.shape[-2:], start, end, width)
+            self._line_sampling = key, sampling
+        else:
+            sampling = self._line_sampling[1]
+
+        # Interpolate the values based on the data, for all the wavelengths at once
+        # FIXME: the mean should be dependent on how many pixels inside the
+        # original data were pick on each line. Currently if some pixels fall
+        # out of the original data, the outside pixels count as 0.
+        spec1d = img.apply_spatial_sampling(spec2d, sampling).T
         if width == 1:
-            # simple version for the most usual case
-            spec1d = ndimage.map_coordinates(spec2d, coord[:, 0, :, :], order=1)
+            # Same as for the most usual case, keep the original type
+            if numpy.issubdtype(spec2d.dtype, numpy.integer):
+                spec1d = numpy.rint(spec1d)
+            spec1d = spec1d.astype(spec2d.dtype)
         else:
-            # FIXME: the mean should be dependent on how many pixels inside the
-            # original data were pick on each line. Currently if some pixels fall
-            # out of the original data, the outside pixels count as 0.
-            # force the intermediate values to float, as mean() still needs to run
-            spec1d_w = ndimage.map_coordinates(spec2d, coord, output=float, order=1)
-            spec1d = spec1d_w.mean(axis=0)
+            spec1d /= width
         assert spec1d.shape == (n, spec2d.shape[0])
 
         # Use metadata to indicate spatial distance between pixel
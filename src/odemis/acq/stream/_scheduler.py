@@ -0,0 +1,317 @@
+# -*- coding: utf-8 -*-
+"""
+Created on 18 Oct 2026
+
+@author: agent
+
+Copyright © 2026 agent, Delmic
+
+This file is part of Odemis.
+
+Odemis is free software: you can redistribute it and/or modify it under the terms of the GNU
+General Public License version 2 as published by the Free Software Foundation.
+
+Odemis is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even
+the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General
+Public License for more details.
+
+You should have received a copy of the GNU General Public License along with Odemis. If not,
+see http://www.gnu.org/licenses/.
+
+"""
+
+# Contains the scheduler which runs the (re)computation of the images and
+# histograms of all the streams and projections, on a small set of shared threads.
+
+import collections
+import logging
+import math
+import os
+import threading
+import time
+import weakref
+from typing import Callable, Dict, Optional, Any
+
+# Maximum number of threads used to compute the images/histograms of all the streams
+MAX_WORKERS = min(4, os.cpu_count() or 1)
+# Minimum time between two updates of a stream which is not visible (s)
+HIDDEN_PERIOD = 2
+# Number of updates used to compute the latency statistics
+LATENCY_HISTORY = 100
+
+
+class UpdateRequest(object):
+    """
+    Allows to request the (re)computation of some data of an object (eg, the
+    image of a stream), which is run "soon" by the UpdateScheduler. Multiple
+    requests before the computation starts are merged into a single one.
+    It has the same interface as a threading.Event, so that the code which
+    needs to know whether a new computation has been requested can check it
+    while computing.
+    """
+
+    def __init__(self, method: Callable, period: float = 0.1, adaptive: bool = False,
+                 stream=None, scheduler: Optional["UpdateScheduler"] = None):
+        """
+        :param method: bound method (of the object) to call to do the computation.
+          Only a weak reference is kept, so that the object can be garbage collected.
+        :param period: minimum time between the start of two computations (s)
+        :param adaptive: if True, the time between the end of a computation and
+          the start of the next one is at least the duration of the computation.
+          This limits the CPU usage for computations which are slow.
+        :param stream: the stream whose visibility defines the priority of the
+          computation. If None, it's always considered visible.
+        :param scheduler: the scheduler to use. If None, the process-wide one is used.
+        """
+        self._method = weakref.WeakMethod(method)
+        self.name = getattr(method, "__qualname__", str(method))
+        self.period = period
+        self.adaptive = adaptive
+        self._stream = weakref.ref(stream) if stream is not None else None
+        self._scheduler = scheduler or get_update_scheduler()
+
+        # Protected by the scheduler lock
+        self._pending = False
+        self._running = False
+        self._request_time = 0  # time of the first request not yet handled
+        self._next_time = 0  # earliest time of the next computation
+
+    @property
+    def stream(self):
+        """
+        :return: the stream, or None if not defined or garbage collected
+        """
+        return self._stream() if self._stream is not None else None
+
+    def set(self):
+        """
+        Request the computation to be run (again)
+        """
+        self._scheduler.request(self)
+
+    def clear(self):
+        """
+        Cancel the computation requested, if it hasn't started yet
+        """
+        self._scheduler.cancel(self)
+
+    def is_set(self) -> bool:
+        """
+        :return: True if a computation is requested and hasn't started yet
+        """
+        return self._pending
+
+
+class UpdateScheduler(object):
+    """
+    Runs the computations requested via UpdateRequests on a fixed set of threads.
+    The computations of the visible streams (or the ones playing) are run first,
+    and the ones of the hidden streams are throttled.
+    """
+
+    def __init__(self, max_workers: int = MAX_WORKERS):
+        """
+        :param max_workers: maximum number of threads running the computations
+        """
+        self._max_workers = max_workers
+        self._workers = []
+        self._cond = threading.Condition()
+        self._queue = set()  # UpdateRequests pending (possibly also running)
+        self._visibility_filter = None  # Callable[[Stream], bool] or None
+
+        # Statistics
+        self._nexecuted = 0
+        self._ncoalesced = 0
+        self._nfailed = 0
+        self._latencies = collections.deque(maxlen=LATENCY_HISTORY)
+
+    def setVisibilityFilter(self, vfilter: Optional[Callable[[Any], bool]]):
+        """
+        Define which streams are visible to the user, and so should be updated first.
+        Streams which are playing (should_update is True) are always considered visible.
+        :param vfilter: function taking a stream and returning True if it's visible.
+          If None, all the streams are considered visible.
+        """
+        with self._cond:
+            self._visibility_filter = vfilter
+            self._cond.notify_all()
+
+    def request(self, req: UpdateRequest):
+        """
+        Schedule the computation of the given request. If it's already scheduled,
+        the requests are merged.
+        """
+        with self._cond:
+            if req._pending:
+                self._ncoalesced += 1
+            else:
+                req._pending = True
+                req._request_time = time.time()
+                self._queue.add(req)
+                if len(self._workers) < self._max_workers and len(self._workers) < len(self._queue):
+                    self._start_worker()
+            # Wake up a worker, also in case the priority has changed
+            self._cond.notify()
+
+    def cancel(self, req: UpdateRequest):
+        """
+        Unschedule the computation of the given request, if it hasn't started yet.
+        """
+        with self._cond:
+            req._pending = False
+            if not req._running:
+                self._queue.discard(req)
+
+    def getStats(self) -> Dict[str, float]:
+        """
+        :return: information about the state and performance of the scheduler:
+          * workers: number of threads
+          * queued: number of computations waiting to be run
+          * running: number of computations currently running
+          * executed: number of computations run
+          * coalesced: number of requests dropped, because merged into an already pending one
+          * failed: number of computations which raised an exception
+          * latency_mean, latency_max (s): time between the request and the start of
+            the computation, over the last computations
+        """
+        with self._cond:
+            running = sum(1 for r in self._queue if r._running)
+            lats = list(self._latencies)
+            return {
+                "workers": len(self._workers),
+                "queued": sum(1 for r in self._queue if r._pending and not r._running),
+                "running": running,
+                "executed": self._nexecuted,
+                "coalesced": self._ncoalesced,
+                "failed": self._nfailed,
+                "latency_mean": sum(lats) / len(lats) if lats else 0,
+                "latency_max": max(lats) if lats else 0,
+            }
+
+    def resetStats(self):
+        """
+        Reset the counters and latencies reported by getStats()
+        """
+        with self._cond:
+            self._nexecuted = 0
+            self._ncoalesced = 0
+            self._nfailed = 0
+            self._latencies.clear()
+
+    def _start_worker(self):
+        # Must be called with the lock taken
+        t = threading.Thread(target=self._run, name="Stream update worker %d" % (len(self._workers),))
+        t.daemon = True
+        self._workers.append(t)
+        t.start()
+
+    def _is_visible(self, req: UpdateRequest) -> bool:
+        stream = req.stream
+        if stream is None:
+            return True
+        try:
+            if stream.should_update.value:
+                return True
+        except AttributeError:
+            pass
+
+        vfilter = self._visibility_filter
+        if vfilter is None:
+            return True
+        try:
+            return vfilter(stream)
+        except Exception:
+            logging.exception("Failed to check visibility of stream %s", stream)
+            return True
+
+    def _pick(self) -> UpdateRequest:
+        """
+        Wait for the next computation to run. Must be called with the lock taken.
+        :return: the request to run, already marked as running
+        """
+        while True:
+            now = time.time()
+            best = None
+            best_key = None
+            tnext = math.inf
+            for req in list(self._queue):
+                if req._running:
+                    continue
+                if req._method() is None:  # Object has been garbage collected
+                    req._pending = False
+                    self._queue.discard(req)
+                    continue
+
+                visible = self._is_visible(req)
+                if visible:
+                    treq = req._next_time
+                else:
+                    treq = max(req._next_time, req._request_time + HIDDEN_PERIOD)
+                if treq > now:
+                    tnext = min(tnext, treq)
+                    continue
+
+                # Visible first, then the oldest request
+                key = (not visible, req._request_time)
+                if best is None or key < best_key:
+                    best, best_key = req, key
+
+            if best is not None:
+                best._pending = False
+                best._running = True
+                self._latencies.append(now - best._request_time)
+                return best
+
+            if math.isinf(tnext):
+                self._cond.wait()
+            else:
+                self._cond.wait(tnext - now)
+
+    def _run(self):
+        """
+        Main loop of each worker thread
+        """
+        while True:
+            with self._cond:
+                req = self._pick()
+
+            tstart = time.time()
+            method = req._method()
+            try:
+                if method is not None:
+                    method()
+            except Exception:
+                logging.exception("Failed to run update %s", req.name)
+                failed = True
+            else:
+                failed = False
+            tend = time.time()
+            del method
+
+            with self._cond:
+                req._running = False
+                if req.adaptive:
+                    req._next_time = tend + max(req.period, tend - tstart)
+                else:
+                    req._next_time = tstart + req.period
+                if not req._pending:
+                    self._queue.discard(req)
+                self._nexecuted += 1
+                if failed:
+                    self._nfailed += 1
+                self._cond.notify_all()
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_update_scheduler() -> UpdateScheduler:
+    """
+    :return: the process-wide scheduler used by the streams and projections
+    """
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = UpdateScheduler()
+        return _scheduler
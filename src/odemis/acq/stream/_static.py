@@ -24,12 +24,8 @@ see http://www.gnu.org/licenses/.
 # they were initialised with.
 
 import copy
-import gc
 import logging
 import math
-import threading
-import time
-import weakref
 from collections.abc import Iterable
 from typing import List, Optional, Union
 
@@ -46,6 +42,7 @@ from odemis.model._dataflow import DataArray
 from odemis.model._dataio import DataArrayShadow
 from odemis.util import almost_equal, conversion, find_closest, img, spectrum
 from ._base import POL_POSITIONS, POL_POSITIONS_RESULTS, Stream
+from ._scheduler import UpdateRequest
 
 
 class StaticStream(Stream):
@@ -61,59 +58,18 @@ class StaticStream(Stream):
         """
         super(StaticStream, self).__init__(name, None, None, None, raw=raw, *args, **kwargs)
 
-        self._ht_needs_recompute = threading.Event()
-        self._hthread = None
+        # max 4 Hz, and not using too much CPU
+        self._ht_needs_recompute = UpdateRequest(self._updateHistogram, 0.25,
+                                                 adaptive=True, stream=self)
 
     def _shouldUpdateHistogram(self):
         """
         Ensures that the histogram VA will be updated in the "near future".
         """
-        # If the previous request is still being processed, the event
+        # If the previous request is still being processed, the request
         # synchronization allows to delay it (without accumulation).
-        if self._hthread is None:
-            self._hthread = threading.Thread(target=self._histogram_thread,
-                                         args=(weakref.ref(self),),
-                                         name="Histogram computation")
-            self._hthread.daemon = True
-            self._hthread.start()
         self._ht_needs_recompute.set()
 
-    @staticmethod
-    def _histogram_thread(wstream):
-        """
-        Called as a separate thread, and recomputes the histogram whenever
-        it receives an event asking for it.
-        wself (Weakref to a stream): the stream to follow
-        """
-        try:
-            stream = wstream()
-            name = stream.name.value
-            ht_needs_recompute = stream._ht_needs_recompute
-            # Only hold a weakref to allow the stream to be garbage collected
-            # On GC, trigger im_needs_recompute so that the thread can end too
-            wstream = weakref.ref(stream, lambda o: ht_needs_recompute.set())
-
-            while True:
-                del stream
-                ht_needs_recompute.wait()  # wait until a new image is available
-                stream = wstream()
-                if stream is None:
-                    logging.debug("Stream %s disappeared so ending histogram update thread", name)
-                    break
-
-                tstart = time.time()
-                ht_needs_recompute.clear()
-                stream._updateHistogram()
-                tend = time.time()
-
-                # sleep as much, to ensure we are not using too much CPU
-                tsleep = max(0.25, tend - tstart)  # max 4 Hz
-                time.sleep(tsleep)
-        except Exception:
-            logging.exception("Histogram update thread failed")
-
-        gc.collect()
-
 
 class RGBStream(StaticStream):
     """
@@ -836,10 +792,11 @@ class StaticSpectrumStream(StaticStream):
     # The tricky part is we need to keep the raw data as .raw for things
     # like saving the stream or updating the calibration, but all the
     # display-related methods must work on the calibrated data.
-    def _updateDRange(self, data=None):
+    def _updateDRange(self, data=None, minmax=None):
         if data is None:
             data = self.calibrated.value
-        super(StaticSpectrumStream, self)._updateDRange(data)
+            minmax = None
+        super(StaticSpectrumStream, self)._updateDRange(data, minmax)
 
     def _updateHistogram(self, data=None):
         if data is None:
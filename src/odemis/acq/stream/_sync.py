@@ -23,6 +23,7 @@ import time
 from abc import ABCMeta, abstractmethod
 from concurrent.futures._base import RUNNING, FINISHED, CANCELLED, TimeoutError, \
     CancelledError
+from contextlib import contextmanager
 from functools import partial
 from typing import Tuple, List, Optional, Any, Dict
 
@@ -32,6 +33,7 @@ import odemis.util.driver as udriver
 from odemis import model, util
 from odemis.acq import leech
 from odemis.acq import scan
+from odemis.acq.diskstore import AcquisitionDiskStore
 from odemis.acq.leech import AnchorDriftCorrector, LeechAcquirer
 from odemis.acq.stream._live import LiveStream
 from odemis.model import MD_POS, MD_DESCRIPTION, MD_PIXEL_SIZE, MD_ACQ_DATE, MD_AD_LIST, \
@@ -76,6 +78,201 @@ GUI_ORANGE = (255, 163, 0) # FG_COLOUR_HIGHLIGHT - from src/odemis/gui/__init__.
 # all the time, and anyway, the camera overhead is around 8ms, so it's relatively small.
 CCD_FRAME_OVERHEAD = 2e-3  # s, extra time to wait by the e-beam for each spot position, to make sure the CCD is ready
 
+# Sparse scanning: ratio of the pixels to scan during the first pass (regularly spread),
+# and the number of passes to scan all the pixels requested.
+SPARSE_SCAN_INITIAL_RATIO = 0.25
+SPARSE_SCAN_PASSES = 4
+
+# Minimum number of snapshots acquired to use the measured overhead for estimating the acquisition time
+MIN_SNAPSHOTS_CALIBRATION = 10
+
+
+class SnapshotTimer:
+    """
+    Records the time spent in each step of the acquisition of the snapshots, so that it's possible
+    to know where the overhead (compared to the exposure time) comes from.
+    """
+
+    def __init__(self):
+        self._durations: Dict[str, float] = {}  # step -> total time spent (s)
+        self._start: Optional[float] = None  # time.perf_counter() when the acquisition started
+        self._end: Optional[float] = None  # time.perf_counter() when the acquisition stopped
+        self.n_snapshots = 0  # number of snapshots acquired
+
+    def start(self) -> None:
+        """
+        Indicate the acquisition of the snapshots starts. All the time spent from now on is
+        accounted in the total.
+        """
+        self._start = time.perf_counter()
+        self._end = None
+
+    def stop(self) -> None:
+        """
+        Indicate the acquisition of the snapshots is over.
+        """
+        self._end = time.perf_counter()
+
+    @contextmanager
+    def measure(self, step: str):
+        """
+        Context manager to measure the time spent in the given step.
+        :param step: name of the step (eg, "scanner", "detector", "leeches"...)
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(step, time.perf_counter() - start)
+
+    def add(self, step: str, dur: float) -> None:
+        """
+        Record time spent in the given step. It can be called multiple times per snapshot.
+        :param step: name of the step
+        :param dur: time spent (s)
+        """
+        self._durations[step] = self._durations.get(step, 0.0) + dur
+
+    def add_snapshot(self) -> None:
+        """
+        Record that one more snapshot has been acquired.
+        """
+        self.n_snapshots += 1
+
+    def get_breakdown(self) -> Dict[str, float]:
+        """
+        :return: step -> average time spent per snapshot (s). The time not spent in any of the
+        recorded steps is reported as "other", and the average total time as "total".
+        """
+        if self.n_snapshots == 0 or self._start is None:
+            return {}
+        end = self._end if self._end is not None else time.perf_counter()
+        breakdown = {s: d / self.n_snapshots for s, d in self._durations.items()}
+        total = (end - self._start) / self.n_snapshots
+        breakdown["other"] = max(0.0, total - sum(breakdown.values()))
+        breakdown["total"] = total
+        return breakdown
+
+
+class LiveRGBProjection:
+    """
+    Keeps the RGB projection of an image which is progressively acquired, so that at each update
+    only the area modified since the previous update is converted. The histogram of the acquired
+    pixels is also updated incrementally.
+    """
+
+    def __init__(self, data: model.DataArray):
+        """
+        :param data: 2D image, which will be progressively filled during the acquisition
+        """
+        self.data = data
+        self._rgb = None  # numpy array of shape YXC (uint8), or None if not yet computed
+        self._irange = None  # intensity range used for the RGB conversion
+        self._tint = None
+        # area which has changed since the last update: ltrb (r and b excluded), or None if nothing
+        self._dirty = None
+        self._dirty_lock = threading.Lock()  # as the dirty area is updated by the acquisition thread
+        self._prev_scan_area = None  # ltrb (r and b excluded) area drawn in orange at the previous update
+
+        # Running histogram of the pixels acquired. Only possible if the data has a small integer type,
+        # otherwise, the histogram is recomputed from all the acquired pixels at every update.
+        if data.dtype.kind in "iu" and data.itemsize <= 2:
+            self._hist = img.HistogramAccumulator(data.dtype)
+            self._hist_mask = numpy.zeros(data.shape, dtype=bool)  # pixels already in the histogram
+        else:
+            self._hist = None
+            self._hist_mask = None
+
+    def add_dirty(self, rect: Tuple[int, int, int, int]):
+        """
+        Indicate that an area of the image has changed (typically, because it's been acquired)
+        :param rect: ltrb (r and b excluded), in pixels
+        """
+        with self._dirty_lock:
+            if self._dirty is None:
+                self._dirty = rect
+            else:
+                d = self._dirty
+                self._dirty = (min(d[0], rect[0]), min(d[1], rect[1]), max(d[2], rect[2]), max(d[3], rect[3]))
+
+    def _update_histogram(self, acq_mask: numpy.ndarray, rect: Optional[Tuple[int, int, int, int]]):
+        """
+        :param acq_mask: pixels acquired
+        :param rect: area where new pixels might have been acquired: ltrb
+        """
+        if rect is None:
+            return
+        l, t, r, b = rect
+        new_px = acq_mask[t:b, l:r] & ~self._hist_mask[t:b, l:r]
+        if new_px.any():
+            self._hist.add(self.data[t:b, l:r][new_px])
+            self._hist_mask[t:b, l:r] |= new_px
+
+    def _compute_irange(self, acq_mask: numpy.ndarray) -> Tuple[float, float]:
+        if self._hist is not None:
+            hist, edges = self._hist.get()
+        else:
+            hist, edges = img.histogram(self.data[acq_mask])
+        return img.findOptimalRange(hist, edges, 1 / 256)
+
+    def _convert(self, acq_mask: numpy.ndarray, rect: Tuple[int, int, int, int]):
+        """
+        Update the RGB image in the given area
+        """
+        l, t, r, b = rect
+        if l >= r or t >= b:
+            return
+        rgb = img.DataArray2RGB(self.data[t:b, l:r], self._irange, self._tint)
+        rgb[~acq_mask[t:b, l:r]] = GUI_BLUE  # Blue background = not yet acquired data
+        self._rgb[t:b, l:r] = rgb
+
+    def update(self, acq_mask: numpy.ndarray, scan_area: Optional[Tuple[int, int, int, int]],
+               tint=(255, 255, 255)) -> numpy.ndarray:
+        """
+        Update the RGB projection, based on the new data acquired.
+        :param acq_mask: pixels already acquired (True), same shape as the data
+        :param scan_area: ltrb (r and b excluded) pixels currently being acquired, or None.
+        :param tint: colouration of the image, in RGB.
+        :return: the RGB image (YXC), as a copy, so it's safe to use while the next update happens
+        """
+        shape = self.data.shape
+        with self._dirty_lock:
+            dirty = self._dirty
+            self._dirty = None
+        if self._rgb is None:
+            dirty = (0, 0, shape[1], shape[0])
+
+        if self._hist is not None:
+            self._update_histogram(acq_mask, dirty)
+        irange = self._compute_irange(acq_mask)
+
+        # Only recompute the whole image if the range has changed visibly (ie, by 1/256 of the range)
+        if (self._rgb is None or self._tint != tint or
+            abs(irange[0] - self._irange[0]) > (self._irange[1] - self._irange[0]) / 256 or
+            abs(irange[1] - self._irange[1]) > (self._irange[1] - self._irange[0]) / 256
+           ):
+            self._irange = irange
+            self._tint = tint
+            self._rgb = numpy.empty(shape + (3,), dtype=numpy.uint8)
+            self._convert(acq_mask, (0, 0, shape[1], shape[0]))
+        else:
+            if dirty:
+                self._convert(acq_mask, dirty)
+            # The area which was previously in orange has to be drawn normally
+            if self._prev_scan_area:
+                self._convert(acq_mask, self._prev_scan_area)
+
+        rgbim = self._rgb.copy()
+        self._prev_scan_area = None
+        if scan_area:
+            # Orange progress pixels
+            l, t = max(0, scan_area[0]), max(0, scan_area[1])
+            r, b = min(shape[1], scan_area[2]), min(shape[0], scan_area[3])
+            rgbim[t:b, l:r] = GUI_ORANGE
+            self._prev_scan_area = (l, t, r, b)
+
+        return rgbim
+
 
 class MultipleDetectorStream(Stream, metaclass=ABCMeta):
     """
@@ -187,10 +384,11 @@ class MultipleDetectorStream(Stream, metaclass=ABCMeta):
         self._current_scan_area = None  # l,t,r,b (int)
         self._live_area_shape = None  # (int, int) Y, X shape of the live area
         self._live_area_md = {}  # metadata for the live area
+        # RGB projections of the live data, to update them only where the data has changed
+        self._live_projections: Dict[int, LiveRGBProjection] = {}  # id(data) -> projection
 
         # Start threading event for live update overlay
         self._live_update_period = 2  # s
-        self._im_needs_recompute = threading.Event()
         self._init_thread(self._live_update_period)
 
         # For the acquisition
@@ -207,6 +405,7 @@ class MultipleDetectorStream(Stream, metaclass=ABCMeta):
         self._acq_data = [[] for _ in streams] # latest acquired data
         self._live_data = [[] for _ in streams] # all acquired data in live format, reshaped to the final shape by _assembleFinalData
         self._acq_min_date = None  # minimum acquisition time for the data to be acceptable
+        self._disk_store = None  # AcquisitionDiskStore, if the live data is stored directly on disk
 
         # original values of the hardware VAs to be restored after acquisition
         self._orig_hw_values: Dict[model.VigilantAttribute, Any] = {}  # VA -> original value
@@ -724,6 +923,21 @@ class MultipleDetectorStream(Stream, metaclass=ABCMeta):
             except ValueError as ex:
                 logging.warning("Failed to store user tint for stream %s: %s", s.name.value, ex)
 
+    def _create_live_array(self, n: int, pol_idx: int, shape: Tuple[int, ...], dtype,
+                           md: Dict[str, Any]) -> model.DataArray:
+        """
+        Create a (zero-initialized) DataArray to store the live data of a stream.
+        If the acquisition is stored on disk, the array is backed by a file, instead of the memory.
+        :param n: number of the stream
+        :param pol_idx: polarisation index
+        :param shape: shape of the array
+        :param dtype: numpy dtype of the array
+        :param md: metadata of the array
+        """
+        if self._disk_store:
+            return self._disk_store.create_array(f"stream{n}-pol{pol_idx}", shape, dtype, md)
+        return model.DataArray(numpy.zeros(shape=shape, dtype=dtype), md)
+
     def _assembleLiveData(self, n: int, raw_data: model.DataArray,
                           px_idx: Tuple[int, int], px_pos: Optional[Tuple[float, float]],
                           rep: Tuple[int, int], pol_idx: int):
@@ -772,7 +986,7 @@ class MultipleDetectorStream(Stream, metaclass=ABCMeta):
                        MD_PIXEL_SIZE: sub_pxs,
                        MD_ROTATION: rotation,
                        MD_DESCRIPTION: self._streams[n].name.value})
-            da = model.DataArray(numpy.zeros(shape=rep[::-1] * numpy.array(tile_shape), dtype=raw_data.dtype), md)
+            da = self._create_live_array(n, pol_idx, tuple(rep[::-1] * numpy.array(tile_shape)), raw_data.dtype, md)
             self._live_data[n].append(da)
 
         self._live_data[n][pol_idx][
@@ -812,7 +1026,7 @@ class MultipleDetectorStream(Stream, metaclass=ABCMeta):
                        MD_PIXEL_SIZE: self._pxs,
                        MD_ROTATION: rotation,
                        MD_DESCRIPTION: self._streams[n].name.value})
-            da = model.DataArray(numpy.zeros(shape=rep[::-1], dtype=raw_data.dtype), md)
+            da = self._create_live_array(n, pol_idx, rep[::-1], raw_data.dtype, md)
             self._live_data[n].append(da)
 
         self._live_data[n][pol_idx][
@@ -851,29 +1065,38 @@ class MultipleDetectorStream(Stream, metaclass=ABCMeta):
         tint ((int, int, int)): colouration of the image, in RGB.
         return (DataArray): 3D DataArray.
         """
-        acq_mask = self._acq_mask.copy() # because of threading issues this variable needs to be copied
+        acq_mask = self._acq_mask
         scan_area = self._current_scan_area
         if scan_area is None:
             return None
-        data_acq = data[acq_mask]
-
-        hist, edges = img.histogram(data_acq)
-        irange = img.findOptimalRange(hist, edges, 1/256)
-        rgbim = img.DataArray2RGB(data, irange, tint)
-        md = self._find_metadata(data.metadata)
-        md[model.MD_DIMS] = "YXC" # RGB format
 
-        # Blue background = not yet acquired data
-        rgbim[~ acq_mask] = GUI_BLUE
+        proj = self._live_projections.get(id(data))
+        if proj is None or proj.data is not data:
+            # New data => new projection. Forget the projections of data not used anymore.
+            live_ids = {id(d) for das in self._live_data for d in das}
+            projs = {i: p for i, p in self._live_projections.items() if i in live_ids}
+            proj = LiveRGBProjection(data)
+            projs[id(data)] = proj
+            self._live_projections = projs  # Replace it at once, as it's read by the acquisition thread
 
         # Only update the scan_area if one is provided (sometimes it is None e.g. CL)
         if scan_area:
-            # Orange progress pixels
-            rgbim[scan_area[1]:scan_area[3]+1, scan_area[0]:scan_area[2]+1] = GUI_ORANGE
+            scan_area = (scan_area[0], scan_area[1], scan_area[2] + 1, scan_area[3] + 1)
+        rgbim = proj.update(acq_mask, scan_area, tint)
 
+        md = self._find_metadata(data.metadata)
+        md[model.MD_DIMS] = "YXC" # RGB format
         rgbim.flags.writeable = False
         return model.DataArray(rgbim, md)
 
+    def _mark_live_area_acquired(self, rect: Tuple[int, int, int, int]):
+        """
+        Indicate to the live projections that an area has been acquired (in the live area coordinates)
+        :param rect: ltrb (r and b excluded), in pixels
+        """
+        for proj in list(self._live_projections.values()):
+            proj.add_dirty(rect)
+
     def _updateImage(self):
         """
         Function called by image update thread which handles updating the overlay of the SEM live update image
@@ -913,6 +1136,12 @@ class SEMCCDMDStream(MultipleDetectorStream):
     If the "integration time" requested is longer than the maximum exposure time of the detector,
     image integration will be performed.
     """
+    # True if the live data can be stored on disk (ie, it's stored in arrays created by _create_live_array())
+    _supports_disk_store = True
+    # Overhead (s) per snapshot measured during the latest acquisition, for each detector and
+    # type of acquirer: (detector name, acquirer class name) -> overhead.
+    # It's shared between all the streams, as it mostly depends on the hardware.
+    _snapshot_overhead: Dict[Tuple[str, str], float] = {}
 
     def __init__(self, name, streams):
         """
@@ -951,6 +1180,11 @@ class SEMCCDMDStream(MultipleDetectorStream):
         self._trigger = self._emitter.startScan  # to acquire a CCD image every time the SEM starts a new scan
         self._ccd_idx = len(self._streams) - 1  # optical detector is always last in streams
 
+        # If not empty, the data is written to this directory while it is acquired, instead of
+        # being kept in memory. If the directory contains an interrupted acquisition with the same
+        # settings, the acquisition is resumed: only the pixels not yet acquired are acquired.
+        self.storePath = model.StringVA("")
+
     def _supports_hw_sync(self):
         """
         :returns (bool): True if hardware synchronised acquisition is supported.
@@ -998,11 +1232,17 @@ class SEMCCDMDStream(MultipleDetectorStream):
 
             if self._integrationTime:
                 exp = self._integrationTime.value  # get the total exp time
-                readout *= self._integrationCounts.value
+                n_snapshots = self._integrationCounts.value
             else:
                 exp = self._sccd._getDetectorVA("exposureTime").value
-
-            if self._supports_hw_sync():
+                n_snapshots = 1
+            readout *= n_snapshots
+
+            overhead = self._snapshot_overhead.get(self._get_overhead_key(self._get_acquirer_class()))
+            if overhead is not None:
+                # Use the overhead measured during the previous acquisition
+                dur_image = exp + readout + overhead * n_snapshots
+            elif self._supports_hw_sync():
                 # The overhead per frame depends a lot on the camera. For now, we use arbitrarily the
                 # overhead observed on an Andor Newton (8 ms).
                 dur_image = exp + readout + 0.008
@@ -1028,22 +1268,70 @@ class SEMCCDMDStream(MultipleDetectorStream):
         Select whether the ebeam is moved for scanning or the sample stage.
         :param future: Current future running for the whole acquisition.
         """
+        acquirer_cls = self._get_acquirer_class()
+        if acquirer_cls is SEMCCDAcquirerRectangle:
+            assert self.rotation.value == 0  # Rotation not supported for this acquisition
+        acquirer = acquirer_cls(self)
+
+        logging.debug("Will run acquisition with %s", acquirer.__class__.__name__)
+        return self._run_acquisition_ccd(future, acquirer)
+
+    def _get_acquirer_class(self) -> type:
+        """
+        :return: the class of SEMCCDAcquirer to use, based on the current settings and hardware.
+        """
         if hasattr(self, "useScanStage") and self.useScanStage.value:
             if model.hasVA(self._emitter, "scanPath"):
-                acquirer = SEMCCDAcquirerScanStageVector(self)
+                return SEMCCDAcquirerScanStageVector
             else:
-                acquirer = SEMCCDAcquirerScanStage(self)
+                return SEMCCDAcquirerScanStage
         elif self._supports_hw_sync():
-            acquirer = SEMCCDAcquirerHwSync(self)
+            return SEMCCDAcquirerHwSync
         else:
             if model.hasVA(self._emitter, "scanPath"):
-                acquirer = SEMCCDAcquirerVector(self)
+                return SEMCCDAcquirerVector
             else:
-                assert self.rotation.value == 0  # Rotation not supported for this acquisition
-                acquirer = SEMCCDAcquirerRectangle(self)
+                return SEMCCDAcquirerRectangle
 
-        logging.debug("Will run acquisition with %s", acquirer.__class__.__name__)
-        return self._run_acquisition_ccd(future, acquirer)
+    def _get_overhead_key(self, acquirer_cls: type) -> Tuple[str, str]:
+        """
+        :param acquirer_cls: the class of SEMCCDAcquirer
+        :return: the key of the overhead per snapshot in _snapshot_overhead, for the detector of
+        this stream and the given acquirer
+        """
+        return self._sccd._detector.name, acquirer_cls.__name__
+
+    def _record_timing(self, acquirer: "SEMCCDAcquirer") -> None:
+        """
+        Log the time spent in each step of the snapshot acquisitions, and record the overhead per
+        snapshot, so that the next estimations of the acquisition time are closer to reality.
+        :param acquirer: the acquirer used for the acquisition which just completed
+        """
+        timing = acquirer.timer.get_breakdown()
+        if not timing:
+            return
+        logging.info("Time spent per snapshot: %s",
+                     ", ".join("%s: %g ms" % (step, d * 1e3) for step, d in timing.items()))
+
+        if acquirer.timer.n_snapshots < MIN_SNAPSHOTS_CALIBRATION:
+            return  # Too few snapshots for the measurement to be reliable
+
+        try:
+            try:
+                ro_rate = self._sccd._getDetectorVA("readoutRate").value
+            except Exception:
+                ro_rate = 100e6  # Hz
+            readout = numpy.prod(self._sccd._getDetectorVA("resolution").value) / ro_rate
+        except Exception:
+            readout = 0  # Not a camera (eg, time-correlator)
+
+        # The time spent in these steps is already estimated separately
+        estimated_steps = sum(timing.get(step, 0) for step in ("leeches", "polarization", "stage"))
+        overhead = max(0.0, timing["total"] - estimated_steps - acquirer.snapshot_time - readout)
+        key = self._get_overhead_key(acquirer.__class__)
+        logging.debug("Measured overhead of %g ms per snapshot with %s on %s",
+                      overhead * 1e3, key[1], key[0])
+        self._snapshot_overhead[key] = overhead
 
     def _get_polarisation_positions(self) -> List[Optional[float]]:
         # if no polarimetry hardware present => no position / 0 s
@@ -1141,6 +1429,15 @@ class SEMCCDMDStream(MultipleDetectorStream):
         self._raw = []
         self._last_ccd_update = 0  # To force immediate update of CCD live view
 
+        if self._disk_store and self._disk_store.resumed:
+            # Reuse the data already acquired (for each polarization already started)
+            for n, das in enumerate(self._live_data):
+                while True:
+                    da = self._disk_store.get_array(f"stream{n}-pol{len(das)}")
+                    if da is None:
+                        break
+                    das.append(da)
+
         # For live update of the SEM area
         # Metadata for the live area image (useful if the actual data is not yet available)
         pxs = acquirer.pxs
@@ -1175,6 +1472,38 @@ class SEMCCDMDStream(MultipleDetectorStream):
         else:
             self._acq_mask[px_idx[0] * tile_size[1]:(px_idx[0] + 1) * tile_size[1],
                            px_idx[1] * tile_size[0]:(px_idx[1] + 1) * tile_size[0]] = True
+            self._mark_live_area_acquired((px_idx[1] * tile_size[0], px_idx[0] * tile_size[1],
+                                           (px_idx[1] + 1) * tile_size[0], (px_idx[0] + 1) * tile_size[1]))
+
+    def _open_disk_store(self, acquirer: "SEMCCDAcquirer", pos_polarizations: List[Optional[str]]):
+        """
+        Prepare the storage of the live data on disk, if requested by the user (via .storePath).
+        If it contains an interrupted acquisition with the same settings, it is resumed.
+        """
+        self._disk_store = None
+        path = self.storePath.value
+        if not path:
+            return
+        if not self._supports_disk_store:
+            logging.warning("Stream %s doesn't support storing the data on disk, will keep it in memory",
+                            self.name.value)
+            return
+
+        rep = self.repetition.value
+        settings = {"streams": [s.name.value for s in self._streams],
+                    "detector": self._ccd.name,
+                    "repetition": rep,
+                    "roi": self.roi.value,
+                    "rotation": self.rotation.value,
+                    "polarizations": pos_polarizations,
+                    "integration": acquirer.integration_count,
+                    "snapshot_time": acquirer.snapshot_time,
+                    "tile_size": acquirer.tile_size,
+                    "acquirer": acquirer.__class__.__name__,
+                    }
+        # If the pixels cannot be skipped, there is no point in resuming
+        self._disk_store = AcquisitionDiskStore(path, settings, (len(pos_polarizations), rep[1], rep[0]),
+                                                resume=acquirer.can_skip_pixels)
 
     def _update_live_pixel(self, ccd_da, integration_count: int):
         # Live update the setting stream with the new data
@@ -1248,6 +1577,7 @@ class SEMCCDMDStream(MultipleDetectorStream):
             self._pxs = acquirer.pxs  # Used by some of the data assembling functions
             self._roa_center_phys = acquirer.pos_center
 
+            self._open_disk_store(acquirer, pos_polarizations)
             self._reset_live_data(acquirer)
             logging.debug("Starting acquisition of %s px @ dt = %s s, roi = %s, rotation = %s rad",
                           rep, acquirer.snapshot_time * acquirer.integration_count,
@@ -1255,16 +1585,25 @@ class SEMCCDMDStream(MultipleDetectorStream):
 
             # Iterate for the polarisations
             start_t = time.time()
+            timer = acquirer.timer
+            timer.start()
             n = 0  # number of images acquired so far
             for pol_idx, pol_pos in enumerate(pos_polarizations):
                 # Move to the polarisation position
-                time_move_pol_left = self._select_polarization(pol_pos)
+                with timer.measure("polarization"):
+                    time_move_pol_left = self._select_polarization(pol_pos)
 
                 # NOTE: for hwsync: start the e-beam scan
                 acquirer.start_spatial_acquisition(pol_idx)
 
                 # iterate over pixel positions for scanning.
                 for px_idx in numpy.ndindex(*rep[::-1]):  # last dim (X) iterates first
+                    if self._disk_store and self._disk_store.is_done((pol_idx,) + px_idx):
+                        # Already acquired in a previous (interrupted) acquisition
+                        self._update_live_area(px_idx, acquirer.tile_size, in_progress=False)
+                        n += acquirer.integration_count
+                        continue
+
                     px_pos = acquirer.start_pixel_acquisition(px_idx)
                     logging.debug("Acquiring px %s at %s", px_idx, px_pos)
 
@@ -1282,28 +1621,37 @@ class SEMCCDMDStream(MultipleDetectorStream):
                         # NOTE: for hwsync, this is just about retrieving the image
                         snapshot_das = acquirer.acquire_one_snapshot(n, px_idx)
                         self._check_cancelled()
-                        self._update_live_pixel(snapshot_das[self._ccd_idx], acquirer.integration_count)
-                        pixel_das = self._integrate_snapshot(snapshot_das)
+                        with timer.measure("live"):
+                            self._update_live_pixel(snapshot_das[self._ccd_idx], acquirer.integration_count)
+                        with timer.measure("integration"):
+                            pixel_das = self._integrate_snapshot(snapshot_das)
                         dur_snapshot = time.time() - start_snapshot
 
                         # extra time needed taking leeches into account and moving polarizer HW if present
                         leech_time_left = (tot_num - n + 1) * leech_time_p_snapshot
                         extra_time = leech_time_left + time_move_pol_left
+                        # Let the progress update callbacks know where the time is spent
+                        future.timing = timer.get_breakdown()
                         self._updateProgress(future, dur_snapshot, n + 1, tot_num, extra_time)
 
-                        self._run_leeches(acquirer, pixel_das)
+                        with timer.measure("leeches"):
+                            self._run_leeches(acquirer, pixel_das)
                         n += 1  # number of images acquired so far
+                        timer.add_snapshot()
 
                     # All the data for this pixel has been acquired => store it in the "live data".
                     # Live data = data is the same shape as the final data, but not yet completely acquired.
-                    for s_idx, da in enumerate(pixel_das):
-                        if da is None:
-                            continue
-                        self._assembleLiveData(s_idx, da, px_idx, px_pos, rep, pol_idx)
-
-                    # Update the SEM live area to indicate that the pixel/tile is done
-                    self._update_live_area(px_idx, acquirer.tile_size, in_progress=False)
-                    self._shouldUpdateImage()
+                    with timer.measure("live"):
+                        for s_idx, da in enumerate(pixel_das):
+                            if da is None:
+                                continue
+                            self._assembleLiveData(s_idx, da, px_idx, px_pos, rep, pol_idx)
+                        if self._disk_store:
+                            self._disk_store.mark_done((pol_idx,) + px_idx)
+
+                        # Update the SEM live area to indicate that the pixel/tile is done
+                        self._update_live_area(px_idx, acquirer.tile_size, in_progress=False)
+                        self._shouldUpdateImage()
                     logging.debug("Done acquiring image number %s out of %s.", n, tot_num)
 
                 spatial_das = acquirer.complete_spatial_acquisition(pol_idx)
@@ -1313,14 +1661,20 @@ class SEMCCDMDStream(MultipleDetectorStream):
                     self._assembleLiveData2D(s_idx, da, (0, 0), None, rep, pol_idx)
 
             # Stop the acquisition
+            timer.stop()
             dur = time.time() - start_t
             logging.info("Acquisition completed in %g s -> %g s/frame, frame duration = %s s",
                          dur, dur / n, acquirer.snapshot_time * acquirer.integration_count)
+            self._record_timing(acquirer)
 
             acquirer.terminate_acquisition()
 
             # Save all the data
             self._assemble_final_data_all_streams()
+            timing = timer.get_breakdown()
+            if timing:
+                for da in self._raw:
+                    da.metadata[model.MD_ACQ_TIMING] = dict(timing)
 
             self._stopLeeches()  # Can update the .raw data
 
@@ -1355,6 +1709,14 @@ class SEMCCDMDStream(MultipleDetectorStream):
                 s._unlinkHwVAs()
             acquirer.restore_hardware()
 
+            if self._disk_store:
+                # If the acquisition didn't complete, keep it resumable
+                try:
+                    self._disk_store.close(complete=(error is None))
+                except Exception:
+                    logging.exception("Failed to close the data stored on disk")
+                self._disk_store = None
+
             self._dc_estimator = None
             self._img_intor = []
             self._acq_done.set()
@@ -1418,6 +1780,10 @@ class SEMMDStream(MultipleDetectorStream):
             raise ValueError("%s detector has no softwareTrigger" % (self._det0.name,))
         self._trigger = self._det0.softwareTrigger
 
+        # Fraction of the pixels actually scanned. If < 1, and the e-beam supports vector scanning,
+        # only some pixels are scanned (selected adaptively), and the others are interpolated.
+        self.scanFraction = model.FloatContinuous(1, range=(0.01, 1))
+
     def _update_live_area(self, rect: Tuple[int, int, int, int], in_progress=True):
         """
         :param rect: rectangle being acquired: ltbr in pixel coordinates
@@ -1429,6 +1795,7 @@ class SEMMDStream(MultipleDetectorStream):
             self._current_scan_area = rect
         else:
             self._acq_mask[rect[1]:rect[3], rect[0]:rect[2]] = True
+            self._mark_live_area_acquired(rect)
 
     def _estimateRawAcquisitionTime(self):
         """
@@ -1437,7 +1804,10 @@ class SEMMDStream(MultipleDetectorStream):
         """
         # Each pixel x the dwell time (of the emitter) + 20% overhead
         dt = self._dwellTime.value
-        duration = numpy.prod(self.repetition.value) * dt * 1.20
+        npixels = numpy.prod(self.repetition.value)
+        if self.scanFraction.value < 1 and model.hasVA(self._emitter, "scanPath"):
+            npixels *= self.scanFraction.value
+        duration = npixels * dt * 1.20
         # Add the setup time
         duration += self.SETUP_OVERHEAD
 
@@ -1511,8 +1881,12 @@ class SEMMDStream(MultipleDetectorStream):
 
     def _runAcquisition(self, future) -> Tuple[List[model.DataArray], Optional[Exception]]:
         if model.hasVA(self._emitter, "scanPath"):
+            if self.scanFraction.value < 1:
+                return self._runAcquisitionSparse(future)
             return self._runAcquisitionVector(future)
         else:
+            if self.scanFraction.value < 1:
+                logging.warning("Sparse scanning not supported without vector scanning, will scan all the pixels")
             return self._runAcquisitionRectangle(future)
 
     def _runAcquisitionRectangle(self, future) -> Tuple[List[model.DataArray], Optional[Exception]]:
@@ -1763,6 +2137,302 @@ class SEMMDStream(MultipleDetectorStream):
 
         return self.raw, error
 
+    def _assembleLiveDataSparse(self, n: int, raw_data: model.DataArray, px_idx: numpy.ndarray,
+                                rep: Tuple[int, int]):
+        """
+        Copies the data of pixels scanned in any order to the complete (live_data) DataArray
+        representing spatial data (of shape YX).
+        :param n: number of the current stream
+        :param raw_data: 1D data acquired, with one value per pixel scanned
+        :param px_idx: (N, 2) indices (Y, X) of the pixels scanned, in the same order as raw_data
+        :param rep: repetition frame/ size of entire frame
+        """
+        self._store_tint(n, raw_data)
+
+        if not self._live_data[n]:
+            md = raw_data.metadata.copy()
+            img.mergeMetadata(md)  # Apply the correction metadata which might be in the raw data
+            md.update({MD_POS: self._roa_center_phys,
+                       MD_PIXEL_SIZE: self._pxs,
+                       MD_ROTATION: self.rotation.value,
+                       MD_DESCRIPTION: self._streams[n].name.value})
+            da = self._create_live_array(n, 0, rep[::-1], raw_data.dtype, md)
+            self._live_data[n].append(da)
+
+        self._live_data[n][0][px_idx[:, 0], px_idx[:, 1]] = raw_data
+
+    def _runAcquisitionSparse(self, future) -> Tuple[List[model.DataArray], Optional[Exception]]:
+        """
+        Acquires images from the multiple detectors, by scanning only a fraction of the pixels (as
+        defined by .scanFraction), and interpolating the other ones. It relies on vector scanning.
+        The pixels are scanned in multiple passes: first a regular subset of the pixels, and then,
+        at each pass, the pixels where the image of the last stream varies the most, or which are
+        the furthest from any scanned pixel.
+        The pixels actually scanned are indicated in the metadata, with MD_SCAN_MASK.
+        :returns
+            list of DataArray: All the data acquired.
+            error: None if everything went fine, an Exception if an error happened, but some data has
+              already been acquired.
+        raises:
+          CancelledError() if cancelled
+          Exceptions if error
+        """
+        error = None
+        try:
+            self._acq_done.clear()
+            px_time = self._adjustHardwareSettings()
+
+            rep = tuple(self.repetition.value)
+            roi = self.roi.value
+            rotation = self.rotation.value
+            # No margin, as anyway there is no fly-back: the pixels are not scanned line by line
+            pos_flat, _, _ = scan.generate_scan_vector(self._emitter, rep, roi, rotation, dwell_time=None)
+            pos = pos_flat.reshape(rep[1], rep[0], 2)
+
+            self._acq_data = [[] for _ in self._streams]  # just to be sure it's really empty
+            self._live_data = [[] for _ in self._streams]
+            self._current_scan_area = (0, 0, 0, 0)
+            self._raw = []
+            self._anchor_raw = []
+
+            tot_num = int(numpy.prod(rep))
+            n_target = max(1, min(tot_num, round(tot_num * self.scanFraction.value)))
+            logging.debug("Starting e-beam sparse acquisition of %d/%d px @ %s s with components %s",
+                          n_target, tot_num, px_time, ", ".join(s._detector.name for s in self._streams))
+
+            self._pxs = self._getPixelSize()
+            self._scanner_pxs = self._emitter.pixelSize.value  # sub-pixel size
+            self._roa_center_phys = self._getCenterPositionPhys()  # Independent of rotation
+            self._acq_mask = numpy.zeros(rep[::-1], dtype=bool)
+
+            # initialize leeches. The pixels are acquired as one long "line".
+            leech_np, leech_time_ppx = self._startLeeches(px_time, n_target, (1, n_target))
+            live_period_px = max(1, round(self._live_update_period / px_time))
+
+            # number of spots scanned so far
+            spots_sum = 0
+            pass_idx = 0
+            while spots_sum < n_target:
+                # Select the pixels to scan during this pass
+                if pass_idx == 0:
+                    init_mask = scan.generate_sparse_mask(rep, n_target * SPARSE_SCAN_INITIAL_RATIO)
+                    pass_px_idx = numpy.argwhere(init_mask)[:n_target]
+                else:
+                    npasses_left = max(1, SPARSE_SCAN_PASSES - pass_idx)
+                    npixels_pass = math.ceil((n_target - spots_sum) / npasses_left)
+                    estimate = scan.interpolate_sparse_data(self._live_data[-1][0], self._acq_mask)
+                    pass_px_idx = scan.select_sparse_pixels(estimate, self._acq_mask, npixels_pass)
+                logging.debug("Sparse scanning pass %d: %d px", pass_idx, len(pass_px_idx))
+                pass_idx += 1
+
+                # Scan the pixels in blocks, until the next leech, and less than the live period
+                i = 0
+                while i < len(pass_px_idx):
+                    npixels2scan = min([np for np in leech_np if np is not None] +
+                                       [live_period_px, len(pass_px_idx) - i])
+                    block_idx = pass_px_idx[i:i + npixels2scan]
+                    i += npixels2scan
+
+                    # Bounding box of the pixels scanned, for the live update
+                    acq_rect = (block_idx[:, 1].min(), block_idx[:, 0].min(),
+                                block_idx[:, 1].max(), block_idx[:, 0].max())
+                    self._current_scan_area = acq_rect
+
+                    scan_vector = pos[block_idx[:, 0], block_idx[:, 1]]
+                    start = self._acquireScanVector(scan_vector, (npixels2scan, 1), px_time * npixels2scan)
+
+                    for si, das in enumerate(self._acq_data):
+                        last_da = das[-1]  # normally, there is only one DataArray
+                        if len(last_da) == 0:
+                            raise IOError("No data received for stream %s" % (self._streams[si].name.value,))
+
+                        raw_da = self._preprocessData(si, last_da.reshape(-1), tuple(block_idx[0]))
+                        self._assembleLiveDataSparse(si, raw_da, block_idx, rep)
+
+                    self._acq_mask[block_idx[:, 0], block_idx[:, 1]] = True
+                    self._mark_live_area_acquired((acq_rect[0], acq_rect[1], acq_rect[2] + 1, acq_rect[3] + 1))
+                    self._shouldUpdateImage()
+
+                    spots_sum += npixels2scan
+
+                    # remove synchronisation
+                    self._df0.synchronizedOn(None)
+                    self._emitter.scanPath.value = None  # disable vector scanning (for leeches)
+                    self._check_cancelled()
+
+                    leech_time_left = (n_target - spots_sum) * leech_time_ppx
+                    self._updateProgress(future, time.time() - start, spots_sum, n_target, leech_time_left)
+
+                    # Check if it's time to run a leech
+                    for li, l in enumerate(self.leeches):
+                        if leech_np[li] is None:
+                            continue
+                        leech_np[li] -= npixels2scan
+                        if leech_np[li] <= 0:
+                            try:
+                                np = l.next([d[-1] for d in self._acq_data])
+                            except Exception:
+                                logging.exception("Leech %s failed, will retry next pixel", l)
+                                np = 1  # try again next pixel
+                            leech_np[li] = np
+                            self._check_cancelled()
+
+                    self._acq_data = [[] for _ in self._streams]  # delete acq_data to use less RAM
+
+            # Done!
+            with self._acq_lock:
+                self._check_cancelled()
+                self._acq_state = FINISHED
+            self._current_scan_area = None  # Indicate we are done for the live update
+
+            self._interpolate_sparse_live_data()
+            for stream_idx, das in enumerate(self._live_data):
+                if stream_idx == 0 and len(das) == 0:
+                    # It's OK to not have data for the SEM stream (e.g. Monochromator)
+                    continue
+                self._assembleFinalData(stream_idx, das)
+
+            self._stopLeeches()
+
+            if self._dc_estimator:
+                self._anchor_raw.append(self._assembleAnchorData(self._dc_estimator.raw))
+
+        except Exception as exp:
+            if not isinstance(exp, CancelledError):
+                logging.exception("Scanner sync sparse acquisition of multiple detectors failed")
+
+            # make sure it's all stopped
+            for s, sub in zip(self._streams, self._subscribers):
+                s._dataflow.unsubscribe(sub)
+            self._df0.synchronizedOn(None)
+
+            if not isinstance(exp, CancelledError) and self._acq_state == CANCELLED:
+                # Reset data in case it was cancelled very late, to regain memory
+                self._raw = []
+                self._anchor_raw = []
+                logging.warning("Converting exception to cancellation")
+                raise CancelledError()
+
+            # If it wasn't finalized yet, finalize the data (with what was scanned so far)
+            if not self._raw:
+                try:
+                    if self._acq_mask.any():
+                        self._interpolate_sparse_live_data()
+                    for stream_idx, das in enumerate(self._live_data):
+                        if stream_idx == 0 and len(das) == 0:
+                            continue
+                        self._assembleFinalData(stream_idx, das)
+                except Exception:
+                    logging.warning("Failed to assemble the final data after exception in stream %s", self.name.value)
+
+            if not self._raw:
+                # No data -> just make it look like a "complete" exception
+                raise exp
+
+            error = exp
+        finally:
+            self._current_scan_area = None  # Indicate we are done for the live (also in case of error)
+            for s in self._streams:
+                s._unlinkHwVAs()
+            self._restoreHardwareSettings()
+            self._emitter.scanPath.value = None  # disable vector scanning
+            self._acq_data = [[] for _ in self._streams]  # regain a bit of memory
+            self._live_data = [[] for _ in self._streams]
+            self._streams[0].raw = []
+            self._streams[0].image.value = None
+            self._dc_estimator = None
+            self._current_future = None
+            self._acq_done.set()
+
+        return self.raw, error
+
+    def _interpolate_sparse_live_data(self):
+        """
+        Fill-in the pixels of the live data which have not been scanned (according to ._acq_mask)
+        by interpolation, and store the mask of the scanned pixels in the metadata.
+        """
+        for das in self._live_data:
+            for da in das:
+                est = scan.interpolate_sparse_data(da, self._acq_mask)
+                if numpy.issubdtype(da.dtype, numpy.integer):
+                    dinfo = numpy.iinfo(da.dtype)
+                    est = numpy.clip(numpy.round(est), dinfo.min, dinfo.max)
+                da[...] = est
+                da.metadata[model.MD_SCAN_MASK] = self._acq_mask.copy()
+
+    def _acquireScanVector(self, scan_vector: numpy.ndarray, res: Tuple[int, int],
+                           frame_time: float) -> float:
+        """
+        Scan the given positions with the e-beam, and wait until all the detectors have received
+        their data (in ._acq_data). The drift compensation is automatically applied.
+        The synchronisation and the scan path are left as-is, so it's up to the caller to reset them.
+        :param scan_vector: (N, 2) positions to scan, in scanner coordinates
+        :param res: X/Y shape of the data, as set on the independent detectors (ie, with a .resolution)
+        :param frame_time: expected time to scan all the positions (s)
+        :return: time when the acquisition started
+        :raises TimeoutError: if a detector didn't receive its data in time
+        :raises CancelledError: if the acquisition was cancelled
+        """
+        # Update the resolution of the "independent" detectors
+        has_inde_detectors = False
+        for s in self._streams:
+            det = s._detector
+            if model.hasVA(det, "resolution"):
+                has_inde_detectors = True
+                det.resolution.value = res
+                # It's unlikely but the detector could have specific constraints on the resolution
+                # and refuse the requested one => better fail early.
+                if det.resolution.value != res:
+                    raise ValueError(f"Failed to set the resolution of {det.name} to {res[0]} x {res[1]} px: "
+                                     f"{det.resolution.value} px accepted")
+                else:
+                    logging.debug("Set resolution of independent detector %s to %s",
+                                  det.name, res)
+
+        # Compensate for the drift
+        if self._dc_estimator:
+            drift_comp = (-self._dc_estimator.tot_drift[0], -self._dc_estimator.tot_drift[1])
+            scan_vector, clipped_drift = scan.shift_scan_vector(self._emitter, scan_vector, drift_comp)
+            if drift_comp != clipped_drift:
+                logging.error("Drift of %s px caused acquisition region out "
+                              "of bounds: limited to %s px",
+                              drift_comp, clipped_drift)
+
+        self._emitter.scanPath.value = scan_vector
+
+        # and now the acquisition
+        for ce in self._acq_complete:
+            ce.clear()
+
+        self._df0.synchronizedOn(self._trigger)
+        for s, sub in zip(self._streams, self._subscribers):
+            s._dataflow.subscribe(sub)
+
+        start = time.time()
+        self._acq_min_date = start
+
+        if has_inde_detectors:
+            # The independent detectors might need a bit of time to be ready.
+            # If not waiting, the first pixels might be missed.
+            # Note: ephemeron EBIC hardware needs at least 0.1s
+            time.sleep(0.1)
+
+        self._trigger.notify()  # starts the e-beam scan
+
+        # Wait for all the Dataflows to return the data. As all the
+        # detectors are linked together to the e-beam, they should all
+        # receive the data (almost) at the same time.
+        max_end_t = start + frame_time * 10 + 5
+        for i, s in enumerate(self._streams):
+            timeout = max(5.0, max_end_t - time.time())
+            if not self._acq_complete[i].wait(timeout):
+                raise TimeoutError("Acquisition of repetition stream at pos %s timed out after %g s"
+                                   % (self._emitter.translation.value, time.time() - start))
+            self._check_cancelled()
+            s._dataflow.unsubscribe(self._subscribers[i])
+
+        return start
+
     def _runAcquisitionVector(self, future) -> Tuple[List[model.DataArray], Optional[Exception]]:
         """
         Acquires images from the multiple detectors via software synchronisation.
@@ -1827,22 +2497,6 @@ class SEMMDStream(MultipleDetectorStream):
                 acq_rect = (px_idx[1], px_idx[0], px_idx[1] + n_x - 1, px_idx[0] + n_y - 1)
                 self._update_live_area(acq_rect, in_progress=True)
 
-                # Update the resolution of the "independent" detectors
-                has_inde_detectors = False
-                for s in self._streams:
-                    det = s._detector
-                    if model.hasVA(det, "resolution"):
-                        has_inde_detectors = True
-                        det.resolution.value = (n_x, n_y)
-                        # It's unlikely but the detector could have specific constraints on the resolution
-                        # and refuse the requested one => better fail early.
-                        if det.resolution.value != (n_x, n_y):
-                            raise ValueError(f"Failed to set the resolution of {det.name} to {n_x} x {n_y} px: "
-                                             f"{det.resolution.value} px accepted")
-                        else:
-                            logging.debug("Set resolution of independent detector %s to %s",
-                                          det.name, (n_x, n_y))
-
                 # Pick the points from the full scan vector that needs to be scanned in this iteration
                 if n_y == 1:  # single line, or smaller => no flyback => no need to use the margin
                     next_px_flat = margin + px_idx[1] + px_idx[0] * (rep[0] + margin)
@@ -1854,49 +2508,7 @@ class SEMMDStream(MultipleDetectorStream):
                     scan_vector = pos_flat[next_px_flat:next_px_flat + scan_vector_len]
                     scan_margin = margin
 
-                # Compensate for the drift
-                if self._dc_estimator:
-                    drift_comp = (-self._dc_estimator.tot_drift[0], -self._dc_estimator.tot_drift[1])
-                    scan_vector, clipped_drift = scan.shift_scan_vector(self._emitter, scan_vector, drift_comp)
-                    if drift_comp != clipped_drift:
-                        logging.error("Drift of %s px caused acquisition region out "
-                                      "of bounds: limited to %s px",
-                                      drift_comp, clipped_drift)
-
-                self._emitter.scanPath.value = scan_vector
-
-                # and now the acquisition
-                for ce in self._acq_complete:
-                    ce.clear()
-
-                self._df0.synchronizedOn(self._trigger)
-                for s, sub in zip(self._streams, self._subscribers):
-                    s._dataflow.subscribe(sub)
-
-                start = time.time()
-                self._acq_min_date = start
-
-                if has_inde_detectors:
-                    # The independent detectors might need a bit of time to be ready.
-                    # If not waiting, the first pixels might be missed.
-                    # Note: ephemeron EBIC hardware needs at least 0.1s
-                    time.sleep(0.1)
-
-                self._trigger.notify()  # starts the e-beam scan
-                # Time to scan a frame
-                frame_time = px_time * npixels2scan
-
-                # Wait for all the Dataflows to return the data. As all the
-                # detectors are linked together to the e-beam, they should all
-                # receive the data (almost) at the same time.
-                max_end_t = start + frame_time * 10 + 5
-                for i, s in enumerate(self._streams):
-                    timeout = max(5.0, max_end_t - time.time())
-                    if not self._acq_complete[i].wait(timeout):
-                        raise TimeoutError("Acquisition of repetition stream at pos %s timed out after %g s"
-                                           % (self._emitter.translation.value, time.time() - start))
-                    self._check_cancelled()
-                    s._dataflow.unsubscribe(self._subscribers[i])
+                start = self._acquireScanVector(scan_vector, (n_x, n_y), px_time * npixels2scan)
 
                 for i, das in enumerate(self._acq_data):
                     last_da = das[-1]  # normally, there is only one DataArray
@@ -2082,8 +2694,8 @@ class SEMSpectrumMDStream(SEMCCDMDStream):
                        MD_DESCRIPTION: self._streams[n].name.value})
 
             # Shape of spectrum data = C11YX
-            da = numpy.zeros(shape=(spec_shape[1], 1, 1, rep[1], rep[0]), dtype=raw_data.dtype)
-            self._live_data[n].append(model.DataArray(da, md))
+            da = self._create_live_array(n, pol_idx, (spec_shape[1], 1, 1, rep[1], rep[0]), raw_data.dtype, md)
+            self._live_data[n].append(da)
 
         self._live_data[n][pol_idx][:, 0, 0, px_idx[0], px_idx[1]] = raw_data.reshape(spec_shape[1])
 
@@ -2101,7 +2713,12 @@ class SEMTemporalMDStream(SEMCCDMDStream):
         # Special because it has no readout rate and no exposureTime
         try:
             exp = self._sccd._getDetectorVA("dwellTime").value
-            dur_image = exp * 1.10 # 10% overhead
+            overhead = self._snapshot_overhead.get(self._get_overhead_key(self._get_acquirer_class()))
+            if overhead is not None:
+                # Use the overhead measured during the previous acquisition
+                dur_image = exp + overhead
+            else:
+                dur_image = exp * 1.10 # 10% overhead
             duration = numpy.prod(self.repetition.value) * dur_image
             # Add the setup time
             duration += self.SETUP_OVERHEAD
@@ -2139,8 +2756,8 @@ class SEMTemporalMDStream(SEMCCDMDStream):
                        MD_DESCRIPTION: self._streams[n].name.value})
 
             # Shape of temporal data = 1T1YX
-            da = numpy.zeros(shape=(1, time_shape, 1, rep[1], rep[0]), dtype=raw_data.dtype)
-            self._live_data[n].append(model.DataArray(da, md))
+            da = self._create_live_array(n, pol_idx, (1, time_shape, 1, rep[1], rep[0]), raw_data.dtype, md)
+            self._live_data[n].append(da)
 
         # Detector image has a shape of 1,T => copy T into second dimension
         self._live_data[n][pol_idx][0, :, 0, px_idx[0], px_idx[1]] = raw_data.reshape(time_shape)
@@ -2207,8 +2824,8 @@ class SEMAngularSpectrumMDStream(SEMCCDMDStream):
                               len(md[MD_THETA_LIST]), angle_res)
 
             # Shape of spectrum data = CA1YX
-            da = numpy.zeros(shape=(spec_res, angle_res, 1, rep[1], rep[0]), dtype=raw_data.dtype)
-            self._live_data[n].append(model.DataArray(da, md))
+            da = self._create_live_array(n, pol_idx, (spec_res, angle_res, 1, rep[1], rep[0]), raw_data.dtype, md)
+            self._live_data[n].append(da)
 
         # Detector image has a shape of (angle, lambda)
         raw_data = raw_data.T  # transpose to (lambda, angle)
@@ -2291,8 +2908,8 @@ class SEMTemporalSpectrumMDStream(SEMCCDMDStream):
                        MD_DESCRIPTION: self._streams[n].name.value})
 
             # Shape of spectrum data = CT1YX
-            da = numpy.zeros(shape=(spec_res, temp_res, 1, rep[1], rep[0]), dtype=raw_data.dtype)
-            self._live_data[n].append(model.DataArray(da, md))
+            da = self._create_live_array(n, pol_idx, (spec_res, temp_res, 1, rep[1], rep[0]), raw_data.dtype, md)
+            self._live_data[n].append(da)
 
         # Detector image has a shape of (time, lambda)
         raw_data = raw_data.T  # transpose to (lambda, time)
@@ -2320,6 +2937,7 @@ class SEMARMDStream(SEMCCDMDStream):
     It handles acquisition, but not rendering (so .image always returns an empty
     image).
     """
+
     def _assembleLiveData(self, n: int, raw_data: model.DataArray,
                           px_idx: Tuple[int, int], px_pos: Tuple[float, float],
                           rep: Tuple[int, int], pol_idx: int):
@@ -2337,7 +2955,21 @@ class SEMARMDStream(SEMCCDMDStream):
         # The AR data contains an MD_ROTATION information about the rotation of the parabolic mirror
         # relative to the X/Y axes of the SEM data.
 
-        self._live_data[n].append(raw_data)
+        if self._disk_store:
+            # All the AR images of a polarization are stored in a single array of shape YX + image
+            # shape, and the position and acquisition date of each image in a separate array.
+            shape = tuple(rep[::-1]) + raw_data.shape
+            if pol_idx > len(self._live_data[n]) - 1:
+                md = raw_data.metadata.copy()
+                del md[MD_POS]
+                da = self._create_live_array(n, pol_idx, shape, raw_data.dtype, md)
+                self._live_data[n].append(da)
+            px_md = self._disk_store.create_array(f"stream{n}-pol{pol_idx}-pxmd", shape[:2] + (3,),
+                                                  numpy.float64, {})
+            self._live_data[n][pol_idx][px_idx] = raw_data
+            px_md[px_idx] = (px_pos[0], px_pos[1], raw_data.metadata.get(MD_ACQ_DATE, 0))
+        else:
+            self._live_data[n].append(raw_data)
 
     def _assembleFinalData(self, n, data):
         """
@@ -2348,6 +2980,19 @@ class SEMARMDStream(SEMCCDMDStream):
         if n != self._ccd_idx:
             return super(SEMARMDStream, self)._assembleFinalData(n, data)
 
+        if self._disk_store:
+            # Split the arrays of each polarization into one DataArray per pixel (without copy)
+            for pol_idx, da in enumerate(data):
+                px_md = self._disk_store.get_array(f"stream{n}-pol{pol_idx}-pxmd")
+                for px_idx in numpy.ndindex(*da.shape[:2]):
+                    if not self._disk_store.is_done((pol_idx,) + px_idx):
+                        continue  # Not acquired (yet)
+                    md = da.metadata.copy()
+                    md[MD_POS] = tuple(px_md[px_idx][:2])
+                    md[MD_ACQ_DATE] = float(px_md[px_idx][2])
+                    self._raw.append(model.DataArray(da[px_idx], md))
+            return
+
         # Add all the DataArrays of the AR independently
         self._raw.extend(data)
 
@@ -2833,6 +3478,10 @@ class SEMCCDAcquirer(abc.ABC):
     Abstract Acquirer for SEM+CCD streams, which can be used to acquire images using the e-beam to scan,
     without support for rotation. It supports fuzzing, leeches, and pixel integration.
     """
+    # True if the pixels can be acquired independently, so that some of them can be skipped
+    can_skip_pixels = True
+    # Name of the step, in the timing breakdown, corresponding to the move to the next pixel
+    move_step = "scanner"
 
     def __init__(self, mdstream: SEMCCDMDStream) -> None:
         """
@@ -2857,6 +3506,9 @@ class SEMCCDAcquirer(abc.ABC):
         # original values of the hardware VAs to be restored after acquisition
         self._orig_hw_values: Dict[model.VigilantAttribute, Any] = {}  # VA -> original value
 
+        # time spent in each step of the snapshot acquisitions
+        self.timer = SnapshotTimer()
+
     def restore_hardware(self) -> None:
         """
         Restore the VAs of the hardware to their original values before the acquisition started
@@ -3241,8 +3893,10 @@ class SEMCCDAcquirerRectangle(SEMCCDAcquirer):
         :return: the acquired data for each stream. If no data was received for a given stream,
         then None is provided.
         """
-        self._move_scanner(px_idx)
+        with self.timer.measure(self.move_step):
+            self._move_scanner(px_idx)
 
+        start_wait = time.perf_counter()
         failures = 0  # keeps track of acquisition failures
         while True:  # Done only once normally, excepted in case of failures
             # TODO: use queue, as in the hwsync version?
@@ -3312,12 +3966,14 @@ class SEMCCDAcquirerRectangle(SEMCCDAcquirer):
             # Since we reached this point means everything went fine, so
             # no need to retry
             break
+        self.timer.add("detector", time.perf_counter() - start_wait)
 
         # Done -> immediately preprocess the data
         ret_das = []
-        for i, das in enumerate(self._mdstream._acq_data):
-            preprocessed_da = self._mdstream._preprocessData(i, das[-1], px_idx)
-            ret_das.append(preprocessed_da)
+        with self.timer.measure("preprocess"):
+            for i, das in enumerate(self._mdstream._acq_data):
+                preprocessed_da = self._mdstream._preprocessData(i, das[-1], px_idx)
+                ret_das.append(preprocessed_da)
         logging.debug("Pre-processed data %d %s", n, px_idx)
 
         # TODO not necessary? Nice for checking the streams are not generating more data
@@ -3407,8 +4063,9 @@ class SEMCCDAcquirerVector(SEMCCDAcquirerRectangle):
         # For SEM data, need to convert raw tile into a proper 2D image
         img_das = []
         # We don't pass the md_cor because correct values are always computed properly in _assembleLiveData()
-        for da in das[:-1]:
-            img_das.append(scan.vector_data_to_img(da, self._tile_res, self._tile_margin, {}))
+        with self.timer.measure("preprocess"):
+            for da in das[:-1]:
+                img_das.append(scan.vector_data_to_img(da, self._tile_res, self._tile_margin, {}))
 
         img_das.append(das[-1])
 
@@ -3425,6 +4082,8 @@ class SEMCCDAcquirerScanStage(SEMCCDAcquirerRectangle):
      and has a small range.
     * sample stage: use the sample stage to scan. Slower & less accurate, but cheaper.
     """
+    move_step = "stage"
+
     def __init__(self, mdstream):
         super().__init__(mdstream)
 
@@ -3642,8 +4301,9 @@ class SEMCCDAcquirerScanStageVector(SEMCCDAcquirerScanStage):
         # For SEM data, need to convert raw tile into a proper 2D image
         img_das = []
         # We don't pass the md_cor because correct values are always computed properly in _assembleLiveData()
-        for da in das[:-1]:
-            img_das.append(scan.vector_data_to_img(da, self._tile_res, self._tile_margin, {}))
+        with self.timer.measure("preprocess"):
+            for da in das[:-1]:
+                img_das.append(scan.vector_data_to_img(da, self._tile_res, self._tile_margin, {}))
 
         img_das.append(das[-1])
 
@@ -3656,6 +4316,9 @@ class SEMCCDAcquirerHwSync(SEMCCDAcquirer):
     connection between the scanner and the CCD, so that is pixel start triggers a frame acquisition.
     This also relies on vector scanning, so the driver must support .scanPath too.
     """
+    # The whole area is scanned in one go
+    can_skip_pixels = False
+
     def __init__(self, mdstream: SEMCCDMDStream):
         """
         :param mdstream: (SEMCCDMDStream) the stream to acquire from
@@ -3875,12 +4538,14 @@ class SEMCCDAcquirerHwSync(SEMCCDAcquirer):
         # Wait for one CCD image to arrive
         timeout = self.snapshot_time * 3 + 5
         try:
-            ccd_data = self._mdstream._acq_data_queue[self._mdstream._ccd_idx].get(timeout=timeout)
+            with self.timer.measure("detector"):
+                ccd_data = self._mdstream._acq_data_queue[self._mdstream._ccd_idx].get(timeout=timeout)
         except queue.Empty:
             raise TimeoutError(f"Timeout while waiting for CCD data after {timeout} s")
         self._mdstream._check_cancelled()
 
-        ccd_data = self._mdstream._preprocessData(self._mdstream._ccd_idx, ccd_data, px_idx)
+        with self.timer.measure("preprocess"):
+            ccd_data = self._mdstream._preprocessData(self._mdstream._ccd_idx, ccd_data, px_idx)
         ret_das.append(ccd_data)
 
         # ccd_dates.append(ccd_data.metadata[model.MD_ACQ_DATE])  # for debugging
@@ -844,6 +844,51 @@ class BaseSPARCTestCase(unittest.TestCase, ABC):
         self.assertEqual(sem_md[model.MD_USER_TINT], (0, 255, 0))  # from .tint
         self.assertEqual(cl_md[model.MD_USER_TINT], (255, 0, 0))  # from .tint
 
+    def test_acq_cl_sparse(self):
+        """
+        Test acquisition for SEM MD CL intensity, with sparse scanning
+        """
+        self.skipIfNotSupported("cl", "vector")
+        # Create the stream
+        sems = stream.SEMStream("test sem", self.sed, self.sed.data, self.ebeam,
+                                emtvas={"dwellTime", "scale", "magnification", "pixelSize"})
+        mcs = stream.CLSettingsStream("test",
+                                      self.cl, self.cl.data, self.ebeam,
+                                      emtvas={"dwellTime", })
+        sms = stream.SEMMDStream("test sem-md", [sems, mcs])
+
+        mcs.roi.value = (0.1, 0.2, 0.4, 0.6)
+        mcs.emtDwellTime.value = 10e-6  # s
+        mcs.repetition.value = (200, 300)
+        exp_pos, exp_pxs, exp_res = roi_to_phys(mcs)
+        full_dur = sms.estimateAcquisitionTime()
+
+        sms.scanFraction.value = 0.2
+        self.assertLess(sms.estimateAcquisitionTime(), full_dur)
+
+        # Start acquisition
+        timeout = 1 + 2.5 * sms.estimateAcquisitionTime()
+        f = sms.acquire()
+        data, exp = f.result(timeout)
+        self.assertIsNone(exp)
+        self.assertEqual(len(data), 2)
+
+        # All the pixels should be filled, but only a fraction of them scanned
+        for d in data:
+            self.assertEqual(d.shape, exp_res[::-1])
+            mask = d.metadata[model.MD_SCAN_MASK]
+            self.assertEqual(mask.shape, exp_res[::-1])
+            self.assertAlmostEqual(numpy.count_nonzero(mask), 0.2 * mask.size, delta=mask.size * 0.01)
+            self.assertTrue(mask[0, 0] and mask[-1, -1])  # corners always scanned
+            numpy.testing.assert_allclose(d.metadata[model.MD_POS], exp_pos)
+            numpy.testing.assert_allclose(d.metadata[model.MD_PIXEL_SIZE], exp_pxs)
+
+        # Interpolated data should be within the range of the scanned data
+        sem_da = data[0]
+        scanned = sem_da[sem_da.metadata[model.MD_SCAN_MASK]]
+        self.assertGreaterEqual(sem_da.min(), scanned.min())
+        self.assertLessEqual(sem_da.max(), scanned.max())
+
     def test_acq_cl_rotated(self):
         """
         Test short & long acquisition for SEM MD CL intensity with rotation
@@ -0,0 +1,233 @@
+#-*- coding: utf-8 -*-
+"""
+Created on 18 Oct 2026
+
+@author: agent
+
+Copyright © 2026 agent, Delmic
+
+This file is part of Odemis.
+
+Odemis is free software: you can redistribute it and/or modify it under the terms
+of the GNU General Public License version 2 as published by the Free Software
+Foundation.
+
+Odemis is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+Odemis. If not, see http://www.gnu.org/licenses/.
+"""
+
+# Test acq.stream._scheduler
+
+import gc
+import logging
+import threading
+import time
+import unittest
+
+import numpy
+
+from odemis import model
+from odemis.acq import stream
+from odemis.acq.stream import UpdateRequest, UpdateScheduler, get_update_scheduler
+
+logging.basicConfig(format="%(asctime)s  %(levelname)-7s %(module)s:%(lineno)d %(message)s")
+logging.getLogger().setLevel(logging.DEBUG)
+
+
+class FakeComputation(object):
+    """
+    Records when the computation is run
+    """
+    def __init__(self, scheduler, period=0.1, duration=0, stream=None):
+        self.duration = duration
+        self.calls = []  # start time of each call
+        self.running = 0
+        self.max_running = 0
+        self._lock = threading.Lock()
+        self.request = UpdateRequest(self.compute, period, stream=stream, scheduler=scheduler)
+
+    def compute(self):
+        with self._lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        self.calls.append(time.time())
+        time.sleep(self.duration)
+        with self._lock:
+            self.running -= 1
+
+
+class FakeStream(object):
+
+    def __init__(self, name):
+        self.name = model.StringVA(name)
+        self.should_update = model.BooleanVA(False)
+
+
+class UpdateSchedulerTestCase(unittest.TestCase):
+
+    def test_coalesce(self):
+        """
+        Multiple requests before the computation starts are run only once
+        """
+        sched = UpdateScheduler(max_workers=2)
+        comp = FakeComputation(sched, period=0.5, duration=0.1)
+        comp.request.set()
+        time.sleep(0.05)  # computation started
+        self.assertFalse(comp.request.is_set())
+        for i in range(10):
+            comp.request.set()
+        self.assertTrue(comp.request.is_set())
+        time.sleep(1)
+
+        # First call + one after all the requests (not before the period)
+        self.assertEqual(len(comp.calls), 2)
+        self.assertGreaterEqual(comp.calls[1] - comp.calls[0], 0.5)
+        # Never run in parallel for the same request
+        self.assertEqual(comp.max_running, 1)
+        stats = sched.getStats()
+        self.assertEqual(stats["executed"], 2)
+        self.assertEqual(stats["coalesced"], 9)
+        self.assertEqual(stats["queued"], 0)
+        self.assertLessEqual(stats["workers"], 2)
+
+        # Cancel before it's run
+        comp.request.set()
+        comp.request.clear()
+        time.sleep(0.6)
+        self.assertEqual(len(comp.calls), 2)
+
+    def test_max_workers(self):
+        """
+        Many computations are run on a limited number of threads
+        """
+        nthreads = threading.active_count()
+        sched = UpdateScheduler(max_workers=3)
+        comps = [FakeComputation(sched, duration=0.05) for i in range(30)]
+        for c in comps:
+            c.request.set()
+
+        time.sleep(0.1)
+        self.assertLessEqual(threading.active_count(), nthreads + 3)
+        self.assertEqual(sched.getStats()["running"], 3)
+        time.sleep(1)
+        for c in comps:
+            self.assertEqual(len(c.calls), 1)
+        stats = sched.getStats()
+        self.assertEqual(stats["executed"], 30)
+        self.assertGreater(stats["latency_max"], 0.3)
+
+    def test_visibility(self):
+        """
+        The visible streams are updated first, and the hidden ones are throttled
+        """
+        sched = UpdateScheduler(max_workers=1)
+        visible = [FakeStream("visible %d" % i) for i in range(5)]
+        hidden = [FakeStream("hidden %d" % i) for i in range(5)]
+        sched.setVisibilityFilter(lambda s: s in visible)
+
+        comps_hidden = [FakeComputation(sched, duration=0.01, stream=s) for s in hidden]
+        comps_visible = [FakeComputation(sched, duration=0.01, stream=s) for s in visible]
+        # Hidden streams requested first, but still run after the visible ones
+        for c in comps_hidden + comps_visible:
+            c.request.set()
+
+        time.sleep(0.5)
+        for c in comps_visible:
+            self.assertEqual(len(c.calls), 1)
+        for c in comps_hidden:
+            self.assertEqual(len(c.calls), 0)
+        self.assertEqual(sched.getStats()["queued"], 5)
+
+        # Playing stream is always visible
+        hidden[0].should_update.value = True
+        comps_hidden[0].request.set()  # Already requested => no effect
+        time.sleep(0.1)
+        self.assertEqual(len(comps_hidden[0].calls), 1)
+
+        # Everything is visible => run immediately
+        sched.setVisibilityFilter(None)
+        time.sleep(0.2)
+        for c in comps_hidden:
+            self.assertEqual(len(c.calls), 1)
+
+    def test_gc(self):
+        """
+        The scheduler doesn't prevent the objects from being garbage collected
+        """
+        sched = UpdateScheduler(max_workers=1)
+        comp = FakeComputation(sched, duration=0.2)
+        comp.request.set()
+        comp.request.set()
+        time.sleep(0.1)
+        del comp
+        gc.collect()
+        time.sleep(0.3)
+        self.assertEqual(sched.getStats()["queued"], 0)
+        self.assertEqual(sched.getStats()["running"], 0)
+
+
+class StaticStreamsSchedulerTestCase(unittest.TestCase):
+    """
+    Test the update of many static streams at the same time
+    """
+
+    def test_many_streams(self):
+        nthreads = threading.active_count()
+        sched = get_update_scheduler()
+        sched.resetStats()
+
+        md = {
+            model.MD_PIXEL_SIZE: (1e-6, 1e-6),  # m/px
+            model.MD_POS: (13.7e-3, -30e-3),  # m
+            model.MD_IN_WL: (600e-9, 620e-9),  # m
+            model.MD_OUT_WL: (620e-9, 650e-9),  # m
+        }
+        streams = []
+        projs = []
+        for i in range(20):
+            da = model.DataArray(numpy.random.randint(0, 4095, (256, 512), dtype=numpy.uint16), md)
+            if i % 2:
+                s = stream.StaticFluoStream("fluo %d" % i, da)
+            else:
+                s = stream.StaticSEMStream("sem %d" % i, da)
+            streams.append(s)
+            projs.append(stream.RGBSpatialProjection(s))
+
+        # Only the first streams are visible: they should be computed first
+        visible = streams[:4]
+        sched.setVisibilityFilter(lambda s: s in visible)
+        try:
+            for p in projs:
+                p._shouldUpdateImage()
+
+            tend = time.time() + 10
+            while time.time() < tend:
+                if all(p.image.value is not None for p in projs[:4]):
+                    break
+                time.sleep(0.01)
+            else:
+                self.fail("Visible streams not updated")
+            self.assertLessEqual(threading.active_count(), nthreads + stream.MAX_WORKERS)
+
+            # The hidden streams are eventually computed too
+            time.sleep(stream.HIDDEN_PERIOD + 1)
+            for p, s in zip(projs, streams):
+                self.assertIsNotNone(p.image.value)
+                self.assertIsNotNone(s.histogram.value)
+                self.assertEqual(p.image.value.shape, (256, 512, 3))
+        finally:
+            sched.setVisibilityFilter(None)
+
+        stats = sched.getStats()
+        logging.debug("Scheduler stats: %s", stats)
+        self.assertGreaterEqual(stats["executed"], 20)
+        self.assertEqual(stats["failed"], 0)
+        self.assertLessEqual(stats["workers"], stream.MAX_WORKERS)
+
+
+if __name__ == "__main__":
+    unittest.main()
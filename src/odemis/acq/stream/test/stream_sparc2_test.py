@@ -20,6 +20,8 @@ Odemis. If not, see http://www.gnu.org/licenses/.
 
 import logging
 import os
+import shutil
+import tempfile
 import time
 import unittest
 
@@ -27,9 +29,10 @@ import numpy
 
 import odemis
 from odemis import model
-from odemis.acq import stream, leech
+from odemis.acq import stream, leech, diskstore
 from odemis.acq.leech import ProbeCurrentAcquirer
 from odemis.acq.stream.test.base_sparc import BaseSPARCTestCase, roi_to_phys
+from odemis.util import img
 
 logging.basicConfig(format="%(asctime)s  %(levelname)-7s %(module)s:%(lineno)d %(message)s")
 logging.getLogger().setLevel(logging.DEBUG)
@@ -120,6 +123,109 @@ class SPARC2TestCase(BaseSPARCTestCase):
         pcmd = spec_md[model.MD_EBEAM_CURRENT_TIME]
         self.assertGreater(len(pcmd), 5 * 6 / 2)
 
+        # The time spent in each step should be reported
+        timing = spec_md[model.MD_ACQ_TIMING]
+        self.assertEqual(f.timing.keys(), timing.keys())
+        for step in ("scanner", "detector", "leeches", "integration", "live", "total"):
+            self.assertIn(step, timing)
+        self.assertGreaterEqual(timing["detector"], specs.detExposureTime.value * 0.9)
+        self.assertGreater(timing["total"], timing["detector"])
+
+    def test_snapshot_overhead_per_detector(self):
+        """
+        The overhead per snapshot measured during an acquisition is only used to estimate
+        the acquisition time of the streams with the same detector
+        """
+        stream.SEMCCDMDStream._snapshot_overhead.clear()
+        self.addCleanup(stream.SEMCCDMDStream._snapshot_overhead.clear)
+
+        sems = stream.SEMStream("test sem", self.sed, self.sed.data, self.ebeam)
+        specs = stream.SpectrumSettingsStream("test spec", self.spec, self.spec.data, self.ebeam,
+                                              detvas={"exposureTime"})
+        sps = stream.SEMSpectrumMDStream("test sem-spec", [sems, specs])
+        ars = stream.ARSettingsStream("test ar", self.ccd, self.ccd.data, self.ebeam,
+                                      detvas={"exposureTime"})
+        sas = stream.SEMARMDStream("test sem-ar", [sems, ars])
+
+        # Enough snapshots to record the overhead (>= MIN_SNAPSHOTS_CALIBRATION)
+        specs.detExposureTime.value = 0.01  # s
+        specs.repetition.value = (4, 3)
+        ars.detExposureTime.value = 0.01  # s
+        ars.repetition.value = (4, 3)
+        spec_est = sps.estimateAcquisitionTime()
+        ar_est = sas.estimateAcquisitionTime()
+
+        f = sps.acquire()
+        data, exp = f.result(5 + 2 * spec_est)
+        self.assertIsNone(exp)
+
+        # Only the overhead of the spectrometer has been measured
+        self.assertEqual(list(stream.SEMCCDMDStream._snapshot_overhead.keys()),
+                         [(self.spec.name, sps._get_acquirer_class().__name__)])
+        self.assertNotAlmostEqual(sps.estimateAcquisitionTime(), spec_est)
+        self.assertAlmostEqual(sas.estimateAcquisitionTime(), ar_est)
+
+    def test_acq_ar_disk_store_resume(self):
+        """
+        Interrupt an AR acquisition stored on disk, and resume it: the pixels already acquired
+        should be kept, and the data should be the same as an acquisition stored in memory.
+        """
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+
+        sems = stream.SEMStream("test sem", self.sed, self.sed.data, self.ebeam)
+        ars = stream.ARSettingsStream("test ar", self.ccd, self.ccd.data, self.ebeam,
+                                      detvas={"exposureTime"})
+        sas = stream.SEMARMDStream("test sem-ar", [sems, ars])
+        ars.detExposureTime.value = 0.1  # s
+        ars.repetition.value = (4, 3)
+        if not sas._get_acquirer_class().can_skip_pixels:
+            self.skipTest("Acquisition cannot be resumed with %s" % (sas._get_acquirer_class().__name__,))
+        timeout = 5 + 2 * sas.estimateAcquisitionTime()
+        sas.storePath.value = path
+
+        # Interrupt the acquisition after a few pixels
+        nupdates = []
+        f = sas.acquire()
+        f.add_update_callback(lambda f, s, e: nupdates.append(e))
+        end = time.time() + timeout
+        while len(nupdates) < 5 and time.time() < end:
+            time.sleep(0.01)
+        f.cancel()
+        self.assertTrue(f.cancelled())
+
+        stored, progress = diskstore.open_store(path)
+        self.assertEqual(progress.shape, (1, 3, 4))
+        nacq = numpy.count_nonzero(progress)
+        self.assertTrue(0 < nacq < progress.size)
+        ar_stored = [d for d in stored if d.ndim == 4]  # pol-array of shape YX + image shape
+        self.assertEqual(len(ar_stored), 1)
+        ar_acquired = ar_stored[0][progress[0]].copy()
+
+        # Resume => only the missing pixels are acquired, the others are the same as before
+        f = sas.acquire()
+        data, exp = f.result(timeout)
+        self.assertIsNone(exp)
+        ar_data = data[1:]
+        self.assertEqual(len(ar_data), progress.size)
+        acquired_idx = numpy.flatnonzero(progress[0])
+        for i, im in zip(acquired_idx, ar_acquired):
+            numpy.testing.assert_array_equal(ar_data[i], im)
+
+        # Same data (structure) as when it is stored in memory
+        sas.storePath.value = ""
+        f = sas.acquire()
+        data_mem, exp = f.result(timeout)
+        self.assertIsNone(exp)
+        self.assertEqual(len(data), len(data_mem))
+        for da, da_mem in zip(data, data_mem):
+            self.assertEqual(da.shape, da_mem.shape)
+            self.assertEqual(da.dtype, da_mem.dtype)
+            numpy.testing.assert_allclose(da.metadata[model.MD_POS], da_mem.metadata[model.MD_POS])
+            numpy.testing.assert_allclose(da.metadata[model.MD_PIXEL_SIZE],
+                                          da_mem.metadata[model.MD_PIXEL_SIZE])
+            self.assertEqual(da.metadata.get(model.MD_DESCRIPTION), da_mem.metadata.get(model.MD_DESCRIPTION))
+
     def test_acq_cl_leech(self):
         """
         Test acquisition for SEM MD CL intensity + 2 leeches
@@ -187,5 +293,74 @@ class SPARC2TestCase(BaseSPARCTestCase):
         self.assertGreater(len(pcmd), 500 / 10)
 
 
+class SnapshotTimerTestCase(unittest.TestCase):
+    """
+    Tests the recording of the time spent in each step of the SEM+CCD acquisitions
+    """
+
+    def test_breakdown(self):
+        timer = stream.SnapshotTimer()
+        self.assertEqual(timer.get_breakdown(), {})
+
+        timer.start()
+        for i in range(4):
+            with timer.measure("detector"):
+                time.sleep(0.02)
+            if i % 2:
+                with timer.measure("leeches"):
+                    time.sleep(0.01)
+            time.sleep(0.01)  # Not accounted in any step
+            timer.add_snapshot()
+        timer.stop()
+
+        breakdown = timer.get_breakdown()
+        self.assertEqual(timer.n_snapshots, 4)
+        self.assertEqual(set(breakdown.keys()), {"detector", "leeches", "other", "total"})
+        self.assertGreaterEqual(breakdown["detector"], 0.02)
+        self.assertGreaterEqual(breakdown["leeches"], 0.005)
+        self.assertGreaterEqual(breakdown["other"], 0.01)
+        self.assertAlmostEqual(breakdown["total"],
+                               breakdown["detector"] + breakdown["leeches"] + breakdown["other"])
+
+        # Once stopped, the breakdown doesn't change anymore
+        time.sleep(0.05)
+        self.assertEqual(timer.get_breakdown(), breakdown)
+
+
+class LiveRGBProjectionTestCase(unittest.TestCase):
+    """
+    Tests the incremental live projection used during the SEM+CCD acquisitions
+    """
+
+    def test_incremental(self):
+        """The incremental projection should be (almost) identical to projecting the whole image"""
+        rng = numpy.random.default_rng(0)
+        shape = (32, 40)
+        full = rng.normal(2000, 300, shape).clip(0, 4095).astype(numpy.uint16)
+        data = model.DataArray(numpy.zeros(shape, dtype=numpy.uint16))
+        acq_mask = numpy.zeros(shape, dtype=bool)
+        proj = stream.LiveRGBProjection(data)
+
+        for y, x in numpy.ndindex(shape[0], shape[1] // 8):
+            x *= 8
+            data[y, x:x + 8] = full[y, x:x + 8]
+            acq_mask[y, x:x + 8] = True
+            proj.add_dirty((x, y, x + 8, y + 1))
+            if x % 16:
+                continue
+
+            scan_area = (x + 8, y, x + 16, y + 1)
+            rgbim = proj.update(acq_mask, scan_area)
+
+            # Compare to the projection of the whole image
+            hist, edges = img.histogram(data[acq_mask])
+            irange = img.findOptimalRange(hist, edges, 1 / 256)
+            exp_rgbim = img.DataArray2RGB(data, irange)
+            exp_rgbim[~acq_mask] = stream.GUI_BLUE
+            exp_rgbim[y:y + 1, x + 8:x + 16] = stream.GUI_ORANGE
+            # The range is only updated when it changes visibly => allow 1 grey level difference
+            numpy.testing.assert_allclose(rgbim, exp_rgbim, atol=1)
+
+
 if __name__ == "__main__":
     unittest.main()
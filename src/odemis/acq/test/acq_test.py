@@ -752,6 +752,47 @@ class MeteorTestCase(unittest.TestCase):
         # 2 streams, 2 updates per stream, so 2 updates at least
         self.assertGreaterEqual(self._nb_updates, 2)
 
+    def test_only_FM_streams_with_hot_zstack(self):
+        self.ccd.exposureTime.value = 0.1  # s
+
+        s1 = stream.FluoStream(
+            "fluo1", self.ccd, self.ccd.data, self.light, self.light_filter, focuser=self.fm_focuser
+        )
+        s1.excitation.value = sorted(s1.excitation.choices)[0]
+        s2 = stream.FluoStream(
+            "fluo2", self.ccd, self.ccd.data, self.light, self.light_filter, focuser=self.fm_focuser
+        )
+        s2.excitation.value = sorted(s2.excitation.choices)[-1]
+        self.streams = [s1, s2]
+
+        zlevels_list = generate_zlevels(self.fm_focuser, (-2e-6, 2e-6), 1e-6)
+        zlevels = {s: list(zlevels_list) for s in self.streams}
+
+        f = acqmng.acquireZStack(self.streams, zlevels, hot=True)
+        f.add_update_callback(self._on_progress_update)
+        data, exp = f.result()
+        self.assertIsNone(exp)
+
+        self.assertEqual(len(data), 2)
+        for d in data:
+            self.assertIsInstance(d, model.DataArray)
+            self.assertEqual(d.shape[0], len(zlevels_list))
+            self.assertEqual(len(d.metadata[model.MD_POS]), 3)
+            self.assertEqual(len(d.metadata[model.MD_PIXEL_SIZE]), 3)
+
+        # Each plane should have its timing reported
+        for s in self.streams:
+            timings = f.plane_timings[s.name.value]
+            self.assertEqual(len(timings), len(zlevels_list))
+            for t in timings:
+                self.assertGreater(t["acquire"], 0)
+
+        # The streams should be stopped at the end
+        for s in self.streams:
+            self.assertFalse(s.is_active.value)
+
+        self.assertGreaterEqual(self._nb_updates, 2)
+
     def test_only_SEM_streams_with_zstack(self):
         self.ebeam.dwellTime.value = 1e-6  # s
         sems = stream.SEMStream("sem", self.sed, self.sed.data, self.ebeam)
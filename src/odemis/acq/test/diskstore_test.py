@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+Created on 18 Oct 2026
+
+@author: agent
+
+Copyright © 2026 agent, Delmic
+
+This file is part of Odemis.
+
+Odemis is free software: you can redistribute it and/or modify it under the terms
+of the GNU General Public License version 2 as published by the Free Software
+Foundation.
+
+Odemis is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+Odemis. If not, see http://www.gnu.org/licenses/.
+"""
+import logging
+import shutil
+import tempfile
+import unittest
+
+import numpy
+
+from odemis import model
+from odemis.acq.diskstore import AcquisitionDiskStore, open_store
+
+logging.getLogger().setLevel(logging.DEBUG)
+
+SETTINGS = {"repetition": (4, 3), "roi": (0.1, 0.2, 0.6, 0.7), "polarizations": [None]}
+
+
+class TestAcquisitionDiskStore(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def _acquire(self, store, pixels):
+        """
+        Simulate the acquisition of the given pixels
+        """
+        da = store.get_array("spec")
+        if da is None:
+            md = {model.MD_DESCRIPTION: "Spectrum", model.MD_PIXEL_SIZE: (1e-6, 1e-6),
+                  model.MD_WL_LIST: numpy.linspace(400e-9, 700e-9, 5)}
+            da = store.create_array("spec", (5, 1, 1, 3, 4), numpy.uint16, md)
+        for y, x in pixels:
+            da[:, 0, 0, y, x] = numpy.arange(5) + y * 10 + x
+            store.mark_done((0, y, x))
+        return da
+
+    def test_complete(self):
+        store = AcquisitionDiskStore(self.path, SETTINGS, (1, 3, 4))
+        self.assertFalse(store.resumed)
+        da = self._acquire(store, numpy.ndindex(3, 4))
+        store.close(complete=True)
+        self.assertEqual(da[2, 0, 0, 2, 3], 2 + 23)
+
+        data, progress = open_store(self.path)
+        self.assertEqual(len(data), 1)
+        numpy.testing.assert_array_equal(data[0], da)
+        self.assertTrue(progress.all())
+        self.assertEqual(data[0].metadata[model.MD_DESCRIPTION], "Spectrum")
+        self.assertEqual(data[0].metadata[model.MD_PIXEL_SIZE], (1e-6, 1e-6))
+        numpy.testing.assert_array_equal(data[0].metadata[model.MD_WL_LIST],
+                                         numpy.linspace(400e-9, 700e-9, 5))
+
+        # A complete acquisition is never resumed
+        store = AcquisitionDiskStore(self.path, SETTINGS, (1, 3, 4))
+        self.assertFalse(store.resumed)
+        self.assertIsNone(store.get_array("spec"))
+
+    def test_resume(self):
+        store = AcquisitionDiskStore(self.path, SETTINGS, (1, 3, 4))
+        pixels = list(numpy.ndindex(3, 4))
+        self._acquire(store, pixels[:5])
+        store.close(complete=False)
+
+        # The partial data can be read
+        data, progress = open_store(self.path)
+        self.assertEqual(numpy.count_nonzero(progress), 5)
+        self.assertEqual(data[0][4, 0, 0, 1, 0], 4 + 10)
+        self.assertEqual(data[0][4, 0, 0, 2, 0], 0)
+
+        # Different settings => start from scratch
+        settings = dict(SETTINGS, repetition=(8, 6))
+        store = AcquisitionDiskStore(self.path, settings, (1, 6, 8))
+        self.assertFalse(store.resumed)
+        store.close(complete=False)
+
+        # Resume an acquisition
+        store = AcquisitionDiskStore(self.path, SETTINGS, (1, 3, 4))
+        self._acquire(store, pixels[:5])
+        store.close(complete=False)
+        store = AcquisitionDiskStore(self.path, SETTINGS, (1, 3, 4))
+        self.assertTrue(store.resumed)
+        todo = [px for px in pixels if not store.is_done((0,) + px)]
+        self.assertEqual(todo, pixels[5:])
+        da = self._acquire(store, todo)
+        store.close(complete=True)
+
+        expected = numpy.zeros((5, 1, 1, 3, 4), dtype=numpy.uint16)
+        for y, x in pixels:
+            expected[:, 0, 0, y, x] = numpy.arange(5) + y * 10 + x
+        numpy.testing.assert_array_equal(da, expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
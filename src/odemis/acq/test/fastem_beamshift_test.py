@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+Created on 18 Oct 2026
+
+@author: agent
+
+Copyright © 2026 agent, Delmic
+
+This file is part of Odemis.
+
+Odemis is free software: you can redistribute it and/or modify it under the terms
+of the GNU General Public License version 2 as published by the Free Software
+Foundation.
+
+Odemis is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+Odemis. If not, see http://www.gnu.org/licenses/.
+"""
+import logging
+import math
+import os
+import tempfile
+import unittest
+
+import numpy
+
+from odemis.acq.fastem_beamshift import BeamShiftModel
+
+logging.getLogger().setLevel(logging.DEBUG)
+
+
+def fake_beam_shift(x, y):
+    """Smooth beam shift (in m) as a function of the stage position (in m)"""
+    return (2e-6 + 1e-4 * x - 5e-3 * x ** 2 + 2e-4 * x * y,
+            -1e-6 + 3e-4 * y + 1e-4 * x)
+
+
+class TestBeamShiftModel(unittest.TestCase):
+
+    def test_no_measurement(self):
+        model = BeamShiftModel()
+        bs, std = model.predict((0, 0))
+        self.assertIsNone(bs)
+        self.assertTrue(math.isinf(std))
+
+    def test_fit(self):
+        """The model should learn a smooth function, and be more confident where there are measurements"""
+        model = BeamShiftModel()
+        rng = numpy.random.default_rng(0)
+        for x, y in rng.uniform(-0.02, 0.02, (50, 2)):
+            bs = fake_beam_shift(x, y)
+            noise = rng.normal(0, 20e-9, 2)
+            model.add_measurement((x, y), (bs[0] + noise[0], bs[1] + noise[1]))
+
+        self.assertEqual(model.n_measurements, 50)
+        for x, y in ((0, 0), (0.01, -0.005), (-0.015, 0.012)):
+            bs, std = model.predict((x, y))
+            exp_bs = fake_beam_shift(x, y)
+            numpy.testing.assert_allclose(bs, exp_bs, atol=50e-9)
+            self.assertLess(std, 100e-9)
+
+        # Far away from the measurements, the uncertainty is much higher
+        _, std_in = model.predict((0, 0))
+        _, std_out = model.predict((0.5, 0.5))
+        self.assertGreater(std_out, 10 * std_in)
+
+    def test_few_measurements(self):
+        """With a single measurement, the prediction is only reliable close to it"""
+        model = BeamShiftModel()
+        model.add_measurement((0.01, 0.01), (1e-6, 2e-6))
+        bs, std_close = model.predict((0.01, 0.01))
+        numpy.testing.assert_allclose(bs, (1e-6, 2e-6), atol=1e-9)
+        _, std_far = model.predict((0.02, 0.01))
+        self.assertGreater(std_far, std_close)
+
+    def test_max_measurements(self):
+        model = BeamShiftModel(max_measurements=10)
+        for i in range(20):
+            model.add_measurement((i * 1e-3, 0), (i * 1e-9, 0))
+        self.assertEqual(model.n_measurements, 10)
+
+    def test_persistence(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            model = BeamShiftModel.for_scintillator(3, directory=tmpdir)
+            self.assertEqual(model.n_measurements, 0)
+            for x, y in ((0, 0), (0.01, 0), (0, 0.01), (0.01, 0.01)):
+                model.add_measurement((x, y), fake_beam_shift(x, y))
+            model.save()
+            self.assertTrue(os.path.exists(model.path))
+
+            # Another scintillator has its own model
+            model_other = BeamShiftModel.for_scintillator(4, directory=tmpdir)
+            self.assertEqual(model_other.n_measurements, 0)
+
+            model_loaded = BeamShiftModel.for_scintillator(3, directory=tmpdir)
+            self.assertEqual(model_loaded.n_measurements, 4)
+            self.assertEqual(model_loaded.predict((0.005, 0.005)), model.predict((0.005, 0.005)))
+
+            # A corrupted file should not prevent from using the model
+            with open(model.path, "w") as f:
+                f.write("not json")
+            model_corrupted = BeamShiftModel.for_scintillator(3, directory=tmpdir)
+            self.assertEqual(model_corrupted.n_measurements, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
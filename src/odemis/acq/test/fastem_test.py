@@ -38,6 +38,7 @@ from odemis.acq import fastem, stream
 from odemis.acq.acqmng import SettingsObserver
 from odemis.acq.align.fastem import Calibrations
 from odemis.acq.fastem import DEFAULT_PITCH, SETTINGS_SELECTION
+from odemis.acq.fastem_beamshift import BeamShiftModel
 from odemis.gui.comp.fastem_roa import FastEMROA
 from odemis.gui.comp.overlay.shapes import EditableShape
 from odemis.gui.model.main_gui_data import FastEMMainGUIData
@@ -1419,6 +1420,118 @@ class TestFastEMAcquisitionTaskMock(TestFastEMAcquisitionTask):
         data, err = task.run()
         self.assertEqual(data[(0, 0)].shape, (7200, 7200))
 
+    def test_offload_queue_backpressure(self):
+        """Test that the scan waits for the offload queue to be emptied, and that the field timings are reported."""
+        coordinates = (0, 0, 1e-8, 1e-8)  # in m
+        roc_2 = fastem.FastEMROC("roc_2", 0, coordinates)
+        roc_3 = fastem.FastEMROC("roc_3", 0, coordinates)
+        points = [(0, 0), (0.000001, 0), (0.000001, 0.000001), (0, 0.000001)]
+
+        roa = FastEMROA(shape=MockEditableShape(),
+                        main_data=self.main_data,
+                        overlap=0.0,
+                        name="roa_name",
+                        slice_index=0)
+        roa.roc_2.value = roc_2
+        roa.roc_3.value = roc_3
+        roa.shape._points = points
+        roa.shape.points.value = points
+
+        # Give sometime for calculation of field_indices
+        time.sleep(2)
+
+        task = fastem.AcquisitionTask(self.scanner, self.multibeam, self.descanner, self.mppc, self.stage,
+                                      self.scan_stage, self.ccd, self.beamshift, self.lens, self.se_detector,
+                                      self.ebeam_focus, roa, path="test-path", username="default",
+                                      pre_calibrations=None, save_full_cells=False, settings_obs=None,
+                                      spot_grid_thresh=0.5, blank_beam=True, stop_acq_on_failure=True, future=Mock())
+
+        def _image_received(*args, **kwargs):
+            task.image_received(None, numpy.ones((10, 10)))
+
+        # The offload queue is full at first, and then gets emptied
+        fill_levels = iter([99, 80, 60])
+        asm = Mock()
+        asm.configure_mock(**{"getFillLevelOffloadingQueue.side_effect": lambda: next(fill_levels, 0)})
+        task._asm = asm
+        self.mppc.configure_mock(**{"data.next.side_effect": _image_received})
+
+        data, err = task.run()
+        self.assertIsNone(err)
+        self.assertEqual(len(data), len(roa.field_indices))
+        self.assertEqual(set(task.field_timings.keys()), set(roa.field_indices))
+        first_timing = task.field_timings[roa.field_indices[0]]
+        for step in ("move", "settle", "offload", "scan"):
+            self.assertIn(step, first_timing)
+        # Should have waited ~2s for the offload queue to go below the low level
+        self.assertGreaterEqual(first_timing["offload"], 1.5)
+
+    def test_beam_shift_model(self):
+        """
+        Test that with a reliable beam shift model, the beam shift is predicted, and only measured on the first
+        field and on a few of the regular beam shift correction fields, to validate the predictions.
+        """
+        coordinates = (0, 0, 1e-8, 1e-8)  # in m
+        roc_2 = fastem.FastEMROC("roc_2", 0, coordinates)
+        roc_3 = fastem.FastEMROC("roc_3", 0, coordinates)
+        # Large enough for several rows of fields
+        points = [(0, 0), (60e-6, 0), (60e-6, 60e-6), (0, 60e-6)]
+
+        roa = FastEMROA(shape=MockEditableShape(),
+                        main_data=self.main_data,
+                        overlap=0.0,
+                        name="roa_name",
+                        slice_index=0)
+        roa.roc_2.value = roc_2
+        roa.roc_3.value = roc_3
+        roa.shape._points = points
+        roa.shape.points.value = points
+
+        # Give sometime for calculation of field_indices
+        time.sleep(2)
+
+        prev_shift = self.beamshift.shift.value
+        self.addCleanup(setattr, self.beamshift.shift, "value", prev_shift)
+        self.beamshift.shift.value = (1e-6, 1e-6)
+
+        bs_model = BeamShiftModel()
+        task = fastem.AcquisitionTask(self.scanner, self.multibeam, self.descanner, self.mppc, self.stage,
+                                      self.scan_stage, self.ccd, self.beamshift, self.lens, self.se_detector,
+                                      self.ebeam_focus, roa, path="test-path", username="default",
+                                      pre_calibrations=None, save_full_cells=False, settings_obs=None,
+                                      spot_grid_thresh=0.5, blank_beam=True, stop_acq_on_failure=True, future=Mock(),
+                                      beam_shift_model=bs_model)
+        # The beam shift is the same everywhere, and measured enough for the model to be reliable
+        for pos in task._get_all_abs_stage_movements(roa.field_indices):
+            for _ in range(3):
+                bs_model.add_measurement(pos, (1e-6, 1e-6))
+        n_measurements = bs_model.n_measurements
+
+        def _image_received(*args, **kwargs):
+            task.image_received(None, numpy.ones((10, 10)))
+
+        self.mppc.configure_mock(**{"data.next.side_effect": _image_received})
+        measured_fields = []
+
+        def _correct_beam_shift():
+            measured_fields.append(task.field_idx)
+            return 1e-6, 1e-6
+
+        task.correct_beam_shift = _correct_beam_shift
+
+        data, err = task.run()
+        self.assertIsNone(err)
+        self.assertEqual(len(data), len(roa.field_indices))
+        cor_indices = task._calculate_beam_shift_cor_indices()
+        self.assertGreater(len(cor_indices), len(measured_fields))
+        # Only measured on the first field, and on one out of BEAM_SHIFT_VALIDATION_PERIOD of the regular fields
+        period = fastem.BEAM_SHIFT_VALIDATION_PERIOD
+        regular_fields = [idx for idx in roa.field_indices[1:] if idx in cor_indices]
+        self.assertEqual(measured_fields, roa.field_indices[:1] + regular_fields[period - 1::period])
+        # Each measurement updates the model
+        self.assertEqual(bs_model.n_measurements, n_measurements + len(measured_fields))
+        numpy.testing.assert_allclose(self.beamshift.shift.value, (1e-6, 1e-6))
+
     def test_pre_calibrate(self):
         self.skipTest(
             "Skipping test because the pre-calibration method is not mocked."
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""
+Created on 18 Oct 2026
+
+@author: agent
+
+Copyright © 2026 agent, Delmic
+
+This file is part of Odemis.
+
+Odemis is free software: you can redistribute it and/or modify it under the terms
+of the GNU General Public License version 2 as published by the Free Software
+Foundation.
+
+Odemis is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+Odemis. If not, see http://www.gnu.org/licenses/.
+"""
+
+# Test acq.planner
+
+import logging
+import unittest
+
+from odemis import model
+from odemis.acq import planner
+from odemis.acq.planner import AcquisitionPlanner, estimateAxisMoveDuration, orderZLevels
+from odemis.driver import simulated
+from odemis.util.driver import guessActuatorMoveDuration
+
+logging.getLogger().setLevel(logging.DEBUG)
+
+
+class FakeStream(object):
+    """
+    Has the same attributes as a (fluorescence) stream, as used by the planner
+    """
+
+    def __init__(self, name, em_filter=None, band=None, focus=None, z=None):
+        self.name = model.StringVA(name)
+        self.prepared = 0
+        self._axis_map = {}
+        self._axis_vas = {}
+        if focus is not None:
+            self._axis_map["focusZ"] = ("z", focus)
+            self._axis_vas["focusZ"] = model.FloatVA(z)
+        if em_filter is not None:
+            self._em_filter = em_filter
+            choices = em_filter.axes["band"].choices
+            self._emission_to_idx = {v: k for k, v in choices.items()}
+            self.emission = model.VigilantAttribute(band)
+
+    def prepare(self):
+        self.prepared += 1
+        return model.InstantaneousFuture()
+
+
+def _priority(s):
+    # The streams named "sem*" are of lower priority
+    return 50 if s.name.value.startswith("sem") else 100
+
+
+class AcquisitionPlannerTestCase(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.filter = simulated.GenericComponent(
+            name="filter", role="filter",
+            axes={"band": {"choices": {0: "blue", 1: "green", 2: "red", 3: "pass-through"}}})
+        cls.focus = simulated.GenericComponent(
+            name="focus", role="focus",
+            axes={"z": {"range": (-1e-3, 1e-3)}})
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.filter.terminate()
+        cls.focus.terminate()
+
+    def test_estimate_axis(self):
+        self.assertEqual(estimateAxisMoveDuration(self.filter, "band", 1, 1), 0)
+        self.assertEqual(estimateAxisMoveDuration(self.filter, "band", 0, 3),
+                         planner.DEFAULT_SWITCH_DURATION)
+        self.assertAlmostEqual(estimateAxisMoveDuration(self.focus, "z", 0, 100e-6),
+                               guessActuatorMoveDuration(self.focus, "z", 100e-6))
+
+    def test_filter_order(self):
+        """
+        The streams using the current filter position are acquired first
+        """
+        self.filter.moveAbsSync({"band": 2})
+        streams = [FakeStream("fluo %s" % b, self.filter, b) for b in ("blue", "green", "red")]
+        acq_planner = AcquisitionPlanner(streams)
+        order, durations = acq_planner.plan()
+        self.assertIs(order[0], streams[2])
+        self.assertEqual(durations[0], 0)
+        self.assertEqual(sum(durations), 2 * planner.DEFAULT_SWITCH_DURATION)
+
+        # Two streams with the same filter are acquired one after the other
+        streams.append(FakeStream("fluo blue 2", self.filter, "blue"))
+        acq_planner = AcquisitionPlanner(streams)
+        order, durations = acq_planner.plan()
+        self.assertEqual(sum(durations), 2 * planner.DEFAULT_SWITCH_DURATION)
+        i = order.index(streams[0])
+        self.assertIn(streams[3], order[i - 1:i + 2])
+
+        # The next acquisition (eg, next tile) starts from the last filter position
+        for s in order:
+            acq_planner.reconfigure(s)
+            self.assertEqual(s.prepared, 1)
+            self.assertEqual(self.filter.position.value["band"], s._emission_to_idx[s.emission.value])
+        order_next, durations = AcquisitionPlanner(streams).plan()
+        self.assertIs(order_next[0], order[-1])
+        self.assertEqual(durations[0], 0)
+
+    def test_priority(self):
+        """
+        The priority is always respected, and the reconfiguration time is only
+        used to order the streams of same priority.
+        """
+        self.filter.moveAbsSync({"band": 0})
+        sem = FakeStream("sem")
+        fluos = [FakeStream("fluo %s" % b, self.filter, b) for b in ("red", "green")]
+        streams = [sem] + fluos
+        order, durations = AcquisitionPlanner(streams).plan(_priority)
+        self.assertIs(order[-1], sem)
+        self.assertEqual(durations[-1], 0)
+        self.assertEqual(order[:2], fluos)
+
+        # Same cost whatever the order => follow the priority
+        fluos = [FakeStream("fluo %s" % b, self.filter, "pass-through") for b in ("red", "green")]
+        def priority_name(s):
+            return 100 + (0.5 if s is fluos[1] else 0.1)
+        order, durations = AcquisitionPlanner(fluos).plan(priority_name)
+        self.assertEqual(order, [fluos[1], fluos[0]])
+
+        # Different priority => follow the priority, even if it's slower
+        self.filter.moveAbsSync({"band": 0})
+        fluos = [FakeStream("fluo %s" % b, self.filter, b) for b in ("blue", "red")]
+        def priority_wl(s):
+            return 100 + (0.7 if s is fluos[1] else 0.4)
+        order, durations = AcquisitionPlanner(fluos).plan(priority_wl)
+        self.assertEqual(order, [fluos[1], fluos[0]])
+        self.assertEqual(sum(durations), 2 * planner.DEFAULT_SWITCH_DURATION)
+
+    def test_focus(self):
+        """
+        Streams with a different focus are ordered by focus position
+        """
+        self.focus.moveAbsSync({"z": 0})
+        zs = [300e-6, -100e-6, 100e-6, 200e-6, -200e-6]
+        streams = [FakeStream("fluo %g" % z, focus=self.focus, z=z) for z in zs]
+        order, durations = AcquisitionPlanner(streams).plan()
+        ordered_z = [s._axis_vas["focusZ"].value for s in order]
+        self.assertIn(ordered_z, ([-100e-6, -200e-6, 100e-6, 200e-6, 300e-6],
+                                  [100e-6, 200e-6, 300e-6, -100e-6, -200e-6]))
+
+        # More streams than what is searched exhaustively => still a reasonable order
+        zs = [i * 10e-6 for i in range(planner.MAX_EXHAUSTIVE_STREAMS + 3)]
+        streams = [FakeStream("fluo %g" % z, focus=self.focus, z=z) for z in reversed(zs)]
+        order, durations = AcquisitionPlanner(streams).plan()
+        ordered_z = [s._axis_vas["focusZ"].value for s in order]
+        self.assertEqual(ordered_z, zs)
+
+    def test_order_zlevels(self):
+        zlevels = [-2e-6, -1e-6, 0, 1e-6, 2e-6]
+        self.assertEqual(orderZLevels(zlevels, -3e-6), zlevels)
+        self.assertEqual(orderZLevels(zlevels, 1.5e-6), zlevels[::-1])
+        self.assertEqual(orderZLevels(zlevels, None), zlevels)
+        self.assertEqual(orderZLevels([1e-6], 3e-6), [1e-6])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -29,7 +29,8 @@ import numpy.testing
 
 import odemis
 from odemis import model
-from odemis.acq.scan import generate_scan_vector, vector_data_to_img, generate_scan_pixel_ttl
+from odemis.acq.scan import generate_scan_vector, vector_data_to_img, generate_scan_pixel_ttl, \
+    generate_sparse_mask, interpolate_sparse_data, select_sparse_pixels
 from odemis.util import testing
 
 CONFIG_PATH = os.path.dirname(odemis.__file__) + "/../../install/linux/usr/share/odemis/"
@@ -162,6 +163,68 @@ class TestGenerateScanVector(unittest.TestCase):
         self.assertEqual(numpy.sum(ttls), res[0] * res[1])  # As many high values as there are pixels
 
 
+class TestSparseScan(unittest.TestCase):
+
+    def test_sparse_mask(self):
+        res = (40, 27)
+        mask = generate_sparse_mask(res, 100)
+        self.assertEqual(mask.shape, (res[1], res[0]))
+        self.assertTrue(mask[0, 0] and mask[0, -1] and mask[-1, 0] and mask[-1, -1])
+        self.assertAlmostEqual(numpy.count_nonzero(mask), 100, delta=20)
+
+        # Asking for more pixels than available => all of them
+        mask = generate_sparse_mask(res, 10000)
+        self.assertTrue(mask.all())
+
+        # Single line
+        mask = generate_sparse_mask((50, 1), 10)
+        self.assertEqual(mask.shape, (1, 50))
+        self.assertEqual(numpy.count_nonzero(mask), 10)
+
+    def test_interpolate(self):
+        """
+        A linear gradient should be perfectly reconstructed from a few pixels
+        """
+        y, x = numpy.mgrid[0:30, 0:40]
+        data = 10 * x + 3 * y
+        mask = generate_sparse_mask((40, 30), 50)
+        sparse = numpy.where(mask, data, 0).astype(numpy.uint16)
+        est = interpolate_sparse_data(sparse, mask)
+        numpy.testing.assert_allclose(est, data, atol=1e-6)
+
+        # Single line
+        mask = generate_sparse_mask((40, 1), 10)
+        est = interpolate_sparse_data(data[:1], mask)
+        numpy.testing.assert_allclose(est, data[:1], atol=1e-6)
+
+    def test_adaptive(self):
+        """
+        With the same number of pixels, the adaptive selection should reconstruct better than a
+        regular subsampling
+        """
+        y, x = numpy.mgrid[0:64, 0:64]
+        data = numpy.where((x - 30) ** 2 + (y - 34) ** 2 < 15 ** 2, 1000.0, 100.0)  # A disc
+        n_target = data.size // 4
+
+        mask = generate_sparse_mask((64, 64), n_target / 4)
+        while numpy.count_nonzero(mask) < n_target:
+            est = interpolate_sparse_data(numpy.where(mask, data, 0), mask)
+            n = min(n_target - numpy.count_nonzero(mask), n_target // 4)
+            px_idx = select_sparse_pixels(est, mask, n)
+            self.assertEqual(len(px_idx), n)
+            self.assertFalse(mask[px_idx[:, 0], px_idx[:, 1]].any())  # Only new pixels
+            mask[px_idx[:, 0], px_idx[:, 1]] = True
+        adapt_err = numpy.abs(interpolate_sparse_data(data, mask) - data).mean()
+
+        reg_mask = generate_sparse_mask((64, 64), numpy.count_nonzero(mask))
+        reg_err = numpy.abs(interpolate_sparse_data(data, reg_mask) - data).mean()
+        self.assertLess(adapt_err, reg_err)
+
+        # No more pixels to scan => empty selection
+        px_idx = select_sparse_pixels(data, numpy.ones(data.shape, dtype=bool), 10)
+        self.assertEqual(px_idx.shape, (0, 2))
+
+
 class TestVectorAcquisition(unittest.TestCase):
 
     @classmethod
@@ -77,6 +77,9 @@ CAN_SAVE_PYRAMID = False
 # on the center of the data. For example, to rotate a 2D image by 0.7 rad
 # counter clockwise, the rotation vector would be 0, 0, 0.7
 
+# For sparse scanning, the pixels actually scanned are saved in ImageData/ScanMask,
+# as a boolean array of the same YX shape as the image (True when scanned).
+
 # Data is normally always recoded as 5 dimensions in order CTZYX. One exception
 # is for the RGB (looking) data, in which case it's recorded only in 3
 # dimensions, CYX (that allows to easily open it in hdfview).
@@ -451,6 +454,12 @@ def _add_image_info(group, dataset, image):
             _h5svi_set_state(group["Shear"], ST_REPORTED)
             group["Shear"].attrs["UNIT"] = ""
 
+        # Scan mask (YX bool): the pixels actually scanned, the others being interpolated
+        if model.MD_SCAN_MASK in image.metadata:
+            group["ScanMask"] = numpy.asarray(image.metadata[model.MD_SCAN_MASK], dtype=bool)
+            # pass state as a numpy.uint, to force it being a single value (instead of a list)
+            _h5svi_set_state(group["ScanMask"], numpy.uint(ST_REPORTED))
+
     finally:
         if ds_class is not None:
             dataset.attrs["CLASS"] = ds_class
@@ -675,6 +684,13 @@ def _read_image_info(group):
     except Exception:
         logging.warning("Failed to parse Shear info", exc_info=True)
 
+    try:
+        md[model.MD_SCAN_MASK] = numpy.array(group["ScanMask"], dtype=bool)
+    except KeyError:
+        pass
+    except Exception:
+        logging.warning("Failed to parse ScanMask info", exc_info=True)
+
     return md
 
 
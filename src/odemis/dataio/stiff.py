@@ -35,7 +35,7 @@ LOSSY = False
 # identifier of a file.
 
 
-def export(filename, data, thumbnail=None, compressed=True, pyramid=False):
+def export(filename, data, thumbnail=None, compressed=True, pyramid=False, index=None):
     '''
     Write a collection of multiple OME-TIFF files with the given images and
     metadata
@@ -48,5 +48,8 @@ def export(filename, data, thumbnail=None, compressed=True, pyramid=False):
       with last dimension of length 3 (RGB). If the exporter doesn't support it,
       it will be dropped silently.
     compressed (boolean): whether the file is compressed or not.
+    index (None or boolean): whether to write an index file next to each file,
+      for faster opening. If None, only done for large files.
     '''
-    tiff.export(filename, data, thumbnail, compressed, multiple_files=True, pyramid=pyramid)
+    tiff.export(filename, data, thumbnail, compressed, multiple_files=True, pyramid=pyramid,
+                index=index)
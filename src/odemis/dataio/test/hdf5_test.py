@@ -1474,6 +1474,42 @@ class TestHDF5IO(unittest.TestCase):
         im = rdata[0]
         self.assertEqual(im.metadata[model.MD_ACQ_RECIPES], metadata[model.MD_ACQ_RECIPES])
 
+    def test_read_and_save_md_scan_mask(self):
+        """
+        Checks that MD_SCAN_MASK metadata is saved and read back correctly.
+        """
+        size = (64, 32)
+        dtype = numpy.dtype("uint16")
+        mask = numpy.zeros(size[::-1], dtype=bool)
+        mask[::4, ::3] = True
+        metadata = {model.MD_SW_VERSION: "1.0-test",
+                    model.MD_HW_NAME: "fake hw",
+                    model.MD_DESCRIPTION: "test scan mask",
+                    model.MD_ACQ_DATE: time.time(),
+                    model.MD_PIXEL_SIZE: (1e-6, 1e-6),
+                    model.MD_POS: (1e-3, -30e-3),
+                    model.MD_SCAN_MASK: mask,
+                    }
+
+        data = model.DataArray(numpy.zeros(size[::-1], dtype), metadata=metadata)
+        # Add a second acquisition without mask, to check it's not mixed up
+        md_nomask = metadata.copy()
+        del md_nomask[model.MD_SCAN_MASK]
+        md_nomask[model.MD_DESCRIPTION] = "test no mask"
+        data_nomask = model.DataArray(numpy.ones(size[::-1], dtype), metadata=md_nomask)
+
+        hdf5.export(FILENAME, [data, data_nomask])
+
+        rdata = hdf5.read_data(FILENAME)
+        self.assertEqual(len(rdata), 2)
+        for im in rdata:
+            if im.metadata[model.MD_DESCRIPTION] == "test scan mask":
+                rmask = im.metadata[model.MD_SCAN_MASK]
+                self.assertEqual(rmask.dtype, bool)
+                numpy.testing.assert_array_equal(rmask, mask)
+            else:
+                self.assertNotIn(model.MD_SCAN_MASK, im.metadata)
+
 
 if __name__ == "__main__":
     # import sys;sys.argv = ['', 'Test.testName']
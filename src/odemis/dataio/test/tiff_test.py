@@ -27,6 +27,7 @@ import os
 import re
 import time
 import unittest
+import unittest.mock
 import xml.etree.ElementTree as ET
 from datetime import datetime
 # from unittest.case import skip
@@ -532,6 +533,45 @@ class TestTiffIO(unittest.TestCase):
         im = rdata[0]
         self.assertEqual(im.metadata[model.MD_ACQ_RECIPES], metadata[model.MD_ACQ_RECIPES])
 
+    def test_read_and_save_md_scan_mask(self):
+        """
+        Checks that MD_SCAN_MASK metadata is saved and read back correctly.
+        """
+        size = (61, 37)  # not a multiple of 8, to check the bit packing
+        dtype = numpy.dtype("uint16")
+        mask = numpy.zeros(size[::-1], dtype=bool)
+        mask[::4, ::3] = True
+        mask[-1, -1] = True
+        metadata = {model.MD_SW_VERSION: "1.0-test",
+                    model.MD_HW_NAME: "fake hw",
+                    model.MD_DESCRIPTION: "test scan mask",
+                    model.MD_ACQ_DATE: time.time(),
+                    model.MD_PIXEL_SIZE: (1e-6, 1e-6),
+                    model.MD_POS: (1e-3, -30e-3),
+                    model.MD_SCAN_MASK: mask,
+                    }
+
+        data = model.DataArray(numpy.zeros(size[::-1], dtype), metadata=metadata)
+        # Add a second acquisition without mask, to check it's not mixed up
+        md_nomask = metadata.copy()
+        del md_nomask[model.MD_SCAN_MASK]
+        md_nomask[model.MD_DESCRIPTION] = "test no mask"
+        data_nomask = model.DataArray(numpy.ones(size[::-1], dtype), metadata=md_nomask)
+
+        tiff.export(FILENAME, [data, data_nomask])
+
+        rdata = tiff.read_data(FILENAME)
+        self.assertEqual(len(rdata), 2)
+        rmask = rdata[0].metadata[model.MD_SCAN_MASK]
+        self.assertEqual(rmask.dtype, bool)
+        numpy.testing.assert_array_equal(rmask, mask)
+        self.assertNotIn(model.MD_SCAN_MASK, rdata[1].metadata)
+
+        # Same thing when opening the file without reading the data
+        acd = tiff.open_data(FILENAME)
+        numpy.testing.assert_array_equal(acd.content[0].metadata[model.MD_SCAN_MASK], mask)
+        self.assertNotIn(model.MD_SCAN_MASK, acd.content[1].metadata)
+
     def testExportRead(self):
         """
         Checks that we can read back an image and a thumbnail
@@ -2434,6 +2474,149 @@ class TestTiffIO(unittest.TestCase):
         # the size of this tile is also the size of the image
         self.assertEqual(tiles[0][0].shape, (156, 187))
 
+    def testIndex(self):
+        """
+        Check the index file is used to open the file, and it gives the same
+        result as parsing the file.
+        """
+        index_fn = tiff._getIndexFilename(FILENAME)
+        self.addCleanup(lambda: os.path.exists(index_fn) and os.remove(index_fn))
+
+        size = (3, 257, 295)
+        ldata = []
+        for i in range(size[0]):
+            md = {
+                model.MD_DESCRIPTION: "test %d" % (i,),
+                model.MD_POS: (2e-6, 10e-6 + i),
+                model.MD_PIXEL_SIZE: (1e-6, 1e-6),
+                model.MD_EXP_TIME: 1.2,
+                model.MD_IN_WL: (500e-9, 520e-9),
+                model.MD_OUT_WL: (600e-9, 630e-9),
+                model.MD_USER_TINT: (255, 0, 65),
+                model.MD_EXTRA_SETTINGS: {"Camera": {"exposureTime": [1.2, "s"]}},
+            }
+            arr = numpy.arange(size[1] * size[2], dtype=numpy.uint16).reshape(size[1:]) + i
+            ldata.append(model.DataArray(arr, metadata=md))
+        thumbnail = model.DataArray(numpy.zeros((50, 60, 3), dtype=numpy.uint8))
+
+        # Small file => no index by default
+        tiff.export(FILENAME, ldata, thumbnail, pyramid=True)
+        self.assertFalse(os.path.exists(index_fn))
+
+        tiff.export(FILENAME, ldata, thumbnail, pyramid=True, index=True)
+        self.assertTrue(os.path.exists(index_fn))
+
+        rdata = tiff.AcquisitionDataTIFF(FILENAME)
+        pdata = tiff.AcquisitionDataTIFF(FILENAME, use_index=False)
+        self.assertEqual(len(rdata.content), len(pdata.content))
+        self.assertEqual(len(rdata.thumbnails), len(pdata.thumbnails))
+        for rd, pd in zip(rdata.content, pdata.content):
+            self.assertEqual(rd.shape, pd.shape)
+            self.assertEqual(rd.dtype, pd.dtype)
+            self.assertEqual(rd.maxzoom, pd.maxzoom)
+            self.assertEqual(rd.tile_shape, pd.tile_shape)
+            self.assertEqual(rd.metadata.keys(), pd.metadata.keys())
+            for k, v in pd.metadata.items():
+                if isinstance(v, numpy.ndarray):
+                    numpy.testing.assert_array_equal(rd.metadata[k], v)
+                else:
+                    self.assertEqual(rd.metadata[k], v)
+            numpy.testing.assert_array_equal(rd.getData(), pd.getData())
+            numpy.testing.assert_array_equal(rd.getTile(1, 0, 0), pd.getTile(1, 0, 0))
+            numpy.testing.assert_array_equal(rd.getTile(0, 0, 1), pd.getTile(0, 0, 1))
+        numpy.testing.assert_array_equal(rdata.thumbnails[0].getData(), thumbnail)
+
+        # Modify the file (without the index) => the index should not be used anymore
+        ldata[0][0, 0] = 12
+        tiff._saveAsMultiTiffLT(FILENAME, ldata[:1], None)
+        rdata = tiff.AcquisitionDataTIFF(FILENAME)
+        self.assertEqual(len(rdata.content), 1)
+        self.assertEqual(rdata.content[0].getData()[0, 0], 12)
+
+        # Export again, not pyramidal => the (old) index should be removed
+        tiff.export(FILENAME, ldata)
+        self.assertFalse(os.path.exists(index_fn))
+
+    def testIndexInvalid(self):
+        """
+        Check an invalid index file is not used, and the files it opened are closed
+        """
+        index_fn = tiff._getIndexFilename(FILENAME)
+        self.addCleanup(lambda: os.path.exists(index_fn) and os.remove(index_fn))
+
+        md = {model.MD_DESCRIPTION: "test",
+              model.MD_PIXEL_SIZE: (1e-6, 1e-6),
+              }
+        data = model.DataArray(numpy.arange(20 * 30, dtype=numpy.uint16).reshape(20, 30), md)
+        tiff.export(FILENAME, data, pyramid=True, index=True)
+
+        # Corrupt the index, in a way which is only detected after the file is opened
+        with open(index_fn, "r") as f:
+            index = json.load(f)
+        for entry in index["data"]:
+            entry["dtype"] = "not a dtype"
+        with open(index_fn, "w") as f:
+            json.dump(index, f)
+
+        opened, closed = [], []
+        orig_open, orig_close = tiff.TIFF.open, tiff.TIFF.close
+
+        def spy_open(*args, **kwargs):
+            handle = orig_open(*args, **kwargs)
+            opened.append(handle)
+            return handle
+
+        def spy_close(handle):
+            closed.append(handle)
+            orig_close(handle)
+
+        with unittest.mock.patch.object(tiff.TIFF, "open", spy_open), \
+             unittest.mock.patch.object(tiff.TIFF, "close", spy_close):
+            rdata = tiff.AcquisitionDataTIFF(FILENAME)
+
+        # The file is opened via the full scan
+        self.assertEqual(len(rdata.content), 1)
+        numpy.testing.assert_array_equal(rdata.content[0].getData(), data)
+
+        # The file opened for the index has been closed
+        self.assertGreaterEqual(len(opened), 2)
+        self.assertTrue(any(c is opened[0] for c in closed))
+
+    def testIndexMultipleFiles(self):
+        """
+        Check the index file is written and used for multiple files export
+        """
+        fn = "test.0.ome.tiff"
+        fns = ["test.%d.ome.tiff" % i for i in range(2)]
+        for f in fns:
+            self.addCleanup(os.remove, f)
+            self.addCleanup(os.remove, tiff._getIndexFilename(f))
+
+        ldata = []
+        for i in range(2):
+            md = {model.MD_DESCRIPTION: "test %d" % (i,),
+                  model.MD_PIXEL_SIZE: (1e-6, 1e-6),
+                  model.MD_IN_WL: (500e-9 + i * 100e-9, 520e-9 + i * 100e-9),
+                  }
+            ldata.append(model.DataArray(numpy.full((20, 30), i, dtype=numpy.uint16), md))
+        tiff.export(fn, ldata, multiple_files=True, index=True)
+
+        for f in fns:
+            self.assertTrue(os.path.exists(tiff._getIndexFilename(f)))
+            rdata = tiff.AcquisitionDataTIFF(f)
+            self.assertEqual(len(rdata.content), 2)
+            for i, rd in enumerate(rdata.content):
+                self.assertEqual(rd.metadata[model.MD_DESCRIPTION], "test %d" % (i,))
+                self.assertEqual(rd.metadata[model.MD_IN_FILE_INDEX], i)
+                self.assertEqual(rd.metadata[model.MD_FILENAME], f)
+                numpy.testing.assert_array_equal(rd.getData(), ldata[i])
+
+        # One file missing => the index is not valid anymore, but it's still possible to open
+        os.rename(fns[1], fns[1] + ".bak")
+        self.addCleanup(os.rename, fns[1] + ".bak", fns[1])
+        rdata = tiff.AcquisitionDataTIFF(fns[0])
+        self.assertEqual(len(rdata.content), 1)
+
     def test_convert_thermo_fisher_to_odemis_metadata(self):
 
         # open example image
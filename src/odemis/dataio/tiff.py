@@ -19,6 +19,8 @@ PURPOSE. See the GNU General Public License for more details.
 You should have received a copy of the GNU General Public License along with
 Odemis. If not, see http://www.gnu.org/licenses/.
 '''
+import base64
+import binascii
 import calendar
 import configparser
 import json
@@ -72,6 +74,14 @@ STIFF_SPLIT = ".0."  # pattern to replace with the "stiff" multiple file
 
 CAN_SAVE_PYRAMID = True # indicates the support for pyramidal export
 TILE_SIZE = 256 # Tile size of pyramidal images
+
+# The index is a (hidden) file next to the TIFF file, which contains the result
+# of parsing the file (metadata and position of each image). It allows to open
+# large files much faster.
+INDEX_EXT = ".idx"
+INDEX_VERSION = 1
+INDEX_MIN_FILE_SIZE = 100e6  # bytes, files smaller are fast enough to open without index
+
 LOSSY = False
 
 # We try to make it as much as possible looking like a normal (multi-page) TIFF,
@@ -847,6 +857,10 @@ def _updateMDFromOME(root, das):
             if acq_recipes is not None:
                 md[model.MD_ACQ_RECIPES] = acq_recipes.text
 
+            scan_mask = mapa.find(".//M[@K='ScanMask']")
+            if scan_mask is not None:
+                md[model.MD_SCAN_MASK] = _decodeScanMask(scan_mask.text)
+
         except (AttributeError, KeyError, ValueError):
             pass
 
@@ -1518,6 +1532,37 @@ def _dtype2OMEtype(dtype):
         raise NotImplementedError("Data type %s is not supported by OME" % dtype)
 
 
+def _encodeScanMask(mask) -> str:
+    """
+    Convert a scan mask into a (compact) string, to be stored in the OME-XML
+    mask (2D array of bool): the scan mask (MD_SCAN_MASK)
+    return (str): JSON with the shape, and the bits packed and base64 encoded
+    """
+    mask = numpy.asarray(mask, dtype=bool)
+    bits = base64.b64encode(numpy.packbits(mask, axis=None)).decode("ascii")
+    return json.dumps({"shape": mask.shape, "bits": bits})
+
+
+def _decodeScanMask(s: str) -> numpy.ndarray:
+    """
+    Convert back a string created by _encodeScanMask() into a scan mask
+    s (str): the encoded scan mask
+    return (2D array of bool): the scan mask (MD_SCAN_MASK)
+    raise ValueError: if the string is not a valid scan mask
+    """
+    try:
+        enc = json.loads(s)
+        shape = tuple(int(v) for v in enc["shape"])
+        bits = numpy.frombuffer(base64.b64decode(enc["bits"]), dtype=numpy.uint8)
+    except (KeyError, TypeError, binascii.Error) as ex:
+        raise ValueError("Invalid scan mask: %s" % (ex,))
+
+    size = int(numpy.prod(shape))
+    if bits.size * 8 < size:
+        raise ValueError("Scan mask has %d values, while %d expected" % (bits.size * 8, size))
+    return numpy.unpackbits(bits, count=size).astype(bool).reshape(shape)
+
+
 def _addImageElement(root, das, ifd, rois, fname=None, fuuid=None):
     """
     Add the metadata of a list of DataArray to a OME-XML root element
@@ -1578,7 +1623,8 @@ def _addImageElement(root, das, ifd, rois, fname=None, fuuid=None):
     if (model.MD_EXTRA_SETTINGS in globalMD or
         model.MD_ROTATION in globalMD or
         model.MD_SHEAR in globalMD or
-        model.MD_ACQ_RECIPES in globalMD):
+        model.MD_ACQ_RECIPES in globalMD or
+        model.MD_SCAN_MASK in globalMD):
 
         # get the extra settings from the global metadata
         sett = globalMD.get(model.MD_EXTRA_SETTINGS, {})
@@ -1611,6 +1657,9 @@ def _addImageElement(root, das, ifd, rois, fname=None, fuuid=None):
         if model.MD_ACQ_RECIPES in globalMD:
             m = ET.SubElement(value, "M", attrib={"K": "AcquisitionRecipes"})
             m.text = globalMD[model.MD_ACQ_RECIPES]
+        if model.MD_SCAN_MASK in globalMD:
+            m = ET.SubElement(value, "M", attrib={"K": "ScanMask"})
+            m.text = _encodeScanMask(globalMD[model.MD_SCAN_MASK])
 
     # Find a dimension along which the DA can be concatenated. That's a
     # dimension which is of size 1.
@@ -2061,6 +2110,7 @@ def _saveAsMultiTiffLT(
     :param pyramid: whether the file should be saved in the pyramid format or not.
       In this format, each image is saved along with different zoom levels
     :param imagej: save the metadata in a way that ImageJ can read it
+    :return: the name of the file written
     """
     if multiple_files:
         # Add index
@@ -2068,9 +2118,9 @@ def _saveAsMultiTiffLT(
         if len(tokens) < 2:
             raise ValueError("The filename '%s' doesn't contain '%s'." % (filename, STIFF_SPLIT))
         orig_filename = tokens[0] + "." + str(file_index) + "." + tokens[1]
-        f = TIFF.open(orig_filename, mode='w')
     else:
-        f = TIFF.open(filename, mode='w')
+        orig_filename = filename
+    f = TIFF.open(orig_filename, mode='w')
 
     # According to this page: http://www.openmicroscopy.org/site/support/file-formats/ome-tiff/ome-tiff-data
     # LZW is a good trade-off between compatibility and small size (reduces file
@@ -2253,6 +2303,9 @@ def _saveAsMultiTiffLT(
                         c = compression
                     write_image(f, data[i], write_rgb=write_rgb, compression=c, pyramid=pyramid)
 
+    f.close()
+    return orig_filename
+
 
 def extract_imagej_metadata(ldata) -> str:
     """
@@ -2343,6 +2396,118 @@ def write_image(f, arr, compression=None, write_rgb=False, pyramid=False):
         f.write_tiles(subim, TILE_SIZE, TILE_SIZE, compression, write_rgb)
 
 
+def _getIndexFilename(filename: str) -> str:
+    """
+    :param filename: the name of a TIFF file
+    :return: the name of the (hidden) index file of the TIFF file
+    """
+    path, bn = os.path.split(filename)
+    return os.path.join(path, "." + bn + INDEX_EXT)
+
+
+def _encodeIndexValue(v: Any) -> Any:
+    """
+    Convert a value (typically metadata) into a structure which can be stored
+    in JSON, without losing the type information (tuples, numpy arrays...).
+    :param v: the value to convert
+    :return: the value, only made of JSON types
+    :raise TypeError: if the value (or a sub-value) cannot be converted
+    """
+    if v is None or isinstance(v, (bool, int, float, str)):
+        return v
+    elif isinstance(v, tuple):
+        return {"__tuple__": [_encodeIndexValue(i) for i in v]}
+    elif isinstance(v, list):
+        return [_encodeIndexValue(i) for i in v]
+    elif isinstance(v, dict):
+        if all(isinstance(k, str) and not k.startswith("__") for k in v):
+            return {k: _encodeIndexValue(i) for k, i in v.items()}
+        else:  # JSON only supports string keys
+            return {"__dict__": [[_encodeIndexValue(k), _encodeIndexValue(i)] for k, i in v.items()]}
+    elif isinstance(v, numpy.ndarray):
+        if v.dtype.kind not in "biuf":
+            raise TypeError("Cannot encode array of type %s" % (v.dtype,))
+        return {"__ndarray__": v.tolist(), "dtype": v.dtype.str}
+    elif isinstance(v, numpy.generic) and v.dtype.kind in "biuf":
+        return {"__npscalar__": v.item(), "dtype": v.dtype.str}
+    raise TypeError("Cannot encode value of type %s" % (type(v),))
+
+
+def _decodeIndexValue(v: Any) -> Any:
+    """
+    Opposite of _encodeIndexValue()
+    :param v: a value as loaded from JSON
+    :return: the original value
+    """
+    if isinstance(v, list):
+        return [_decodeIndexValue(i) for i in v]
+    elif isinstance(v, dict):
+        if "__tuple__" in v:
+            return tuple(_decodeIndexValue(i) for i in v["__tuple__"])
+        elif "__dict__" in v:
+            return {_decodeIndexValue(k): _decodeIndexValue(i) for k, i in v["__dict__"]}
+        elif "__ndarray__" in v:
+            return numpy.array(v["__ndarray__"], dtype=v["dtype"])
+        elif "__npscalar__" in v:
+            return numpy.dtype(v["dtype"]).type(v["__npscalar__"])
+        return {k: _decodeIndexValue(i) for k, i in v.items()}
+    return v
+
+
+def _writeIndex(filenames: List[str]) -> None:
+    """
+    Write the index file of each TIFF file of an acquisition. The index contains
+    the parsed structure of the file (ie, the metadata and the position of each
+    image in the IFDs), so that opening the file doesn't require to go through
+    all the IFDs and the OME-XML again.
+    :param filenames: all the files of the acquisition (the first one is used
+      to parse the acquisition). They must all be in the same directory.
+    :raise TypeError: if some metadata cannot be stored in the index
+    """
+    acd = AcquisitionDataTIFF(filenames[0], use_index=False)
+
+    files = []
+    fn_to_idx = {}
+    for fn in filenames:
+        st = os.stat(fn)
+        fn_to_idx[os.path.abspath(fn)] = len(files)
+        files.append({"name": os.path.basename(fn), "size": st.st_size, "mtime": st.st_mtime_ns})
+
+    def describe_das(das):
+        if das is None:
+            return None
+        merged = isinstance(das.tiff_info, list)
+        tiff_info = das.tiff_info if merged else [das.tiff_info]
+        md = das.metadata.copy()
+        # Added back when opening the file
+        md.pop(model.MD_FILENAME, None)
+        md.pop(model.MD_IN_FILE_INDEX, None)
+        return {
+            "shape": das.shape,
+            "dtype": numpy.dtype(das.dtype).str,
+            "metadata": md,
+            "tiff_info": [{"file": fn_to_idx[os.path.abspath(ti["filename"])],
+                           "dir_index": ti["dir_index"],
+                           "hdim_index": ti.get("hdim_index")}
+                          for ti in tiff_info],
+            "merged": merged,
+            "maxzoom": getattr(das, "maxzoom", None),
+            "tile_shape": getattr(das, "tile_shape", None),
+        }
+
+    index = {
+        "version": INDEX_VERSION,
+        "files": files,
+        "data": [describe_das(das) for das in acd.content],
+        "thumbnails": [describe_das(das) for das in acd.thumbnails],
+    }
+    sindex = json.dumps(_encodeIndexValue(index))
+
+    for fn in filenames:
+        with open(_getIndexFilename(fn), "w") as f:
+            f.write(sindex)
+
+
 def export(
     filename: str,
     data: Union[model.DataArray, List[model.DataArray]],
@@ -2351,6 +2516,7 @@ def export(
     multiple_files: bool = False,
     pyramid: bool = False,
     imagej: bool = False,
+    index: Optional[bool] = None,
 ) -> None:
     """
     Write a TIFF file with the given image and metadata
@@ -2370,6 +2536,8 @@ def export(
       files or not.
     :param pyramid: whether to export data as pyramid
     :param imagej: save the metadata in a format compatible with ImageJ
+    :param index: whether to write an index file next to the TIFF file(s), so that
+      they can be opened faster. If None, it is written only if the files are large.
     """
     filename = str(filename)
     if not isinstance(data, list):
@@ -2384,13 +2552,30 @@ def export(
         uuid_list = []
         for i in range(nfiles):
             uuid_list.append(uuid.uuid4().urn)
+        filenames = []
         for i in range(nfiles):
             # TODO: Take care of thumbnails
-            _saveAsMultiTiffLT(filename, data, None, compressed,
-                                multiple_files, i, uuid_list, pyramid, imagej=imagej)
-        return
+            fn = _saveAsMultiTiffLT(filename, data, None, compressed,
+                                    multiple_files, i, uuid_list, pyramid, imagej=imagej)
+            filenames.append(fn)
+    else:
+        _saveAsMultiTiffLT(filename, data, thumbnail, compressed, pyramid=pyramid, imagej=imagej)
+        filenames = [filename]
 
-    _saveAsMultiTiffLT(filename, data, thumbnail, compressed, pyramid=pyramid, imagej=imagej)
+    if index is None:
+        index = sum(os.path.getsize(fn) for fn in filenames) >= INDEX_MIN_FILE_SIZE
+    if index:
+        try:
+            _writeIndex(filenames)
+        except Exception:
+            logging.warning("Failed to write the index of %s", filename, exc_info=True)
+    else:
+        # Make sure there is no index left from a previous file with the same name
+        for fn in filenames:
+            try:
+                os.remove(_getIndexFilename(fn))
+            except FileNotFoundError:
+                pass
 
 
 def read_data(filename):
@@ -2447,19 +2632,24 @@ class DataArrayShadowTIFF(DataArrayShadow):
         Returns an instance of DataArrayShadowTIFF or DataArrayShadowPyramidalTIFF,
         depending if the image is pyramidal or not.
         """
-        if isinstance(tiff_info, list):
-            tiff_handle = tiff_info[0]['handle']
+        if "tile_shape" in kwargs:
+            # Already known (from the index), no need to read the file
+            tiled = kwargs["tile_shape"] is not None
         else:
-            tiff_handle = tiff_info['handle']
-        num_tcols = tiff_handle.GetField(T.TIFFTAG_TILEWIDTH)
-        num_trows = tiff_handle.GetField(T.TIFFTAG_TILELENGTH)
-        if num_tcols and num_trows:
+            if isinstance(tiff_info, list):
+                tiff_handle = tiff_info[0]['handle']
+            else:
+                tiff_handle = tiff_info['handle']
+            num_tcols = tiff_handle.GetField(T.TIFFTAG_TILEWIDTH)
+            num_trows = tiff_handle.GetField(T.TIFFTAG_TILELENGTH)
+            tiled = num_tcols and num_trows
+        if tiled:
             subcls = DataArrayShadowPyramidalTIFF
         else:
             subcls = DataArrayShadowTIFF
         return super(DataArrayShadowTIFF, cls).__new__(subcls)
 
-    def __init__(self, tiff_info, shape, dtype, metadata=None):
+    def __init__(self, tiff_info, shape, dtype, metadata=None, tile_shape=None, maxzoom=None):
         """
         Constructor
         tiff_info (dictionary or list of dictionaries): Information about the source tiff file
@@ -2472,6 +2662,7 @@ class DataArrayShadowTIFF(DataArrayShadow):
         shape (tuple of int): The shape of the corresponding DataArray
         dtype (numpy.dtype): The data type
         metadata (dict str->val): The metadata
+        tile_shape, maxzoom: not used (only for pyramidal images)
         """
         self.tiff_info = tiff_info
 
@@ -2527,7 +2718,7 @@ class DataArrayShadowPyramidalTIFF(DataArrayShadowTIFF):
     the reading of a pyramidal TIFF file. IOW, reading subdirectories and tiles.
     """
 
-    def __init__(self, tiff_info, shape, dtype, metadata=None):
+    def __init__(self, tiff_info, shape, dtype, metadata=None, tile_shape=None, maxzoom=None):
         """
         Constructor
         tiff_info (dictionary or list of dictionaries): Information about the source tiff file
@@ -2541,6 +2732,9 @@ class DataArrayShadowPyramidalTIFF(DataArrayShadowTIFF):
         shape (tuple of int): The shape of the corresponding DataArray
         dtype (numpy.dtype): The data type
         metadata (dict str->val): The metadata
+        tile_shape (None or (0<int, 0<int)): the shape of the tiles. If None, it
+            (and maxzoom) is read from the file.
+        maxzoom (None or 0<=int): the number of zoom levels
         """
         self.tiff_info = tiff_info
         if isinstance(tiff_info, list):
@@ -2549,22 +2743,23 @@ class DataArrayShadowPyramidalTIFF(DataArrayShadowTIFF):
             tiff_info0 = tiff_info
         tiff_file = tiff_info0['handle']
 
-        num_tcols = tiff_file.GetField(T.TIFFTAG_TILEWIDTH)
-        num_trows = tiff_file.GetField(T.TIFFTAG_TILELENGTH)
-        if num_tcols is None or num_trows is None:
-            raise ValueError("The image is not tiled")
+        if tile_shape is None:
+            num_tcols = tiff_file.GetField(T.TIFFTAG_TILEWIDTH)
+            num_trows = tiff_file.GetField(T.TIFFTAG_TILELENGTH)
+            if num_tcols is None or num_trows is None:
+                raise ValueError("The image is not tiled")
 
-        with tiff_info0['lock']:
-            tiff_file.SetDirectory(tiff_info0['dir_index'])
-            sub_ifds = tiff_file.GetField(T.TIFFTAG_SUBIFD)
+            with tiff_info0['lock']:
+                tiff_file.SetDirectory(tiff_info0['dir_index'])
+                sub_ifds = tiff_file.GetField(T.TIFFTAG_SUBIFD)
 
-        # add the number of subdirectories, and the main image
-        if sub_ifds:
-            maxzoom = len(sub_ifds)
-        else:
-            maxzoom = 0
+            # add the number of subdirectories, and the main image
+            if sub_ifds:
+                maxzoom = len(sub_ifds)
+            else:
+                maxzoom = 0
 
-        tile_shape = (num_tcols, num_trows)
+            tile_shape = (num_tcols, num_trows)
 
         DataArrayShadow.__init__(self, shape, dtype, metadata, maxzoom, tile_shape)
 
@@ -2620,20 +2815,30 @@ class AcquisitionDataTIFF(AcquisitionData):
     """
     Implements AcquisitionData for TIFF files
     """
-    def __init__(self, filename):
+    def __init__(self, filename, use_index=True):
         """
         Constructor
         filename (string): The name of the TIFF file
+        use_index (bool): if True, and there is a valid index file, the structure
+          of the file is read from the index, instead of parsing the whole file.
         """
         # lock to avoid race conditions when accessing the TIFF file (as libtiff
         # uses multiple calls to access a specific IFD/tile + tag.
         self._lock = threading.Lock()
-        tiff_file = TIFF.open(filename, mode='r')
-        try:
-            data, thumbnails = self._getAllOMEDataArrayShadows(filename, tiff_file)
-        except ValueError as ex:
-            logging.info("Failed to use the OME data (%s), will use standard TIFF", ex)
-            data, thumbnails = self._getAllDataArrayShadows(filename, tiff_file, self._lock)
+        data = None
+        if use_index:
+            try:
+                data, thumbnails = self._getAllDataArrayShadowsFromIndex(filename)
+            except LookupError as ex:
+                logging.debug("Not using the index of %s: %s", filename, ex)
+
+        if data is None:
+            tiff_file = TIFF.open(filename, mode='r')
+            try:
+                data, thumbnails = self._getAllOMEDataArrayShadows(filename, tiff_file)
+            except ValueError as ex:
+                logging.info("Failed to use the OME data (%s), will use standard TIFF", ex)
+                data, thumbnails = self._getAllDataArrayShadows(filename, tiff_file, self._lock)
 
         # In case we open a basic TIFF file not generated by Odemis, this is a
         # very common "corner case": only one image, and no metadata. At least,
@@ -2755,6 +2960,79 @@ class AcquisitionDataTIFF(AcquisitionData):
         data = [i for i in data if i is not None]
         return data, thumbnails
 
+    def _getAllDataArrayShadowsFromIndex(self, filename: str):
+        """
+        Create the all DataArrayShadows for the given TIFF file based on its index file
+        filename (str): the name of the TIFF file
+        return:
+            data (list of DataArrayShadows or None): DataArrayShadows, as returned
+              by _getAllOMEDataArrayShadows() or _getAllDataArrayShadows().
+            thumbnails (list of DataArrayShadows): DataArrayShadows for all the
+               thumbnails images found in the file
+        raise LookupError:
+            If there is no index file, or it doesn't correspond to the file(s)
+        """
+        index_fn = _getIndexFilename(filename)
+        try:
+            with open(index_fn, "r") as f:
+                index = _decodeIndexValue(json.load(f))
+        except FileNotFoundError:
+            raise LookupError("no index file")
+        except (IOError, ValueError, TypeError, KeyError) as ex:
+            raise LookupError("failed to read index file %s: %s" % (index_fn, ex))
+
+        try:
+            if index["version"] != INDEX_VERSION:
+                raise LookupError("index version %s not supported" % (index["version"],))
+
+            # Check the file(s) haven't changed since the index was written
+            path = os.path.dirname(filename)
+            fns = []
+            for finfo in index["files"]:
+                fn = os.path.join(path, finfo["name"])
+                try:
+                    st = os.stat(fn)
+                except OSError:
+                    raise LookupError("file %s is missing" % (fn,))
+                if st.st_size != finfo["size"] or st.st_mtime_ns != finfo["mtime"]:
+                    raise LookupError("file %s has been modified" % (fn,))
+                fns.append(fn)
+
+            def create_das(entry):
+                if entry is None:
+                    return None
+                tiff_info = []
+                for ti in entry["tiff_info"]:
+                    ti_das = {'handle': handles[ti["file"]], 'dir_index': ti["dir_index"],
+                              'lock': self._lock, 'filename': fns[ti["file"]]}
+                    if ti["hdim_index"] is not None:
+                        ti_das['hdim_index'] = ti["hdim_index"]
+                    tiff_info.append(ti_das)
+                if not entry["merged"]:
+                    tiff_info = tiff_info[0]
+                return DataArrayShadowTIFF(tiff_info, entry["shape"], numpy.dtype(entry["dtype"]),
+                                           entry["metadata"], tile_shape=entry["tile_shape"],
+                                           maxzoom=entry["maxzoom"])
+
+            # Only the first directory of each file is read
+            handles = []
+            try:
+                for fn in fns:
+                    handles.append(TIFF.open(fn, mode='r'))
+
+                data = [create_das(e) for e in index["data"]]
+                thumbnails = [create_das(e) for e in index["thumbnails"]]
+            except Exception:
+                # The caller will fall back to a full scan, so don't leave the files open
+                for h in handles:
+                    h.close()
+                raise
+        except (KeyError, IndexError, TypeError, ValueError) as ex:
+            raise LookupError("index file %s is invalid: %s" % (index_fn, ex))
+
+        logging.debug("Opened %s using its index", filename)
+        return data, thumbnails
+
     def _findFileByUUID(self, suuid, orig_fn, root_fn):
         """
         Find the file with the given UUID. In addition to immediately
@@ -2879,7 +3157,7 @@ class AcquisitionDataTIFF(AcquisitionData):
         # It can also be a a list of tiff_info,
         # in case the DataArray has multiple pixelData (eg, when data has more than 2D).
         # Add also the lock of the TIFF file
-        tiff_info = {'handle': tfile, 'dir_index': dir_index, 'lock': lock}
+        tiff_info = {'handle': tfile, 'dir_index': dir_index, 'lock': lock, 'filename': filename}
         das = DataArrayShadowTIFF(tiff_info, shape, typ, md)
 
         return das, _isThumbnail(tfile)
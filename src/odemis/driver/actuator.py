@@ -99,6 +99,9 @@ class MultiplexActuator(model.Actuator):
             # TODO: make use of the 'Cancellable' part (for now cancelling a running future doesn't work)
         else:  # Only one dependency => optimize by passing all requests directly
             self._executor = None
+        # Moves passed directly to a dependency, without the executor: list of (Future, dependency)
+        self._direct_moves = []
+        self._direct_lock = threading.RLock()  # to order the direct moves and the ones of the executor
 
         # keep a reference to the subscribers so that they are not
         # automatically garbage collected
@@ -263,7 +266,11 @@ class MultiplexActuator(model.Actuator):
         shift = self._applyInversion(shift)
 
         if self._executor:
-            f = self._executor.submit(self._doMoveRel, shift, **kwargs)
+            with self._direct_lock:
+                f = self._moveDirect(shift, rel=True, **kwargs)
+                if f is None:
+                    # Consecutive relative moves waiting in the queue are merged into a single move
+                    f = self._executor.submit_mergeable(self._mergeShifts, self._doMoveRel, shift, **kwargs)
         else:
             cmv = self._moveTodepMove(shift, rel=True)
             dep, move = cmv.popitem()
@@ -272,11 +279,67 @@ class MultiplexActuator(model.Actuator):
 
         return f
 
+    @staticmethod
+    def _mergeShifts(args, new_args):
+        """
+        Merge the arguments of two _doMoveRel() calls
+        """
+        shift = dict(args[0])
+        for axis, v in new_args[0].items():
+            shift[axis] = shift.get(axis, 0) + v
+        return (shift,)
+
+    def _moveDirect(self, mv, rel, **kwargs):
+        """
+        Pass the move directly to the dependency, if it can be done without changing
+        the order of the moves, to avoid the latency of the executor. That's only
+        the case if the move concerns a single dependency, no move is queued, and no
+        other dependency is running a move passed directly.
+        Must be called with ._direct_lock taken.
+        mv (dict str->value): the move (already with the inversion applied)
+        rel (bool): indicate whether the move is relative or absolute
+        return (Future or None): the future of the move, or None if the move must
+          go via the executor.
+        """
+        if not self._executor.is_idle():
+            return None
+        cmv = self._moveTodepMove(mv, rel)
+        if len(cmv) != 1:
+            return None
+        dep, move = cmv.popitem()
+        if any(d is not dep for f, d in self._direct_moves):
+            return None
+
+        if rel:
+            f = dep.moveRel(move, **kwargs)
+        else:
+            f = dep.moveAbs(move, **kwargs)
+        self._direct_moves.append((f, dep))
+        f.add_done_callback(self._onDirectMoveDone)
+        return f
+
+    def _onDirectMoveDone(self, f):
+        with self._direct_lock:
+            self._direct_moves = [(df, d) for df, d in self._direct_moves if df is not f]
+
+    def _waitDirectMoves(self):
+        """
+        Wait until all the moves passed directly to the dependencies are over
+        """
+        with self._direct_lock:
+            fs = [f for f, d in self._direct_moves]
+        for f in fs:
+            try:
+                f.result()
+            except Exception:
+                pass  # Already reported to the caller of the move
+
     def _doMoveRel(self, shift, **kwargs):
         # TODO: updates don't work because we still wait for the end of the
         # move before we get to the next one => multi-threaded queue? Still need
         # to ensure the order (ie, X>AB>X can be executed as X/AB>X or X>AB/X but
         # XA>AB>X must be in the order XA>AB/X
+        self._waitDirectMoves()
         futures = []
         for dep, move in self._moveTodepMove(shift, rel=True).items():
             f = dep.moveRel(move, **kwargs)
@@ -294,7 +357,10 @@ class MultiplexActuator(model.Actuator):
         pos = self._applyInversion(pos)
 
         if self._executor:
-            f = self._executor.submit(self._doMoveAbs, pos, **kwargs)
+            with self._direct_lock:
+                f = self._moveDirect(pos, rel=False, **kwargs)
+                if f is None:
+                    f = self._executor.submit(self._doMoveAbs, pos, **kwargs)
         else:
             cmv = self._moveTodepMove(pos, rel=False)
             dep, move = cmv.popitem()
@@ -304,6 +370,7 @@ class MultiplexActuator(model.Actuator):
         return f
 
     def _doMoveAbs(self, pos, **kwargs):
+        self._waitDirectMoves()
         futures = []
         for dep, move in self._moveTodepMove(pos, rel=False).items():
             f = dep.moveAbs(move, **kwargs)
@@ -319,7 +386,8 @@ class MultiplexActuator(model.Actuator):
             return model.InstantaneousFuture()
         self._checkReference(axes)
         if self._executor:
-            f = self._executor.submit(self._doReference, axes)
+            with self._direct_lock:
+                f = self._executor.submit(self._doReference, axes)
         else:
             cmv = self._axesTodepAxes(axes)
             dep, a = cmv.popitem()
@@ -330,6 +398,7 @@ class MultiplexActuator(model.Actuator):
     reference.__doc__ = model.Actuator.reference.__doc__
 
     def _doReference(self, axes):
+        self._waitDirectMoves()
         dep_to_axes = self._axesTodepAxes(axes)
         futures = []
         for dep, a in dep_to_axes.items():
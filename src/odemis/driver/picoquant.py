@@ -40,6 +40,7 @@ from decorator import decorator
 
 from odemis import model, util
 from odemis.model import HwError
+from odemis.util.tttr import HH_T3_FORMAT, HH_T3_MAX_DTIME, HH_T3_OVERFLOW_CHANNEL, HH_T3_WRAPAROUND
 
 
 # Based on phdefin.h for PicoHarp 300 DLL
@@ -297,6 +298,12 @@ HH_STOPCNTMAX = 4294967295  # 32 bit is mem max
 HH_HOLDOFFMIN = 0  # ns
 HH_HOLDOFFMAX = 524296  # ns
 
+# TTTR mode: the records read are grouped in batches, published at most at this period (s)
+TTTR_BATCH_PERIOD = 0.1
+# Maximum number of batches waiting to be published. If the subscribers are
+# too slow, the oldest batches are dropped, so that the device FIFO never overflows.
+TTTR_MAX_QUEUED_BATCHES = 16
+
 
 class DeviceError(Exception):
     """Error coming from the device, as reported by the PicoQuant library."""
@@ -385,6 +392,7 @@ class HHDLL(PicoDLL):
 
 # Acquisition control messages
 GEN_START = "S"  # Start acquisition
+GEN_START_TTTR = "R"  # Start acquisition of the time-tagged events
 GEN_STOP = "E"  # Don't acquire image anymore
 GEN_TERM = "T"  # Stop the generator
 GEN_UNSYNC = "U"  # Synchronisation stopped
@@ -454,8 +462,15 @@ class PicoBase(model.Detector, metaclass=ABCMeta):
         super().terminate()
 
     # Acquisition methods
-    def start_generate(self):
-        self._genmsg.put(GEN_START)
+    def start_generate(self, tttr: bool = False):
+        """
+        tttr: if True, acquire the time-tagged events (instead of histograms).
+          Only supported by the devices which have a .tttr DataFlow.
+        raise ValueError: if tttr is True, but the device doesn't support it
+        """
+        if tttr and not hasattr(self, "tttr"):
+            raise ValueError("TTTR mode not supported by %s" % (self.__class__.__name__,))
+        self._genmsg.put(GEN_START_TTTR if tttr else GEN_START)
         if not self._generator.is_alive():
             logging.warning("Restarting acquisition thread")
             self._generator = threading.Thread(target=self._acquire, name=f"{self.name} acquisition thread")
@@ -499,24 +514,25 @@ class PicoBase(model.Detector, metaclass=ABCMeta):
         raises queue.Empty: if no message on the queue
         """
         msg = self._genmsg.get(**kwargs)
-        if msg in (GEN_START, GEN_STOP, GEN_TERM, GEN_UNSYNC) or isinstance(msg, float):
+        if msg in (GEN_START, GEN_START_TTTR, GEN_STOP, GEN_TERM, GEN_UNSYNC) or isinstance(msg, float):
             logging.debug("Acq received message %s", msg)
         else:
             logging.warning("Acq received unexpected message %s", msg)
         return msg
 
-    def _acq_wait_start(self):
+    def _acq_wait_start(self) -> str:
         """
         Blocks until the acquisition should start.
         Note: it expects that the acquisition is stopped.
+        return: the start message received (GEN_START or GEN_START_TTTR)
         raise TerminationRequested: if a terminate message was received
         """
         while True:
             msg = self._get_acq_msg(block=True)
             if msg == GEN_TERM:
                 raise TerminationRequested()
-            elif msg == GEN_START:
-                return
+            elif msg in (GEN_START, GEN_START_TTTR):
+                return msg
 
             # Duplicate Stop or trigger
             logging.debug("Skipped message %s as acquisition is stopped", msg)
@@ -636,9 +652,13 @@ class PicoBase(model.Detector, metaclass=ABCMeta):
         try:
             while True:
                 # Wait until we have a start (or terminate) message
-                self._acq_wait_start()
+                start_msg = self._acq_wait_start()
                 self._old_triggers = []  # discard all old triggers
 
+                if start_msg == GEN_START_TTTR:
+                    self._acquire_tttr()
+                    continue
+
                 # Open protection shutters
                 self._toggle_shutters(self._shutters.keys(), True)
 
@@ -1699,7 +1719,7 @@ class HH400(PicoBase):
 
         # TODO: metadata for indicating the range? cf WL_LIST?
 
-        # TODO: do we need TTTR mode?
+        # Histogram mode by default, switched to T3 mode only while acquiring via .tttr
         self.Initialize(HH_MODE_HIST, 0)
         self._swVersion = self.GetLibraryVersion()
         self._metadata[model.MD_SW_VERSION] = self._swVersion
@@ -1800,12 +1820,15 @@ class HH400(PicoBase):
 
         # For compatibility with the old versions of this driver which didn't have VAs, we set the
         # CFD values at init on the detectors, if they exist, and otherwise set them explicitly.
+        # The explicit ones are stored, to be set again when the measurement mode changes.
+        self._fixed_cfds = {}  # channel (None for sync) -> level (mV), zero cross (mV)
         if sync_dv is not None and sync_zc is not None:
             if "detector0" in self._detectors:
                 self._detectors["detector0"].triggerLevel.value = sync_dv
                 self._detectors["detector0"].zeroCrossLevel.value = sync_zc
             else:
-                self.SetSyncCFD(int(sync_dv * 1000), int(sync_zc * 1000))
+                self._fixed_cfds[None] = (int(sync_dv * 1000), int(sync_zc * 1000))
+                self.SetSyncCFD(*self._fixed_cfds[None])
 
         for i, (dv, zc) in enumerate(zip(disc_volt, zero_cross)):
             child = self._detectors.get(f"detector{i + 1}")
@@ -1813,7 +1836,8 @@ class HH400(PicoBase):
                 child.triggerLevel.value = dv
                 child.zeroCrossLevel.value = zc
             else:
-                self.SetInputCFD(i, int(dv * 1000), int(zc * 1000))
+                self._fixed_cfds[i] = (int(dv * 1000), int(zc * 1000))
+                self.SetInputCFD(i, *self._fixed_cfds[i])
 
         self._actuallen = self.SetHistoLen(HH_MAXLENCODE)
 
@@ -1834,6 +1858,132 @@ class HH400(PicoBase):
         )
         self._setSyncChannelOffset(self.syncChannelOffset.value)
 
+        # Time-tagged events (in T3 mode). Each marker 1 indicates the start of a new pixel.
+        self.tttr = TTTRDataFlow(self)
+
+    def _setMeasMode(self, mode):
+        """
+        Change the measurement mode. As the device is reinitialised, all the
+        settings are set again.
+        mode (HH_MODE_HIST or HH_MODE_T3)
+        """
+        logging.debug("Switching to measurement mode %d", mode)
+        self.Initialize(mode, 0)
+        self.Calibrate()
+        if mode == HH_MODE_HIST:
+            self._actuallen = self.SetHistoLen(HH_MAXLENCODE)
+        elif mode == HH_MODE_T3:
+            # Markers on the rising edge, used to indicate the start of each pixel/line/frame
+            self.SetMarkerEdges(1, 1, 1, 1)
+            self.SetMarkerEnable(1, 1, 1, 1)
+
+        self._setAcqOffset(self.acqOffset.value)
+        self._setPixelDuration(self.pixelDuration.value)
+        self._setSyncDiv(self.syncDiv.value)
+        self._setSyncChannelOffset(self.syncChannelOffset.value)
+        for det in self._detectors.values():
+            det._setTriggerLevel(det.triggerLevel.value)
+        for channel, (level, zc) in self._fixed_cfds.items():
+            if channel is None:
+                self.SetSyncCFD(level, zc)
+            else:
+                self.SetInputCFD(channel, level, zc)
+
+    def _acquire_tttr(self):
+        """
+        Acquire the time-tagged events in T3 mode, until a stop message is received.
+        The records are read continuously from the FIFO of the device, and
+        published in batches, via a separate thread, so that slow subscribers
+        don't cause the FIFO to overflow.
+        raise TerminationRequested: if a terminate message was received
+        """
+        self._setMeasMode(HH_MODE_T3)
+        self._toggle_shutters(self._shutters.keys(), True)
+
+        batches = queue.Queue(maxsize=TTTR_MAX_QUEUED_BATCHES)
+        publisher = threading.Thread(target=self._publish_tttr, args=(batches,),
+                                     name=f"{self.name} TTTR publisher")
+        publisher.start()
+
+        md = self._metadata.copy()
+        # The records are not histograms
+        md.pop(model.MD_DIMS, None)
+        md.pop(model.MD_TIME_LIST, None)
+        md[model.MD_TTTR_FORMAT] = HH_T3_FORMAT
+        md[model.MD_TTTR_RESOLUTION] = self.pixelDuration.value
+        records = []  # ndarrays of uint32 read since the last batch
+        tbatch = time.time()
+        try:
+            logging.debug("Starting new TTTR acquisition")
+            self.StartMeas(HH_ACQTMAX)
+            while True:
+                # Max count must be a multiple of 128
+                rec = self.ReadFiFo(HH_TTREADMAX - HH_TTREADMIN)
+                if rec.size:
+                    records.append(rec)
+
+                now = time.time()
+                if records and now >= tbatch + TTTR_BATCH_PERIOD:
+                    self._queue_tttr_batch(batches, records, md, tbatch)
+                    records = []
+                    tbatch = now
+
+                if self.GetFlags() & HH_FLAG_FIFOFULL:
+                    logging.error("FIFO overflow, stopping the TTTR acquisition")
+                    break
+
+                # If the FIFO was empty, don't read it again immediately
+                if self._acq_should_stop(timeout=None if rec.size else 0.01):
+                    break
+        finally:
+            # Must always be called, whether the measurement finished or not
+            self.StopMeas()
+            if records:
+                self._queue_tttr_batch(batches, records, md, tbatch)
+            batches.put(None)  # End of acquisition
+            publisher.join()
+            logging.debug("TTTR acquisition stopped")
+            self._toggle_shutters(self._shutters.keys(), False)
+            self._setMeasMode(HH_MODE_HIST)
+
+    def _queue_tttr_batch(self, batches, records, md, tstart):
+        """
+        Pass the records to the publisher thread. If the queue is full, the
+        oldest batch is dropped.
+        batches (Queue): the queue of DataArrays to publish
+        records (list of ndarrays of uint32): the records of the batch
+        md (dict): metadata of the acquisition
+        tstart (float): time of the first record of the batch
+        """
+        md = md.copy()
+        md[model.MD_ACQ_DATE] = tstart
+        da = model.DataArray(numpy.concatenate(records), md)
+        try:
+            batches.put_nowait(da)
+        except queue.Full:
+            try:
+                old = batches.get_nowait()
+                logging.warning("TTTR data not processed fast enough, dropping %d records",
+                                old.shape[0])
+            except queue.Empty:  # Just emptied by the publisher
+                pass
+            batches.put_nowait(da)
+
+    def _publish_tttr(self, batches):
+        """
+        Publisher thread: sends the batches of records to the subscribers of .tttr,
+        until None is received.
+        batches (Queue): the queue of DataArrays to publish
+        """
+        while True:
+            da = batches.get()
+            if da is None:
+                break
+            try:
+                self.tttr.notify(da)
+            except Exception:
+                logging.exception("Failed to publish TTTR data")
+
     def _openDevice(self, sn=None):
         """
         sn (None or str): serial number
@@ -2326,7 +2476,9 @@ class HH400(PicoBase):
         nactual = c_int()
         self._dll.ReadFiFo(self._idx, buf_ct, count, byref(nactual))
         # only return the values which were read
-        # TODO: if it's really smaller (eg, 0), copy the data to avoid holding all the mem
+        if nactual.value < count // 2:
+            # copy the data to avoid holding all the mem
+            return buf[: nactual.value].copy()
         return buf[: nactual.value]
 
     def SetMarkerEdges(self, me0, me1, me2, me3):
@@ -2584,6 +2736,29 @@ class BasicDataFlow(model.DataFlow):
             self._detector.set_trigger(False)
 
 
+class TTTRDataFlow(model.DataFlow):
+    """
+    Time-tagged events, acquired continuously, while there are subscribers.
+    Each DataArray is a batch of raw records (uint32), in the format indicated
+    by MD_TTTR_FORMAT. They can be decoded with odemis.util.tttr (the batches
+    must be decoded in order, passing the sync offset from one batch to the next).
+    The DataFlow cannot be used at the same time as the .data DataFlow.
+    """
+    def __init__(self, detector: PicoBase):
+        """
+        detector: the detector that the dataflow corresponds to
+        """
+        model.DataFlow.__init__(self)
+        self._detector = detector
+
+    # start/stop_generate are _never_ called simultaneously (thread-safe)
+    def start_generate(self):
+        self._detector.start_generate(tttr=True)
+
+    def stop_generate(self):
+        self._detector.stop_generate()
+
+
 # Only for testing/simulation purpose
 # Very rough version that is just enough so that if the wrapper behaves correctly,
 # it returns the expected values.
@@ -2933,6 +3108,74 @@ class FakePH330DLL:
         ndbuffer[...] = numpy.random.randint(0, maxval + 1, self._histolen, dtype=numpy.uint32)
 
 
+class FakeT3Generator:
+    """
+    Generates random records, as a HydraHarp in T3 mode would, for a sample with
+    a mono-exponential decay. A marker 1 is inserted at regular interval, to
+    simulate the start of each e-beam pixel.
+    """
+
+    def __init__(self, photon_prob: float = 0.05, lifetime: float = 2e-9,
+                 resolution: float = 4e-12, pixel_syncs: int = 100):
+        """
+        photon_prob: probability to detect a photon after each sync pulse
+        lifetime: decay time of the emission (s)
+        resolution: duration of one dtime unit (s)
+        pixel_syncs: number of syncs between each pixel marker
+        """
+        self.photon_prob = photon_prob
+        self.lifetime = lifetime
+        self.resolution = resolution
+        self.pixel_syncs = pixel_syncs
+        self._nsync = 0  # Total number of syncs generated
+        self._nwraps = 0  # Number of nsync overflows already recorded
+
+    def generate(self, nsyncs: int) -> numpy.ndarray:
+        """
+        Generate the records for the given number of sync periods
+        return (ndarray of uint32): the records
+        """
+        start = self._nsync
+        self._nsync += nsyncs
+        nphotons = numpy.random.binomial(nsyncs, self.photon_prob)
+        psyncs = start + numpy.sort(numpy.random.randint(0, nsyncs, nphotons))
+        dtimes = numpy.random.exponential(self.lifetime / self.resolution, nphotons)
+        dtimes = numpy.minimum(dtimes, HH_T3_MAX_DTIME).astype(numpy.uint32)
+        first_marker = -(-start // self.pixel_syncs) * self.pixel_syncs
+        msyncs = numpy.arange(first_marker, start + nsyncs, self.pixel_syncs)
+
+        # Merge photons (on channel 0) and markers, by order of sync (markers first)
+        syncs = numpy.concatenate([msyncs, psyncs]).astype(numpy.int64)
+        recs = numpy.concatenate([
+            numpy.full(msyncs.shape, (1 << 31) | (1 << 25), dtype=numpy.uint32),
+            dtimes << 10,
+        ])
+        order = numpy.argsort(syncs, kind="stable")
+        syncs = syncs[order]
+        recs = recs[order] | (syncs % HH_T3_WRAPAROUND).astype(numpy.uint32)
+
+        # Insert overflow records before each event whose nsync has wrapped
+        # around since the previous event (each record can count up to 1023 wraps)
+        wraps = syncs // HH_T3_WRAPAROUND
+        novf = numpy.diff(wraps, prepend=self._nwraps)
+        if wraps.size:
+            self._nwraps = int(wraps[-1])
+        nrecs = -(-novf // 1023)  # number of overflow records before each event
+        ovf_counts = numpy.full(int(nrecs.sum()), 1023, dtype=numpy.uint32)
+        has_ovf = nrecs > 0
+        last_ovf = numpy.cumsum(nrecs)[has_ovf] - 1
+        ovf_counts[last_ovf] = novf[has_ovf] - (nrecs[has_ovf] - 1) * 1023
+
+        out = numpy.empty(recs.size + ovf_counts.size, dtype=numpy.uint32)
+        # position of each event = its index + number of overflow records up to it
+        pos = numpy.arange(recs.size) + numpy.cumsum(nrecs)
+        out[pos] = recs
+        is_ovf = numpy.ones(out.size, dtype=bool)
+        is_ovf[pos] = False
+        out[is_ovf] = (1 << 31) | (HH_T3_OVERFLOW_CHANNEL << 25) | ovf_counts
+        return out
+
+
 class FakeHHDLL:
     """
     Fake HHDLL. It basically simulates one connected device, which returns
@@ -2958,6 +3201,14 @@ class FakeHHDLL:
         self._acq_end = None
         self._last_acq_dur = None  # s
 
+        # T3 mode
+        self._markerEdges = (0, 0, 0, 0)
+        self._markerEnable = (0, 0, 0, 0)
+        self._markerHoldoff = 0  # ns
+        self._t3gen = None  # FakeT3Generator, while acquiring
+        self._fifo_time = None  # time of the last generation of records
+        self._fifo = numpy.empty((0,), dtype=numpy.uint32)  # records not yet read
+
     def __getattr__(self, name):
         # Provide all the PH_* function without the PH_ prefix too.
         # Support calling functions without the prefix, by automatically adding it.
@@ -3079,6 +3330,10 @@ class FakeHHDLL:
             raise DeviceError(-16, "ERROR_INSTANCE_RUNNING")
         self._acq_start = time.time()
         self._acq_end = self._acq_start + _val(tacq) * 1e-3
+        if self._mode == HH_MODE_T3:
+            self._t3gen = FakeT3Generator(resolution=self._base_res * (2 ** self._bincode) * 1e-12)
+            self._fifo_time = self._acq_start
+            self._fifo = numpy.empty((0,), dtype=numpy.uint32)
 
     def HH_StopMeas(self, i):
         if self._acq_start is not None:
@@ -3147,16 +3402,35 @@ class FakeHHDLL:
     # Special Functions for TTTR Mode
 
     def HH_ReadFiFo(self, i, buffer, count, nactual):
-        raise NotImplementedError()
+        if self._mode != HH_MODE_T3:
+            raise DeviceError(-18, "ERROR_INVALID_MODE")
+        count = _val(count)
+        n = _deref(nactual, c_int)
+
+        # Generate the records since the last read
+        if self._acq_start is not None:
+            now = min(time.time(), self._acq_end)
+            nsyncs = int((now - self._fifo_time) * self._syncRate)
+            if nsyncs > 0:
+                self._fifo_time += nsyncs / self._syncRate
+                self._fifo = numpy.concatenate([self._fifo, self._t3gen.generate(nsyncs)])
+
+        if self._fifo.size == 0:
+            time.sleep(0.01)  # Like the USB 2.0 devices, wait a little bit if there is no data
+        nread = min(count, self._fifo.size)
+        ndbuffer = numpy.ctypeslib.as_array(buffer, (count,))
+        ndbuffer[:nread] = self._fifo[:nread]
+        self._fifo = self._fifo[nread:]
+        n.value = nread
 
     def HH_SetMarkerEdges(self, i, me0, me1, me2, me3):
-        raise NotImplementedError()
+        self._markerEdges = (_val(me0), _val(me1), _val(me2), _val(me3))
 
     def HH_SetMarkerEnable(self, i, en0, en1, en2, en3):
-        raise NotImplementedError()
+        self._markerEnable = (_val(en0), _val(en1), _val(en2), _val(en3))
 
     def HH_SetMarkerHoldoffTime(self, i, holdofftime):
-        raise NotImplementedError()
+        self._markerHoldoff = _val(holdofftime)
 
     # Special Functions for Continuous Mode
 
@@ -1543,6 +1543,17 @@ class Controller(object):
         # takes more characters and for CL, we need a more clever code anyway
         return not axes.isdisjoint(self.GetMotionStatus())
 
+    def getMovingAxes(self, axes):
+        """
+        Indicate which motors are moving.
+        axes (set of str): axes to check
+        return (set of str): the axes which are moving
+        raise PIGCSError if an error on a controller happened
+        """
+        assert axes.issubset(set(self._channels))
+        # All the axes are reported in a single query
+        return axes & self.GetMotionStatus()
+
     def stopMotion(self):
         """
         Stop the motion on all axes immediately
@@ -1775,6 +1786,13 @@ class CLAbsController(Controller):
         self._lastpos[axis] = (pos, time.time())
         return pos
 
+    def getMovingAxes(self, axes):
+        """
+        See Controller.getMovingAxes
+        """
+        # The motion status is not sufficient, so check each axis via isMoving()
+        return {a for a in axes if self.isMoving({a})}
+
     def isMoving(self, axes=None):
         """
         Indicate whether the motors are moving (ie, last requested move is over)
@@ -2330,6 +2348,13 @@ class CLRelController(Controller):
     def getTargetPosition(self, axis):
         return self.GetTargetPosition(axis) * self._upm[axis]
 
+    def getMovingAxes(self, axes):
+        """
+        See Controller.getMovingAxes
+        """
+        # The motion status is not sufficient, so check each axis via isMoving()
+        return {a for a in axes if self.isMoving({a})}
+
     # Warning: if the settling window is too small or settling time too big,
     # it might take several seconds to reach target (or even never reach it)
     def isMoving(self, axes=None):
@@ -2776,6 +2801,13 @@ class SMOController(Controller):
         self._storeMove(axis, ad, duration)
         return ad
 
+    def getMovingAxes(self, axes):
+        """
+        See Controller.getMovingAxes
+        """
+        # The motion status is not sufficient, so check each axis via isMoving()
+        return {a for a in axes if self.isMoving({a})}
+
     def isMoving(self, axes=None):
         """
         See Controller.isMoving
@@ -2956,6 +2988,8 @@ class Bus(model.Actuator):
 
         # will take care of executing axis move asynchronously
         self._executor = CancellableThreadPoolExecutor(max_workers=1) # one task at a time
+        self._move_monitor = driver.MoveMonitor(self._getMovingAxes)
+        self._move_errors = []  # exceptions reported by the controllers during the current move
 
     def _updatePosition(self, axes=None):
         """
@@ -3230,75 +3264,48 @@ class Bus(model.Actuator):
             TimeoutError: if took too long to finish the move
         """
         moving_axes = set(axes)
-
         need_pos_update = True
-        raise_exp = None  # exception to raise at the end
+        self._move_errors = []  # to raise at the end
 
-        last_upd = time.time()
-        dur = max(0.01, min(end - last_upd, 60))
-        max_dur = dur * 2 + 3
-        timeout = last_upd + max_dur
-        last_axes = moving_axes.copy()  # moving axes as of last position update
-        try:
-            while not future._must_stop.is_set():
-                # If next future is update and all moving_axes are in next future axes
-                # => stop immediately without updating the positions
-                nf = self._executor.get_next_future(future)
-                if nf is not None and moving_axes <= nf._update_axes:
-                    need_pos_update = False
-                    # TODO: make sure the position gets updated from time to time
-                    # there is non-ending series of update moves.
-                    # => reuse the .GetPosition() of the controller.moveRel()?
-                    logging.debug("Ending move control early as next move is an update containing %s", moving_axes)
-                    return
+        def is_next_update(axes):
+            # If next future is update and all moving_axes are in next future axes
+            # => stop immediately without updating the positions
+            nf = self._executor.get_next_future(future)
+            return nf is not None and axes <= nf._update_axes
 
-                for an in moving_axes.copy():  # need copy to remove during iteration
-                    controller, channel = self._axis_to_cc[an]
-                    # TODO: change isMoving to report separate info on multiple channels
-                    if not controller.isMoving({channel}):
-                        moving_axes.discard(an)
-                        try:
-                            controller.checkError()
-                        except PIGCSError as ex:
-                            raise_exp = ex  # Keep it for the end, while waiting for other axes
-                            logging.error("Move on axis %s has failed: %s", an, ex)
-                if not moving_axes:
-                    # no more axes to wait for
-                    break
+        last_axes = set(axes)  # moving axes as of last position update
 
-                now = time.time()
-                if now > timeout:
-                    logging.info("Stopping move due to timeout after %g s.", max_dur)
-                    ctlrs = set(self._axis_to_cc[an][0] for an in moving_axes)
-                    for controller in ctlrs:
-                        controller.stopMotion()
-                    raise TimeoutError("Move is not over after %g s, while "
-                                       "expected it takes only %g s" %
-                                       (max_dur, dur))
-
-                # Update the position from time to time (10 Hz)
-                if now - last_upd > 0.1 or last_axes != moving_axes:
-                    self._updatePosition(last_axes)
-                    last_upd = now
-                    last_axes = moving_axes.copy()
-
-                # Wait half of the time left (maximum 0.1 s)
-                left = end - time.time()
-                sleept = max(0.001, min(left / 2, 0.1))
-                future._must_stop.wait(sleept)
-            else:
-                logging.debug("Move of axes %s cancelled before the end", axes)
-                # stop all axes still moving
-                ctlrs = set(self._axis_to_cc[an][0] for an in moving_axes)
-                for controller in ctlrs:
-                    controller.stopMotion()
-                future._was_stopped = True
-                raise CancelledError()
-        except Exception:
+        def update_position(axes):
+            self._updatePosition(axes)
+            last_axes.clear()
+            last_axes.update(moving_axes)
+
+        dur = max(0.01, min(end - time.time(), 60))
+        try:
+            if self._move_monitor.wait(moving_axes, end, future._must_stop, max_dur=dur * 2 + 3,
+                                       on_update=update_position, on_poll=is_next_update):
+                # TODO: make sure the position gets updated from time to time
+                # there is non-ending series of update moves.
+                # => reuse the .GetPosition() of the controller.moveRel()?
+                logging.debug("Ending move control early as next move is an update containing %s", moving_axes)
+                need_pos_update = False
+                return
+        except CancelledError:
+            # stop all axes still moving
+            ctlrs = set(self._axis_to_cc[an][0] for an in moving_axes)
+            for controller in ctlrs:
+                controller.stopMotion()
+            future._was_stopped = True
+            raise
+        except TimeoutError:
+            logging.info("Stopping move due to timeout")
+            ctlrs = set(self._axis_to_cc[an][0] for an in moving_axes)
+            for controller in ctlrs:
+                controller.stopMotion()
             raise
         else:
-            if raise_exp:
-                raise raise_exp
+            if self._move_errors:
+                raise self._move_errors[0]
         finally:
             if need_pos_update:
                 # Position update takes quite some time, which increases latency for
@@ -3308,6 +3315,31 @@ class Bus(model.Actuator):
                 self._updatePosition(last_axes)
             self._pos_needs_update.set()
 
+    def _getMovingAxes(self, axes):
+        """
+        axes (set of str): the axes names to check
+        return (set of str): the axes still moving
+        """
+        # Query all the axes of a controller at once
+        ctlr_channels = {}  # Controller -> channel -> axis name
+        for an in axes:
+            controller, channel = self._axis_to_cc[an]
+            ctlr_channels.setdefault(controller, {})[channel] = an
+
+        moving = set()
+        for controller, channels in ctlr_channels.items():
+            moving_channels = controller.getMovingAxes(set(channels.keys()))
+            moving |= {channels[c] for c in moving_channels}
+            if len(moving_channels) < len(channels):
+                try:
+                    controller.checkError()
+                except PIGCSError as ex:
+                    # Keep it for the end, while waiting for other axes
+                    logging.error("Move on axes %s has failed: %s",
+                                  set(channels.values()) - moving, ex)
+                    self._move_errors.append(ex)
+        return moving
+
     def _cancelCurrentMove(self, future):
         """
         Cancels the current move (both absolute or relative). Non-blocking.
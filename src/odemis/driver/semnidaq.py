@@ -94,6 +94,13 @@ from odemis import model, util
 from odemis.model import roattribute, oneway
 from odemis.util import driver, get_best_dtype_for_acc
 
+# See if the optimised (cython-based) downsampling is available
+try:
+    from odemis.util import downsample_fast
+except ImportError:
+    logging.warning("Failed to load optimised downsampling, slow version will be used.")
+    downsample_fast = None
+
 logging.captureWarnings(True)  # Log the DAQmx warnings
 
 
@@ -1592,17 +1599,15 @@ class Acquirer:
 
         logging.debug("Got another %s AI samples, over %s still to acquire", new_samples_n, samples_left_n)
 
-        # Downsample each channel independently
-        for c in range(ai_data.shape[0]):
-            prev_samples_n[c], prev_samples_sum[c] = self._downsample_data(ai_data[c],
-                                                                           acq_settings.res,
-                                                                           acq_settings.margin,
-                                                                           acquired_n, acq_settings.ai_osr,
-                                                                           ai_buffer[c, :new_samples_n],
-                                                                           prev_samples_n[c],
-                                                                           prev_samples_sum[c],
-                                                                           acc_dtype,
-                                                                           average=True)
+        prev_samples_n, prev_samples_sum = self._downsample_channels(ai_data,
+                                                                     acq_settings.res,
+                                                                     acq_settings.margin,
+                                                                     acquired_n, acq_settings.ai_osr,
+                                                                     ai_buffer[:, :new_samples_n],
+                                                                     prev_samples_n,
+                                                                     prev_samples_sum,
+                                                                     acc_dtype,
+                                                                     average=True)
         return new_samples_n, prev_samples_n, prev_samples_sum
 
     def _read_ci_buffer(self, acq_settings: AcquisitionSettings,
@@ -1667,17 +1672,18 @@ class Acquirer:
                                     new_samples_n, samples_to_acquire)
 
                 logging.debug("Got another %s CI samples, over %s still to acquire", new_samples_n, samples_left_n)
-                ci_prev_samples_n[c], ci_prev_samples_sum[c] = self._downsample_data(ci_data[c],
-                                                                                     acq_settings.res,
-                                                                                     acq_settings.margin,
-                                                                                     ci_acquired_n,
-                                                                                     acq_settings.ao_osr,
-                                                                                     ci_buffer[:new_samples_n],
-                                                                                     ci_prev_samples_n[c],
-                                                                                     ci_prev_samples_sum[c],
-                                                                                     acc_dtype=ci_data.dtype,
-                                                                                     # for sum, this is the same as data.dtype
-                                                                                     average=False)
+                # The channels are read one at a time, so downsample them one at a time too
+                (ci_prev_samples_n[c],), (ci_prev_samples_sum[c],) = self._downsample_channels(
+                    ci_data[c:c + 1],
+                    acq_settings.res,
+                    acq_settings.margin,
+                    ci_acquired_n,
+                    acq_settings.ao_osr,
+                    ci_buffer[numpy.newaxis, :new_samples_n],
+                    ci_prev_samples_n[c:c + 1],
+                    ci_prev_samples_sum[c:c + 1],
+                    acc_dtype=ci_data.dtype,  # for sum, this is the same as data.dtype
+                    average=False)
             ci_acquired_n += new_samples_n
 
         return ci_acquired_n, ci_prev_samples_n, ci_prev_samples_sum
@@ -1842,6 +1848,51 @@ class Acquirer:
             do_task.triggers.start_trigger.cfg_dig_edge_start_trig(ai_task.triggers.start_trigger.term)
             do_task.out_stream.auto_start = False
 
+    @classmethod
+    def _downsample_channels(cls,
+                             data: numpy.ndarray,  # C x Y x X (no margin)
+                             res: Tuple[int, int],  # X, Y
+                             margin: int,
+                             acquired_n: int,
+                             osr: int,
+                             buffer: numpy.ndarray,  # C x N
+                             prev_samples_n: List[int],
+                             prev_samples_sum: List[int],
+                             acc_dtype: numpy.dtype = numpy.float64,
+                             average: bool = True,
+                             ) -> Tuple[List[int], List[int]]:
+        """
+        Downsample the acquisition data of all the channels, and store it at the
+        final place into the image array. It uses the optimised version if
+        available, and otherwise calls _downsample_data() on each channel.
+        :param data: (3D array of shape CYX) final image data. It does NOT contain the margin.
+        :param buffer: (2D array of shape CN) any number of samples lastly acquired, for each channel
+        :param prev_samples_n: for each channel, the samples_n returned by the last call
+        :param prev_samples_sum: for each channel, the samples_sum returned by the last call
+        See _downsample_data() for the other arguments.
+        :returns:
+            * samples_n: for each channel, the number of the (last) samples which
+            could not be fully fitted in a pixel yet.
+            * samples_sum: for each channel, the sum of the (last) samples which
+            could not be fully fitted in a pixel yet.
+        """
+        if downsample_fast and buffer.shape[1] > 0:
+            try:
+                return downsample_fast.downsample(data, buffer, margin, acquired_n, osr,
+                                                  prev_samples_n, prev_samples_sum, average)
+            except (TypeError, ValueError) as ex:  # Typically, unsupported dtype
+                logging.debug("Fast downsampling cannot run: %s", ex)
+
+        samples_n = list(prev_samples_n)
+        samples_sum = list(prev_samples_sum)
+        for c in range(data.shape[0]):
+            samples_n[c], samples_sum[c] = cls._downsample_data(data[c], res, margin,
+                                                                acquired_n, osr,
+                                                                buffer[c],
+                                                                samples_n[c], samples_sum[c],
+                                                                acc_dtype, average)
+        return samples_n, samples_sum
+
     @classmethod
     def _downsample_data(cls,
                          data: numpy.ndarray,  # Y x X (no margin)
@@ -1905,7 +1956,7 @@ class Acquirer:
                 return pixel_samples_n, pixel_sum
             # else get the final pixels, sum, compute the average, store (unless it's in the margin)
             if x >= 0:
-                data[y, x] = pixel_sum / osr  # automatically converted to the dtype
+                data[y, x] = pixel_sum / osr if average else pixel_sum  # automatically converted to the dtype
             acquired_n += new_samples_n
             buffer = buffer[new_samples_n:]
 
@@ -1926,7 +1977,7 @@ class Acquirer:
             buffer_pixels = buffer[margin_pixels_n * osr:new_samples_n]
             # Downsample the whole set of data to the given location
             if buffer_pixels.size > 0:
-                cls._downsample_pixels(data, (max(0, x), y), buffer_pixels, osr, acc_dtype)
+                cls._downsample_pixels(data, (max(0, x), y), buffer_pixels, osr, acc_dtype, average)
 
             # Update the pointers
             acquired_n += new_samples_n
@@ -395,19 +395,28 @@ class Detector(model.Detector):
     of the fake SEM. It sets up a Dataflow and notifies it every time that a fake
     SEM image is generated. It also keeps and updates a “drift vector”
     """
-    def __init__(self, name, role, parent, **kwargs):
+    def __init__(self, name, role, parent, max_rate: bool = False, **kwargs):
         """
         Note: parent should have a child "scanner" already initialised
+        :param max_rate: if True, the frames are sent as soon as they are generated,
+         without waiting for the (simulated) scanning duration. This allows to
+         measure the throughput of the rest of the acquisition pipeline.
         """
         # It will set up ._shape and .parent
         model.Detector.__init__(self, name, role, parent=parent, **kwargs)
         self.data = SEMDataFlow(self)
+        self._max_rate = max_rate
         self._acquisition_thread = None
         self._acquisition_lock = threading.Lock()
         self._acquisition_init_lock = threading.Lock()
         self._acquisition_must_stop = threading.Event()
 
         self.fake_img = self.parent.fake_img
+        # The scan settings and the focus rarely change between frames, so the
+        # corresponding computations are cached (as key, value)
+        self._scan_index_cache = (None, None)  # (trans, scale, res, max_res) -> index, is_view
+        self._fov_cache = (None, None)  # (min_x, min_y, max_res, dist) -> blurred FoV image
+
         # The shape is just one point, the depth
         idt = numpy.iinfo(self.fake_img.dtype)
         data_depth = idt.max - idt.min + 1
@@ -532,13 +541,11 @@ class Detector(model.Detector):
                 numpy.rint(scan_path + center, out=coord, casting="unsafe")
                 sim_img = fov_img[coord[:, 1], coord[:, 0]]  # 1D
             else:
-                # compute each row and column that will be included
-                first_x = trans[0] + (max_res[0] - res[0] * scale[0]) / 2
-                first_y = trans[1] + (max_res[1] - res[1] * scale[1]) / 2
-                coord = ([int(round(first_x + i * scale[0])) for i in range(res[0])],
-                         [int(round(first_y + i * scale[1])) for i in range(res[1])])
                 # Get every pixel of the grid
-                sim_img = fov_img[numpy.ix_(coord[1], coord[0])]  # copy
+                index, is_view = self._get_scan_index(trans, scale, res, max_res)
+                sim_img = fov_img[index]
+                if is_view:
+                    sim_img = sim_img.copy()
 
                 # Update position metadata based on the translation
                 trans_phy = scanner.pixelToPhy(trans)
@@ -551,7 +558,8 @@ class Detector(model.Detector):
                 maxf = 2 ** bpp - 1
                 b = maxf / max(1, (maxd - mind))
                 # Multiply by a float and drop to the original dtype
-                numpy.multiply(sim_img - mind, b, out=sim_img, casting="unsafe")
+                numpy.subtract(sim_img, mind, out=sim_img)
+                numpy.multiply(sim_img, b, out=sim_img, casting="unsafe")
                 if bpp <= 8:
                     sim_img = sim_img.astype(numpy.uint8)
 
@@ -575,6 +583,45 @@ class Detector(model.Detector):
             duration = sim_img.size * dwell_time + res[1] * scanner.settleTime
             return da, duration
 
+    def _get_scan_index(self, trans: Tuple[float, float], scale: Tuple[float, float],
+                        res: Tuple[int, int], max_res: Tuple[int, int]) -> Tuple[tuple, bool]:
+        """
+        Compute which pixels of the FoV image are scanned with the given settings.
+        The result is cached, as it's typically the same for many frames in a row.
+        :param trans: translation (px)
+        :param scale: scale (ratio)
+        :param res: resolution (px)
+        :param max_res: maximum resolution (px), corresponding to the FoV image
+        :return:
+          index: to apply on the FoV image (YX) to get the scanned image
+          is_view: True if the result of the indexing is a view on the FoV image
+            (ie, the rows and columns are regularly spaced), False if it's a copy.
+        """
+        key = (trans, scale, res, max_res)
+        prev_key, cached = self._scan_index_cache
+        if key == prev_key:
+            return cached
+
+        # compute each row and column that will be included
+        coords = []
+        for i in (1, 0):  # Y, X
+            first = trans[i] + (max_res[i] - res[i] * scale[i]) / 2
+            coord = numpy.rint(first + numpy.arange(res[i]) * scale[i]).astype(numpy.intp)
+            step = coord[1] - coord[0] if len(coord) > 1 else 1
+            # Regular spacing => a slice is much faster to copy than fancy indexing
+            if step > 0 and coord[0] >= 0 and numpy.all(numpy.diff(coord) == step):
+                coord = slice(coord[0], coord[-1] + 1, step)
+            coords.append(coord)
+
+        is_view = all(isinstance(c, slice) for c in coords)
+        if any(isinstance(c, slice) for c in coords):
+            index = tuple(coords)
+        else:
+            index = numpy.ix_(*coords)
+
+        self._scan_index_cache = key, (index, is_view)
+        return index, is_view
+
     def _simulate_fov(self):
         """
         Generate simulated image based on translation, resolution and current drift.
@@ -604,7 +651,13 @@ class Detector(model.Detector):
             pos = self.parent._focus.position.value['z']
             # Multiply by 10,000 to have a more pronounced effect (arbitrary value found by trial and error)
             dist = abs(pos - self.parent._focus._good_focus) * 1e4
-            fov_img = ndimage.gaussian_filter(fov_img, sigma=dist)
+            # Blurring is slow, and typically the same for many frames in a row
+            key = (min_x, min_y, max_res, dist)
+            prev_key, blurred_img = self._fov_cache
+            if key != prev_key:
+                blurred_img = ndimage.gaussian_filter(fov_img, sigma=dist)
+                self._fov_cache = key, blurred_img
+            fov_img = blurred_img
 
         return fov_img
 
@@ -615,6 +668,9 @@ class Detector(model.Detector):
         to the dwell time and resolution and provides the new generated output to
         the Dataflow.
         """
+        nframes = 0
+        scan_dur = 0  # s, total simulated scanning duration of the frames sent
+        tfirst = None
         try:
             first_frame = True
             while not self._acquisition_must_stop.is_set():
@@ -626,13 +682,26 @@ class Detector(model.Detector):
                 if first_frame:  # startScan event is sent at the beginning of the *first* frame only
                     self.parent._scanner.startScan.notify()
                     first_frame = False
+                tstart = time.time()
+                if tfirst is None:
+                    tfirst = tstart
                 img, duration = self._simulate_image()
-                if self._acquisition_must_stop.wait(duration):
+                if self._max_rate:
+                    if self._acquisition_must_stop.is_set():
+                        break
+                # The scanning started at the beginning of the simulation
+                elif self._acquisition_must_stop.wait(max(0, tstart + duration - time.time())):
                     break
                 callback(img)
+                nframes += 1
+                scan_dur += duration
         except Exception:
             logging.exception("Unexpected failure during image acquisition")
         finally:
+            if nframes:
+                dur = time.time() - tfirst
+                logging.info("Acquired %d frames at %.1f fps (scan settings allow %.1f fps)",
+                             nframes, nframes / dur, nframes / scan_dur)
             logging.debug("Acquisition thread closed")
             self._acquisition_must_stop.clear()
 
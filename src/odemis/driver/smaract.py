@@ -38,7 +38,7 @@ from odemis import model
 from odemis import util
 from odemis.model import CancellableFuture, CancellableThreadPoolExecutor, isasync, VigilantAttribute, roattribute
 from odemis.util import driver, RepeatingTimer, almost_equal
-from concurrent.futures import CancelledError, TimeoutError
+from concurrent.futures import CancelledError
 
 try:
     import smaract.si as si
@@ -3047,6 +3047,7 @@ class MCS2(model.Actuator):
 
         # will take care of executing axis move asynchronously
         self._executor = CancellableThreadPoolExecutor(1)  # one task at a time
+        self._move_monitor = driver.MoveMonitor(self._get_moving_channels)
 
         # define the referenced VA from the query
         axes_ref = {a: self._is_channel_referenced(i) for a, i in self._axis_map.items()}
@@ -3238,6 +3239,30 @@ class MCS2(model.Actuator):
         self.core.SA_CTL_GetProperty_i32(self._id, c_int8(idx), c_uint32(property_key), byref(ret_val), c_size_t(0))
         return ret_val.value
 
+    def GetProperties_i32(self, property_key, idxs):
+        """
+        Reads the same property of several channels, with a single exchange with the
+        controller: all the read requests are sent, and then all the replies are read.
+        property_key (int32): property key symbol
+        idxs (list of int): channels
+        returns (list of int): the value of each channel
+        """
+        rids = []
+        try:
+            for idx in idxs:
+                rid = c_uint8()
+                self.core.SA_CTL_RequestReadProperty(self._id, c_int8(idx), c_uint32(property_key), byref(rid),
+                                                     SA_CTL_TransmitHandle_t(0))
+                rids.append(rid)
+        finally:
+            # All the requests sent must be read, even if one failed
+            values = []
+            for rid in rids:
+                ret_val = c_int32()
+                self.core.SA_CTL_ReadProperty_i32(self._id, rid, byref(ret_val), c_size_t(0))
+                values.append(ret_val.value)
+        return values
+
     def GetProperty_i64(self, property_key, idx):
         """
         property_key (int64): property key symbol
@@ -3307,12 +3332,14 @@ class MCS2(model.Actuator):
 
         return self.GetProperty_i32(SA_CTLDLL.SA_CTL_PKEY_CHANNEL_STATE, channel)
 
-    def _check_channel_error(self, channel):
+    def _check_channel_error(self, channel, state=None):
         """
         channel (int)
+        state (None or int): the channel state, if it was already read
         raise a HwError if the channel reports an error
         """
-        state = self._get_channel_state(channel)
+        if state is None:
+            state = self._get_channel_state(channel)
         if state & SA_CTLDLL.SA_CTL_CH_STATE_BIT_MOVEMENT_FAILED:
             if state & SA_CTLDLL.SA_CTL_CH_STATE_BIT_END_STOP_REACHED:
                 raise model.HwError("Channel %d: reached end-stop" % (channel,))
@@ -3337,6 +3364,23 @@ class MCS2(model.Actuator):
         """
         return bool(self._get_channel_state(channel) & SA_CTLDLL.SA_CTL_CH_STATE_BIT_ACTIVELY_MOVING)
 
+    def _get_moving_channels(self, channels):
+        """
+        channels (set of int)
+        return (set of int): the channels still moving
+        raise HwError: if a channel which stopped moving failed to reach its target
+        """
+        # Query all the channels at once
+        channels = sorted(channels)
+        states = self.GetProperties_i32(SA_CTLDLL.SA_CTL_PKEY_CHANNEL_STATE, channels)
+        moving = set()
+        for c, state in zip(channels, states):
+            if state & SA_CTLDLL.SA_CTL_CH_STATE_BIT_ACTIVELY_MOVING:
+                moving.add(c)
+            else:
+                self._check_channel_error(c, state)
+        return moving
+
     def _get_position(self, channel):
         """
         Get the position on a specified channel
@@ -3548,46 +3592,19 @@ class MCS2(model.Actuator):
             CancelledError: if cancelled before the end of the move
         """
         moving_axes = set(axes)
-
-        last_upd = time.time()
-        dur = max(0.01, min(end - last_upd, 60))
-        max_dur = dur * 2 + 1
-        logging.debug("Expecting a move of %g s, will wait up to %g s", dur, max_dur)
-        timeout = last_upd + max_dur
         try:
-            while not future._must_stop.is_set():
-                for a in moving_axes.copy():  # need copy to remove during iteration
-                    if not self._is_channel_moving(a):
-                        moving_axes.discard(a)
-                        self._check_channel_error(a)
-
-                if not moving_axes:
-                    # no more axes to wait for
-                    break
-
-                now = time.time()
-                if now > timeout:
-                    logging.warning("Stopping move due to timeout after %g s.", max_dur)
-                    # Note: stopping actually happens just after in the exception handler
-                    for a in moving_axes:
-                        logging.debug("Channel %s state 0x%x", a, self._get_channel_state(a))
-                    raise TimeoutError("Move is not over after %g s, while "
-                                       "expected it takes only %g s" %
-                                       (max_dur, dur))
-
-                # Update the position from time to time (10 Hz)
-                if now - last_upd > 0.1:
-                    self._updatePosition()
-                    last_upd = time.time()
-
-                # Wait half of the time left (maximum 0.1 s)
-                left = end - time.time()
-                sleept = max(0.001, min(left / 2, 0.1))
-                future._must_stop.wait(sleept)
-            else:
-                logging.debug("Move of axes %s cancelled before the end", axes)
+            try:
+                self._move_monitor.wait(moving_axes, end, future._must_stop,
+                                        on_update=lambda _: self._updatePosition())
+            except CancelledError:
                 future._was_stopped = True
-                raise CancelledError()
+                raise
+            except TimeoutError:
+                logging.warning("Stopping move due to timeout")
+                # Note: stopping actually happens just after in the exception handler
+                for a in moving_axes:
+                    logging.debug("Channel %s state 0x%x", a, self._get_channel_state(a))
+                raise
         except Exception:
             # stop all axes still moving, either because it was cancelled or just for safety
             for a in moving_axes:
@@ -3734,6 +3751,9 @@ class FakeMCS2_DLL(object):
         self._move_finish_time = [time.time()] * 3
         self._target = [0] * 3
 
+        self._read_requests = {}  # request ID -> (channel, property key)
+        self._next_rid = 0
+
     def _get_current_pos(self, axis):
         """
         return (int): position
@@ -3806,6 +3826,18 @@ class FakeMCS2_DLL(object):
         val = _deref(p_val, c_int32)
         val.value = self.properties[property_key.value][ch.value]
 
+    def SA_CTL_RequestReadProperty(self, handle, ch, property_key, p_rid, t_handle):
+        if not property_key.value in self.properties:
+            raise SA_CTLError(SA_CTLDLL.SA_CTL_ERROR_INVALID_KEY, "error")
+        rid = _deref(p_rid, c_uint8)
+        rid.value = self._next_rid
+        self._read_requests[self._next_rid] = (c_int8(ch.value), c_uint32(property_key.value))
+        self._next_rid = (self._next_rid + 1) % 256
+
+    def SA_CTL_ReadProperty_i32(self, handle, rid, p_val, size):
+        ch, property_key = self._read_requests.pop(rid.value)
+        self.SA_CTL_GetProperty_i32(handle, ch, property_key, p_val, size)
+
     def SA_CTL_GetProperty_i64(self, handle, ch, property_key, p_val, size):
         if not property_key.value in self.properties:
             raise SA_CTLError(SA_CTLDLL.SA_CTL_ERROR_INVALID_KEY, "error")
@@ -65,6 +65,51 @@ class MultiplexTest(unittest.TestCase, simulated_test.ActuatorTest):
         self.dependency2.speed.value = sc2
         self.assertEqual(self.dev.speed.value["y"], 2)
 
+    def test_merge_rel(self):
+        """
+        Check that consecutive relative moves waiting in the queue are merged
+        """
+        self.dev.moveAbs({"x": 0, "y": 0}).result()
+        self.dev.speed.value = {"x": 0.01, "y": 0.01}
+        # Slow move on both dependencies, so that the next moves are queued (0.1 s)
+        f0 = self.dev.moveAbs({"x": 1e-3, "y": 1e-3})
+        fs = [self.dev.moveRel({"x": 1e-6, "y": -2e-6}) for i in range(5)]
+        for f in fs:
+            self.assertIs(f, fs[0])
+        fs[0].result()
+        self.assertTrue(f0.done())
+        testing.assert_pos_almost_equal(self.dev.position.value, {"x": 1e-3 + 5e-6, "y": 1e-3 - 10e-6},
+                                        atol=1e-9)
+
+        # An absolute move in-between prevents merging
+        f0 = self.dev.moveAbs({"x": 0, "y": 0})
+        f1 = self.dev.moveRel({"x": 1e-6, "y": 1e-6})
+        f2 = self.dev.moveAbs({"x": 1e-3, "y": 1e-3})
+        f3 = self.dev.moveRel({"x": 1e-6, "y": 1e-6})
+        self.assertIsNot(f1, f3)
+        self.assertIsNot(f2, f1)
+        self.assertIsNot(f2, f3)
+        f3.result()
+        self.assertTrue(f0.done())
+        self.assertTrue(f1.done())
+        self.assertTrue(f2.done())
+        testing.assert_pos_almost_equal(self.dev.position.value, {"x": 1e-3 + 1e-6, "y": 1e-3 + 1e-6},
+                                        atol=1e-9)
+
+    def test_direct_move(self):
+        """
+        Check that moves on a single dependency are kept in order with the ones on all of them
+        """
+        self.dev.moveAbs({"x": 0, "y": 0}).result()
+        self.dev.speed.value = {"x": 0.01, "y": 0.01}
+        f1 = self.dev.moveRel({"x": 1e-3})  # Directly passed to the dependency
+        f2 = self.dev.moveAbs({"x": 0, "y": 1e-3})
+        f3 = self.dev.moveRel({"y": 1e-3})
+        f3.result()
+        self.assertTrue(f1.done())
+        self.assertTrue(f2.done())
+        testing.assert_pos_almost_equal(self.dev.position.value, {"x": 0, "y": 2e-3}, atol=1e-9)
+
 
 class MultiplexOneTest(unittest.TestCase, simulated_test.ActuatorTest):
     actuator_type = MultiplexActuator
@@ -19,8 +19,11 @@ import queue
 import threading
 from abc import ABCMeta
 
+import numpy
+
 from odemis import model
 from odemis.driver import picoquant, simulated
+from odemis.util import tttr
 import os
 import time
 import unittest
@@ -386,6 +389,17 @@ class TestPH300(PicoBaseTest, unittest.TestCase):
             elif child.name == CONFIG_DET1["name"]:
                 cls.det1 = child
 
+    def test_no_tttr(self):
+        """
+        The PH300 doesn't support the TTTR mode => it should be rejected immediately
+        """
+        self.assertFalse(hasattr(self.dev, "tttr"))
+        with self.assertRaises(ValueError):
+            self.dev.start_generate(tttr=True)
+
+        # The histogram acquisition should still work afterwards
+        self.test_acquire_get()
+
 
 class TestPH330(PicoBaseTest, unittest.TestCase):
     """
@@ -457,6 +471,46 @@ class TestHH400(PicoBaseTest, unittest.TestCase):
             self.dev.syncDiv.value = i
             self.assertEqual(self.dev.syncDiv.value, i)
 
+    def test_tttr(self):
+        """
+        Acquire time-tagged events, and build the lifetime histograms from them
+        """
+        batches = []
+        received = threading.Event()
+
+        def on_tttr(df, data):
+            batches.append(data)
+            received.set()
+
+        self.dev.tttr.subscribe(on_tttr)
+        # Opening the shutters (if any) can take a while => only start counting from the first batch
+        received.wait(30)
+        time.sleep(1)
+        self.dev.tttr.unsubscribe(on_tttr)
+        time.sleep(0.5)  # Wait for the last batch
+
+        self.assertGreater(len(batches), 1)
+        self.assertEqual(batches[0].dtype, numpy.uint32)
+        self.assertEqual(batches[0].metadata[model.MD_TTTR_FORMAT], tttr.HH_T3_FORMAT)
+        self.assertEqual(batches[0].metadata[model.MD_TTTR_RESOLUTION], self.dev.pixelDuration.value)
+
+        offset = 0
+        events = []
+        for b in batches:
+            ev, offset = tttr.decode_hh_t3(b, offset)
+            events.append(ev)
+        events = numpy.concatenate(events)
+        self.assertTrue(numpy.all(numpy.diff(events["sync"].astype(numpy.int64)) >= 0))
+        npixels = max(1, numpy.count_nonzero(events["marker"]) - 1)
+        if TEST_NOHW:  # The simulator regularly sends a pixel marker
+            self.assertGreater(npixels, 10)
+        hist = tttr.lifetime_histograms(events, npixels, 1024)
+        self.assertEqual(hist.shape, (npixels, 1024))
+
+        # Check it's back to the histogram mode
+        d = self.dev.data.get()
+        self.assertEqual(d.shape, self.dev.shape[-2::-1])
+
 
 class PicoShuttersMixinTest(metaclass=ABCMeta):
     """
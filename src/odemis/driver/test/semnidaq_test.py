@@ -747,6 +747,69 @@ class TestAnalogSEM(unittest.TestCase):
         self.assertEqual(data[0, 0], buffer[margin])
         self.assertEqual(data[-1, -1], buffer[-1])
 
+    def test_downsample_fast(self):
+        """
+        Check the optimised downsampling gives the same result as the numpy version
+        """
+        if not semnidaq.downsample_fast:
+            self.skipTest("downsample_fast not available, cannot test it")
+
+        rng = numpy.random.default_rng(0)
+        for nc, res, margin, osr, dtype, average in ((1, (20, 10), 3, 1, numpy.int16, True),
+                                                     (2, (20, 10), 3, 13, numpy.int16, True),
+                                                     (3, (64, 17), 0, 7, numpy.int16, True),
+                                                     (2, (33, 5), 5, 4, numpy.uint32, False),
+                                                     (2, (20, 10), 3, 5, numpy.int8, True),
+                                                     (1, (20, 10), 0, 3, numpy.uint8, True),
+                                                     ):
+            n_samples = res[1] * (res[0] + margin) * osr
+            high = min(3000, numpy.iinfo(dtype).max)
+            low = max(-3000, numpy.iinfo(dtype).min) if average else 0
+            buffer = rng.integers(low, high, (nc, n_samples)).astype(dtype)
+            acc_dtype = util.get_best_dtype_for_acc(buffer.dtype, osr)
+            # Pass all at once, one pixel at a time, and a random number of samples at a time
+            for grain in (n_samples, osr, None):
+                data_np = numpy.zeros((nc, res[1], res[0]), dtype=dtype)
+                data_fast = numpy.zeros((nc, res[1], res[0]), dtype=dtype)
+                np_samples_n, np_samples_sum = [0] * nc, [0] * nc
+                fast_samples_n, fast_samples_sum = [0] * nc, [0] * nc
+                acquired_n = 0
+                while acquired_n < n_samples:
+                    n = grain or int(rng.integers(1, 3 * osr * res[0]))
+                    chunk = buffer[:, acquired_n:acquired_n + n]
+                    for c in range(nc):
+                        np_samples_n[c], np_samples_sum[c] = Acquirer._downsample_data(
+                            data_np[c], res, margin, acquired_n, osr, chunk[c],
+                            np_samples_n[c], np_samples_sum[c], acc_dtype, average)
+                    fast_samples_n, fast_samples_sum = semnidaq.downsample_fast.downsample(
+                        data_fast, chunk, margin, acquired_n, osr,
+                        fast_samples_n, fast_samples_sum, average)
+                    acquired_n += chunk.shape[1]
+
+                numpy.testing.assert_array_equal(data_fast, data_np)
+                self.assertEqual(fast_samples_n, [0] * nc)
+
+            if not average:  # Check the sum is correct
+                exp = buffer.reshape(nc, res[1], res[0] + margin, osr).sum(axis=3)[:, :, margin:]
+                numpy.testing.assert_array_equal(data_fast, exp)
+
+    def test_downsample_channels_unsupported_dtype(self):
+        """
+        Check the downsampling falls back to the numpy version if the dtype is not supported
+        by the optimised version
+        """
+        rng = numpy.random.default_rng(0)
+        nc, res, margin, osr = 2, (20, 10), 3, 4
+        n_samples = res[1] * (res[0] + margin) * osr
+        buffer = rng.integers(-3000, 3000, (nc, n_samples)).astype(numpy.float32)
+        data = numpy.zeros((nc, res[1], res[0]), dtype=numpy.float32)
+        samples_n, samples_sum = Acquirer._downsample_channels(data, res, margin, 0, osr, buffer,
+                                                               [0] * nc, [0] * nc, numpy.float64,
+                                                               average=True)
+        self.assertEqual(samples_n, [0] * nc)
+        exp = buffer.reshape(nc, res[1], res[0] + margin, osr).mean(axis=3)[:, :, margin:]
+        numpy.testing.assert_allclose(data, exp, rtol=1e-6)
+
     def test_acquisition(self):
         # Fast acquisition, using synchronous acquisition
         self.scanner.dwellTime.value = 1.e-6  # s
@@ -634,6 +634,58 @@ class TestSEMDrift(TestSEM):
         self.assertEqual(img.metadata[model.MD_DWELL_TIME], dwell_time)
 
 
+class TestSEMMaxRate(unittest.TestCase):
+    """
+    Tests with the detector sending the frames without waiting for the scanning duration
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        config = copy.deepcopy(CONFIG_SEM)
+        config["children"]["detector0"]["max_rate"] = True
+        cls.sem = simsem.SimSEM(**config)
+
+        for child in cls.sem.children.value:
+            if child.name == CONFIG_SED["name"]:
+                cls.sed = child
+            elif child.name == CONFIG_SCANNER["name"]:
+                cls.scanner = child
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.sem.terminate()
+
+    def test_acquire_flow(self):
+        self.scanner.scale.value = (4, 4)
+        self.scanner.resolution.value = (64, 64)
+        self.scanner.dwellTime.value = 1e-3  # s => 4 s per frame, if it was really scanning
+        frame_dur = 64 * 64 * self.scanner.dwellTime.value
+
+        number = 10
+        images = []
+        acq_done = threading.Event()
+
+        def receive_image(df, image):
+            images.append(image)
+            if len(images) >= number:
+                acq_done.set()
+
+        start = time.time()
+        self.sed.data.subscribe(receive_image)
+        try:
+            self.assertTrue(acq_done.wait(frame_dur))
+        finally:
+            self.sed.data.unsubscribe(receive_image)
+        duration = time.time() - start
+
+        self.assertLess(duration, frame_dur)
+        for im in images[:number]:
+            self.assertEqual(im.shape, (64, 64))
+            self.assertEqual(im.metadata[model.MD_DWELL_TIME], 1e-3)
+        # Same settings => same image
+        numpy.testing.assert_array_equal(images[0], images[number - 1])
+
+
 class TestIndependentDetector(unittest.TestCase):
 
     @classmethod
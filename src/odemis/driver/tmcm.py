@@ -394,6 +394,7 @@ class TMCLController(model.Actuator):
 
         # will take care of executing axis move asynchronously
         self._executor = ParallelThreadPoolExecutor()  # one task at a time
+        self._move_monitor = driver.MoveMonitor(self._getMovingAxes)
 
         self._abs_encoder = {}  # int -> bool: axis ID -> use encoder position
         self._ref_max_length = {}  # int -> float: axis ID -> max distance during referencing
@@ -1054,6 +1055,29 @@ class TMCLController(model.Actuator):
         val = self.SendInstruction(6, param, axis)
         return val
 
+    def GetAxesParam(self, axes, param):
+        """
+        Read the same axis/parameter setting of several axes, with a single exchange
+        with the device: all the instructions are sent, and then all the replies are read.
+        axes (list of int): axis numbers
+        param (0<=int<=255): parameter number
+        return (list of int): the value stored for each axis
+        """
+        if len(axes) <= 1:
+            return [self.GetAxisParam(a, param) for a in axes]
+
+        with self._ser_access:
+            try:
+                msgs = [self._send_query(6, param, a, 0) for a in axes]
+                return [self._receive_answer(6, msg) for msg in msgs]
+            except (IOError, TMCLError) as ex:  # IOError includes TimeoutError
+                # Some replies might be left => flush them, and use the regular instructions,
+                # which know how to recover (or report the error of the specific axis)
+                logging.warning("Failed to read parameter %d of axes %s at once (%s), will read them one by one",
+                                param, axes, ex)
+                self._resynchonise()
+                return [self.GetAxisParam(a, param) for a in axes]
+
     def SetAxisParam(self, axis, param, val):
         """
         Write the axis/parameter setting from the RAM
@@ -1288,12 +1312,14 @@ class TMCLController(model.Actuator):
 #         status = self.GetGlobalParam(2, gparam)
 #         return (status == 1)
 
-    def _checkErrorFlag(self, axis):
+    def _checkErrorFlag(self, axis, xef=None):
         """
         Raises an HWError if the axis error flag reports an issue
+        xef (None or int): the extended error flag, if it was already read
         """
         # Extended Error Flag: automatically reset after reading it
-        xef = self.GetAxisParam(axis, 207)
+        if xef is None:
+            xef = self.GetAxisParam(axis, 207)
         if xef & 1:
             raise HwError("Stall detected on axis %d" % (axis,))
         elif xef & 2:  # only on TMCM-3214
@@ -2080,62 +2106,56 @@ class TMCLController(model.Actuator):
         """
         do_axes = do_axes or {}
         moving_axes = set(axes)
-        moving_do_axes = set(do_axes)
-        last_upd = time.time()
         startt = time.time()
-        dur = max(0.01, min(end - last_upd, 100))
-        max_dur = dur * 2 + 1
-        logging.debug("Expecting a move of %g s, will wait up to %g s", dur, max_dur)
-        timeout = last_upd + max_dur
-        last_axes = moving_axes.copy()
-        try:
-            while not future._must_stop.is_set():
-                for aid in moving_axes.copy(): # need copy to remove during iteration
-                    if self._isOnTarget(aid):
-                        moving_axes.discard(aid)
-                    # Check whether the move has stopped due to an error
-                    self._checkErrorFlag(aid)
-
-                now = time.time()
-                for ch in moving_do_axes.copy():
-                    if now > startt + self._do_axes[ch][3]:
-                        # finished waiting for do channel
-                        moving_do_axes.discard(ch)
-
-                if not moving_axes and not moving_do_axes:
-                    # no more axes to wait for
-                    break
 
-                if now > timeout:
-                    logging.warning("Stopping move due to timeout after %g s.", max_dur)
-                    for i in moving_axes:
-                        self.MotorStop(i)
-                    raise TimeoutError("Move is not over after %g s, while "
-                                       "expected it takes only %g s" %
-                                       (max_dur, dur))
-
-                # Update the position from time to time (10 Hz)
-                if now - last_upd > 0.1 or last_axes != moving_axes:
-                    last_names = set(n for n, i in self._name_to_axis.items() if i in last_axes)
-                    self._updatePosition(last_names)
-                    last_upd = time.time()
-                    last_axes = moving_axes.copy()
-
-                # Wait half of the time left (maximum 0.1 s)
-                left = end - time.time()
-                sleept = max(0.001, min(left / 2, 0.1))
-                future._must_stop.wait(sleept)
-            else:
-                logging.debug("Move of axes %s, %s cancelled before the end", axes, do_axes)
-                # stop all axes still moving them
-                for i in moving_axes:
-                    self.MotorStop(i)
-                future._was_stopped = True
-                raise CancelledError()
+        def update_position(axes):
+            names = set(n for n, i in self._name_to_axis.items() if i in axes)
+            self._updatePosition(names)
+
+        try:
+            self._move_monitor.wait(moving_axes, end, future._must_stop,
+                                    max_dur=max(0.01, min(end - time.time(), 100)) * 2 + 1,
+                                    on_update=update_position)
+
+            # The digital output axes are only waited for a fixed time
+            for ch in do_axes:
+                left = startt + self._do_axes[ch][3] - time.time()
+                if left > 0 and future._must_stop.wait(left):
+                    logging.debug("Move of axes %s, %s cancelled before the end", axes, do_axes)
+                    raise CancelledError()
+        except CancelledError:
+            # stop all axes still moving them
+            for i in moving_axes:
+                self.MotorStop(i)
+            future._was_stopped = True
+            raise
+        except TimeoutError:
+            logging.warning("Stopping move due to timeout")
+            for i in moving_axes:
+                self.MotorStop(i)
+            raise
         finally:
             # TODO: check if the move succeded ? (= Not failed due to stallguard/limit switch)
             self._updatePosition() # update (all axes) with final position
 
+    def _getMovingAxes(self, axes):
+        """
+        axes (set of int): the axes IDs to check
+        return (set of int): the axes which have not yet reached their target
+        raise HwError: if an axis reports an error
+        """
+        # Query all the axes at once
+        axes = sorted(axes)
+        reached = self.GetAxesParam(axes, 8)
+        xefs = self.GetAxesParam(axes, 207)
+        moving = set()
+        for aid, r, xef in zip(axes, reached, xefs):
+            if r == 0:
+                moving.add(aid)
+            # Check whether the move has stopped due to an error
+            self._checkErrorFlag(aid, xef)
+        return moving
+
     def _cancelCurrentMove(self, future):
         """
         Cancels the current move (both absolute or relative). Non-blocking.
@@ -2743,6 +2763,7 @@ class CANController(model.Actuator):
 
         # will take care of executing axis move asynchronously
         self._executor = ParallelThreadPoolExecutor()  # one task at a time
+        self._move_monitor = driver.MoveMonitor(self._getMovingAxes)
 
         self._ref_max_length = {}  # int -> float: axis ID -> max distance during referencing
         axes_def = {}
@@ -3252,51 +3273,43 @@ class CANController(model.Actuator):
             CancelledError: if cancelled before the end of the move
         """
         moving_axes = set(axes)
-        last_upd = time.time()
-        dur = max(0.01, min(end - last_upd, 100))
-        max_dur = dur * 2 + 1
-        logging.debug("Expecting a move of %g s, will wait up to %g s", dur, max_dur)
-        timeout = last_upd + max_dur
-        last_axes = moving_axes.copy()
+
+        def update_position(axes):
+            names = set(n for n, i in self._name_to_axis.items() if i in axes)
+            self._updatePosition(names)
+
         time.sleep(0.2)  # wait until it starts moving (onTarget bit needs to be reset)
         try:
-            while not future._must_stop.is_set():
-                for aid in moving_axes.copy():  # need copy to remove during iteration
-                    if self._isOnTarget(aid):
-                        moving_axes.discard(aid)
-                    # Check whether the move has stopped due to an error
-                    self._checkErrorFlag(aid)
-
-                now = time.time()
-                if not moving_axes:
-                    # no more axes to wait for
-                    break
-
-                if now > timeout:
-                    logging.warning("Stopping move due to timeout after %g s.", max_dur)
-                    self.MotorStop()
-                    raise TimeoutError("Move is not over after %g s, while expected it takes only %g s" % (max_dur, dur))
-
-                # Update the position from time to time (10 Hz)
-                if now - last_upd > 0.1 or last_axes != moving_axes:
-                    last_names = set(n for n, i in self._name_to_axis.items() if i in last_axes)
-                    self._updatePosition(last_names)
-                    last_upd = time.time()
-                    last_axes = moving_axes.copy()
-
-                # Wait half of the time left (maximum 0.1 s)
-                left = end - time.time()
-                sleept = max(0.001, min(left / 2, 0.1))
-                future._must_stop.wait(sleept)
-            else:
-                logging.debug("Move of axes %s cancelled before the end", axes)
-                future._was_stopped = True
-                raise CancelledError()
+            self._move_monitor.wait(moving_axes, end, future._must_stop,
+                                    max_dur=max(0.01, min(end - time.time(), 100)) * 2 + 1,
+                                    on_update=update_position)
+        except CancelledError:
+            future._was_stopped = True
+            raise
+        except TimeoutError:
+            logging.warning("Stopping move due to timeout")
+            self.MotorStop()
+            raise
         finally:
             # TODO: check if the move succeded ? (= Not failed due to stallguard/limit switch)
             self._updatePosition()  # update (all axes) with final position
             self.MotorStop()  # stop axes to make sure that the encoder stops adjusting the position
 
+    def _getMovingAxes(self, axes):
+        """
+        axes (set of int): the axes IDs to check
+        return (set of int): the axes which have not yet reached their target
+        raise HwError: if an axis reports an error
+        """
+        # The status word is shared by all the axes => read it only once.
+        # Same as _isOnTarget() and _checkErrorFlag(), but with a single query.
+        stat = self._node.sdo[STATUS_WORD].raw
+        if stat & 0b1000:
+            raise HwError("Fault detected.")
+        if stat & 0x400:  # target reached
+            return set()
+        return set(axes)
+
     def _cancelCurrentMove(self, future):
         """
         Cancels the current move (both absolute or relative). Non-blocking.
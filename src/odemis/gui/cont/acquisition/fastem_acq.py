@@ -45,6 +45,7 @@ from odemis.acq import align, fastem, stream, fastem_conf
 from odemis.acq.align import fastem as align_fastem
 from odemis.acq.align.fastem import Calibrations
 from odemis.acq.fastem import FastEMCalibration, ROASkipped, estimate_acquisition_time
+from odemis.acq.fastem_beamshift import BeamShiftModel
 from odemis.acq.stream import StaticSEMStream
 from odemis.gui import (
     FG_COLOUR_BLIND_BLUE,
@@ -1375,6 +1376,8 @@ class FastEMMultiBeamAcquiController(object):
         stop_acq_on_failure = self.chk_stop_acq_on_failure.IsChecked()
 
         total_t = 0
+        # One model of the beam shift per scintillator, shared by all the ROAs on it
+        beam_shift_models = {}  # scintillator number -> BeamShiftModel
         project_names = list(self.project_roas.keys())
         self._main_data_model.multibeam.dwellTime.value = (
             self.main_tab_data.project_settings_data.value[project_names[0]][
@@ -1398,6 +1401,9 @@ class FastEMMultiBeamAcquiController(object):
                         pre_calib.append(Calibrations.AUTOSTIGMATION)
                     if idx % autofocus_period == 0:
                         pre_calib.append(Calibrations.SEM_AUTOFOCUS)
+                scintillator_num = roa.roc_2.value.scintillator_number.value
+                if scintillator_num not in beam_shift_models:
+                    beam_shift_models[scintillator_num] = BeamShiftModel.for_scintillator(scintillator_num)
                 f = fastem.acquire(
                     roa,
                     project_name,
@@ -1422,6 +1428,7 @@ class FastEMMultiBeamAcquiController(object):
                     acq_dwell_time=self.main_tab_data.project_settings_data.value[
                         project_name
                     ][DWELL_TIME_MULTI_BEAM],
+                    beam_shift_model=beam_shift_models[scintillator_num],
                 )
                 # If this is the last ROA in the current project, set the dwell time for the next project
                 # on completion of current project's future
@@ -51,7 +51,7 @@ from odemis.acq.stream import OpticalStream, SpectrumStream, \
     SinglePointSpectrumProjection, LineSpectrumProjection, \
     PixelTemporalSpectrumProjection, SinglePointTemporalProjection, \
     SinglePointAngularProjection, PixelAngularSpectrumProjection, \
-    ARRawProjection, ARPolarimetryProjection
+    ARRawProjection, ARPolarimetryProjection, PeakMapProjection
 from odemis.gui.comp.viewport import MicroscopeViewport, AngularResolvedViewport, \
     PlotViewport, LineSpectrumViewport, TemporalSpectrumViewport, ChronographViewport, \
     AngularSpectrumViewport, ThetaViewport
@@ -232,6 +232,8 @@ class AnalysisTab(StreamLoadMixin, Tab):
         )
         self._stream_bar_controller.add_action("From file...", self._on_add_file)
         self._stream_bar_controller.add_action("From tileset...", self._on_add_tileset)
+        self._stream_bar_controller.add_action("Peak map", self._on_add_peak_map, self._has_spectrum_cube)
+        self._peak_map = None  # PeakMapProjection displayed in the "Combined 2" view, or None
 
         # Show the file info and correction selection
         self._settings_controller = settings.AnalysisSettingsController(
@@ -321,6 +323,61 @@ class AnalysisTab(StreamLoadMixin, Tab):
     def _on_add_tileset(self):
         self.select_acq_file(extend=True, tileset=True)
 
+    def _get_spectrum_cubes(self):
+        """
+        :returns: (list of StaticSpectrumStream) the (non temporal, non angular) spectrum streams
+          currently opened, which contain more than one pixel.
+        """
+        spec_streams = [s for s in self.tab_data_model.streams.value if isinstance(s, SpectrumStream)]
+        spectrum = self._get_time_spectrum_streams(spec_streams)[0]
+        return [s for s in spectrum
+                if s.calibrated.value is not None and s.calibrated.value.shape[-1] * s.calibrated.value.shape[-2] > 1]
+
+    def _has_spectrum_cube(self):
+        return bool(self._get_spectrum_cubes())
+
+    def _on_add_peak_map(self):
+        """
+        Called when the user requests to display the peak map of the spectrum cube.
+        The map of the peak position replaces the spectrum stream in the "Combined 2" view.
+        """
+        spec_streams = self._get_spectrum_cubes()
+        if not spec_streams:
+            logging.info("No spectrum cube opened, cannot display a peak map")
+            return
+        spec_stream = spec_streams[0]
+
+        self._remove_peak_map()
+        proj = PeakMapProjection(spec_stream)
+        if spec_stream.peak_method.value == "lorentzian":
+            proj.fitType.value = "lorentzian_space"
+        self._peak_map = proj
+
+        view = self._def_views[3]  # Combined 2
+        view.removeStream(spec_stream)
+        view.addStream(proj)
+        view.name.value = "Peak map"
+
+        visible_views = list(self.tab_data_model.visible_views.value)
+        if view not in visible_views:
+            visible_views[1] = view
+            self.tab_data_model.visible_views.value = visible_views
+
+    def _remove_peak_map(self):
+        """
+        Stops displaying the peak map (if it's displayed), and put back the spectrum stream in its view
+        """
+        if self._peak_map is None:
+            return
+
+        proj, self._peak_map = self._peak_map, None
+        proj.cancel()
+        view = self._def_views[3]  # Combined 2
+        view.removeStream(proj.stream)  # Removes the projection
+        view.name.value = "Combined 2"
+        if proj.stream in self.tab_data_model.streams.value:
+            view.addStream(proj.stream)
+
     def _get_time_spectrum_streams(self, spec_streams):
         """
         Sort spectrum streams into the substreams according to types spectrum, temporal spectrum,
@@ -385,6 +442,7 @@ class AnalysisTab(StreamLoadMixin, Tab):
             self.panel.vp_thetaspec.clear()
             self.panel.vp_angular.clear()
             self.panel.vp_angular_pol.clear()
+            self._remove_peak_map()
 
         gc.collect()
         if filename is None:
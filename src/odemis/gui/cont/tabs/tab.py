@@ -27,6 +27,7 @@ import logging
 import wx
 
 import odemis.gui.model as guimod
+from odemis.acq.stream import get_update_scheduler
 
 
 class Tab(object):
@@ -60,11 +61,27 @@ class Tab(object):
             self._connect_interpolation_event()
             self._connect_crosshair_event()
             self._connect_pixelvalue_event()
+            self._set_update_visibility()
 
             self.highlight(False)
 
         self.panel.Show(show)
 
+    def _set_update_visibility(self):
+        """ Give priority to the update of the streams displayed in this tab. The
+        streams of the other tabs (ie, hidden) are updated less often.
+        """
+        visible_views = getattr(self.tab_data_model, "visible_views", None)
+        if visible_views is None:
+            get_update_scheduler().setVisibilityFilter(None)
+            return
+
+        def is_visible(stream):
+            return any(stream in v.getStreams() for v in visible_views.value
+                       if hasattr(v, "getStreams"))
+
+        get_update_scheduler().setVisibilityFilter(is_visible)
+
     def _connect_22view_event(self):
         """ If the tab has a 2x2 view, this method will connect it to the 2x2
         view menu item (or ensure it's disabled).
@@ -61,6 +61,8 @@ BACKEND_NAME = "backend"  # the official name for the backend container
 BACKEND_FILE = os.path.join(BASE_DIRECTORY, BACKEND_NAME + ".ipc")  # the official ipc file for backend (just to detect status)
 
 _microscope = None
+_registry = None  # _ComponentRegistry of the _microscope
+_registry_lock = threading.Lock()
 
 
 def getMicroscope():
@@ -82,6 +84,102 @@ def getMicroscope():
     return _microscope
 
 
+class _ComponentRegistry(object):
+    """
+    Index of the components alive in the backend, by name and by role.
+    It's kept up-to-date by listening to the .alive VA of the microscope, so
+    that looking for a component doesn't need any remote call, and the same
+    proxies are reused.
+    """
+
+    def __init__(self, microscope):
+        """
+        microscope (Microscope): the root of the components
+        raise: any exception if it's not possible to subscribe to .alive
+        """
+        self.microscope = microscope
+        self._lock = threading.Lock()
+        self._by_name = {}  # str -> Component
+        self._by_role = {}  # str -> list of Components
+        microscope.alive.subscribe(self._on_alive, init=True)
+
+    def _on_alive(self, alive):
+        comps = set(alive) | {self.microscope}
+        with self._lock:
+            by_name = {}
+            for c in comps:
+                # Reuse the previous proxy, if it's the same component
+                prev = self._by_name.get(c.name)
+                if prev is not None and prev == c:
+                    c = prev
+                by_name[c.name] = c
+            by_role = {}
+            for c in by_name.values():
+                by_role.setdefault(c.role, []).append(c)
+            self._by_name = by_name
+            self._by_role = by_role
+        logging.debug("Component registry updated with %d components", len(by_name))
+
+    def get_components(self):
+        """
+        return (set of Component): all the components alive (including the microscope)
+        """
+        with self._lock:
+            return set(self._by_name.values())
+
+    def find(self, name=None, role=None):
+        """
+        return (Component or None): the component with the given name and/or role,
+          or None if there is no such component.
+        """
+        with self._lock:
+            if name is not None:
+                c = self._by_name.get(name)
+                if c is not None and (role is None or c.role == role):
+                    return c
+                return None
+            comps = self._by_role.get(role)
+            return comps[0] if comps else None
+
+    def refresh(self):
+        """
+        Update the index from the current alive components (in case the
+        notification of a change has not been received yet)
+        """
+        self._on_alive(self.microscope.alive.value)
+
+    def close(self):
+        try:
+            self.microscope.alive.unsubscribe(self._on_alive)
+        except Exception as ex:
+            # Typically, because the backend is already stopped
+            logging.debug("Failed to unsubscribe from the alive components: %s", ex)
+
+
+def _getRegistry():
+    """
+    return (_ComponentRegistry or None): the registry of the current microscope,
+      or None if it's not possible to keep one (in which case, the components
+      have to be looked up from the microscope every time).
+    """
+    global _registry
+    microscope = getMicroscope()
+    with _registry_lock:
+        if _registry is not None and _registry.microscope is not microscope:
+            # The microscope was reset => the components are probably different
+            _registry.close()
+            _registry = None
+
+        if _registry is None:
+            try:
+                _registry = _ComponentRegistry(microscope)
+            except Exception:
+                logging.warning("Failed to index the components, will look them up every time",
+                                exc_info=True)
+                return None
+        return _registry
+
+
 def getComponent(name=None, role=None):
     """
     Find a component, according to its name or role.
@@ -98,25 +196,38 @@ def getComponent(name=None, role=None):
     if name is None and role is None:
         raise ValueError("Need to specify at least a name or a role")
 
-    for c in getComponents():
-        if name is not None and c.name != name:
-            continue
-        if role is not None and c.role != role:
-            continue
-        return c
+    registry = _getRegistry()
+    if registry is not None:
+        c = registry.find(name, role)
+        if c is None:
+            # Maybe the component just became alive
+            registry.refresh()
+            c = registry.find(name, role)
+        if c is not None:
+            return c
     else:
-        errors = []
-        if name is not None:
-            errors.append("name %s" % name)
-        if role is not None:
-            errors.append("role %s" % role)
-        raise LookupError("No component with the %s" % (" and ".join(errors),))
+        for c in getComponents():
+            if name is not None and c.name != name:
+                continue
+            if role is not None and c.role != role:
+                continue
+            return c
+
+    errors = []
+    if name is not None:
+        errors.append("name %s" % name)
+    if role is not None:
+        errors.append("role %s" % role)
+    raise LookupError("No component with the %s" % (" and ".join(errors),))
 
 
 def getComponents():
     """
     return (set of Component): all the HwComponents (alive) managed by the backend
     """
+    registry = _getRegistry()
+    if registry is not None:
+        return registry.get_components()
     microscope = getMicroscope()
     return microscope.alive.value | {microscope}
     # return _getChildren(microscope)
@@ -39,6 +39,10 @@ class CancellableThreadPoolExecutor(ThreadPoolExecutor):
     def __init__(self, max_workers):
         ThreadPoolExecutor.__init__(self, max_workers)
         self._queue = collections.deque() # thread-safe queue of futures
+        # Last task submitted with submit_mergeable(), as long as it's not started,
+        # and no other task was submitted after it.
+        self._mergeable = None  # _MergeableTask
+        self._merge_lock = threading.Lock()  # protects _mergeable
 
     def submitf(self, f, fn, *args, **kwargs):
         """
@@ -55,7 +59,10 @@ class CancellableThreadPoolExecutor(ThreadPoolExecutor):
 
             w = _WorkItem(f, fn, args, kwargs)
 
-            self._work_queue.put(w)
+            with self._merge_lock:
+                # The new task is after the mergeable one => no more merging possible
+                self._mergeable = None
+                self._work_queue.put(w)
             self._adjust_thread_count()
 
             # add to the queue and track the task
@@ -67,6 +74,44 @@ class CancellableThreadPoolExecutor(ThreadPoolExecutor):
         return self.submitf(futures.Future(), fn, *args, **kwargs)
     submit.__doc__ = ThreadPoolExecutor.submit.__doc__
 
+    def submit_mergeable(self, merge, fn, *args, **kwargs):
+        """
+        Submit a task, which can be merged with the previous task. If the previous
+        task was also submitted with submit_mergeable(), with the same function and
+        keyword arguments, and it hasn't started yet, no new task is created.
+        Instead, the arguments of the pending task are updated to also do the work
+        of the new task, and the future of the pending task is returned.
+        This is typically used to merge consecutive relative moves.
+        Note: as the future is shared, cancelling it cancels all the merged tasks.
+        merge (callable (tuple, tuple) -> tuple): returns the positional arguments
+          of the merged task, based on the arguments of the pending task and the
+          new ones.
+        fn (callable): the function to call
+        args, kwargs -> passed to fn
+        returns (Future): the future of the task (potentially, of the pending task)
+        """
+        with self._merge_lock:
+            task = self._mergeable
+            if (task is not None and task.fn == fn and task.kwargs == kwargs
+                and not task.future.done()):
+                task.args = merge(task.args, args)
+                logging.debug("Merged task %s into pending one", fn)
+                return task.future
+
+        task = _MergeableTask(self, fn, args, kwargs)
+        task.future = self.submit(task.run)
+        with self._shutdown_lock, self._merge_lock:
+            # Only mergeable if nothing else was submitted in-between, and not started yet
+            if task.args is not None and self._queue and self._queue[-1] is task.future:
+                self._mergeable = task
+        return task.future
+
+    def is_idle(self):
+        """
+        return (bool): True if no task is running or waiting to be run
+        """
+        return not self._queue
+
     def _on_done(self, future):
         # task is over
         try:
@@ -121,6 +166,28 @@ class CancellableThreadPoolExecutor(ThreadPoolExecutor):
             return None
 
 
+class _MergeableTask(object):
+    """
+    Task submitted via CancellableThreadPoolExecutor.submit_mergeable(), whose
+    arguments can be updated as long as it hasn't started.
+    """
+    def __init__(self, executor, fn, args, kwargs):
+        self.executor = executor
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.future = None
+
+    def run(self):
+        # From now on, it's not possible to merge anymore
+        with self.executor._merge_lock:
+            if self.executor._mergeable is self:
+                self.executor._mergeable = None
+            args = self.args
+            self.args = None
+        return self.fn(*args, **self.kwargs)
+
+
 class ParallelThreadPoolExecutor(ThreadPoolExecutor):
     """
     An extended ThreadPoolExecutor that can execute multiple jobs in parallel
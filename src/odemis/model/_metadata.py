@@ -26,6 +26,7 @@ These are the conventional metadata available in a DataArray.
 MD_EXP_TIME = "Exposure time"  # s
 MD_ACQ_DATE = "Acquisition date"  # s since epoch
 MD_ACQ_RECIPES = "Acquisition recipes"  # str, comma-separated names of the recipe files used to configure the streams for an acquisition
+MD_ACQ_TIMING = "Acquisition timing"  # dict str -> float: average time (s) spent per snapshot in each step of a software synchronised acquisition
 MD_AD_LIST = "Acquisition dates"  # s since epoch for each element in dimension T
 # distance between two points on the sample that are seen at the centre of two
 # adjacent pixels considering that these two points are in focus
@@ -81,6 +82,7 @@ MD_BEAM_CURRENT = "Electron beam emission current"  # A (float), emission curren
 # (typically, the probe current is a bit smaller and the spot diameter is linearly proportional)
 MD_BEAM_SPOT_DIAM = "Electron beam spot diameter"  # m (float), approximate diameter of the beam spot
 MD_BEAM_COLUMN_TILT = "Beam column tilt"  # (rad) tilt of the beam column
+MD_SCAN_MASK = "Scan mask"  # bool array (Y, X): True for the pixels actually scanned, the others being interpolated (sparse scanning)
 
 # deprecated: use MD_BEAM_* instead
 MD_DWELL_TIME = MD_BEAM_DWELL_TIME
@@ -109,6 +111,8 @@ MD_EBEAM_CURRENT_TIME = "Electron beam emission current over time"
 MD_WL_LIST = "Wavelength list"  # m... (list of float), wavelength for each pixel. The list is the same length as the C dimension
 MD_TIME_LIST = "Time list"  # sec (array) containing the corrections for the timestamp corresponding to each px
 MD_THETA_LIST = "Theta list"  # rad (array) containing the theta values
+MD_TTTR_FORMAT = "TTTR format"  # str, encoding of the time-tagged event records (eg, "HH-T3-V2")
+MD_TTTR_RESOLUTION = "TTTR resolution"  # s, duration of one unit of the start-stop time of the time-tagged events
 
 # Deprecrated: use MD_TIME_LIST
 MD_PIXEL_DUR = "Pixel duration"  # Time duration of a 'pixel' along the time dimension
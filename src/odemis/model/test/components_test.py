@@ -225,6 +225,61 @@ class TestActuator(unittest.TestCase):
 #             self.assertAlmostEqual(val, abs_mov_back[axis])
 
 
+class TestComponentRegistry(unittest.TestCase):
+    """
+    Test model.getComponent(), with a microscope in the same process
+    """
+
+    def setUp(self):
+        self.mic = model.Microscope("Test Microscope", "sparc2")
+        self.ccd = model.HwComponent("Camera", "ccd")
+        self.stage = model.HwComponent("Stage", "stage")
+        self.mic.alive.value = {self.ccd, self.stage}
+        self._orig_microscope = model._core._microscope
+        model._core._microscope = self.mic
+
+    def tearDown(self):
+        model._core._microscope = self._orig_microscope
+        self.ccd.terminate()
+        self.stage.terminate()
+        self.mic.terminate()
+
+    def test_get_component(self):
+        self.assertIs(model.getComponent(role="ccd"), self.ccd)
+        self.assertIs(model.getComponent(name="Stage"), self.stage)
+        self.assertIs(model.getComponent(name="Stage", role="stage"), self.stage)
+        self.assertIs(model.getComponent(role="sparc2"), self.mic)
+        self.assertEqual(model.getComponents(), {self.mic, self.ccd, self.stage})
+        with self.assertRaises(LookupError):
+            model.getComponent(name="Stage", role="ccd")
+        with self.assertRaises(LookupError):
+            model.getComponent(role="focus")
+
+    def test_alive_update(self):
+        self.assertIs(model.getComponent(role="ccd"), self.ccd)
+
+        # New component => immediately found
+        focus = model.HwComponent("Focus", "focus")
+        self.mic.alive.value = self.mic.alive.value | {focus}
+        self.assertIs(model.getComponent(role="focus"), focus)
+
+        # Component removed => not found anymore
+        self.mic.alive.value = {self.stage, focus}
+        with self.assertRaises(LookupError):
+            model.getComponent(role="ccd")
+        self.assertEqual(model.getComponents(), {self.mic, self.stage, focus})
+        focus.terminate()
+
+    def test_reset_microscope(self):
+        self.assertIs(model.getComponent(role="ccd"), self.ccd)
+        mic2 = model.Microscope("Test Microscope 2", "secom")
+        model._core._microscope = mic2
+        with self.assertRaises(LookupError):
+            model.getComponent(role="ccd")
+        self.assertIs(model.getComponent(role="secom"), mic2)
+        mic2.terminate()
+
+
 class FakeActuator(Actuator):
     @isasync
     def moveRel(self, shift):
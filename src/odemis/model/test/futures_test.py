@@ -91,6 +91,43 @@ class TestExecutor(unittest.TestCase):
 
         self.assertGreaterEqual(cancelled, 10)
 
+    def test_mergeable(self):
+        """
+        Check that pending tasks submitted with submit_mergeable() are merged
+        """
+        self.executor = CancellableThreadPoolExecutor(max_workers=1)
+        self.assertTrue(self.executor.is_idle())
+        calls = []
+
+        def merge(args, new_args):
+            return (args[0] + new_args[0],)
+
+        def task(v):
+            calls.append(v)
+            time.sleep(0.1)
+            return v
+
+        f0 = self.executor.submit_mergeable(merge, task, 1)
+        self.assertFalse(self.executor.is_idle())
+        time.sleep(0.05)  # f0 is running => cannot be merged anymore
+        fs = [self.executor.submit_mergeable(merge, task, 2) for i in range(3)]
+        for f in fs:
+            self.assertIs(f, fs[0])
+        self.assertIsNot(f0, fs[0])
+        # Another task in-between prevents merging
+        f4 = self.executor.submit(task, 10)
+        f5 = self.executor.submit_mergeable(merge, task, 3)
+        f6 = self.executor.submit_mergeable(merge, task, 3)
+        self.assertIs(f5, f6)
+
+        self.assertEqual(f5.result(), 6)
+        self.assertEqual(fs[0].result(), 6)
+        self.assertEqual(f0.result(), 1)
+        self.assertEqual(f4.result(), 10)
+        self.assertEqual(calls, [1, 6, 10, 6])
+        time.sleep(0.01)
+        self.assertTrue(self.executor.is_idle())
+
     def _task(self, dur):
         time.sleep(dur)
         return dur
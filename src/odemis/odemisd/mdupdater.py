@@ -20,13 +20,99 @@ You should have received a copy of the GNU General Public License along with
 Odemis. If not, see http://www.gnu.org/licenses/.
 '''
 import collections
+import heapq
 import itertools
 import logging
-from typing import Optional, Tuple, Dict, Union, List
+import math
+import threading
+import time
+from typing import Any, Callable, Optional, Tuple, Dict, Union, List
 
 from odemis import model, util
 
 
+class MetadataCoalescer:
+    '''
+    Sends the metadata updates of a component, merging the updates which come
+    in quick succession, so that only the latest value of each metadata is sent.
+    There are two kinds of updates:
+    * immediate: the metadata is on the component when update() returns. This
+      is needed for the positions of the actuators, as the frames acquired
+      just after a move must have the final position (the move is only complete
+      after the position is updated). The updates received while another
+      update is being sent are merged into a single call.
+    * rate-limited: the first update after a quiet period is sent immediately.
+      The updates received less than a period after the previous sending are
+      merged, and sent together at the end of the period.
+    In all cases, the component always ends up with the latest values, and
+    they are received in the same order as they were updated.
+    '''
+
+    def __init__(self, comp: model.HwComponent, period: float,
+                 schedule: Callable[["MetadataCoalescer", float], None]):
+        '''
+        :param comp: the component of which the metadata is updated
+        :param period: minimum time between two calls to comp.updateMetadata()
+          for the rate-limited updates (s)
+        :param schedule: function to call flush() after a given delay (s)
+        '''
+        self._comp = comp
+        self._period = period
+        self._schedule = schedule
+
+        # Taken while sending, which guarantees that the updates stay in order
+        self._send_lock = threading.Lock()
+        self._lock = threading.Lock()  # Protects the attributes below
+        self._pending = {}  # str -> value: metadata not yet sent
+        self._scheduled = False  # True when a flush() is scheduled
+        self._last_send = -math.inf  # time.monotonic() of the last sending
+
+        # Statistics, for instrumentation
+        self.changes = 0  # number of updates received
+        self.calls = 0  # number of calls to updateMetadata()
+
+    def update(self, md: Dict[str, Any], immediate: bool = False) -> None:
+        '''
+        Update the metadata of the component.
+        :param md: metadata to update
+        :param immediate: if True, the metadata is sent before returning.
+          Otherwise, it's sent a bit later if the component was updated recently.
+        '''
+        with self._lock:
+            self._pending.update(md)
+            self.changes += 1
+            if not immediate:
+                if self._scheduled:  # It will be sent by the next flush()
+                    return
+                delay = self._last_send + self._period - time.monotonic()
+                if delay > 0:
+                    self._scheduled = True
+                    self._schedule(self, delay)
+                    return
+
+        self.flush()
+
+    def flush(self) -> None:
+        '''
+        Send all the pending metadata. If another thread is already sending
+        some metadata, wait for it to be done first.
+        '''
+        with self._send_lock:
+            with self._lock:
+                md = self._pending
+                self._pending = {}
+                self._scheduled = False
+                if not md:  # Already sent by another thread
+                    return
+                self._last_send = time.monotonic()
+
+            try:
+                self._comp.updateMetadata(md)
+                self.calls += 1
+            except Exception:
+                logging.warning("Failed to update metadata of %s", self._comp.name, exc_info=True)
+
+
 class MetadataUpdater(model.Component):
     '''
     Takes care of updating the metadata of detectors, based on the physical
@@ -36,9 +122,22 @@ class MetadataUpdater(model.Component):
     # This is kept in a separate module from the main backend because it has to
     # know the business semantic.
 
-    def __init__(self, name, microscope, **kwargs):
+    # Minimum time between two updates of the metadata of a component (s).
+    # During continuous changes (eg, lens or light settings), this avoids
+    # flooding the detectors with (remote) calls. The positions of the actuators
+    # are always sent immediately, so that a move only completes once the
+    # metadata is updated.
+    UPDATE_PERIOD = 0.02  # s
+    # Time between two reports of the rate of metadata updates (s)
+    STATS_PERIOD = 60  # s
+
+    def __init__(self, name, microscope, update_period: float = UPDATE_PERIOD, **kwargs):
         '''
         microscope (model.Microscope): the microscope to observe and update
+        update_period: minimum time between two updates of the metadata of the
+          same component (s), except for the actuator positions. The changes
+          happening during this period are merged. If 0, each change is sent
+          immediately.
         '''
         model.Component.__init__(self, name, **kwargs)
 
@@ -61,6 +160,18 @@ class MetadataUpdater(model.Component):
         self._det_to_spectrograph : Dict[str, model.HwComponent] = {}  # Detector name -> Spectrograph that affects that detector
         self._det_to_filter : Dict[str, model.HwComponent] = {}  # Detector name -> Filter that affects that detector
 
+        # To send the metadata at a limited rate
+        self._update_period = update_period
+        self._coalescers: Dict[str, MetadataCoalescer] = {}  # Component name -> Coalescer
+        self._flush_queue = []  # heap of (time, int, MetadataCoalescer): coalescers to flush
+        self._flush_counter = itertools.count()  # to never compare the coalescers in the heap
+        self._flush_cv = threading.Condition()  # Protects _flush_queue and _must_stop
+        self._must_stop = False
+        self._flush_thread = threading.Thread(target=self._runFlusher,
+                                              name="Metadata updater flusher")
+        self._flush_thread.daemon = True
+        self._flush_thread.start()
+
         microscope.alive.subscribe(self._onAlive, init=True)
 
     def _getComponent(self, name):
@@ -77,6 +188,75 @@ class MetadataUpdater(model.Component):
 
         return comp
 
+    def _updateMetadata(self, comp: model.HwComponent, md: Dict[str, Any],
+                        immediate: bool = False) -> None:
+        """
+        Update the metadata of a component (see MetadataCoalescer)
+        :param comp: the component to update
+        :param md: the metadata to update
+        :param immediate: if True, the metadata is sent before returning. To be
+          used for the updates caused by a move, so that the move only completes
+          after the metadata is updated. Otherwise, it is sent at a limited rate.
+        """
+        try:
+            coalescer = self._coalescers[comp.name]
+        except KeyError:
+            coalescer = self._coalescers.setdefault(comp.name,
+                            MetadataCoalescer(comp, self._update_period, self._scheduleFlush))
+        coalescer.update(md, immediate)
+
+    def _scheduleFlush(self, coalescer: MetadataCoalescer, delay: float) -> None:
+        """
+        Call coalescer.flush() after the given delay (s), from the flusher thread
+        """
+        with self._flush_cv:
+            heapq.heappush(self._flush_queue,
+                           (time.monotonic() + delay, next(self._flush_counter), coalescer))
+            self._flush_cv.notify()
+
+    def _runFlusher(self) -> None:
+        """
+        Flush the coalescers when their time has come, and regularly log the
+        rate of metadata updates. Runs in a separate thread.
+        """
+        try:
+            prev_stats = time.monotonic()
+            prev_changes, prev_calls = 0, 0
+            while True:
+                coalescer = None
+                with self._flush_cv:
+                    while True:
+                        if self._must_stop:
+                            return
+                        now = time.monotonic()
+                        if self._flush_queue and self._flush_queue[0][0] <= now:
+                            coalescer = heapq.heappop(self._flush_queue)[2]
+                            break
+                        if now >= prev_stats + self.STATS_PERIOD:
+                            break
+                        next_t = prev_stats + self.STATS_PERIOD
+                        if self._flush_queue:
+                            next_t = min(next_t, self._flush_queue[0][0])
+                        self._flush_cv.wait(next_t - now)
+
+                if coalescer:
+                    coalescer.flush()
+                    continue
+
+                # Time to report the statistics
+                coalescers = list(self._coalescers.values())
+                changes = sum(c.changes for c in coalescers)
+                calls = sum(c.calls for c in coalescers)
+                dur = now - prev_stats
+                if changes > prev_changes:
+                    logging.debug("Metadata updates: %.1f calls/s, for %.1f changes/s",
+                                  (calls - prev_calls) / dur, (changes - prev_changes) / dur)
+                prev_stats, prev_changes, prev_calls = now, changes, calls
+        except Exception:
+            logging.exception("Failure in the metadata flusher")
+        finally:
+            logging.debug("Metadata flusher thread over")
+
     def _onAlive(self, components):
         """
         Called when alive is changed => some component started or died
@@ -171,7 +351,7 @@ class MetadataUpdater(model.Component):
             md = {model.MD_POS: (x, y)}
             logging.debug("Updating position for component %s, to %f, %f",
                           comp_affected.name, x, y)
-            comp_affected.updateMetadata(md)
+            self._updateMetadata(comp_affected, md, immediate=True)
 
         stage.position.subscribe(updateStagePos, init=True)
         self._onTerminate.append((stage.position.unsubscribe, (updateStagePos,)))
@@ -185,7 +365,7 @@ class MetadataUpdater(model.Component):
 
         # update static information
         md = {model.MD_LENS_NAME: lens.hwVersion}
-        comp_affected.updateMetadata(md)
+        self._updateMetadata(comp_affected, md)
 
         # List of direct VA -> MD mapping
         md_va_list = {"numericalAperture": model.MD_LENS_NA,
@@ -232,7 +412,7 @@ class MetadataUpdater(model.Component):
                 md = {model.MD_PIXEL_SIZE: mpp,
                       model.MD_LENS_MAG: mag,
                       model.MD_BINNING: binning,}
-                comp_affected.updateMetadata(md)
+                self._updateMetadata(comp_affected, md)
 
             lens.magnification.subscribe(updatePixelDensity, init=True)
             self._onTerminate.append((lens.magnification.unsubscribe, (updatePixelDensity,)))
@@ -246,7 +426,7 @@ class MetadataUpdater(model.Component):
                 # Create a different function for each metadata & component
                 def updateMDFromVABin(val, md_key=md_key, comp_affected=comp_affected):
                     md = {md_key: val}
-                    comp_affected.updateMetadata(md)
+                    self._updateMetadata(comp_affected, md)
 
                 logging.debug("Listening to VA %s.%s -> MD %s", lens.name, va_name, md_key)
                 va = getattr(lens, va_name)
@@ -275,7 +455,7 @@ class MetadataUpdater(model.Component):
                     val = va.value
                     val_bin = tuple(v / binning[bi] for v, bi in zip(val, bin_idx))
                     md = {md_key: val_bin}
-                    comp_affected.updateMetadata(md)
+                    self._updateMetadata(comp_affected, md)
 
                 logging.debug("Listening to VA %s.%s -> MD %s", lens.name, va_name, md_key)
                 va.subscribe(updateMDFromVABin, init=True)
@@ -304,7 +484,7 @@ class MetadataUpdater(model.Component):
                 wl_range = (0, 0)
 
             md = {model.MD_IN_WL: wl_range, model.MD_LIGHT_POWER: sum(power)}
-            comp_affected.updateMetadata(md)
+            self._updateMetadata(comp_affected, md)
 
         light.power.subscribe(updateLightPower, init=True)
         self._onTerminate.append((light.power.unsubscribe, (updateLightPower,)))
@@ -429,7 +609,7 @@ class MetadataUpdater(model.Component):
                               comp_affected.name, filter_bandwidth, spec_bandwidth, bandwidth)
 
         logging.debug("Updating output wavelength for component %s to %s", comp_affected.name, bandwidth)
-        comp_affected.updateMetadata({model.MD_OUT_WL: bandwidth})
+        self._updateMetadata(comp_affected, {model.MD_OUT_WL: bandwidth}, immediate=True)
 
     def observeSpectrograph(self, spectrograph, comp_affected) -> bool:
 
@@ -468,7 +648,7 @@ class MetadataUpdater(model.Component):
                 md = {model.MD_WL_LIST: wll}
                 if "slit-in" in sp.position.value:
                     md[model.MD_INPUT_SLIT_WIDTH] = sp.position.value["slit-in"]
-                det.updateMetadata(md)
+                self._updateMetadata(det, md)
 
             # Schedule metadata update whenever a VA changes
             def on_va_change(_):
@@ -499,7 +679,7 @@ class MetadataUpdater(model.Component):
                     assert isinstance(metadata_cor, dict), "Expected a dictionary format"
                     assert all(
                         isinstance(key, str) for key in metadata_cor), "All keys should be strings"
-                    comp_affected.updateMetadata(metadata_cor)
+                    self._updateMetadata(comp_affected, metadata_cor, immediate=True)
                 except (AssertionError, KeyError) as exp:
                     # Check if CHROMATIC_COR is a dictionary with filter band positions as keys and correction metadata
                     # dictionary as values. For e.g. correction metadata dictionary for a given band position has
@@ -517,7 +697,7 @@ class MetadataUpdater(model.Component):
         if model.hasVA(qwp, "position"):
             def updatePosition(pos, comp_affected=comp_affected):
                 md = {model.MD_POL_POS_QWP: pos["rz"]}
-                comp_affected.updateMetadata(md)
+                self._updateMetadata(comp_affected, md, immediate=True)
 
             qwp.position.subscribe(updatePosition, init=True)
             self._onTerminate.append((qwp.position.unsubscribe, (updatePosition,)))
@@ -529,7 +709,7 @@ class MetadataUpdater(model.Component):
         if model.hasVA(linpol, "position"):
             def updatePosition(pos, comp_affected=comp_affected):
                 md = {model.MD_POL_POS_LINPOL: pos["rz"]}
-                comp_affected.updateMetadata(md)
+                self._updateMetadata(comp_affected, md, immediate=True)
 
             linpol.position.subscribe(updatePosition, init=True)
             self._onTerminate.append((linpol.position.unsubscribe, (updatePosition,)))
@@ -541,7 +721,7 @@ class MetadataUpdater(model.Component):
         if model.hasVA(analyzer, "position"):
             def updatePosition(pos, comp_affected=comp_affected):
                 md = {model.MD_POL_MODE: pos["pol"]}
-                comp_affected.updateMetadata(md)
+                self._updateMetadata(comp_affected, md, immediate=True)
 
             analyzer.position.subscribe(updatePosition, init=True)
             self._onTerminate.append((analyzer.position.unsubscribe, (updatePosition,)))
@@ -557,7 +737,7 @@ class MetadataUpdater(model.Component):
 
         def updateMagnification(mag, comp_affected=comp_affected):
             md = {model.MD_LENS_MAG: mag}
-            comp_affected.updateMetadata(md)
+            self._updateMetadata(comp_affected, md)
 
         streak_lens.magnification.subscribe(updateMagnification, init=True)
         self._onTerminate.append((streak_lens.magnification.unsubscribe, (updateMagnification,)))
@@ -575,7 +755,7 @@ class MetadataUpdater(model.Component):
         if model.hasVA(streak_delay, "triggerDelay"):
             def updateTriggerDelay(delay, comp_affected=comp_affected):
                 md = {model.MD_TRIGGER_DELAY: delay}
-                comp_affected.updateMetadata(md)
+                self._updateMetadata(comp_affected, md)
 
             streak_delay.triggerDelay.subscribe(updateTriggerDelay, init=True)
             self._onTerminate.append((streak_delay.triggerDelay.unsubscribe, (updateTriggerDelay,)))
@@ -584,7 +764,7 @@ class MetadataUpdater(model.Component):
         if model.hasVA(streak_delay, "triggerRate"):
             def updateTriggerRate(rate, comp_affected=comp_affected):
                 md = {model.MD_TRIGGER_RATE: rate}
-                comp_affected.updateMetadata(md)
+                self._updateMetadata(comp_affected, md)
 
             streak_delay.triggerRate.subscribe(updateTriggerRate, init=True)
             self._onTerminate.append((streak_delay.triggerRate.unsubscribe, (updateTriggerRate,)))
@@ -613,7 +793,7 @@ class MetadataUpdater(model.Component):
         for va_name, md_key in va_md_map.items():
             if model.hasVA(ebeam, va_name):
                 def updateBeamParam(val, md_key=md_key, comp_affected=comp_affected):
-                    comp_affected.updateMetadata({md_key: val})
+                    self._updateMetadata(comp_affected, {md_key: val})
 
                 va = getattr(ebeam, va_name)
                 va.subscribe(updateBeamParam, init=True)
@@ -623,7 +803,7 @@ class MetadataUpdater(model.Component):
         if comp_affected.role == "multibeam":
             def updateRotation(rot, comp_affected=comp_affected):
                 md = {model.MD_ROTATION: rot}
-                comp_affected.updateMetadata(md)
+                self._updateMetadata(comp_affected, md)
 
             ebeam.rotation.subscribe(updateRotation, init=True)
             self._onTerminate.append((ebeam.rotation.unsubscribe, (updateRotation,)))
@@ -634,6 +814,11 @@ class MetadataUpdater(model.Component):
     def terminate(self):
         self._mic.alive.unsubscribe(self._onAlive)
 
+        with self._flush_cv:
+            self._must_stop = True
+            self._flush_cv.notify()
+        self._flush_thread.join(5)
+
         # call all the unsubscribes
         for fun, args in self._onTerminate:
             try:
@@ -641,4 +826,8 @@ class MetadataUpdater(model.Component):
             except Exception as ex:
                 logging.warning("Failed to unsubscribe metadata properly: %s", ex)
 
+        # The flusher thread is over, so send directly the updates still pending
+        for coalescer in list(self._coalescers.values()):
+            coalescer.flush()
+
         model.Component.terminate(self)
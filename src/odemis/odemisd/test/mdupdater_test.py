@@ -19,13 +19,14 @@ You should have received a copy of the GNU General Public License along with
 Odemis. If not, see http://www.gnu.org/licenses/.
 """
 
+import time
 import unittest
 import unittest.mock
 
 import numpy
 
 from odemis import model
-from odemis.driver import simsem, static
+from odemis.driver import simsem, simulated, static
 from odemis.model import Microscope
 from odemis.odemisd.mdupdater import MetadataUpdater
 from odemis.util import mock
@@ -57,8 +58,8 @@ class MDUpdaterTest(unittest.TestCase):
 
         with unittest.mock.patch.object(model, "getComponent", fake_get_component):
 
-            # Create a MetadataUpdater
-            mdup = MetadataUpdater("MDUpdater", mic)
+            # Create a MetadataUpdater, which updates the metadata immediately
+            mdup = MetadataUpdater("MDUpdater", mic, update_period=0)
             mic.alive.value = {ccd, lens}
 
             # Now, the lens should be observed: the VAs values should be copied on the CCD metadata
@@ -127,7 +128,7 @@ class EbeamMDUpdaterTest(unittest.TestCase):
         cls._patch_get_component = unittest.mock.patch.object(model, "getComponent", fake_get_component)
         cls._patch_get_component.start()
 
-        cls.mdup = MetadataUpdater("MDUpdater", cls.mic)
+        cls.mdup = MetadataUpdater("MDUpdater", cls.mic, update_period=0)
         cls.mic.alive.value = set(cls.sem.children.value) | {cls.ccd}
 
     @classmethod
@@ -172,5 +173,133 @@ class EbeamMDUpdaterTest(unittest.TestCase):
         self.assertAlmostEqual(md[model.MD_BEAM_VOLTAGE], new_voltage)
 
 
+class StageMDUpdaterTest(unittest.TestCase):
+    """
+    Tests for the stage position propagation
+    """
+
+    def setUp(self):
+        self.mic = Microscope("Fake SECOM", "secom")
+        img = model.DataArray(numpy.empty((512, 768), dtype=numpy.uint16))
+        self.ccd = mock.FakeCCD(img)
+        self.stage = simulated.Stage("Stage", "stage", {"x", "y"},
+                                     ranges={"x": (-0.1, 0.1), "y": (-0.1, 0.1)})
+        self.stage.affects.value = [self.ccd.name]
+
+        comps = [self.ccd, self.stage]
+        def fake_get_component(name):
+            for c in comps:
+                if c.name == name:
+                    return c
+            raise LookupError(f"no component {name}")
+
+        patch_get_component = unittest.mock.patch.object(model, "getComponent", fake_get_component)
+        patch_get_component.start()
+        self.addCleanup(patch_get_component.stop)
+
+        self.mdup = MetadataUpdater("MDUpdater", self.mic)
+        self.mic.alive.value = {self.ccd, self.stage}
+
+    def tearDown(self):
+        self.mdup.terminate()
+        self.stage.terminate()
+
+    def assert_pos_md(self):
+        pos = self.stage.position.value
+        md = self.ccd.getMetadata()
+        numpy.testing.assert_almost_equal(md[model.MD_POS], (pos["x"], pos["y"]))
+
+    def test_single_move(self):
+        """
+        After a move, the frames acquired have the final position
+        """
+        self.assert_pos_md()
+        self.stage.moveAbs({"x": 10e-6, "y": -20e-6}).result()
+        self.assert_pos_md()
+        self.stage.moveRel({"x": 1e-6}).result()
+        self.assert_pos_md()
+
+    def test_back_to_back_moves(self):
+        """
+        Even when the moves follow each other quickly, the metadata has the final
+        position as soon as each move is complete
+        """
+        for i in range(20):
+            self.stage.moveRel({"x": 1e-6, "y": -1e-6}).result()
+            self.assert_pos_md()
+
+        # Queued moves: after the last one, the position is the final one
+        for i in range(20):
+            f = self.stage.moveRel({"x": -1e-6})
+        f.result()
+        self.assert_pos_md()
+
+
+class LensMDUpdaterTest(unittest.TestCase):
+    """
+    Tests for the lens metadata propagation, with the updates merged over a period
+    """
+
+    def setUp(self):
+        self.mic = Microscope("Fake mic", "secom")
+        img = model.DataArray(numpy.empty((512, 768), dtype=numpy.uint16))
+        self.ccd = mock.FakeCCD(img)
+        self.lens = static.OpticalLens("Lens", "lens", mag=0.51, pole_pos=(458, 519))
+        self.lens.affects.value = [self.ccd.name]
+
+        comps = [self.ccd, self.lens]
+        def fake_get_component(name):
+            for c in comps:
+                if c.name == name:
+                    return c
+            raise LookupError(f"no component {name}")
+
+        patch_get_component = unittest.mock.patch.object(model, "getComponent", fake_get_component)
+        patch_get_component.start()
+        self.addCleanup(patch_get_component.stop)
+
+    def test_many_changes(self):
+        """
+        Many quick changes are merged into few metadata updates, with eventually the final value
+        """
+        mdup = MetadataUpdater("MDUpdater", self.mic)
+        self.addCleanup(mdup.terminate)
+        self.mic.alive.value = {self.ccd, self.lens}
+        time.sleep(2 * MetadataUpdater.UPDATE_PERIOD)
+
+        with unittest.mock.patch.object(self.ccd, "updateMetadata", wraps=self.ccd.updateMetadata) as upd_md:
+            nchanges = 100
+            tstart = time.monotonic()
+            for i in range(nchanges):
+                self.lens.polePosition.value = (100 + i, 200)
+                time.sleep(0.001)
+            dur = time.monotonic() - tstart
+
+            time.sleep(2 * MetadataUpdater.UPDATE_PERIOD)
+            self.assertEqual(self.ccd.getMetadata()[model.MD_AR_POLE], (199, 200))
+
+            # At most one update per period (+ the first one, and the last one)
+            max_calls = dur / MetadataUpdater.UPDATE_PERIOD + 2
+            self.assertLessEqual(upd_md.call_count, max_calls)
+            self.assertLess(upd_md.call_count, nchanges)
+
+    def test_terminate(self):
+        """
+        The updates still pending when terminating are not lost
+        """
+        # Long period, so that the updates are still pending when terminating
+        mdup = MetadataUpdater("MDUpdater", self.mic, update_period=10)
+        self.addCleanup(mdup.terminate)
+        self.mic.alive.value = {self.ccd, self.lens}
+        time.sleep(0.1)
+
+        for i in range(10):
+            self.lens.polePosition.value = (100 + i, 200)
+        self.assertNotEqual(self.ccd.getMetadata().get(model.MD_AR_POLE), (109, 200))
+
+        mdup.terminate()
+        self.assertEqual(self.ccd.getMetadata()[model.MD_AR_POLE], (109, 200))
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -21,10 +21,12 @@ see http://www.gnu.org/licenses/.
 """
 from __future__ import annotations  # allows the use of Python3.9 style typing in Python3.8
 
+import collections
 import json
 import logging
 import os
-from typing import Any, Optional, List, Tuple, Union
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Any, Iterable, Iterator, Optional, List, Tuple, Union
 
 import numpy
 
@@ -62,75 +64,17 @@ def data_to_static_streams(data):
 
     # Add each data as a stream of the correct type
     for d in data:
-        acqtype = d.metadata.get(model.MD_ACQ_TYPE)
-        # Hack for not displaying Anchor region data
-        # TODO: store and use acquisition type with MD_ACQ_TYPE?
-        if acqtype == model.MD_AT_ANCHOR or d.metadata.get(model.MD_DESCRIPTION) == "Anchor region":
+        klass, name = _find_static_stream_class(d)
+        if klass is None:
             continue
-
-        default_dims = "CTZYX"
-        if MD_THETA_LIST in d.metadata:
-            # Special trick to handle angular spectrum data, as it's usually only 5 dimensions
-            default_dims =  "CAZYX"
-        dims = d.metadata.get(model.MD_DIMS, default_dims[-d.ndim::])
-        ci = dims.find("C")  # -1 if not found
-        ti = dims.find("T")  # -1 if not found
-        theta_i = dims.find("A")  # -1 if not found
-
-        pxs = d.metadata.get(model.MD_PIXEL_SIZE)
-
-        if ((MD_WL_LIST in d.metadata and (ci >= 0 and d.shape[ci] > 1)) or
-            (ci >= 0 and d.shape[ci] >= 5)  # No metadata, but looks like a spectrum
-           ):
-            if MD_TIME_LIST in d.metadata and (ti >= 0 and d.shape[ti] > 1):
-                # Streak camera data. Create a temporal spectrum
-                name = d.metadata.get(model.MD_DESCRIPTION, "Temporal Spectrum")
-                klass = stream.StaticSpectrumStream
-            elif theta_i >= 0 and d.shape[theta_i] > 1:
-                name = d.metadata.get(model.MD_DESCRIPTION, "AR Spectrum")
-                klass = stream.StaticSpectrumStream
-            else:
-                # Spectrum: either it's obvious according to metadata, or no metadata
-                # but lots of wavelengths, so no other way to display
-                # Note: this is also temporal spectrum data acquired with mirror and focus mode (so no time/wl info)
-                # TODO: maybe drop the check for TIME_LIST and WL_LIST
-                name = d.metadata.get(model.MD_DESCRIPTION, "Spectrum")
-                klass = stream.StaticSpectrumStream
-        elif ((MD_TIME_LIST in d.metadata and ti >= 0 and d.shape[ti] > 1) or
-              (ti >= 5 and d.shape[ti] >= 5)
-             ):
-            # Time data (with XY)
-            name = d.metadata.get(model.MD_DESCRIPTION, "Time")
-            klass = stream.StaticSpectrumStream
-        elif model.MD_AR_POLE in d.metadata:
+        elif klass is stream.StaticARStream:
             # AR data
             ar_data.append(d)
             continue
-        elif model.MD_IN_WL in d.metadata and model.MD_OUT_WL in d.metadata:
-            # No explicit way to distinguish between Brightfield and Fluo,
-            # so guess it's Brightfield  if excitation wl is large (> 100 nm)
-            in_wl = d.metadata.get(model.MD_IN_WL, (0, 0))
-            if in_wl[1] - in_wl[0] < 100e-9:
-                # Fluo
-                name = d.metadata.get(model.MD_DESCRIPTION, "Filtered colour")
-                klass = stream.StaticFluoStream
-            else:
-                # Brightfield
-                name = d.metadata.get(model.MD_DESCRIPTION, "Brightfield")
-                klass = stream.StaticBrightfieldStream
-        elif model.MD_IN_WL in d.metadata:  # only MD_IN_WL
-            name = d.metadata.get(model.MD_DESCRIPTION, "Brightfield")
-            klass = stream.StaticBrightfieldStream
-        elif model.MD_OUT_WL in d.metadata:  # only MD_OUT_WL
-            name = d.metadata.get(model.MD_DESCRIPTION, "Cathodoluminescence")
-            klass = stream.StaticCLStream
-        elif dims in ("CYX", "YXC") and d.shape[ci] in (3, 4):
-            # Only decide it's RGB as last resort, because most microscopy data is not RGB
-            name = d.metadata.get(model.MD_DESCRIPTION, "RGB data")
-            klass = stream.RGBStream
-        else:
-            # Now, either it's a flat greyscale image and we decide it's a SEM image,
+        elif klass is stream.StaticSEMStream:
+            # Either it's a flat greyscale image and we decide it's a SEM image,
             # or it's gone too weird and we try again on flat images
+            pxs = d.metadata.get(model.MD_PIXEL_SIZE)
             if numpy.prod(d.shape[:-2]) != 1 and pxs is not None and len(pxs) != 3:
                 # FIXME: doesn't work currently if d is a DAS
                 subdas = _split_planes(d)
@@ -143,8 +87,6 @@ def data_to_static_streams(data):
                 if len(subdas) > 1:
                     result_streams.extend(data_to_static_streams(subdas))
                     continue
-            name = d.metadata.get(model.MD_DESCRIPTION, "Electrons")
-            klass = stream.StaticSEMStream
 
         if issubclass(klass, stream.Static2DStream):
             if numpy.prod(d.shape[:-3]) != 1:
@@ -167,6 +109,86 @@ def data_to_static_streams(data):
     return result_streams
 
 
+def _find_static_stream_class(d):
+    """
+    Find the type of static stream to display the given data, based only on its
+    metadata and shape (so the data itself is not read).
+    d (DataArray or DataArrayShadow): the data
+    return (class or None, str): the class of the stream, or None if the data
+      should not be displayed, and the default name of the stream.
+    """
+    acqtype = d.metadata.get(model.MD_ACQ_TYPE)
+    # Hack for not displaying Anchor region data
+    # TODO: store and use acquisition type with MD_ACQ_TYPE?
+    if acqtype == model.MD_AT_ANCHOR or d.metadata.get(model.MD_DESCRIPTION) == "Anchor region":
+        return None, ""
+
+    default_dims = "CTZYX"
+    if MD_THETA_LIST in d.metadata:
+        # Special trick to handle angular spectrum data, as it's usually only 5 dimensions
+        default_dims =  "CAZYX"
+    dims = d.metadata.get(model.MD_DIMS, default_dims[-d.ndim::])
+    ci = dims.find("C")  # -1 if not found
+    ti = dims.find("T")  # -1 if not found
+    theta_i = dims.find("A")  # -1 if not found
+
+    if ((MD_WL_LIST in d.metadata and (ci >= 0 and d.shape[ci] > 1)) or
+        (ci >= 0 and d.shape[ci] >= 5)  # No metadata, but looks like a spectrum
+       ):
+        if MD_TIME_LIST in d.metadata and (ti >= 0 and d.shape[ti] > 1):
+            # Streak camera data. Create a temporal spectrum
+            name = d.metadata.get(model.MD_DESCRIPTION, "Temporal Spectrum")
+            klass = stream.StaticSpectrumStream
+        elif theta_i >= 0 and d.shape[theta_i] > 1:
+            name = d.metadata.get(model.MD_DESCRIPTION, "AR Spectrum")
+            klass = stream.StaticSpectrumStream
+        else:
+            # Spectrum: either it's obvious according to metadata, or no metadata
+            # but lots of wavelengths, so no other way to display
+            # Note: this is also temporal spectrum data acquired with mirror and focus mode (so no time/wl info)
+            # TODO: maybe drop the check for TIME_LIST and WL_LIST
+            name = d.metadata.get(model.MD_DESCRIPTION, "Spectrum")
+            klass = stream.StaticSpectrumStream
+    elif ((MD_TIME_LIST in d.metadata and ti >= 0 and d.shape[ti] > 1) or
+          (ti >= 5 and d.shape[ti] >= 5)
+         ):
+        # Time data (with XY)
+        name = d.metadata.get(model.MD_DESCRIPTION, "Time")
+        klass = stream.StaticSpectrumStream
+    elif model.MD_AR_POLE in d.metadata:
+        # AR data
+        name = "Angular"
+        klass = stream.StaticARStream
+    elif model.MD_IN_WL in d.metadata and model.MD_OUT_WL in d.metadata:
+        # No explicit way to distinguish between Brightfield and Fluo,
+        # so guess it's Brightfield  if excitation wl is large (> 100 nm)
+        in_wl = d.metadata.get(model.MD_IN_WL, (0, 0))
+        if in_wl[1] - in_wl[0] < 100e-9:
+            # Fluo
+            name = d.metadata.get(model.MD_DESCRIPTION, "Filtered colour")
+            klass = stream.StaticFluoStream
+        else:
+            # Brightfield
+            name = d.metadata.get(model.MD_DESCRIPTION, "Brightfield")
+            klass = stream.StaticBrightfieldStream
+    elif model.MD_IN_WL in d.metadata:  # only MD_IN_WL
+        name = d.metadata.get(model.MD_DESCRIPTION, "Brightfield")
+        klass = stream.StaticBrightfieldStream
+    elif model.MD_OUT_WL in d.metadata:  # only MD_OUT_WL
+        name = d.metadata.get(model.MD_DESCRIPTION, "Cathodoluminescence")
+        klass = stream.StaticCLStream
+    elif dims in ("CYX", "YXC") and d.shape[ci] in (3, 4):
+        # Only decide it's RGB as last resort, because most microscopy data is not RGB
+        name = d.metadata.get(model.MD_DESCRIPTION, "RGB data")
+        klass = stream.RGBStream
+    else:
+        # A flat greyscale image (or something too weird) => it's a SEM image
+        name = d.metadata.get(model.MD_DESCRIPTION, "Electrons")
+        klass = stream.StaticSEMStream
+
+    return klass, name
+
+
 def _split_planes(data):
     """ Separate a DataArray into multiple DataArrays along the high dimensions (ie, not XY)
 
@@ -253,112 +275,210 @@ def splitext(path: os.PathLike) -> Tuple[str, str]:
 def add_acq_type_md(das):
     """
     Add acquisition type to das.
+    Only the metadata and shape of the data is used, so DataArrayShadows are not read.
     returns: das with updated metadata
     """
-    streams = data_to_static_streams(das)
-    for da, stream in zip(das, streams):
-        if isinstance(stream, StaticSEMStream):
-            da.metadata[model.MD_ACQ_TYPE] = model.MD_AT_EM
-        elif isinstance(stream, StaticCLStream):
-            da.metadata[model.MD_ACQ_TYPE] = model.MD_AT_CL
-        elif isinstance(stream, StaticARStream):
-            da.metadata[model.MD_ACQ_TYPE] = model.MD_AT_AR
-        elif isinstance(stream, StaticSpectrumStream):
-            da.metadata[model.MD_ACQ_TYPE] = model.MD_AT_SPECTRUM
-        elif isinstance(stream, StaticFluoStream):
-            da.metadata[model.MD_ACQ_TYPE] = model.MD_AT_FLUO
+    acq_types = {
+        StaticSEMStream: model.MD_AT_EM,
+        StaticCLStream: model.MD_AT_CL,
+        StaticARStream: model.MD_AT_AR,
+        StaticSpectrumStream: model.MD_AT_SPECTRUM,
+        StaticFluoStream: model.MD_AT_FLUO,
+    }
+    for da in das:
+        klass, _ = _find_static_stream_class(da)
+        if klass is None:  # Data not displayed (eg, anchor region)
+            da.metadata.setdefault(model.MD_ACQ_TYPE, "Unknown")
+        elif klass in acq_types:
+            da.metadata[model.MD_ACQ_TYPE] = acq_types[klass]
         else:
             da.metadata[model.MD_ACQ_TYPE] = "Unknown"
-            logging.warning("Unexpected stream of shape %s in input data." % da.shape)
+            logging.warning("Unexpected stream of shape %s in input data." % (da.shape,))
 
-    # If AR Stream is present, multiple data arrays are created. The data_to_static_streams
-    # function returns a single ARStream, so in this case many data arrays will not be assigned a
-    # stream and therefore also don't have an acquisition type.
-    for da in das:
-        if model.MD_ACQ_TYPE not in da.metadata:
-            da.metadata[model.MD_ACQ_TYPE] = model.MD_AT_AR
     return das
 
 
+# Number of threads used to read the tiles in parallel (it's mostly limited by the I/O)
+TILE_READER_WORKERS = 8
+
+
+def _leader_quality(da: Union[DataArray, DataArrayShadow]) -> float:
+    """
+    Function for sorting different streams. Use largest EM stream first, then other EM streams,
+    then other types of streams sorted by their size.
+    return: (int) The bigger the more leadership
+    """
+    # For now, we prefer a lot the EM images, because they are usually the
+    # one with the smallest FoV and the most contrast
+    if da.metadata[model.MD_ACQ_TYPE] == model.MD_AT_EM:  # SEM stream
+        return numpy.prod(da.shape)  # More pixel to find the overlap
+    else:
+        # A lot less likely
+        return numpy.prod(da.shape) / 100
+
+
+def _read_file_content(fn: str) -> List[Union[DataArray, DataArrayShadow]]:
+    """
+    Opens a file, without reading the data if the format supports it.
+    Same as open_acquisition(), but the errors are not hidden.
+    :param fn: file name
+    :return: the data in the file
+    :raise Exception: if the file cannot be opened
+    """
+    converter = dataio.find_fittest_converter(fn, mode=os.O_RDONLY)
+    if hasattr(converter, "open_data"):
+        return list(converter.open_data(fn).content)
+    else:
+        return converter.read_data(fn)
+
+
+class TileFileShadow(DataArrayShadow):
+    """
+    A DataArrayShadow of some data stored in a file, which doesn't keep the file open.
+    When the data is needed, the file is opened again, and closed as soon as the data is read.
+    This allows to handle (many) more tiles than the number of files which can be opened at the
+    same time.
+    """
+
+    def __init__(self, filename: str, index: int, da: DataArrayShadow):
+        """
+        :param filename: the file containing the data
+        :param index: the position of the data in the content of the file
+        :param da: the data, as opened from the file. Only its metadata is kept.
+        """
+        super().__init__(da.shape, da.dtype, da.metadata)
+        self.filename = filename
+        self.index = index
+
+    def getData(self) -> DataArray:
+        """
+        :return: the data, read from the file, with the metadata of this shadow
+        """
+        da = _read_file_content(self.filename)[self.index]
+        if isinstance(da, DataArrayShadow):
+            da = da.getData()
+        return DataArray(da, self.metadata.copy())
+
+
+def _open_tile(fn: str) -> Tuple[Union[DataArray, DataArrayShadow], ...]:
+    """
+    Opens a file containing a tile, and selects the data which can be stitched. If the format
+    supports it, only the metadata is read, and the data is read later, with _read_tile().
+    The file is not kept open.
+    :param fn: file name of the tile
+    :return: the data which can be stitched, with the best one to use for registration first
+    :raise ValueError: if the file doesn't contain any data which can be stitched
+    :raise Exception: if the file cannot be opened
+    """
+    das = _read_file_content(fn)
+    logging.debug("Got %d streams from file %s", len(das), fn)
+    # Only keep the metadata, so that the file is closed
+    das = [TileFileShadow(fn, i, da) if isinstance(da, DataArrayShadow) else da
+           for i, da in enumerate(das) if da is not None]
+
+    # Remove the DAs we don't want to (cannot) stitch
+    das = add_acq_type_md(das)
+    das = [da for da in das if da.metadata[model.MD_ACQ_TYPE] not in \
+           (model.MD_AT_AR, model.MD_AT_SPECTRUM)]
+
+    # For now the stitching doesn't handle more than 2 dimensions, so only keep the data which
+    # can be converted to 2D (ie, all the other dimensions are 1)
+    das_2d = []
+    for da in das:
+        if numpy.prod(da.shape[:-2]) == 1:
+            das_2d.append(da)
+        else:
+            logging.info("Skipping %s because it is not 2D", da)
+
+    das = das_2d
+    if not das:
+        raise ValueError(f"No compatible 2D data found in file {fn}")
+
+    # Find the best stream to use for registration, and place it first. Note the outcome of this
+    # sorting is expected to be the same for all the tiles.
+    return tuple(sorted(das, key=_leader_quality, reverse=True))
+
+
+def _read_tile(da: Union[DataArray, DataArrayShadow]) -> DataArray:
+    """
+    Reads the data of a tile opened by _open_tile()
+    :param da: the tile
+    :return: the data of the tile, as a 2D DataArray
+    """
+    # The stitching needs the actual data, so it cannot be a DataArrayShadow
+    if isinstance(da, DataArrayShadow):
+        da = da.getData()
+    return img.ensure2DImage(da)
+
+
+def _read_tiles(executor: Executor, tiles: Iterable[Union[DataArray, DataArrayShadow]]) -> Iterator[DataArray]:
+    """
+    Reads the data of the tiles in parallel, but only a few tiles ahead of the
+    consumer, so that the memory usage stays bounded whatever the number of tiles.
+    :param executor: the executor used to read the tiles
+    :param tiles: the tiles opened by _open_tile()
+    :return: the data of each tile, as 2D DataArrays, in the same order as the tiles
+    """
+    pending = collections.deque()  # futures of the tiles being read
+    for da in tiles:
+        if len(pending) >= TILE_READER_WORKERS:
+            yield pending.popleft().result()
+        pending.append(executor.submit(_read_tile, da))
+
+    while pending:
+        yield pending.popleft().result()
+
+
 def open_files_and_stitch(infns: list, registration_method: int = REGISTER_IDENTITY, weaving_method: int = WEAVER_MEAN) -> list:
     """
     Stitches a set of tiles. If the files contain multiple streams, each stream is assumed to be acquired
     at the same position, and they are stitched independently, so that the final result contains one
     stitched image for each stream. All files are assumed to contain the same streams.
+    The files are first opened without reading the data (when the format supports it). The data is read
+    in parallel, only when needed, and just a few tiles ahead of the weaving, to limit the memory usage.
     :param infns: file names of tiles
     :param registration_method: method used for registration
     :param weaving_method: method used for weaving
     :return: list of data arrays containing the stitched images for every stream
     """
-
-    def leader_quality(da):
-        """
-        Function for sorting different streams. Use largest EM stream first, then other EM streams,
-        then other types of streams sorted by their size.
-        return: (int) The bigger the more leadership
-        """
-        # For now, we prefer a lot the EM images, because they are usually the
-        # one with the smallest FoV and the most contrast
-        if da.metadata[model.MD_ACQ_TYPE] == model.MD_AT_EM:  # SEM stream
-            return numpy.prod(da.shape)  # More pixel to find the overlap
-        else:
-            # A lot less likely
-            return numpy.prod(da.shape) / 100
-
-    da_streams = []  # for each stream, a list of DataArrays
-    for fn in infns:
-        # Read data
-        das = open_acquisition(fn)
-        logging.debug("Got %d streams from file %s", len(das), fn)
-
-        # Remove the DAs we don't want to (cannot) stitch
-        das = add_acq_type_md(das)
-        das = [da for da in das if da.metadata[model.MD_ACQ_TYPE] not in \
-               (model.MD_AT_AR, model.MD_AT_SPECTRUM)]
-
-        # Make sure they are not DataArrayShadow, because we need the data to do the stitching
-        das = [da.getData() if isinstance(da, model.DataArrayShadow) else da for da in das]
-        # For now the stitching doesn't handle more than 2 dimensions, so force the data to be 2D
-        das_2d = []
-        for da in das:
-            try:
-                das_2d.append(img.ensure2DImage(da))
-            except ValueError:
-                logging.info("Skipping %s because it is not 2D", da)
-
-        das = das_2d
-        if not das:
-            raise ValueError(f"No compatible 2D data found in file {fn}")
-
-        # Find the best stream to use for registration, and place it first. Note the outcome of this
-        # sorting is expected to be the same for all the tiles.
-        das = tuple(sorted(das, key=leader_quality, reverse=True))
-        da_streams.append(das)
-
     def get_acq_time(das):
         return das[0].metadata.get(model.MD_ACQ_DATE, 0)
 
-    # Sort by time, assuming it's going to be the acquisition order, which normally ensures that
-    # tiles are adjacent in the list, currently required for the register
-    da_streams = sorted(da_streams, key=get_acq_time)
-
-    das_registered = stitching.register(da_streams, registration_method)
-
-    # Weave every stream independently
-    st_weaved_data = []  # List of DataArrays, one for each stream, containing the stitched image
-    # zip(*) to convert from a series of streams per tile to a series of tiles per stream
-    for tiles in zip(*das_registered):  # Iterate on the streams, with all the tiles in a tuple
-        rot = _use_scan_rotation_as_rotation(tiles)
-        weaved = stitching.weave(tiles, weaving_method)
-        weaved.metadata[model.MD_DIMS] = "YX"
-        if rot is not None:
-            weaved.metadata[model.MD_ROTATION_COR] = rot
-        st_weaved_data.append(weaved)
+    with ThreadPoolExecutor(max_workers=TILE_READER_WORKERS) as executor:
+        da_streams = list(executor.map(_open_tile, infns))  # for each tile, a tuple of DataArray(Shadow)s
+
+        # Sort by time, assuming it's going to be the acquisition order, which normally ensures that
+        # tiles are adjacent in the list, currently required for the register
+        da_streams = sorted(da_streams, key=get_acq_time)
+
+        if registration_method != REGISTER_IDENTITY:
+            # The registration compares the main tiles, so their data is needed (but only theirs)
+            main_tiles = executor.map(_read_tile, [das[0] for das in da_streams])
+            da_streams = [(t,) + das[1:] for t, das in zip(main_tiles, da_streams)]
+
+        das_registered = stitching.register(da_streams, registration_method)
+        # zip(*) to convert from a series of streams per tile to a series of tiles per stream
+        st_tiles = list(zip(*das_registered))
+        del da_streams, das_registered
+
+        # Weave every stream independently
+        st_weaved_data = []  # List of DataArrays, one for each stream, containing the stitched image
+        while st_tiles:
+            # Only keep in memory the data of the few tiles being read and weaved
+            tiles = st_tiles.pop(0)
+            rot = _use_scan_rotation_as_rotation(tiles)
+            tiles_data = _read_tiles(executor, tiles)
+            weaved = stitching.weave(tiles, weaving_method, tiles_data=tiles_data)
+            weaved.metadata[model.MD_DIMS] = "YX"
+            if rot is not None:
+                weaved.metadata[model.MD_ROTATION_COR] = rot
+            st_weaved_data.append(weaved)
+            del tiles, tiles_data
 
     return st_weaved_data
 
 
-def _use_scan_rotation_as_rotation(tiles: Tuple[model.DataArray]) -> Optional[float]:
+def _use_scan_rotation_as_rotation(tiles: Tuple[Union[DataArray, DataArrayShadow]]) -> Optional[float]:
     """
     If the tiles have scan rotation metadata, use it as rotation metadata, so that the weaver can
     handle it and the final image looks correctly connected.
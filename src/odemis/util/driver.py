@@ -337,6 +337,108 @@ class ProgressiveMove(model.ProgressiveFuture):
         self.set_result(f.result())
 
 
+class MoveMonitor(object):
+    """
+    Waits for the end of a move of several axes of a controller, by polling their status.
+    The polls are scheduled based on the expected end of the move: while the move is expected to
+    run, the status is polled at most every max_period, and more and more often as the expected end
+    approaches. If the move takes longer than expected, the poll period increases again
+    progressively (exponential back-off), instead of flooding the controller with requests.
+    """
+
+    def __init__(self, get_moving_axes, min_period=0.002, max_period=0.1, backoff=1.5,
+                 update_period=0.1):
+        """
+        get_moving_axes (callable: set -> set): returns the subset of the given axes which are
+          still moving. When the protocol allows it, it should query all the axes in a single
+          request. It may raise an exception to report an error, which stops the wait.
+        min_period (0 < float): minimum time between two polls (in s)
+        max_period (min_period <= float): maximum time between two polls (in s)
+        backoff (1 <= float): factor by which the poll period increases at every poll, once the
+          move is expected to be over.
+        update_period (0 < float): time between two calls to the on_update callback (in s)
+        """
+        if not 0 < min_period <= max_period:
+            raise ValueError("Poll periods must be 0 < min_period <= max_period, but got %g, %g" %
+                             (min_period, max_period))
+        if backoff < 1:
+            raise ValueError("backoff must be >= 1, but got %g" % (backoff,))
+        self._get_moving_axes = get_moving_axes
+        self.min_period = min_period
+        self.max_period = max_period
+        self.backoff = backoff
+        self.update_period = update_period
+
+    def wait(self, moving_axes, end, must_stop, max_dur=None, on_update=None, on_poll=None):
+        """
+        Blocks until all the given axes have stopped moving.
+        It can be called simultaneously from several threads.
+        moving_axes (set): the axes to check. It's updated in place, so that at the end of the
+          wait (including when an exception is raised), it contains the axes still moving.
+        end (float): expected end time of the move (as time.time())
+        must_stop (threading.Event): if set, the wait is stopped immediately
+        max_dur (None or 0 < float): maximum duration of the wait (in s). If None,
+          it's twice the expected duration + 1 s.
+        on_update (None or callable: set -> None): called regularly during the move (every
+          update_period) and when some axes stop, with the axes which were moving since the
+          previous call. Typically used to update the position.
+        on_poll (None or callable: set -> bool): called after each poll, with the axes still moving.
+          If it returns True, the wait is stopped early (without exception).
+        return (set): the axes still moving, which is only non empty if stopped by on_poll.
+        raise:
+            CancelledError: if must_stop was set before the end of the move
+            TimeoutError: if the move is not over after max_dur
+            Any exception raised by get_moving_axes
+        """
+        axes = moving_axes.copy()
+        start = time.time()
+        dur = max(0.01, min(end - start, 60))
+        if max_dur is None:
+            max_dur = dur * 2 + 1
+        logging.debug("Expecting a move of %g s, will wait up to %g s", dur, max_dur)
+        timeout = start + max_dur
+        last_upd = start
+        last_axes = moving_axes.copy()  # moving axes as of last update
+        late_period = self.min_period
+        npolls = 0
+        while not must_stop.is_set():
+            moving_axes &= self._get_moving_axes(moving_axes.copy())
+            npolls += 1
+            if not moving_axes:
+                # no more axes to wait for
+                logging.debug("Move of %g s detected as over after %d polls", time.time() - start, npolls)
+                return set()
+
+            if on_poll and on_poll(moving_axes):
+                logging.debug("Stopped waiting for the end of the move after %d polls", npolls)
+                return moving_axes.copy()
+
+            now = time.time()
+            if now > timeout:
+                raise TimeoutError("Move is not over after %g s, while expected it takes only %g s" %
+                                   (max_dur, dur))
+
+            if on_update and (now - last_upd > self.update_period or last_axes != moving_axes):
+                on_update(last_axes)
+                last_upd = now
+                last_axes = moving_axes.copy()
+
+            # Poll again after half of the time left, or with exponential back-off if already late
+            left = end - time.time()
+            if left > 0:
+                period = left / 2
+            else:
+                period = late_period
+                late_period *= self.backoff
+            period = min(max(self.min_period, period), self.max_period)
+            if on_update:
+                period = min(period, max(self.min_period, last_upd + self.update_period - time.time()))
+            must_stop.wait(period)
+
+        logging.debug("Move of axes %s cancelled before the end", axes)
+        raise CancelledError()
+
+
 def checkLightBand(band):
     """
     Check that the given object looks like a light band. It should either be
@@ -20,11 +20,12 @@ You should have received a copy of the GNU General Public License along with
 Odemis. If not, see http://www.gnu.org/licenses/.
 """
 import logging
+import warnings
 
 import cv2
 import numpy
 from scipy import ndimage
-from scipy.optimize import curve_fit
+from scipy.optimize import curve_fit, OptimizeWarning
 from scipy.signal import medfilt
 
 
@@ -159,3 +160,84 @@ def AssessFocus(levels, min_ratio=15):
         logging.debug("Significant focus level deviation was found")
         return True
     return False
+
+
+def _gauss(z, amplitude, pos, width, base):
+    return amplitude * numpy.exp(-(z - pos) ** 2 / (2 * width ** 2)) + base
+
+
+def FitFocusCurve(positions, levels, min_snr=5):
+    """
+    Estimates the position of the best focus, by fitting a focus curve on a few
+    focus level measurements. The curve is first fitted as a Gaussian, and if
+    this fails, as a parabola around the best measurement.
+    positions (list of floats): focus positions at which the levels were measured
+    levels (list of floats): focus levels measured (same length as positions)
+    min_snr (0<float): minimum ratio between the height of the peak and the
+      noise of the levels for the peak to be considered significant
+    returns:
+        pos (float): predicted position of the best focus level
+        width (0<float): estimated half-width (sigma) of the focus curve peak,
+          in the same unit as the positions
+        gaussian (bool): True if the Gaussian fit succeeded, False if the
+          parabola fallback was used.
+    raises ValueError: if the levels don't have any significant maximum (eg,
+      they are just noise or the best focus level is at the border of the positions)
+    """
+    positions = numpy.asarray(positions, dtype=float)
+    levels = numpy.asarray(levels, dtype=float)
+    if positions.shape != levels.shape or len(positions) < 3:
+        raise ValueError("Need at least 3 focus levels, got %d" % (len(positions),))
+
+    order = numpy.argsort(positions)
+    positions, levels = positions[order], levels[order]
+
+    # Normalise the data, to keep the fit well conditioned
+    center = (positions[0] + positions[-1]) / 2
+    span = positions[-1] - positions[0]
+    lmin, lmax = levels.min(), levels.max()
+    if span <= 0 or lmax <= lmin:
+        raise ValueError("Focus levels are all identical")
+    z = (positions - center) / span
+    lev = (levels - lmin) / (lmax - lmin)
+    i_max = int(numpy.argmax(lev))
+
+    # Gaussian fit, with the peak position restricted to the measured range
+    p_initial = [1, z[i_max], 0.25, 0]
+    bounds = ([0, -0.5, 1e-3, -1], [10, 0.5, 10, 1])
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("error", OptimizeWarning)
+            popt, _ = curve_fit(_gauss, z, lev, p0=p_initial, bounds=bounds, maxfev=1000)
+    except (RuntimeError, ValueError, OptimizeWarning) as ex:
+        logging.debug("Failed to fit Gaussian on focus curve: %s", ex)
+    else:
+        amplitude, pos, width, base = popt
+        # As the levels are normalised, noise also looks like a peak => check
+        # the peak is high compared to the residuals, and that it explains
+        # most of the variations of the levels.
+        res = lev - _gauss(z, *popt)
+        noise = numpy.sqrt(numpy.sum(res ** 2) / max(1, len(z) - 4))
+        r2 = 1 - numpy.sum(res ** 2) / numpy.sum((lev - lev.mean()) ** 2)
+        if amplitude < min_snr * noise or r2 < 0.9:
+            raise ValueError("Focus levels have no significant peak (SNR = %g, R² = %g)" %
+                             (amplitude / max(noise, 1e-9), r2))
+        # If the peak is on the border, or too wide to be distinguishable from
+        # the base, the Gaussian doesn't represent the data
+        if abs(pos) < 0.49 and width < 1:
+            return pos * span + center, width * span, True
+        logging.debug("Gaussian fit of focus curve rejected: %s", popt)
+
+    # Parabola around the best measurement
+    if i_max == 0 or i_max == len(lev) - 1:
+        raise ValueError("Best focus level is at the border of the positions")
+    sl = slice(max(0, i_max - 2), min(len(lev), i_max + 3))
+    a, b, c = numpy.polyfit(z[sl], lev[sl], 2)
+    if a >= 0:
+        raise ValueError("Focus levels have no maximum")
+    pos = -b / (2 * a)
+    peak = c - b ** 2 / (4 * a)
+    # Width of a Gaussian with the same curvature at the peak
+    width = numpy.sqrt(max(peak, 1e-3) / (-2 * a))
+    pos = min(max(pos, z[sl][0]), z[sl][-1])
+    return pos * span + center, width * span, False
@@ -24,9 +24,13 @@ Odemis. If not, see http://www.gnu.org/licenses/.
 
 import logging
 import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy
 from odemis import model
 import scipy.ndimage
+import scipy.sparse
 import cv2
 import copy
 from odemis.model import DataArray
@@ -240,70 +244,195 @@ def compactHistogram(hist, length):
     chist = hist.reshape(-1, bin_size)
     return numpy.sum(chist, 1)
 
-# TODO: compute histogram faster. There are several ways:
-# * x=numpy.bincount(a.flat, minlength=depth) => fast (~0.03s for
-#   a 2048x2048 array) but only works on flat array with uint8 and uint16 and
-#   creates 2**16 bins if uint16 (so need to do a reshape and sum on top of it)
-# * numpy.histogram(a, bins=256, range=(0,depth)) => slow (~0.09s for a
-#   2048x2048 array) but works exactly as needed directly in every case.
-# * see weave? (~ 0.01s for 2048x2048 array of uint16) eg:
-#  timeit.timeit("counts=numpy.zeros((2**16), dtype=numpy.uint32);
-#  weave.inline( code, ['counts', 'idxa'])", "import numpy;from scipy import weave; code=r\"for (int i=0; i<Nidxa[0]; i++) { COUNTS1( IDXA1(i)>>8)++; }\"; idxa=numpy.ones((2048*2048), dtype=numpy.uint16)+15", number=100)
-# * see cython?
-# for comparison, a.min() + a.max() are 0.01s for 2048x2048 array
+
+def cropHistogram(hist, edges, irange):
+    """
+    Select a part of a histogram of integer data which has one bin per value
+    hist (ndarray 1D of 0<=int): histogram, with one bin per value
+    edges (tuple of 2 int): the values corresponding to the first and last bin
+    irange (tuple of 2 int): min/max values of the new histogram
+    return hist, edges: the histogram with irange[1] - irange[0] + 1 bins, and
+      its edges (ie, irange). The values outside of irange are dropped, and the
+      values not in the original histogram are considered empty.
+    """
+    chist = numpy.zeros(irange[1] - irange[0] + 1, dtype=hist.dtype)
+    # Common part between the two ranges
+    low, high = max(irange[0], edges[0]), min(irange[1], edges[1])
+    if low <= high:
+        chist[low - irange[0]:high - irange[0] + 1] = hist[low - edges[0]:high - edges[0] + 1]
+    return chist, (irange[0], irange[1])
+
+
+# Maximum number of bins of the histogram of integer data with a range wider than 16 bits
+INT_HIST_MAX_LENGTH = 8192
+
+
+def _subsample(data, max_samples=None):
+    """
+    Pick a regularly spaced subset of the values of the data, to compute statistics
+    faster on large images.
+    data (numpy.ndarray): the data
+    max_samples (None or 0<int): maximum number of values to keep. None => all the
+      values are kept.
+    return (numpy.ndarray): the data, or a subset of it as a flat array
+    """
+    if max_samples is None or data.size <= max_samples:
+        return data
+
+    # The stride is typically not a multiple of the width of the image, so the values
+    # picked are spread all over the image.
+    step = int(math.ceil(data.size / max_samples))
+    return data.ravel()[::step]
 
 
-def histogram(data, irange=None):
+def _histogram_int(data, irange, length):
+    """
+    Compute the histogram of integer data based on numpy.bincount(), which is much
+    faster than numpy.histogram(), but gives the same bins.
+    data (numpy.ndarray of int): the data
+    irange (tuple of 2 int): min/max values of the histogram
+    length (0<int): number of bins
+    return (None or ndarray 1D of 0<=int): the histogram, or None if the range is
+      too large to use this method.
+    """
+    low, high = int(irange[0]), int(irange[1])
+    width = high - low
+    data = data.ravel()
+
+    if data.itemsize <= 2 and length == width + 1:
+        # Count every value of the type, and only keep the ones in the range
+        if data.dtype.kind == "i":
+            # Look at the data as unsigned with the sign bit flipped, which shifts
+            # all the values by 2**(bits-1), and keeps them in the same order.
+            udtype = numpy.dtype("u%d" % data.itemsize)
+            offset = -(1 << (data.itemsize * 8 - 1))
+            idx = data.view(udtype) ^ udtype.type(-offset)
+        else:
+            offset = 0
+            idx = data
+        start, end = low - offset, high - offset + 1
+        if start >= 0:
+            counts = numpy.bincount(idx, minlength=end)
+            if counts.size > end:
+                logging.warning("Unexpected value %d outside of range %s",
+                                counts.size - 1 + offset, irange)
+            return counts[start:end]
+
+    # Each bin contains several values (or the values are over 16 bits): compute the
+    # index of the bin of each value. Like numpy.histogram(), bin i contains the
+    # values v so that i <= (v - low) * length / width < i + 1, and the last bin also
+    # contains the highest value.
+    # Everything is computed modulo 2**64, so that it works for any integer type. The
+    # values outside of the range then all end up above the width.
+    if width * length >= 2 ** 64:
+        return None
+    k = data.astype(numpy.uint64)
+    k -= numpy.uint64(low % 2 ** 64)
+    inside = (k <= width)
+    if not inside.all():
+        k = k[inside]
+    if length <= width:
+        k *= numpy.uint64(length)
+        k //= numpy.uint64(width)
+        numpy.minimum(k, length - 1, out=k)
+    return numpy.bincount(k.view(numpy.int64), minlength=length)
+
+
+def histogram(data, irange=None, max_samples=None):
     """
     Compute the histogram of the given image.
     data (numpy.ndarray of numbers): greyscale image
-    irange (None or tuple of 2 unsigned int): min/max values to be found
+    irange (None or tuple of 2 numbers): min/max values to be found
       in the data. None => auto (min, max will be detected from the data)
+    max_samples (None or 0<int): if the data has more values, only a regularly
+      spaced subset of them is used. It makes the computation much faster on large
+      images, while keeping the same shape of the histogram (but the counts are
+      proportionally smaller). None => all the data is used.
     return hist, edges:
      hist (ndarray 1D of 0<=int): number of pixels with the given value
       Note that the length of the returned histogram is not fixed. If irange
       is defined and data is integer, the length is always equal to
-      irange[1] - irange[0] + 1.
+      irange[1] - irange[0] + 1 (limited to 8192 if the data is more than 16 bits).
+      The values outside of irange are not counted.
      edges (tuple of numbers): lowest and highest bound of the histogram.
        edges[1] is included in the bin. If irange is defined, it's the same
        values.
     """
+    # cast to ndarray to ensure the statistics are scalars (instead of DataArrays)
+    data = _subsample(data.view(numpy.ndarray), max_samples)
+
     if irange is None:
         if data.dtype.kind in "biu":
             idt = numpy.iinfo(data.dtype)
-            irange = (idt.min, idt.max)
+            irange = (int(idt.min), int(idt.max))
             if data.itemsize > 2:
                 # range is too big to be used as is => look really at the data
-                irange = (int(data.view(numpy.ndarray).min()),
-                          int(data.view(numpy.ndarray).max()))
+                irange = (int(data.min()), int(data.max()))
         else:
-            # cast to ndarray to ensure a scalar (instead of a DataArray)
-            irange = (data.view(numpy.ndarray).min(), data.view(numpy.ndarray).max())
-
-    # short-cuts (for the most usual types)
-    if data.dtype.kind in "bu" and irange[0] == 0 and data.itemsize <= 2 and len(data) > 0:
-        # TODO: for int (irange[0] < 0), treat as unsigned, and swap the first
-        # and second halves of the histogram.
-        # TODO: for 32 or 64 bits with full range, convert to a view looking
-        # only at the 2 high bytes.
+            # NaNs are not counted in the histogram, so also ignore them for the range
+            irange = (numpy.nanmin(data), numpy.nanmax(data))
+
+    if data.dtype.kind in "biu":
         length = irange[1] - irange[0] + 1
-        hist = numpy.bincount(data.flat, minlength=length)
-        edges = (0, hist.size - 1)
-        if edges[1] > irange[1]:
-            logging.warning("Unexpected value %d outside of range %s", edges[1], irange)
+        if data.itemsize > 2:
+            length = min(INT_HIST_MAX_LENGTH, length)
+        hist = _histogram_int(data, irange, length)
+        if hist is not None:
+            return hist, (irange[0], irange[1])
     else:
-        if data.dtype.kind in "biu":
-            length = min(8192, irange[1] - irange[0] + 1)
-        else:
-            # For floats, it will automatically find the minimum and maximum
-            length = 256
-        hist, all_edges = numpy.histogram(data, bins=length, range=irange)
-        edges = (max(irange[0], all_edges[0]),
-                 min(irange[1], all_edges[-1]))
+        # For floats, numpy.histogram() already uses bincount() when the bins are regular
+        length = 256
 
+    hist, all_edges = numpy.histogram(data, bins=length, range=irange)
+    edges = (max(irange[0], all_edges[0]),
+             min(irange[1], all_edges[-1]))
     return hist, edges
 
 
+class HistogramAccumulator(object):
+    """
+    Histogram of data which is received progressively (eg, an image acquired pixel
+    by pixel). It is updated only with the new data, instead of being recomputed
+    from all the data each time.
+    """
+
+    def __init__(self, dtype, irange=None):
+        """
+        dtype (numpy.dtype): type of the data
+        irange (None or tuple of 2 numbers): min/max values of the histogram. None
+          => the whole range of the type, which is only possible for integer types.
+        """
+        self._dtype = numpy.dtype(dtype)
+        if irange is None:
+            if self._dtype.kind not in "iu":
+                raise ValueError("A range is needed for a histogram of type %s" % (self._dtype,))
+            idt = numpy.iinfo(self._dtype)
+            irange = (int(idt.min), int(idt.max))
+        self._irange = irange
+        self.reset()
+
+    def reset(self):
+        """
+        Remove all the data from the histogram
+        """
+        self._hist, self._edges = histogram(numpy.empty((0,), dtype=self._dtype), self._irange)
+
+    def add(self, data):
+        """
+        Add values to the histogram
+        data (numpy.ndarray): the new values (of any shape)
+        """
+        hist, self._edges = histogram(data, self._irange)
+        self._hist += hist
+
+    def get(self):
+        """
+        return hist, edges: the histogram of all the data added so far, in the same
+          format as histogram().
+        """
+        return self._hist, self._edges
+
+
 def guessDRange(data):
     """
     Guess the data range of the data given.
@@ -908,6 +1037,105 @@ def Average(images, rect, mpp, merge=0.5):
 # TODO: add operator Screen
 
 
+# Maximum number of threads used by apply_spatial_sampling()
+SAMPLING_WORKERS = min(4, os.cpu_count() or 1)
+# Approximate number of values (of the non-spatial dimensions x sampled pixels)
+# processed at once by apply_spatial_sampling()
+SAMPLING_CHUNK_SIZE = 2 ** 21
+
+
+def get_line_sampling(shape: Tuple[int, int], start: Tuple[float, float], end: Tuple[float, float],
+                      width: int = 1) -> scipy.sparse.csr_matrix:
+    """
+    Compute the weights to sample the pixels along a line, with bilinear
+    interpolation, summed over the width of the line. It gives the same result as
+    scipy.ndimage.map_coordinates() with order=1: the points falling outside
+    of the data count as 0. The weights only depend on the geometry, so they can
+    be computed once, and applied to many images with apply_spatial_sampling().
+    shape: the Y, X dimensions of the data
+    start: the x, y coordinates of the first point of the line (px)
+    end: the x, y coordinates of the last point of the line (px)
+    width: number of points sampled perpendicular to the line, for each point
+      along the line. They are spread every px, centered on the line.
+    returns (sparse matrix of shape N, Y*X): for each point along the line, the
+      weight of every pixel. There are N = 1 + int(length) points, spread
+      evenly from start to end.
+    raises ValueError: if the line is shorter than 1 px
+    """
+    v = (end[0] - start[0], end[1] - start[1])
+    l = math.hypot(*v)
+    if l < 1:
+        raise ValueError("Line must be at least 1 px long, but got %s -> %s" % (start, end))
+    n = 1 + int(l)
+
+    # Coordinates of all the points, of shape width, n
+    # Spread over the width, along the perpendicular unit vector
+    pv = (-v[1] / l, v[0] / l)
+    spread = (width - 1) / 2
+    xs = numpy.linspace(start[0], end[0], n) + numpy.linspace(pv[0] * -spread, pv[0] * spread, width)[:, None]
+    ys = numpy.linspace(start[1], end[1], n) + numpy.linspace(pv[1] * -spread, pv[1] * spread, width)[:, None]
+    rows = numpy.broadcast_to(numpy.arange(n), xs.shape)
+
+    # Only the points inside the data are interpolated (others are 0)
+    h, w = shape
+    inside = (xs >= 0) & (xs <= w - 1) & (ys >= 0) & (ys <= h - 1)
+    xs, ys, rows = xs[inside], ys[inside], rows[inside]
+
+    # Bilinear interpolation between the 4 neighbouring pixels. For the points
+    # on the last row/column, the last pixel is used as "first" neighbour.
+    x0 = numpy.minimum(numpy.floor(xs), max(w - 2, 0)).astype(numpy.intp)
+    y0 = numpy.minimum(numpy.floor(ys), max(h - 2, 0)).astype(numpy.intp)
+    fx = xs - x0
+    fy = ys - y0
+    x1 = numpy.minimum(x0 + 1, w - 1)  # if only one column, the weight is 0 anyway
+    y1 = numpy.minimum(y0 + 1, h - 1)
+    weights = numpy.concatenate([(1 - fy) * (1 - fx), (1 - fy) * fx, fy * (1 - fx), fy * fx])
+    cols = numpy.concatenate([y0 * w + x0, y0 * w + x1, y1 * w + x0, y1 * w + x1])
+
+    # Duplicated entries (eg, same pixel used by multiple points of the width) are summed
+    sampling = scipy.sparse.csr_matrix((weights, (numpy.tile(rows, 4), cols)), shape=(n, h * w))
+    sampling.eliminate_zeros()
+    return sampling
+
+
+def apply_spatial_sampling(data: numpy.ndarray, sampling: scipy.sparse.csr_matrix) -> numpy.ndarray:
+    """
+    Compute the weighted sum of the pixels of the data, independently for each
+    position of the non-spatial dimensions (eg, each wavelength).
+    Only the pixels with a weight are read. The computation is split in chunks,
+    along the non-spatial dimensions, which are run in parallel.
+    data (ndarray of shape ..., Y, X): the data to sample
+    sampling (sparse matrix of shape N, Y*X): for each output point, the weight of
+      every pixel, as returned by get_line_sampling()
+    returns (ndarray of float64 of shape ..., N): the weighted sums
+    """
+    lead_shape = data.shape[:-2]
+    data2d = data.reshape(-1, data.shape[-2] * data.shape[-1])  # no copy if possible
+    npoints = sampling.shape[0]
+
+    # Only keep the pixels which are used
+    cols = numpy.unique(sampling.indices)
+    weights = sampling[:, cols]
+    res = numpy.empty((data2d.shape[0], npoints), dtype=numpy.float64)
+
+    chunk_len = max(1, SAMPLING_CHUNK_SIZE // max(1, cols.size))
+    chunks = [slice(i, i + chunk_len) for i in range(0, data2d.shape[0], chunk_len)]
+
+    def sample_chunk(chunk: slice):
+        sub = numpy.take(data2d[chunk], cols, axis=1)  # shape K, U
+        res[chunk] = (weights @ sub.T).T
+
+    if len(chunks) > 1 and SAMPLING_WORKERS > 1:
+        with ThreadPoolExecutor(max_workers=min(SAMPLING_WORKERS, len(chunks))) as executor:
+            for f in [executor.submit(sample_chunk, c) for c in chunks]:
+                f.result()  # To raise any exception
+    else:
+        for c in chunks:
+            sample_chunk(c)
+
+    return res.reshape(lead_shape + (npoints,))
+
+
 def mean_within_circle(data: model.DataArray, center: Tuple[float, float], radius: float) -> model.DataArray:
     """
     Compute the mean value of the points within a circle.
@@ -925,19 +1153,19 @@ def mean_within_circle(data: model.DataArray, center: Tuple[float, float], radiu
     returns (DataArray of type float, with same shape as data minus X&Y):
         the mean of data that corresponds to points in the circle.
     """
-    n = 0
-    datasum = numpy.zeros(data.shape[:-2], dtype=numpy.float64)
-
+    h, w = data.shape[-2:]
     # Scan the square around the circle, and only pick the points in the circle
-    for px in range(max(0, int(center[0] - radius)),
-                    min(int(center[0] + radius) + 1, data.shape[-1])):
-        for py in range(max(0, int(center[1] - radius)),
-                        min(int(center[1] + radius) + 1, data.shape[-2])):
-            if math.hypot(center[0] - px, center[1] - py) <= radius:
-                n += 1
-                datasum += data[..., py, px]
-
-    mean = datasum / n
+    px, py = numpy.meshgrid(numpy.arange(max(0, int(center[0] - radius)),
+                                         min(int(center[0] + radius) + 1, w)),
+                            numpy.arange(max(0, int(center[1] - radius)),
+                                         min(int(center[1] + radius) + 1, h)))
+    inside = numpy.hypot(center[0] - px, center[1] - py) <= radius
+    idx = py[inside] * w + px[inside]
+    n = idx.size
+
+    sampling = scipy.sparse.csr_matrix((numpy.ones(n), (numpy.zeros(n, dtype=int), idx)),
+                                       shape=(1, h * w))
+    mean = apply_spatial_sampling(data, sampling)[..., 0] / n
     return mean
 
 
@@ -1299,29 +1527,37 @@ def assembleZCube(images, zlevels):
         # images is a list of 3 dim data arrays.
         # Will fail on purpose if the images contain more than 2 dimensions
         ret = numpy.array([im.reshape(im.shape[-2:]) for im in images])
+        return zCubeToDataArray(ret, images[0].metadata, zlevels)
 
-        # Add back metadata
-        metadata3d = copy.copy(images[0].metadata)
-        # Extend pixel size to 3D
-        ps_x, ps_y = metadata3d[model.MD_PIXEL_SIZE]
-        ps_z = (zlevels[-1] - zlevels[0]) / (len(zlevels) - 1) if len(zlevels) > 1 else 1e-6
 
-        # Compute cube centre
-        c_x, c_y = metadata3d[model.MD_POS]
-        c_z = (zlevels[0] + zlevels[-1]) / 2  # Assuming zlevels are ordered
-        metadata3d[model.MD_POS] = (c_x, c_y, c_z)
+def zCubeToDataArray(cube, md, zlevels):
+    """
+    Convert an already assembled xyz cube into a DataArray with the 3D metadata.
+    It's useful when the planes are directly written into a pre-allocated array.
+    :param cube: (ndarray of shape ZYX) the planes, in the same order as zlevels
+    :param md: (dict) metadata of the first plane. It is not modified.
+    :param zlevels: (list of float) list of focus positions
+    :return: (DataArray of shape ZYX) the data array of the xyz cube
+    """
+    metadata3d = copy.copy(md)
+    # Extend pixel size to 3D
+    ps_x, ps_y = metadata3d[model.MD_PIXEL_SIZE]
+    ps_z = (zlevels[-1] - zlevels[0]) / (len(zlevels) - 1) if len(zlevels) > 1 else 1e-6
 
-        # For a negative pixel size, convert to a positive and flip the z axis
-        if ps_z < 0:
-            ret = numpy.flipud(ret)
-            ps_z = -ps_z
+    # Compute cube centre
+    c_x, c_y = metadata3d[model.MD_POS]
+    c_z = (zlevels[0] + zlevels[-1]) / 2  # Assuming zlevels are ordered
+    metadata3d[model.MD_POS] = (c_x, c_y, c_z)
 
-        metadata3d[model.MD_PIXEL_SIZE] = (ps_x, ps_y, ps_z)
-        metadata3d[model.MD_DIMS] = "ZYX"
+    # For a negative pixel size, convert to a positive and flip the z axis
+    if ps_z < 0:
+        cube = numpy.flipud(cube)
+        ps_z = -ps_z
 
-        ret = DataArray(ret, metadata3d)
+    metadata3d[model.MD_PIXEL_SIZE] = (ps_x, ps_y, ps_z)
+    metadata3d[model.MD_DIMS] = "ZYX"
 
-        return ret
+    return DataArray(cube, metadata3d)
 
 
 def apply_flood_fill(input_array, start):
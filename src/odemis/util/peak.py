@@ -14,10 +14,16 @@ Odemis is distributed in the hope that it will be useful, but WITHOUT ANY WARRAN
 
 You should have received a copy of the GNU General Public License along with Odemis. If not, see http://www.gnu.org/licenses/.
 '''
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from concurrent.futures._base import CancelledError, CANCELLED, FINISHED, RUNNING
 import logging
+import math
+import multiprocessing
 import numpy
 from odemis import model
+from odemis.util.spectrum import get_wavelength_per_pixel
+from odemis.util.concurrent import executeAsyncTask
+import os
 from scipy.optimize import curve_fit, OptimizeWarning
 import threading
 import time
@@ -201,6 +207,174 @@ def Detect(y_vector, x_vector=None, lookahead=5, delta=0):
     return maxtab, mintab
 
 
+def _GetBounds(spectrum, wavelength, type, npeaks):
+    """
+    Computes the bounds of the fitting parameters.
+    spectrum (1d array of floats): The data representing the spectrum.
+    wavelength (1d array of floats): The wavelength values corresponding to the spectrum.
+    type (str): Type of fitting
+    npeaks (int): number of peaks
+    returns (2 lists of floats): lower and upper bounds, for each peak (pos, width, amplitude),
+      and the offset, in the domain of the fitting type (space or energy)
+    """
+    if type in {'gaussian_energy', 'lorentzian_energy'}:
+        energy = apply_jacobian_x(wavelength)
+        # lower & upper bounds for center position, width, amplitude in energy domain
+        en_rng = energy[0] - energy[-1]
+        lower_bounds = [energy[-1] - en_rng / 2, en_rng / 1e4, 0] * npeaks
+        upper_bounds = [energy[0] + en_rng / 2, en_rng * 10, numpy.inf] * npeaks
+    else:
+        # lower & upper bounds for center position, width, amplitude in space domain
+        wl_rng = wavelength[-1] - wavelength[0]
+        lower_bounds = [wavelength[0] - wl_rng / 2, wl_rng / 1e3, 0] * npeaks
+        upper_bounds = [wavelength[-1] + wl_rng / 2, wl_rng * 10, numpy.inf] * npeaks
+
+    # Set the lower & upper bounds for the offset. The upper bound must be strictly bigger
+    # than the lower bound, so if the spectrum goes to 0 (or below), the offset is forced to ~0.
+    lower_bounds.append(0)
+    upper_bounds.append(max(min(spectrum), numpy.finfo(float).tiny))
+    return lower_bounds, upper_bounds
+
+
+def _CurveFit(spectrum, wavelength, type, fit_list, param_bounds, x_scale=1.0):
+    """
+    Runs the curve fitting on the spectrum (converted to energy if needed)
+    x_scale (float or "jac"): characteristic scale of each parameter, as in least_squares().
+      "jac" is needed when the initial parameters are already close to the solution,
+      as the parameters have very different orders of magnitude (eg, 1e-7 m and 1e3).
+    returns:
+         params (list of 3-tuple): Each peak parameters as (pos, width, amplitude) in space domain
+         offset (float): global offset to add
+    raises: Exception if the fitting failed
+    """
+    FitFunction = PEAK_FUNCTIONS[type]
+    with warnings.catch_warnings():
+        # Hide scipy/optimize/minpack.py:690: OptimizeWarning: Covariance of the parameters could not be estimated
+        warnings.filterwarnings("ignore", "", OptimizeWarning)
+        if type in {'gaussian_energy', 'lorentzian_energy'}:
+            energy = apply_jacobian_x(wavelength)
+            spectra_energy = apply_jacobian_y(wavelength, spectrum)
+            params, _ = curve_fit(FitFunction, energy, spectra_energy, p0=fit_list, bounds=param_bounds,
+                                  x_scale=x_scale)
+        else:
+            params, _ = curve_fit(FitFunction, wavelength, spectrum, p0=fit_list, bounds=param_bounds,
+                                  x_scale=x_scale)
+
+    # reformat parameters to (list of 3 tuples, offset)
+    peaks_params = []
+    for pos, width, amplitude in _Grouped(params[:-1], 3):
+        if type in {'gaussian_energy', 'lorentzian_energy'}:
+            peaks_params.append(peak_to_wavelength(pos, width, amplitude))
+        else:
+            peaks_params.append((pos, width, amplitude))
+
+    return peaks_params, params[-1]
+
+
+def _FitPeaks(spectrum, wavelength, type='gaussian_space', check_cancelled=None):
+    """
+    Smooths the spectrum signal, detects the peaks and applies the type of peak
+    fitting required.
+    spectrum (1d array of floats): The data representing the spectrum.
+    wavelength (1d array of floats): The wavelength values corresponding to the
+    spectrum given.
+    type (str): Type of fitting to be applied
+    check_cancelled (None or callable): called regularly, should raise CancelledError
+      if the fitting should stop
+    returns:
+         params (list of 3-tuple): Each peak parameters as (pos, width, amplitude)
+         offset (float): global offset to add
+    raises:
+            KeyError if given type not available
+            ValueError if fitting cannot be applied
+    """
+    # values based on experimental datasets
+    if len(wavelength) >= 2000:
+        divider = 20
+    elif len(wavelength) >= 1000:
+        divider = 25
+    else:
+        divider = 30
+    init_window_size = max(3, len(wavelength) // divider)
+    window_size = init_window_size
+    logging.debug("Starting peak detection on data (len = %d) with window = %d",
+                  len(wavelength), window_size)
+    if type not in PEAK_FUNCTIONS:
+        raise KeyError("Given type %s not in available fitting types: %s" % (type, list(PEAK_FUNCTIONS.keys())))
+    wl_rng = wavelength[-1] - wavelength[0]
+    width = wl_rng * WIDTH_RATIO  # initial peak width estimation
+
+    for step in range(5):
+        if check_cancelled:
+            check_cancelled()
+        smoothed = Smooth(spectrum, window_len=window_size)
+        # Increase window size until peak detection finds enough peaks to fit
+        # the spectrum curve
+        peaks = Detect(smoothed, wavelength, lookahead=window_size, delta=5)[0]
+        if not peaks:
+            window_size = int(round(window_size * 1.2))
+            logging.debug("Retrying to fit peak with window = %d", window_size)
+            continue
+
+        fit_list = []
+        for (pos, amplitude) in peaks:
+            if type in {'gaussian_energy', 'lorentzian_energy'}:
+                fit_list.extend(peak_to_energy(pos, width, amplitude))
+            else:
+                fit_list.extend([pos, width, amplitude])
+
+        # Initialize the offset with the minimum possible value
+        fit_list.append(0)
+        param_bounds = _GetBounds(spectrum, wavelength, type, len(peaks))
+
+        if check_cancelled:
+            check_cancelled()
+
+        try:
+            return _CurveFit(spectrum, wavelength, type, fit_list, param_bounds)
+        except Exception as ex:
+            window_size = int(round(window_size * 1.2))
+            logging.debug("Retrying to fit peak with window = %d due to error %s", window_size, ex)
+            continue
+
+    raise ValueError("Could not apply peak fitting of type %s." % type)
+
+
+def _FitPeaksFrom(spectrum, wavelength, type, peaks_params, offset):
+    """
+    Fits the spectrum starting from the given parameters (typically from a neighbouring spectrum),
+    without peak detection.
+    peaks_params (list of 3-tuple): Each initial peak parameters as (pos, width, amplitude) in space domain
+    offset (float): initial global offset
+    returns:
+         params (list of 3-tuple): Each peak parameters as (pos, width, amplitude)
+         offset (float): global offset to add
+    raises: Exception if the fitting failed
+    """
+    fit_list = []
+    for pos, width, amplitude in peaks_params:
+        if type in {'gaussian_energy', 'lorentzian_energy'}:
+            fit_list.extend(peak_to_energy(pos, width, amplitude))
+        else:
+            fit_list.extend([pos, width, amplitude])
+    fit_list.append(offset)
+
+    # The initial parameters must be within the bounds
+    lower_bounds, upper_bounds = _GetBounds(spectrum, wavelength, type, len(peaks_params))
+    fit_list = numpy.clip(fit_list, lower_bounds, upper_bounds)
+    return _CurveFit(spectrum, wavelength, type, fit_list, (lower_bounds, upper_bounds), x_scale="jac")
+
+
+def _FitResidual(spectrum, wavelength, type, fit):
+    """
+    Computes how well a fit matches the spectrum
+    fit (list of 3-tuple, float): the peak parameters and the offset, as returned by _FitPeaks()
+    returns (float): the root mean square of the difference between the curve and the spectrum
+    """
+    curve = Curve(wavelength, fit[0], fit[1], type)
+    return math.sqrt(numpy.mean((spectrum - curve) ** 2))
+
+
 class PeakFitter(object):
     def __init__(self):
         # will take care of executing peak fitting asynchronously
@@ -250,95 +424,13 @@ class PeakFitter(object):
                 KeyError if given type not available
                 ValueError if fitting cannot be applied
         """
-        try:
-            # values based on experimental datasets
-            if len(wavelength) >= 2000:
-                divider = 20
-            elif len(wavelength) >= 1000:
-                divider = 25
-            else:
-                divider = 30
-            init_window_size = max(3, len(wavelength) // divider)
-            window_size = init_window_size
-            logging.debug("Starting peak detection on data (len = %d) with window = %d",
-                          len(wavelength), window_size)
-            try:
-                wl_rng = wavelength[-1] - wavelength[0]
-                width = wl_rng * WIDTH_RATIO  # initial peak width estimation
-                FitFunction = PEAK_FUNCTIONS[type]
-            except KeyError:
-                raise KeyError("Given type %s not in available fitting types: %s" % (type, list(PEAK_FUNCTIONS.keys())))
-            for step in range(5):
-                if future._fit_state == CANCELLED:
-                    raise CancelledError()
-                smoothed = Smooth(spectrum, window_len=window_size)
-                # Increase window size until peak detection finds enough peaks to fit
-                # the spectrum curve
-                peaks = Detect(smoothed, wavelength, lookahead=window_size, delta=5)[0]
-                if not peaks:
-                    window_size = int(round(window_size * 1.2))
-                    logging.debug("Retrying to fit peak with window = %d", window_size)
-                    continue
-
-                fit_list = []
-                lower_bounds = []
-                upper_bounds = []
-                for (pos, amplitude) in peaks:
-                    if type in {'gaussian_energy', 'lorentzian_energy'}:
-                        energy = apply_jacobian_x(wavelength)
-                        spectra_energy = apply_jacobian_y(wavelength, spectrum)
-                        fit_list.extend(peak_to_energy(pos, width, amplitude))
-                        # lower & upper bounds for center position, width, amplitude in energy domain
-                        en_rng = energy[0] - energy[-1]
-                        lower_bounds.extend([energy[-1] - en_rng / 2, en_rng / 1e4, 0])
-                        upper_bounds.extend([energy[0] + en_rng / 2, en_rng * 10, numpy.inf])
-                    else:
-                        # lower & upper bounds for center position, width, amplitude in space domain
-                        fit_list.extend([pos, width, amplitude])
-                        lower_bounds.extend([wavelength[0] - wl_rng / 2, wl_rng / 1e3, 0])
-                        upper_bounds.extend([wavelength[-1] + wl_rng / 2, wl_rng * 10, numpy.inf])
-
-                # Initialize the offset with the minimum possible value
-                offset = 0
-                fit_list.append(offset)
-                # Set the lower & upper bounds for the offset
-                lower_bounds.extend([0])
-                upper_bounds.extend([min(spectrum)])
-                param_bounds = (lower_bounds, upper_bounds)
-
-                if future._fit_state == CANCELLED:
-                    raise CancelledError()
+        def check_cancelled():
+            if future._fit_state == CANCELLED:
+                raise CancelledError()
 
-                try:
-                    with warnings.catch_warnings():
-                        # Hide scipy/optimize/minpack.py:690: OptimizeWarning: Covariance of the parameters could not be estimated
-                        warnings.filterwarnings("ignore", "", OptimizeWarning)
-                        # TODO, from scipy 0.17, curve_fit() supports the 'bounds' parameter.
-                        # It could be used to ensure the peaks params are positives.
-                        # (Once we don't support Ubuntu 12.04)
-                        if type in {'gaussian_energy', 'lorentzian_energy'}:
-                            params, _ = curve_fit(FitFunction, energy, spectra_energy, p0=fit_list, bounds=param_bounds)
-                        else:
-                            params, _ = curve_fit(FitFunction, wavelength, spectrum, p0=fit_list, bounds=param_bounds)
-                    break
-                except Exception as ex:
-                    window_size = int(round(window_size * 1.2))
-                    logging.debug("Retrying to fit peak with window = %d due to error %s", window_size, ex)
-                    continue
-            else:
-                raise ValueError("Could not apply peak fitting of type %s." % type)
-            # reformat parameters to (list of 3 tuples, offset)
-            peaks_params = []
-            for pos, width, amplitude in _Grouped(params[:-1], 3):
-                # Note: to avoid negative peaks, the fit functions only take the
-                # absolute of the amplitude/width. So now amplitude and width
-                # have 50% chances to be negative => Force positive now.
-                if type in {'gaussian_energy', 'lorentzian_energy'}:
-                    peaks_params.append(peak_to_wavelength(pos, width, amplitude))
-                else:
-                    peaks_params.append((pos, width, amplitude))
-
-            return peaks_params, params[-1], type
+        try:
+            peaks_params, offset = _FitPeaks(spectrum, wavelength, type, check_cancelled)
+            return peaks_params, offset, type
         except CancelledError:
             logging.debug("Fitting of type %s was cancelled.", type)
         finally:
@@ -369,6 +461,237 @@ class PeakFitter(object):
         return len(data) * 10e-3  # s
 
 
+# A fit started from the parameters of a neighbour is only accepted if its residual is at most
+# this times the residual of the neighbour. Otherwise, it might have stalled near the initial
+# parameters, and the peaks are detected.
+MAX_WARM_FIT_RESIDUAL_RATIO = 1.5
+# A fit started from the parameters of a neighbour is only accepted if its strongest peak is
+# similar to the strongest peak of the neighbour: its width and amplitude must be within this
+# ratio, and its position within the width of the neighbour peak.
+MAX_WARM_PEAK_RATIO = 2
+
+
+def _StrongestPeak(peaks_params, wavelength):
+    """
+    Picks the strongest peak of a fit.
+    A peak outside of the spectrum range, or narrower than the wavelength step, can get a
+    very large amplitude while barely contributing to the curve, so it's not considered
+    (unless there is no other peak).
+    peaks_params (list of 3-tuple): Each peak parameters as (pos, width, amplitude)
+    wavelength (1d array of floats): The wavelength values corresponding to the spectrum.
+    returns (3-tuple): pos, width, amplitude of the strongest peak
+    """
+    wl_min, wl_max = min(wavelength), max(wavelength)
+    min_width = (wl_max - wl_min) / max(1, len(wavelength) - 1)
+    inside = [p for p in peaks_params if wl_min <= p[0] <= wl_max and abs(p[1]) >= min_width] or peaks_params
+    return max(inside, key=lambda p: p[2])
+
+
+def _IsWarmFitValid(fit, residual, nfit, nresidual, wavelength):
+    """
+    Checks whether a fit started from the parameters of a neighbour is as good as the
+    neighbour fit. It's not the case if the optimization stalled, or if the strongest
+    peak drifted to a different peak.
+    fit, nfit (list of 3-tuple, float): the peak parameters and the offset of the
+      warm-started fit, and of the neighbour fit
+    residual, nresidual (float): the residuals of the fits
+    returns (bool): True if the fit can be used
+    """
+    if residual > nresidual * MAX_WARM_FIT_RESIDUAL_RATIO:
+        return False
+    pos, width, amplitude = _StrongestPeak(fit[0], wavelength)
+    npos, nwidth, namplitude = _StrongestPeak(nfit[0], wavelength)
+    return (abs(pos - npos) <= abs(nwidth) and
+            abs(nwidth) / MAX_WARM_PEAK_RATIO <= abs(width) <= abs(nwidth) * MAX_WARM_PEAK_RATIO and
+            namplitude / MAX_WARM_PEAK_RATIO <= amplitude <= namplitude * MAX_WARM_PEAK_RATIO)
+
+
+def _FitSpectrumCold(spectrum, wavelength, type):
+    """
+    Fits the spectrum from the regular initial guess, by detecting the peaks. The
+    result is then refined by fitting again from it, as the first fit often stalls
+    far from the optimum, due to the badly conditioned parameters.
+    returns (list of 3-tuple, float), float: the peak parameters and the offset, and the residual
+    raises: Exception if the fitting failed
+    """
+    fit = _FitPeaks(spectrum, wavelength, type)
+    residual = _FitResidual(spectrum, wavelength, type, fit)
+    try:
+        rfit = _FitPeaksFrom(spectrum, wavelength, type, *fit)
+        rresidual = _FitResidual(spectrum, wavelength, type, rfit)
+        if rresidual < residual:
+            fit, residual = rfit, rresidual
+    except Exception as ex:
+        logging.debug("Failed to refine the fit: %s", ex)
+    return fit, residual
+
+
+def _FitSpectraBlock(spectra, wavelength, type):
+    """
+    Fits all the spectra of a block. It's run in a separate process.
+    Each fit is first initialized with the parameters of a neighbouring spectrum (left, or above),
+    which is much faster than detecting the peaks. Only if it fails, or if the result is
+    worse than the neighbour fit (see _IsWarmFitValid()), the peaks are detected.
+    spectra (ndarray of shape Y, X, C): the spectra
+    wavelength (1d array of floats): The wavelength values corresponding to the spectra.
+    type (str): Type of fitting
+    returns (ndarray of shape Y, X, 4): position, width, amplitude and offset of the strongest
+      peak of each spectrum. NaN if the fitting failed.
+    """
+    res = numpy.full(spectra.shape[:2] + (4,), numpy.nan)
+    fits = {}  # (y, x) -> ((peaks_params, offset), residual)
+    for y, x in numpy.ndindex(*spectra.shape[:2]):
+        spec = spectra[y, x]
+        fit, residual = None, math.inf
+        for ny, nx in ((y, x - 1), (y - 1, x)):
+            if (ny, nx) in fits:
+                nfit, nresidual = fits[(ny, nx)]
+                try:
+                    wfit = _FitPeaksFrom(spec, wavelength, type, *nfit)
+                    wresidual = _FitResidual(spec, wavelength, type, wfit)
+                except Exception:
+                    continue
+                if _IsWarmFitValid(wfit, wresidual, nfit, nresidual, wavelength):
+                    fit, residual = wfit, wresidual
+                    break
+                # Only used if the regular fitting fails
+                if fit is None or wresidual < residual:
+                    fit, residual = wfit, wresidual
+        else:  # No good enough warm fit => detect the peaks
+            try:
+                fit, residual = _FitSpectrumCold(spec, wavelength, type)
+            except Exception as ex:
+                logging.debug("Failed to fit spectrum at %s: %s", (x, y), ex)
+            if fit is None:
+                continue
+
+        fits[(y, x)] = fit, residual
+        fits.pop((y - 1, x - 1), None)  # Not needed anymore
+        peaks_params, offset = fit
+        pos, width, amplitude = _StrongestPeak(peaks_params, wavelength)
+        res[y, x] = pos, width, amplitude, offset
+
+    return res
+
+
+def FitCube(data, type='gaussian_space', max_workers=None):
+    """
+    Fits the peaks of every spectrum of a spectrum cube, in parallel in multiple processes.
+    data (DataArray of shape C11YX or CYX): the spectrum cube, with MD_WL_LIST. If there is
+      a T or A dimension, the spectra are averaged along it.
+    type (str): Type of fitting to be applied ('gaussian_space', 'lorentzian_space',
+      'gaussian_energy' or 'lorentzian_energy')
+    max_workers (None or int): maximum number of processes used. None => number of CPUs.
+    returns (model.ProgressiveFuture): its result is a list of 3 DataArrays of shape YX:
+      the position (m), width (m) and amplitude of the strongest peak of each spectrum,
+      with the spatial metadata of the cube. The value is NaN where the fitting failed.
+    raises:
+        KeyError if given type not available
+        ValueError if the data is not a spectrum cube
+    """
+    if type not in PEAK_FUNCTIONS:
+        raise KeyError("Given type %s not in available fitting types: %s" % (type, list(PEAK_FUNCTIONS.keys())))
+    if data.ndim not in (3, 5):
+        raise ValueError("Expected a spectrum cube of 3 or 5 dimensions, but got shape %s" % (data.shape,))
+    wavelength = get_wavelength_per_pixel(data)
+
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    # Roughly, the first fit of each block takes ~10x longer than the next ones
+    npx = data.shape[-1] * data.shape[-2]
+    est_dur = npx * len(wavelength) * 2e-3 / max_workers
+    f = model.ProgressiveFuture(remaining_time=est_dur)
+    f._fit_state = RUNNING
+    f._fit_lock = threading.Lock()
+    f._fit_futures = []
+    f.task_canceller = _CancelFitCube
+
+    executeAsyncTask(f, _DoFitCube, args=(f, data, wavelength, type, max_workers))
+    return f
+
+
+def _DoFitCube(future, data, wavelength, type, max_workers):
+    """
+    returns (list of 3 DataArrays): see FitCube()
+    """
+    if data.ndim == 5:
+        # Average time or theta values if they exist (iow, flatten axis 1), and drop Z
+        if data.shape[1] > 1:
+            data = numpy.mean(data, axis=1)[:, 0]
+        else:
+            data = data[:, 0, 0]
+    spectra = numpy.moveaxis(numpy.asarray(data), 0, -1)  # YXC
+    rows = spectra.shape[0]
+    # Several blocks per worker, to spread the load evenly
+    block_rows = max(1, int(math.ceil(rows / (max_workers * 4))))
+
+    start = time.time()
+    res = numpy.empty(spectra.shape[:2] + (4,))
+    # Use "spawn" so that it's safe even if the caller has many threads (eg, the GUI)
+    ctx = multiprocessing.get_context("spawn")
+    executor = ProcessPoolExecutor(max_workers=max_workers, mp_context=ctx)
+    try:
+        with future._fit_lock:
+            if future._fit_state == CANCELLED:
+                raise CancelledError()
+            fs = {}
+            for y in range(0, rows, block_rows):
+                bf = executor.submit(_FitSpectraBlock, numpy.ascontiguousarray(spectra[y:y + block_rows]),
+                                     wavelength, type)
+                fs[bf] = y
+            future._fit_futures = list(fs.keys())
+
+        ndone = 0
+        for bf in as_completed(fs):
+            if future._fit_state == CANCELLED:
+                raise CancelledError()
+            y = fs[bf]
+            block = bf.result()
+            res[y:y + block.shape[0]] = block
+            ndone += block.shape[0]
+            dur = time.time() - start
+            future.set_progress(remaining_time=dur * (rows - ndone) / ndone)
+    except CancelledError:
+        logging.debug("Fitting of the cube was cancelled")
+        raise
+    finally:
+        executor.shutdown(wait=False)
+        with future._fit_lock:
+            cancelled = (future._fit_state == CANCELLED)
+            future._fit_state = FINISHED
+
+    if cancelled:
+        raise CancelledError()
+
+    logging.debug("Fitted %d spectra in %g s", rows * spectra.shape[1], time.time() - start)
+    md = {k: v for k, v in data.metadata.items()
+          if k in (model.MD_POS, model.MD_PIXEL_SIZE, model.MD_ROTATION, model.MD_SHEAR, model.MD_ACQ_DATE)}
+    md[model.MD_DIMS] = "YX"
+    maps = []
+    for i, desc in enumerate(("Peak position", "Peak width", "Peak amplitude")):
+        mmd = md.copy()
+        mmd[model.MD_DESCRIPTION] = desc
+        maps.append(model.DataArray(res[:, :, i].copy(), mmd))
+
+    return maps
+
+
+def _CancelFitCube(future):
+    """
+    Canceller of _DoFitCube task.
+    """
+    with future._fit_lock:
+        if future._fit_state == FINISHED:
+            return False
+        future._fit_state = CANCELLED
+        # The blocks already being processed will finish, but not the other ones
+        for bf in future._fit_futures:
+            bf.cancel()
+        logging.debug("Cube fitting cancelled.")
+
+    return True
+
+
 def peak_to_energy(pos, width, amplitude):
     """
     Converts the peaks to energy domain.
@@ -533,6 +533,8 @@ def estimate_grid_orientation_from_img(
     threshold_rel: Optional[float] = None,
     num_spots: Optional[int] = None,
     min_distance: Optional[int] = None,
+    binning: int = 1,
+    prior: Optional[GeometricTransform] = None,
 ) -> Tuple[T, float]:
     """
     Image based estimation of the orientation of a square grid of points.
@@ -563,6 +565,14 @@ def estimate_grid_orientation_from_img(
     min_distance : int, optional
         The minimal allowed distance in pixels separating peaks. To find the
         maximum number of peaks, use `min_distance=1`.
+    binning : int, optional
+        If more than 1, the spots are first located on the image binned by
+        this factor, and then refined at full resolution.
+    prior : GeometricTransform, optional
+        A previous estimate of the orientation of the pattern. If provided,
+        the spots are only searched around their expected position (within
+        `min_distance / 2`), which is much faster than searching the whole
+        image.
 
     Returns
     -------
@@ -582,5 +592,9 @@ def estimate_grid_orientation_from_img(
         num_spots = shape[0] * shape[1]
     elif num_spots == 0:
         num_spots = None
-    ji = find_spot_positions(image, sigma, threshold_abs, threshold_rel, num_spots, min_distance)
+    seed = None
+    if prior is not None:
+        seed = prior.apply(unit_gridpoints(shape, mode="ji"))
+    ji = find_spot_positions(image, sigma, threshold_abs, threshold_rel, num_spots, min_distance,
+                             binning=binning, seed=seed)
     return estimate_grid_orientation(ji, shape, transform_type)
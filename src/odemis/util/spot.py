@@ -16,11 +16,10 @@ You should have received a copy of the GNU General Public License along with Ode
 """
 import logging
 import math
-from typing import Optional, Tuple
+from typing import List, Optional, Tuple
 
 import cv2
 import numpy
-import scipy.signal
 from odemis import model, util
 from odemis.util import img
 from odemis.util.peak_local_max import peak_local_max
@@ -149,6 +148,26 @@ def FindCenterCoordinates(
     return xc, -yc
 
 
+def FindCentersCoordinates(
+    images: List[numpy.ndarray], smoothing: bool = True
+) -> List[Tuple[float, float]]:
+    """
+    Returns the radial symmetry center of each image, as FindCenterCoordinates().
+    The images of the same shape are processed all at once.
+
+    """
+    centers = [None] * len(images)
+    by_shape = {}  # shape -> list of indices
+    for idx, image in enumerate(images):
+        by_shape.setdefault(numpy.shape(image), []).append(idx)
+    for shape, indices in by_shape.items():
+        jis = radial_symmetry_centers(numpy.stack([images[idx] for idx in indices]), smoothing)
+        for idx, ji in zip(indices, jis):
+            xc, yc = to_physical_space(ji, shape)
+            centers[idx] = (xc, -yc)
+    return centers
+
+
 def radial_symmetry_center(
     image: numpy.ndarray, smoothing: bool = True
 ) -> Tuple[float, float]:
@@ -183,59 +202,84 @@ def radial_symmetry_center(
     (2.0, 4.0)
 
     """
-    image = numpy.asarray(image, dtype=numpy.float64)
+    jc, ic = radial_symmetry_centers(numpy.asarray(image)[numpy.newaxis], smoothing)[0]
+    return jc, ic
+
+
+def radial_symmetry_centers(
+    images: numpy.ndarray, smoothing: bool = True
+) -> numpy.ndarray:
+    """
+    Returns the radial symmetry center of each image of a stack, with sub-pixel
+    resolution. All the images are processed at once, which is much faster than
+    calling radial_symmetry_center() on each of them.
+
+    Parameters
+    ----------
+    images : array_like of shape (N, n, m)
+        The images of which to determine the radial symmetry center.
+    smoothing : boolean
+        Apply a smoothing kernel to the intensity gradient.
+
+    Returns
+    -------
+    pos : ndarray of shape (N, 2)
+        Position of the radial symmetry center `(j, i)` of each image, as pixel
+        index of the image.
+
+    """
+    images = numpy.asarray(images, dtype=numpy.float64)
 
     # Compute lattice midpoints (jk, ik).
-    n, m = image.shape
+    _, n, m = images.shape
     jk, ik = numpy.meshgrid(
         numpy.arange(n - 1, dtype=float) + 0.5,
         numpy.arange(m - 1, dtype=float) + 0.5,
         indexing="ij",
     )
 
-    # Calculate the intensity gradient.
-    kj = numpy.array([(1, 1), (-1, -1)])
-    ki = numpy.array([(1, -1), (1, -1)])
-    dIdj = scipy.signal.convolve2d(image, kj, mode="valid")
-    dIdi = scipy.signal.convolve2d(image, ki, mode="valid")
+    # Calculate the intensity gradient, along the diagonals (same as a
+    # convolution with the kernels [(1, 1), (-1, -1)] and [(1, -1), (1, -1)]).
+    dIdj = images[:, 1:, 1:] + images[:, 1:, :-1] - images[:, :-1, 1:] - images[:, :-1, :-1]
+    dIdi = images[:, 1:, 1:] - images[:, 1:, :-1] + images[:, :-1, 1:] - images[:, :-1, :-1]
     if smoothing:
-        k = numpy.ones((3, 3)) / 9.0
-        dIdj = scipy.signal.convolve2d(dIdj, k, boundary="symm", mode="same")
-        dIdi = scipy.signal.convolve2d(dIdi, k, boundary="symm", mode="same")
+        dIdj = ndimage.uniform_filter(dIdj, size=(1, 3, 3), mode="reflect")
+        dIdi = ndimage.uniform_filter(dIdi, size=(1, 3, 3), mode="reflect")
     dI2 = numpy.square(dIdj) + numpy.square(dIdi)
 
-    # Discard entries where the intensity gradient magnitude is zero, flatten
-    # the array in the same go.
-    idx = numpy.flatnonzero(dI2)
-    jk = numpy.take(jk, idx)
-    ik = numpy.take(ik, idx)
-    dIdj = numpy.take(dIdj, idx)
-    dIdi = numpy.take(dIdi, idx)
-    dI2 = numpy.take(dI2, idx)
+    # Entries where the intensity gradient magnitude is zero are discarded, by
+    # giving them a weight of zero.
+    valid = dI2 > 0
 
     # Construct the set of equations for a line passing through the midpoint
     # `(jk, ik)`, parallel to the gradient intensity, in implicit form:
     # `a*j + b*i = c`, normalized such that `a^2 + b^2 = 1`.
     dI = numpy.sqrt(dI2)
-    a = -dIdi / dI
-    b = dIdj / dI
+    a = numpy.divide(-dIdi, dI, out=numpy.zeros_like(dI), where=valid)
+    b = numpy.divide(dIdj, dI, out=numpy.zeros_like(dI), where=valid)
     c = a * jk + b * ik
 
     # Weighting: weight by the square of the gradient magnitude and inverse
     # distance to the centroid of the square of the gradient intensity
     # magnitude.
-    sdI2 = numpy.sum(dI2)
-    j0 = numpy.sum(dI2 * jk) / sdI2
-    i0 = numpy.sum(dI2 * ik) / sdI2
-    w = numpy.sqrt(dI2 / numpy.hypot(jk - j0, ik - i0))
-
-    # Solve the linear set of equations in a least-squares sense.
+    sdI2 = numpy.sum(dI2, axis=(1, 2))
+    j0 = numpy.sum(dI2 * jk, axis=(1, 2)) / sdI2
+    i0 = numpy.sum(dI2 * ik, axis=(1, 2)) / sdI2
+    dist = numpy.hypot(jk - j0[:, None, None], ik - i0[:, None, None])
+    w2 = numpy.divide(dI2, dist, out=numpy.zeros_like(dI2), where=valid)
+
+    # Solve the linear set of equations of each image in a least-squares sense,
+    # via the normal equations (2 x 2).
     # Note: rcond is set explicitly to have correct and consistent behavior,
     #       independent on numpy version.
+    ata = numpy.empty((len(images), 2, 2))
+    ata[:, 0, 0] = numpy.sum(w2 * a * a, axis=(1, 2))
+    ata[:, 0, 1] = ata[:, 1, 0] = numpy.sum(w2 * a * b, axis=(1, 2))
+    ata[:, 1, 1] = numpy.sum(w2 * b * b, axis=(1, 2))
+    atc = numpy.stack([numpy.sum(w2 * a * c, axis=(1, 2)),
+                       numpy.sum(w2 * b * c, axis=(1, 2))], axis=-1)
     rcond = numpy.finfo(numpy.float64).eps * max(n, m)
-    jc, ic = numpy.linalg.lstsq(numpy.vstack((w * a, w * b)).T, w * c, rcond)[0]
-
-    return jc, ic
+    return numpy.einsum("kij,kj->ki", numpy.linalg.pinv(ata, rcond), atc)
 
 
 def _CreateSEDisk(r=3):
@@ -370,11 +414,20 @@ def find_spot_positions(
     threshold_rel: Optional[float] = None,
     num_spots: Optional[int] = None,
     min_distance: Optional[int] = None,
+    binning: int = 1,
+    seed: Optional[numpy.ndarray] = None,
 ) -> numpy.ndarray:
     """
     Find the center coordinates of spots with the highest intensity in an
     image.
 
+    To go faster, the spots can be first searched on a binned version of the
+    image (`binning` > 1), or around their expected positions (`seed`). In
+    both cases, the center of each spot is then refined on a small window of
+    the full resolution image. The result is the same as a full resolution
+    search, as long as each spot is (still) detectable on the binned image, or
+    is within `min_distance / 2` of its expected position.
+
     Parameters
     ----------
     image : ndarray
@@ -394,6 +447,13 @@ def find_spot_positions(
     min_distance : int, optional
         The minimal allowed distance in pixels separating peaks. To find the
         maximum number of peaks, use `min_distance=1`.
+    binning : int, optional
+        If more than 1, the spots are first located on the image binned by
+        this factor.
+    seed : ndarray of shape (M, 2), optional
+        The expected coordinates `(j, i)` of the spots, for instance from a
+        previous call. If provided, the spots are only searched within
+        `min_distance / 2` of these positions, and `binning` is not used.
 
     Returns
     -------
@@ -405,27 +465,126 @@ def find_spot_positions(
     size = int(round(3 * sigma))
     len_object = 2 * size  # typical length of a spot
     min_distance = len_object if not min_distance else min_distance  # distance between spots
-    filtered = bandpass_filter(image, sigma, len_object)
+
+    if seed is not None:
+        candidates = numpy.rint(seed).astype(numpy.int64).reshape(-1, 2)
+        radius = max(1, min_distance // 2)
+    elif binning > 1:
+        candidates = _find_coarse_spot_positions(image, sigma, binning, num_spots, min_distance)
+        radius = binning
+    else:
+        filtered = bandpass_filter(image, sigma, len_object)
+        coordinates = peak_local_max(
+            filtered,
+            min_distance=min_distance,
+            threshold_abs=threshold_abs,
+            threshold_rel=threshold_rel,
+            exclude_border=False,
+            num_peaks=num_spots,
+            p_norm=2,
+            len_object=len_object,
+        )
+        subimgs = [_get_subimage(filtered, ji, size) for ji in coordinates]
+        return _refine_spot_positions(coordinates, subimgs, size)
+
+    # Filter only a window around each candidate, large enough so that the
+    # filtered values around the spot are the same as when filtering the whole
+    # image (thanks to the image being extended the same way as the filters do).
+    margin = len_object + int(math.ceil(4 * sigma)) + 1
+    hw = radius + size + margin  # half width of the window
+    offsets = numpy.arange(-hw, hw + 1)
+    padded = numpy.pad(image, hw, mode="symmetric")
+    candidates = numpy.clip(candidates, 0, numpy.array(image.shape) - 1)
+    windows = padded[(candidates[:, 0, numpy.newaxis, numpy.newaxis] + hw + offsets[:, numpy.newaxis]),
+                     (candidates[:, 1, numpy.newaxis, numpy.newaxis] + hw + offsets)]
+    filtered = bandpass_filter(windows, sigma, len_object)
+
+    # Local maximum within the search radius
+    center = filtered[:, hw - radius:hw + radius + 1, hw - radius:hw + radius + 1]
+    am = numpy.argmax(center.reshape(len(center), -1), axis=1)
+    peak_val = center.reshape(len(center), -1)[numpy.arange(len(center)), am]
+    peaks = numpy.column_stack(numpy.unravel_index(am, center.shape[1:])) - radius  # relative to the candidate
+
+    # Same thresholds as peak_local_max(), with the maximum of the whole image
+    # approximated by the maximum of all the windows.
+    threshold = filtered.min() if threshold_abs is None else threshold_abs
+    if threshold_rel is not None and filtered.size:
+        threshold = max(threshold, threshold_rel * filtered.max())
+    keep = peak_val > threshold
+
+    # Sort by intensity, and drop the candidates which converged to the same
+    # spot (or too close).
+    order = [k for k in numpy.argsort(-peak_val, kind="stable") if keep[k]]
+    selected = []
+    coordinates = []
+    for k in order:
+        ji = candidates[k] + peaks[k]
+        if any(math.hypot(*(ji - c)) < min_distance for c in coordinates):
+            continue
+        selected.append(k)
+        coordinates.append(ji)
+        if num_spots and len(selected) >= num_spots:
+            break
+
+    n, m = image.shape
+    subimgs = []
+    for k, ji in zip(selected, coordinates):
+        if any((ji[0] < size, ji[1] < size, ji[0] >= n - size, ji[1] >= m - size)):
+            raise IndexError("Position too close to the edge of the image.")
+        j, i = hw + peaks[k]
+        subimgs.append(filtered[k, j - size:j + size + 1, i - size:i + size + 1])
+    return _refine_spot_positions(numpy.array(coordinates, dtype=numpy.int64).reshape(-1, 2),
+                                  subimgs, size)
+
+
+def _find_coarse_spot_positions(
+    image: numpy.ndarray,
+    sigma: float,
+    binning: int,
+    num_spots: Optional[int],
+    min_distance: int,
+) -> numpy.ndarray:
+    """
+    Find the approximate positions of the spots, on the binned image. See
+    find_spot_positions() for the parameters.
+
+    Returns
+    -------
+    coordinates : ndarray of shape (N, 2)
+        The coordinates `(j, i)` of the spots in the full resolution image,
+        with an accuracy of `binning` px. More spots than `num_spots` can be
+        returned, as the thresholds are only applied at full resolution.
+
+    """
+    n, m = image.shape[0] // binning, image.shape[1] // binning
+    binned = image[:n * binning, :m * binning].reshape(n, binning, m, binning).mean(axis=(1, 3))
+
+    len_object = max(1, int(round(6 * sigma / binning)))
+    filtered = bandpass_filter(binned, sigma / binning, len_object)
     coordinates = peak_local_max(
         filtered,
-        min_distance=min_distance,
-        threshold_abs=threshold_abs,
-        threshold_rel=threshold_rel,
+        min_distance=max(1, min_distance // binning),
         exclude_border=False,
-        num_peaks=num_spots,
+        num_peaks=2 * num_spots if num_spots else None,  # Some extra, in case of noise
         p_norm=2,
         len_object=len_object,
     )
+    return coordinates * binning + (binning - 1) // 2
 
-    # Improve coordinate estimate using radial symmetry center.
-    refined_coordinates = numpy.empty_like(coordinates, dtype=float)
-    for idx, ji in enumerate(coordinates):
-        subimg = _get_subimage(filtered, ji, size)
-        rsc = radial_symmetry_center(subimg, smoothing=False)
-        delta = numpy.subtract(rsc, size)
-        refined_coordinates[idx] = ji + delta
 
-    return refined_coordinates
+def _refine_spot_positions(
+    coordinates: numpy.ndarray, subimgs: List[numpy.ndarray], size: int
+) -> numpy.ndarray:
+    """
+    Improve the coordinate estimates using the radial symmetry center of the
+    (filtered) sub-images of shape `(2 * size + 1, 2 * size + 1)` centered on
+    each coordinate.
+
+    """
+    if not subimgs:
+        return numpy.empty((0, 2), dtype=float)
+    rsc = radial_symmetry_centers(numpy.stack(subimgs), smoothing=False)
+    return coordinates + (rsc - size)
 
 
 def EstimateLatticeConstant(pos):
@@ -523,7 +682,8 @@ def bandpass_filter(image, len_noise, len_object):
     """
     Implements a real-space bandpass filter that suppresses pixel noise and
     long-wavelength image variations while retaining information of a
-    characteristic size.
+    characteristic size. If the image has more than 2 dimensions, only the last
+    2 dimensions are filtered (ie, it's a stack of images).
 
     Adaptation from 'bpass.pro', written by John C. Crocker and David G. Grier.
     Source: http://physics-server.uoregon.edu/~raghu/particle_tracking.html
@@ -545,16 +705,19 @@ def bandpass_filter(image, len_noise, len_object):
 
     """
     image = numpy.asarray(image)
+    stack_dims = (0,) * (image.ndim - 2)  # Do not filter along the extra dimensions
 
     # Low-pass filter using a Gaussian kernel.
-    denoised = ndimage.filters.gaussian_filter(image, len_noise, mode="reflect")
+    denoised = ndimage.filters.gaussian_filter(image, stack_dims + (len_noise, len_noise), mode="reflect")
 
     # Estimate background variations using a boxcar kernel.
     N = 2 * int(round(len_object)) + 1
-    background = ndimage.filters.uniform_filter(image, N, mode="reflect")
+    background = ndimage.filters.uniform_filter(image, (1,) * len(stack_dims) + (N, N), mode="reflect")
 
     if image.dtype.kind == "u":
-        # Use cv2.subtract for unsigned integers (no wrap-around).
-        return cv2.subtract(denoised, background)
+        if image.ndim == 2:
+            # Use cv2.subtract for unsigned integers (no wrap-around).
+            return cv2.subtract(denoised, background)
+        return numpy.where(denoised > background, denoised - background, 0).astype(image.dtype)
     else:
         return numpy.maximum(denoised - background, 0)
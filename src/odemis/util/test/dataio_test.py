@@ -16,17 +16,22 @@ Odemis is distributed in the hope that it will be useful, but WITHOUT ANY WARRAN
 You should have received a copy of the GNU General Public License along with Odemis. If not, see http://www.gnu.org/licenses/.
 '''
 import json
+import multiprocessing
 import os
 import re
+import resource
 import tempfile
 import time
+import tracemalloc
 import unittest
 import warnings
+from concurrent.futures import ProcessPoolExecutor
 
 import numpy
 
 from odemis import model
 from odemis.acq import stream
+from odemis.acq.stitching import REGISTER_GLOBAL_SHIFT
 from odemis.dataio import tiff
 from odemis.util import testing
 from odemis.util.dataio import (
@@ -41,6 +46,21 @@ from odemis.util.dataio import (
 
 FILENAMES = ["test_%d" % i + tiff.EXTENSIONS[0] for i in range(4)]
 
+
+def _stitch_with_file_limit(filenames, nfree):
+    """
+    Stitches the files, while only nfree more files can be opened by the process.
+    Runs in a separate process, as the limit applies to the whole process.
+    """
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    nopen = len(os.listdir("/proc/self/fd"))
+    resource.setrlimit(resource.RLIMIT_NOFILE, (nopen + nfree, hard))
+    try:
+        return open_files_and_stitch(filenames)
+    finally:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (soft, hard))
+
+
 class TestDataIO(unittest.TestCase):
 
     def setUp(self) -> None:
@@ -289,6 +309,110 @@ class TestDataIO(unittest.TestCase):
         testing.assert_tuple_almost_equal(rdata[0].metadata[model.MD_POS], (25e-6, 25e-6))
         testing.assert_tuple_almost_equal(rdata[0].metadata[model.MD_PIXEL_SIZE], (1e-6, 1e-6))
 
+    def test_open_files_and_stitch_streams(self):
+        """
+        Stitch tiles containing 2 streams each, with registration based on the data
+        """
+        # Tiles cut from a large image, with an overlap of 206 px
+        full_sem = numpy.random.randint(0, 4000, size=(306, 306)).astype(numpy.uint16)
+        full_cl = numpy.random.randint(0, 4000, size=(306, 306)).astype(numpy.uint16)
+        for i, (filename, (t, l)) in enumerate(zip(FILENAMES, [(0, 0), (0, 50), (50, 0), (50, 50)])):
+            md = {model.MD_DESCRIPTION: "sem",
+                  model.MD_ACQ_DATE: time.time() + i,
+                  model.MD_PIXEL_SIZE: (1e-6, 1e-6),  # m/px
+                  model.MD_POS: ((l - 25) * 1e-6, -(t - 25) * 1e-6),  # m
+                  model.MD_DWELL_TIME: 1e-6,  # s
+                  }
+            md_cl = md.copy()
+            md_cl[model.MD_DESCRIPTION] = "cl"
+            md_cl[model.MD_OUT_WL] = (400e-9, 700e-9)  # m
+            tiff.export(filename, [model.DataArray(full_sem[t:t + 256, l:l + 256].copy(), md),
+                                   model.DataArray(full_cl[t:t + 256, l:l + 256].copy(), md_cl)])
+
+        rdata = open_files_and_stitch(FILENAMES, REGISTER_GLOBAL_SHIFT)
+
+        self.assertEqual(len(rdata), 2)
+        self.assertEqual(rdata[0].metadata[model.MD_DESCRIPTION], "sem")  # EM stream first
+        self.assertEqual(rdata[1].metadata[model.MD_DESCRIPTION], "cl")
+        for da, full in zip(rdata, (full_sem, full_cl)):
+            self.assertEqual(da.shape, full.shape)
+            # The mean of the overlapping tiles might be rounded differently
+            numpy.testing.assert_allclose(da, full, atol=1)
+            testing.assert_tuple_almost_equal(da.metadata[model.MD_POS], (0, 0))
+
+    def test_open_files_and_stitch_many(self):
+        """
+        Stitch more tiles than files which can be opened at the same time
+        """
+        ntiles = 20, 20  # X, Y
+        size = 16  # px
+        full = numpy.random.randint(0, 4000, size=(ntiles[1] * size, ntiles[0] * size)).astype(numpy.uint16)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filenames = []
+            for i in range(ntiles[0] * ntiles[1]):
+                x, y = i % ntiles[0], i // ntiles[0]
+                md = {model.MD_DESCRIPTION: "sem",
+                      model.MD_ACQ_DATE: time.time() + i,
+                      model.MD_PIXEL_SIZE: (1e-6, 1e-6),  # m/px
+                      model.MD_POS: ((x + 0.5 - ntiles[0] / 2) * size * 1e-6,
+                                     -(y + 0.5 - ntiles[1] / 2) * size * 1e-6),  # m
+                      }
+                tile = full[y * size:(y + 1) * size, x * size:(x + 1) * size].copy()
+                filename = os.path.join(tmpdir, "t%d%s" % (i, tiff.EXTENSIONS[0]))
+                tiff.export(filename, model.DataArray(tile, md))
+                filenames.append(filename)
+
+            # Limit the number of files which can be opened to less than the number of tiles.
+            # It's done in a separate process, so that it doesn't depend on the files opened
+            # by the other tests.
+            ctx = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as executor:
+                rdata = executor.submit(_stitch_with_file_limit, filenames, 64).result()
+
+        self.assertEqual(len(rdata), 1)
+        self.assertEqual(rdata[0].shape, full.shape)
+        numpy.testing.assert_array_equal(rdata[0], full)
+
+    def test_open_files_and_stitch_memory(self):
+        """
+        Check the tiles are not all loaded in memory at the same time while stitching
+        """
+        ntiles = 16, 16  # X, Y
+        size = 128  # px
+        step = size // 4  # px, so the tiles overlap a lot, and the final image is much smaller than all the tiles
+        full = numpy.random.randint(0, 4000, size=((ntiles[1] - 1) * step + size,
+                                                   (ntiles[0] - 1) * step + size)).astype(numpy.uint16)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filenames = []
+            for i in range(ntiles[0] * ntiles[1]):
+                x, y = i % ntiles[0], i // ntiles[0]
+                md = {model.MD_DESCRIPTION: "sem",
+                      model.MD_ACQ_DATE: time.time() + i,
+                      model.MD_PIXEL_SIZE: (1e-6, 1e-6),  # m/px
+                      model.MD_POS: ((x * step + size / 2 - full.shape[1] / 2) * 1e-6,
+                                     -(y * step + size / 2 - full.shape[0] / 2) * 1e-6),  # m
+                      }
+                tile = full[y * step:y * step + size, x * step:x * step + size].copy()
+                filename = os.path.join(tmpdir, "t%d%s" % (i, tiff.EXTENSIONS[0]))
+                tiff.export(filename, model.DataArray(tile, md))
+                filenames.append(filename)
+            tiles_nbytes = ntiles[0] * ntiles[1] * size * size * full.itemsize
+
+            # The first call imports the file format modules, which should not be counted
+            open_files_and_stitch(filenames[:4])
+            tracemalloc.start()
+            try:
+                rdata = open_files_and_stitch(filenames)
+                _, peak = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+
+        self.assertEqual(len(rdata), 1)
+        self.assertEqual(rdata[0].shape, full.shape)
+        self.assertLess(peak, tiles_nbytes / 2,
+                        f"Peak memory of {peak} B, while all the tiles take {tiles_nbytes} B")
+
+
 class TestSplitPlanes(unittest.TestCase):
 
     @classmethod
@@ -23,6 +23,7 @@ import logging
 import math
 import os
 import sys
+import threading
 import time
 import unittest
 from concurrent.futures import CancelledError
@@ -34,6 +35,7 @@ from odemis.driver.simulated import GenericComponent
 from odemis.util import testing
 from odemis.util.driver import (
     DEFAULT_SPEED,
+    MoveMonitor,
     ProgressiveMove,
     estimate_stage_movement_time,
     estimateMoveDuration,
@@ -326,5 +328,86 @@ class TestProgressiveMove(unittest.TestCase):
         self.assertNotEqual(new_pos, self.spec_switch.position.value)
 
 
+class TestMoveMonitor(unittest.TestCase):
+    """
+    Test waiting for the end of a (simulated) move with the MoveMonitor
+    """
+
+    def setUp(self):
+        self.end_moves = {}  # axis -> time at which the move ends
+        self.npolls = 0
+
+    def _get_moving_axes(self, axes):
+        self.npolls += 1
+        now = time.time()
+        return {a for a in axes if self.end_moves[a] > now}
+
+    def test_wait(self):
+        monitor = MoveMonitor(self._get_moving_axes)
+        start = time.time()
+        self.end_moves = {"x": start + 0.3, "y": start + 0.5}
+        updates = []
+        moving = {"x", "y"}
+        ret = monitor.wait(moving, start + 0.5, threading.Event(), on_update=updates.append)
+        dur = time.time() - start
+        self.assertEqual(ret, set())
+        self.assertEqual(moving, set())
+        self.assertGreaterEqual(dur, 0.5)
+        self.assertLess(dur, 0.6)
+        # Updated at least at 10Hz
+        self.assertGreaterEqual(len(updates), 4)
+        # Less polls than with the 1 ms period
+        self.assertLess(self.npolls, 100)
+
+    def test_late_move(self):
+        # If the move takes much longer than expected, the polls slow down
+        monitor = MoveMonitor(self._get_moving_axes, max_period=0.1)
+        start = time.time()
+        self.end_moves = {"x": start + 1}
+        monitor.wait({"x"}, start + 0.1, threading.Event())
+        self.assertGreaterEqual(time.time() - start, 1)
+        self.assertLess(self.npolls, 30)
+
+    def test_timeout(self):
+        monitor = MoveMonitor(self._get_moving_axes)
+        start = time.time()
+        self.end_moves = {"x": start + 10, "y": start + 0.1}
+        moving = {"x", "y"}
+        with self.assertRaises(TimeoutError):
+            monitor.wait(moving, start + 0.1, threading.Event(), max_dur=0.5)
+        self.assertLess(time.time() - start, 1)
+        self.assertEqual(moving, {"x"})
+
+    def test_cancel(self):
+        monitor = MoveMonitor(self._get_moving_axes)
+        start = time.time()
+        self.end_moves = {"x": start + 10}
+        must_stop = threading.Event()
+        threading.Timer(0.2, must_stop.set).start()
+        moving = {"x"}
+        with self.assertRaises(CancelledError):
+            monitor.wait(moving, start + 10, must_stop)
+        self.assertLess(time.time() - start, 0.5)
+        self.assertEqual(moving, {"x"})
+
+    def test_on_poll(self):
+        # The wait can be stopped early, by the on_poll callback
+        monitor = MoveMonitor(self._get_moving_axes)
+        start = time.time()
+        self.end_moves = {"x": start + 10}
+        ret = monitor.wait({"x"}, start + 10, threading.Event(),
+                           on_poll=lambda axes: time.time() > start + 0.2)
+        self.assertEqual(ret, {"x"})
+        self.assertLess(time.time() - start, 0.5)
+
+    def test_error(self):
+        def get_moving_axes(axes):
+            raise IOError("Axis failed")
+
+        monitor = MoveMonitor(get_moving_axes)
+        with self.assertRaises(IOError):
+            monitor.wait({"x"}, time.time() + 1, threading.Event())
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -19,7 +19,7 @@ You should have received a copy of the GNU General Public License along with Ode
 import unittest
 import numpy
 
-from odemis.util.focus import MeasureSpotsFocus, MeasureOpticalFocus
+from odemis.util.focus import MeasureSpotsFocus, MeasureOpticalFocus, FitFocusCurve
 
 
 class TestMeasureOpticalFocus(unittest.TestCase):
@@ -64,5 +64,37 @@ class TestMeasureSpotsFocus(unittest.TestCase):
         self.assertGreater(focus_level, 1)  # Usually much higher than 1e12!
 
 
+class TestFitFocusCurve(unittest.TestCase):
+
+    def test_gaussian(self):
+        pos = numpy.linspace(-50e-6, 80e-6, 7)
+        levels = 1000 * numpy.exp(-(pos - 12e-6) ** 2 / (2 * 20e-6 ** 2)) + 50
+        levels += numpy.random.normal(0, 5, pos.shape)
+        best_pos, width, gaussian = FitFocusCurve(pos, levels)
+        self.assertTrue(gaussian)
+        self.assertAlmostEqual(best_pos, 12e-6, delta=2e-6)
+        self.assertAlmostEqual(width, 20e-6, delta=4e-6)
+
+    def test_parabola(self):
+        # A peak which is not Gaussian at all, should still be found
+        pos = numpy.linspace(-3, 3, 7)
+        levels = 100 - numpy.abs(pos - 0.3) ** 1.5
+        best_pos, width, gaussian = FitFocusCurve(pos, levels)
+        self.assertAlmostEqual(best_pos, 0.3, delta=0.5)
+        self.assertGreater(width, 0)
+
+    def test_no_peak(self):
+        pos = numpy.linspace(-50e-6, 80e-6, 7)
+        # All identical
+        with self.assertRaises(ValueError):
+            FitFocusCurve(pos, numpy.ones(7))
+        # Peak outside of the positions
+        with self.assertRaises(ValueError):
+            FitFocusCurve(pos, pos * 10 + 3)
+        # Too few positions
+        with self.assertRaises(ValueError):
+            FitFocusCurve(pos[:2], [1, 2])
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -297,6 +297,107 @@ class TestHistogram(unittest.TestCase):
         hist_forced, edges = img.histogram(grey_img, edges)
         numpy.testing.assert_array_equal(hist, hist_forced)
 
+    def test_int16(self):
+        depth = 4096
+        size = (1024, 965)
+        grey_img = numpy.zeros(size, dtype="int16") - 1500
+        grey_img[0, 0] = -depth // 2
+        grey_img[0, 1] = depth // 2 - 1
+        hist, edges = img.histogram(grey_img, (-depth // 2, depth // 2 - 1))
+        self.assertEqual(len(hist), depth)
+        self.assertEqual(edges, (-depth // 2, depth // 2 - 1))
+        self.assertEqual(hist[0], 1)
+        self.assertEqual(hist[-1], 1)
+        self.assertEqual(hist[-1500 + depth // 2], grey_img.size - 2)
+
+        hist_auto, edges = img.histogram(grey_img)
+        self.assertEqual(edges, (-2 ** 15, 2 ** 15 - 1))
+        numpy.testing.assert_array_equal(hist, hist_auto[2 ** 15 - depth // 2:2 ** 15 + depth // 2])
+
+    def test_same_as_numpy(self):
+        """
+        Check the short-cuts return the same histogram as numpy.histogram()
+        """
+        size = (256, 300)
+        for dtype, irange in (("uint8", (10, 200)),
+                              ("int8", (-50, 60)),
+                              ("uint16", (100, 5000)),
+                              ("int32", (-70000, 90000)),
+                              ("uint32", (0, 2 ** 32 - 1)),
+                              ("int64", (-2 ** 40, 2 ** 40))):
+            idt = numpy.iinfo(dtype)
+            grey_img = numpy.random.randint(max(idt.min, irange[0] - 100), min(idt.max, irange[1] + 100),
+                                            size=size, dtype=dtype)
+            hist, edges = img.histogram(grey_img, irange)
+            self.assertEqual(edges, irange)
+            length = min(8192, irange[1] - irange[0] + 1)
+            hist_np, _ = numpy.histogram(grey_img, bins=length, range=irange)
+            numpy.testing.assert_array_equal(hist, hist_np)
+
+    def test_float_nan(self):
+        grey_img = numpy.random.random((102, 965))
+        grey_img[0, 0] = numpy.nan
+        hist, edges = img.histogram(grey_img)
+        self.assertEqual(numpy.sum(hist), grey_img.size - 1)
+        self.assertEqual(edges, (numpy.nanmin(grey_img), numpy.nanmax(grey_img)))
+
+    def test_subsample(self):
+        """
+        Check the histogram on a subset of the data is close from the full one
+        """
+        depth = 4096
+        grey_img = numpy.random.randint(0, depth, size=(2048, 2048), dtype="uint16")
+        hist, edges = img.histogram(grey_img, (0, depth - 1))
+        hist_sub, edges_sub = img.histogram(grey_img, (0, depth - 1), max_samples=2 ** 18)
+        self.assertEqual(edges, edges_sub)
+        self.assertEqual(len(hist), len(hist_sub))
+        self.assertLessEqual(numpy.sum(hist_sub), 2 ** 18)
+
+        irange = img.findOptimalRange(hist, edges, 1 / 256)
+        irange_sub = img.findOptimalRange(hist_sub, edges_sub, 1 / 256)
+        numpy.testing.assert_allclose(irange, irange_sub, atol=depth / 256)
+
+    def test_accumulator(self):
+        grey_img = numpy.random.randint(-300, 300, size=(100, 100), dtype="int16")
+        acc = img.HistogramAccumulator(grey_img.dtype)
+        hist, edges = acc.get()
+        self.assertEqual(numpy.sum(hist), 0)
+        for l in grey_img:
+            acc.add(l)
+        hist, edges = acc.get()
+        hist_full, edges_full = img.histogram(grey_img)
+        numpy.testing.assert_array_equal(hist, hist_full)
+        self.assertEqual(edges, edges_full)
+
+        acc.reset()
+        self.assertEqual(numpy.sum(acc.get()[0]), 0)
+
+        # Floats require a range
+        with self.assertRaises(ValueError):
+            img.HistogramAccumulator(numpy.float64)
+        acc = img.HistogramAccumulator(numpy.float64, (0, 1))
+        grey_img = numpy.random.random((100, 100))
+        acc.add(grey_img[:50])
+        acc.add(grey_img[50:])
+        hist, edges = acc.get()
+        hist_full, edges_full = img.histogram(grey_img, (0, 1))
+        numpy.testing.assert_array_equal(hist, hist_full)
+
+    def test_crop(self):
+        grey_img = numpy.zeros((100, 100), dtype="uint16") + 1000
+        grey_img[0, 0] = 10
+        hist, edges = img.histogram(grey_img)
+        chist, cedges = img.cropHistogram(hist, edges, (512, 1535))
+        self.assertEqual(cedges, (512, 1535))
+        self.assertEqual(len(chist), 1024)
+        self.assertEqual(chist[1000 - 512], grey_img.size - 1)
+        self.assertEqual(numpy.sum(chist), grey_img.size - 1)
+
+        # Range larger than the original histogram
+        chist, cedges = img.cropHistogram(hist, edges, (65280, 65791))
+        self.assertEqual(len(chist), 512)
+        self.assertEqual(numpy.sum(chist), 0)
+
     def test_compact(self):
         """
         test the compactHistogram()
@@ -969,6 +1070,40 @@ class TestMeanWithinCircle(unittest.TestCase):
         numpy.testing.assert_almost_equal(m, data[:, :, 15, 10])  # Y, X are in reverse order
 
 
+class TestLineSampling(unittest.TestCase):
+
+    def test_same_as_map_coordinates(self):
+        """
+        Check that sampling the line gives the same result as interpolating each point
+        """
+        import scipy.ndimage
+        data = numpy.random.randint(0, 4000, (6, 30, 40), dtype=numpy.uint16)
+        # Line partly outside of the data, diagonal, and along the X axis
+        lines = [((2, 3), (35, 27)), ((0, 0), (39, 29)), ((39, 5), (0, 5)), ((5, 2.5), (30, 10.2))]
+        for start, end in lines:
+            for width in (1, 2, 5):
+                sampling = img.get_line_sampling(data.shape[-2:], start, end, width)
+                res = img.apply_spatial_sampling(data, sampling)
+                n = 1 + int(math.hypot(end[0] - start[0], end[1] - start[1]))
+                self.assertEqual(res.shape, (data.shape[0], n))
+
+                # Coordinates of all the points, as (Y, X), for each point of the width
+                l = math.hypot(end[0] - start[0], end[1] - start[1])
+                pv = (-(end[1] - start[1]) / l, (end[0] - start[0]) / l)
+                spread = (width - 1) / 2
+                exp = numpy.zeros_like(res)
+                for o in numpy.linspace(-spread, spread, width):
+                    coords = [numpy.linspace(start[1], end[1], n) + pv[1] * o,
+                              numpy.linspace(start[0], end[0], n) + pv[0] * o]
+                    for c in range(data.shape[0]):
+                        exp[c] += scipy.ndimage.map_coordinates(data[c].astype(float), coords, order=1)
+                numpy.testing.assert_allclose(res, exp)
+
+    def test_too_short(self):
+        with self.assertRaises(ValueError):
+            img.get_line_sampling((30, 40), (2, 3), (2.5, 3.5))
+
+
 class TestImageIntegrator(unittest.TestCase):
 
     def setUp(self):
@@ -2068,6 +2203,29 @@ class TestAssembleZCube(unittest.TestCase):
         self.assertGreater(output_rev_z.metadata[model.MD_PIXEL_SIZE][2], 0)
         numpy.testing.assert_array_equal(output_da_after, output_rev_z)
 
+    def test_zcube_to_dataarray(self):
+        """
+        Verify that a pre-allocated cube gets the same data and metadata as when assembled from a list
+        """
+        img_list = []
+        cube = numpy.empty((len(self.z_list),) + self.size, dtype=numpy.uint16)
+        for i in range(len(self.z_list)):
+            im = model.DataArray(numpy.random.randint(0, 220, self.size, dtype=numpy.uint16), self.md)
+            img_list.append(im)
+            cube[i] = im
+
+        exp_da = img.assembleZCube(img_list, self.z_list)
+        output_da = img.zCubeToDataArray(cube, self.md, self.z_list)
+        numpy.testing.assert_array_equal(exp_da, output_da)
+        self.assertEqual(exp_da.metadata, output_da.metadata)
+        # The original metadata should not be modified
+        self.assertEqual(len(self.md[model.MD_POS]), 2)
+
+        # Reversed z order => flipped cube
+        output_rev_z = img.zCubeToDataArray(cube, self.md, self.z_list[::-1])
+        numpy.testing.assert_array_equal(output_rev_z, cube[::-1])
+        self.assertGreater(output_rev_z.metadata[model.MD_PIXEL_SIZE][2], 0)
+
 
 class TestFloodFill(unittest.TestCase):
 
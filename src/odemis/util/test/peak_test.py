@@ -16,6 +16,7 @@ You should have received a copy of the GNU General Public License along with Ode
 '''
 import logging
 import numpy
+from odemis import model
 from odemis.dataio import hdf5
 from odemis.util import peak
 import os
@@ -131,5 +132,69 @@ class TestPeak(unittest.TestCase):
         self.assertRaises(KeyError, peak.Curve, wl, params, offset, type='wrongType')
 
 
+class TestFitCube(unittest.TestCase):
+    """
+    Test peak fitting of a whole spectrum cube
+    """
+
+    def _create_cube(self, wl, shape):
+        """
+        returns (ndarray of shape C11YX, ndarray of shape YX): the spectra, and the expected peak positions
+        """
+        rng = numpy.random.default_rng(0)
+        cube = numpy.empty((len(wl), 1, 1) + shape)
+        exp_pos = numpy.empty(shape)
+        for y, x in numpy.ndindex(*shape):
+            exp_pos[y, x] = 550e-9 + 5e-9 * x + 3e-9 * y
+            cube[:, 0, 0, y, x] = (100 + 1000 * numpy.exp(-(wl - exp_pos[y, x]) ** 2 / (2 * (20e-9) ** 2))
+                                   + rng.normal(0, 10, len(wl)))
+        return cube, exp_pos
+
+    def test_fit_cube(self):
+        wl = numpy.linspace(400e-9, 800e-9, 200)
+        shape = (6, 5)  # Y, X
+        cube, exp_pos = self._create_cube(wl, shape)
+        md = {model.MD_WL_LIST: list(wl),
+              model.MD_POS: (1e-3, 2e-3),
+              model.MD_PIXEL_SIZE: (1e-7, 1e-7),
+              model.MD_DIMS: "CTZYX"}
+        data = model.DataArray(cube, md)
+
+        f = peak.FitCube(data, type='gaussian_space', max_workers=2)
+        pos, width, amplitude = f.result()
+        for m in (pos, width, amplitude):
+            self.assertEqual(m.shape, shape)
+            self.assertEqual(m.metadata[model.MD_POS], md[model.MD_POS])
+            self.assertEqual(m.metadata[model.MD_PIXEL_SIZE], md[model.MD_PIXEL_SIZE])
+        numpy.testing.assert_allclose(pos, exp_pos, atol=5e-9)
+        numpy.testing.assert_allclose(width, 20e-9, rtol=0.35)
+        numpy.testing.assert_allclose(amplitude, 1000, rtol=0.1)
+
+        # Cancelling should stop the computation
+        f = peak.FitCube(data, type='gaussian_energy')
+        f.cancel()
+        self.assertTrue(f.cancelled())
+
+    def test_warm_start(self):
+        """
+        Fitting from the neighbour parameters should be as good as detecting the peaks
+        """
+        wl = numpy.linspace(400e-9, 800e-9, 200)
+        shape = (6, 5)  # Y, X
+        cube, exp_pos = self._create_cube(wl, shape)
+        spectra = numpy.moveaxis(cube[:, 0, 0], 0, -1)  # YXC
+        for ftype in ('gaussian_space', 'gaussian_energy', 'lorentzian_space'):
+            res = peak._FitSpectraBlock(spectra, wl, ftype)
+            numpy.testing.assert_allclose(res[..., 0], exp_pos, atol=2e-9)
+            for y, x in numpy.ndindex(*shape):
+                # Cold fit => strongest peak within the range
+                params, _ = peak._FitPeaks(spectra[y, x], wl, ftype)
+                params = [p for p in params if wl[0] <= p[0] <= wl[-1]]
+                pos, width, amplitude = max(params, key=lambda p: p[2])
+                self.assertLessEqual(abs(res[y, x, 0] - exp_pos[y, x]), abs(pos - exp_pos[y, x]) + 1e-9)
+                if ftype.startswith("gaussian"):
+                    self.assertAlmostEqual(res[y, x, 2], 1000, delta=50)
+
+
 if __name__ == "__main__":
     unittest.main()
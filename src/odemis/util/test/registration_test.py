@@ -446,6 +446,21 @@ class EstimateGridOrientationTest(unittest.TestCase):
         numpy.testing.assert_array_almost_equal(tform.translation, out.translation)
         self.assertAlmostEqual(error_metric, 0.0)
 
+        # Using the previous estimation, with a small shift, as prior
+        prior = AffineTransform(matrix=out.matrix, translation=out.translation + numpy.array([3, -2]))
+        out, error_metric = estimate_grid_orientation_from_img(image, shape, AffineTransform, sigma,
+                                                               prior=prior)
+        numpy.testing.assert_array_almost_equal(tform.matrix, out.matrix)
+        numpy.testing.assert_array_almost_equal(tform.translation, out.translation)
+        self.assertAlmostEqual(error_metric, 0.0)
+
+        # Searching first on a binned image
+        out, error_metric = estimate_grid_orientation_from_img(image, shape, AffineTransform, sigma,
+                                                               binning=4)
+        numpy.testing.assert_array_almost_equal(tform.matrix, out.matrix)
+        numpy.testing.assert_array_almost_equal(tform.translation, out.translation)
+        self.assertAlmostEqual(error_metric, 0.0)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -281,6 +281,20 @@ class TestRadialSymmetryCenter(unittest.TestCase):
         stdev = numpy.std(self.delta.ravel())
         self.assertLess(stdev, 0.05)
 
+    def test_multiple(self):
+        """
+        radial_symmetry_centers should return the same positions as
+        radial_symmetry_center called on each image.
+        """
+        numpy.random.seed(0)
+        imgdata = numpy.random.random_sample((20, 9, 11))
+        imgdata[:, 4, 5] += 5
+        for smoothing in (True, False):
+            coords = spot.radial_symmetry_centers(imgdata, smoothing)
+            self.assertEqual(coords.shape, (20, 2))
+            expected = [spot.radial_symmetry_center(im, smoothing) for im in imgdata]
+            numpy.testing.assert_array_almost_equal(coords, expected)
+
     def test_sanity(self):
         """
         Create an image consisting of all zeros and a single pixel with value
@@ -367,6 +381,34 @@ class TestFindSpotPositions(unittest.TestCase):
         # Check if the sorted arrays are equal
         numpy.testing.assert_array_almost_equal(expected_ji_sorted, ji_sorted)
 
+    def test_binning_and_seed(self):
+        """
+        `find_spot_positions` should find the same spot positions when first
+        searching on a binned image, or around the expected positions.
+        """
+        numpy.random.seed(0)
+        sigma = 1.45
+        jj, ii = numpy.mgrid[0:8, 0:8]
+        loc = numpy.column_stack((100 + 33 * jj.ravel() + 5 * ii.ravel(),
+                                  80 + 41 * ii.ravel() - 3 * jj.ravel()))
+        loc = loc + numpy.random.random_sample(loc.shape)
+        image = synthetic.psf_gaussian((512, 512), loc, sigma)
+        image = (image / image.max() * 1000 + numpy.random.poisson(20, image.shape)).astype(numpy.uint16)
+
+        def sort_ji(ji):
+            return ji[numpy.lexsort((ji[:, 1], ji[:, 0]))]
+
+        expected_ji = sort_ji(spot.find_spot_positions(image, sigma, threshold_rel=0.2, num_spots=64))
+        self.assertEqual(len(expected_ji), 64)
+
+        for binning in (2, 4, 8):
+            ji = spot.find_spot_positions(image, sigma, threshold_rel=0.2, num_spots=64, binning=binning)
+            numpy.testing.assert_allclose(sort_ji(ji), expected_ji, atol=0.01)
+
+        seed = loc + numpy.random.uniform(-4, 4, loc.shape)
+        ji = spot.find_spot_positions(image, sigma, threshold_rel=0.2, num_spots=64, seed=seed)
+        numpy.testing.assert_allclose(sort_ji(ji), expected_ji, atol=0.01)
+
 
 if __name__ == "__main__":
     unittest.main()
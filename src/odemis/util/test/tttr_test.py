@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""
+Created on 18 Oct 2026
+
+@author: agent
+
+Copyright © 2026 agent, Delmic
+
+This file is part of Odemis.
+
+Odemis is free software: you can redistribute it and/or modify it under the terms
+of the GNU General Public License version 2 as published by the Free Software
+Foundation.
+
+Odemis is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+Odemis. If not, see http://www.gnu.org/licenses/.
+"""
+# Test cases for the TTTR decoding functions
+
+import logging
+import unittest
+
+import numpy
+from odemis.util import tttr
+
+logging.getLogger().setLevel(logging.DEBUG)
+
+
+def _photon(nsync, dtime, channel=0):
+    return (channel << 25) | (dtime << 10) | nsync
+
+
+def _marker(nsync, markers=1):
+    return (1 << 31) | (markers << 25) | nsync
+
+
+def _overflow(count):
+    return (1 << 31) | (tttr.HH_T3_OVERFLOW_CHANNEL << 25) | count
+
+
+class TestDecodeHHT3(unittest.TestCase):
+
+    def test_simple(self):
+        records = numpy.array([
+            _marker(0),
+            _photon(5, 100),
+            _photon(1000, 20, channel=1),
+            _overflow(1),
+            _photon(3, 7),  # sync = 1024 + 3
+            _marker(10, markers=2),
+            _overflow(3),  # 3 more wrap arounds
+            _overflow(0),  # old format = 1 wrap around
+            _photon(1, 0x7FFF),
+        ], dtype=numpy.uint32)
+
+        events, offset = tttr.decode_hh_t3(records)
+        self.assertEqual(len(events), 6)  # overflows are removed
+        numpy.testing.assert_array_equal(events.sync, [0, 5, 1000, 1027, 1034, 5 * 1024 + 1])
+        numpy.testing.assert_array_equal(events.dtime, [0, 100, 20, 7, 0, 0x7FFF])
+        numpy.testing.assert_array_equal(events.channel, [1, 0, 1, 0, 2, 0])
+        numpy.testing.assert_array_equal(events.marker, [True, False, False, False, True, False])
+        self.assertEqual(offset, 5 * 1024)
+
+    def test_batches(self):
+        """
+        Decoding in several batches gives the same result as all at once
+        """
+        records = numpy.array([_photon(i % 1024, i % 50) if i % 7 else _overflow(1)
+                               for i in range(1000)], dtype=numpy.uint32)
+        events_all, offset_all = tttr.decode_hh_t3(records)
+
+        offset = 0
+        events = []
+        for b in numpy.array_split(records, 6):
+            ev, offset = tttr.decode_hh_t3(b, offset)
+            events.append(ev)
+        self.assertEqual(offset, offset_all)
+        numpy.testing.assert_array_equal(numpy.concatenate(events), events_all)
+
+    def test_empty(self):
+        events, offset = tttr.decode_hh_t3(numpy.empty((0,), dtype=numpy.uint32), 2048)
+        self.assertEqual(len(events), 0)
+        self.assertEqual(offset, 2048)
+
+
+class TestLifetimeHistograms(unittest.TestCase):
+
+    def test_simple(self):
+        records = numpy.array([
+            _photon(1, 3),  # Before the first pixel => discarded
+            _marker(10),
+            _photon(10, 1),
+            _photon(20, 1),
+            _photon(30, 2, channel=1),
+            _marker(40),
+            _marker(45, markers=2),  # Not a pixel marker
+            _photon(50, 9),  # After the last bin => discarded
+            _photon(60, 0),
+            _marker(70),
+            _photon(80, 3),  # After the last pixel => discarded
+        ], dtype=numpy.uint32)
+        events, _ = tttr.decode_hh_t3(records)
+
+        hist = tttr.lifetime_histograms(events, npixels=2, nbins=4)
+        self.assertEqual(hist.shape, (2, 4))
+        self.assertEqual(hist.dtype, numpy.uint32)
+        numpy.testing.assert_array_equal(hist, [[0, 2, 1, 0], [1, 0, 0, 0]])
+
+        # Only one channel
+        hist = tttr.lifetime_histograms(events, npixels=2, nbins=4, channel=0)
+        numpy.testing.assert_array_equal(hist, [[0, 2, 0, 0], [1, 0, 0, 0]])
+
+        # Rebinned: dtime 9 // 2 = 4 => still discarded
+        hist = tttr.lifetime_histograms(events, npixels=2, nbins=4, rebin=2)
+        numpy.testing.assert_array_equal(hist, [[2, 1, 0, 0], [1, 0, 0, 0]])
+
+        # Using marker 2 as pixel marker
+        hist = tttr.lifetime_histograms(events, npixels=1, nbins=16, pixel_marker=2)
+        self.assertEqual(hist.sum(), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+Created on 18 Oct 2026
+
+@author: agent
+
+Copyright © 2026 agent, Delmic
+
+This file is part of Odemis.
+
+Odemis is free software: you can redistribute it and/or modify it under the
+terms of the GNU General Public License version 2 as published by the Free
+Software Foundation.
+
+Odemis is distributed in the hope that it will be useful, but WITHOUT ANY
+WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+PARTICULAR PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+Odemis. If not, see http://www.gnu.org/licenses/.
+
+"""
+
+# Functions to handle time-tagged time-resolved (TTTR) events, as acquired by
+# the time-correlators (eg, PicoQuant HydraHarp in T3 mode).
+# Each event is either a photon, with the number of the sync (laser) pulse
+# before it, and the time since that pulse ("dtime"), or a marker (eg, the
+# start of a new e-beam pixel), with the number of the sync pulse before it.
+
+from typing import Optional, Tuple
+
+import numpy
+
+# HydraHarp T3 record format (version 2), 32 bits:
+# special (1 bit) | channel (6 bits) | dtime (15 bits) | nsync (10 bits)
+HH_T3_FORMAT = "HH-T3-V2"
+HH_T3_WRAPAROUND = 1024  # number of syncs before nsync wraps around
+HH_T3_OVERFLOW_CHANNEL = 63  # channel of the special records indicating nsync overflows
+HH_T3_MAX_DTIME = 0x7FFF
+
+# Decoded events
+EVENT_DTYPE = numpy.dtype([
+    ("sync", numpy.uint64),  # number of the sync pulse, since the beginning of the acquisition
+    ("dtime", numpy.uint16),  # time since the sync pulse, in units of the resolution
+    ("channel", numpy.uint8),  # input channel for photons, or bitmask of the markers
+    ("marker", numpy.bool_),  # True if it's a marker, False if it's a photon
+])
+
+
+def decode_hh_t3(records: numpy.ndarray, sync_offset: int = 0) -> Tuple[numpy.recarray, int]:
+    """
+    Decode the raw records of a HydraHarp in T3 mode
+    :param records: (uint32) the records, as read from the FIFO of the device
+    :param sync_offset: the number of syncs before the first record. To decode
+      records read in several batches, pass the value returned by the decoding of
+      the previous batch.
+    :return:
+      events (recarray of EVENT_DTYPE): the photons and markers. The overflow
+        records are removed.
+      sync_offset: the number of syncs at the end of the records
+    """
+    records = numpy.asarray(records, dtype=numpy.uint32)
+    special = (records >> 31).astype(bool)
+    channel = ((records >> 25) & 0x3F).astype(numpy.uint8)
+    nsync = (records & 0x3FF).astype(numpy.uint64)
+
+    overflow = special & (channel == HH_T3_OVERFLOW_CHANNEL)
+    # Overflow records contain the number of overflows since the previous one
+    # (0 is for the old format, and means 1)
+    novf = numpy.where(overflow, numpy.maximum(nsync, 1), 0)
+    wraps = numpy.cumsum(novf, dtype=numpy.uint64)
+
+    keep = ~overflow
+    events = numpy.empty(numpy.count_nonzero(keep), dtype=EVENT_DTYPE)
+    events["sync"] = sync_offset + wraps[keep] * HH_T3_WRAPAROUND + nsync[keep]
+    events["dtime"] = (records[keep] >> 10) & HH_T3_MAX_DTIME
+    events["channel"] = channel[keep]
+    events["marker"] = special[keep]
+
+    if wraps.size:
+        sync_offset += int(wraps[-1]) * HH_T3_WRAPAROUND
+    return events.view(numpy.recarray), sync_offset
+
+
+def lifetime_histograms(events: numpy.ndarray, npixels: int, nbins: int,
+                        pixel_marker: int = 1, channel: Optional[int] = None,
+                        rebin: int = 1) -> numpy.ndarray:
+    """
+    Build the histogram of the photon arrival times for each pixel, based on the
+    markers indicating the start of each pixel. As the raw events are kept, the
+    histograms can be computed again, with a different binning, without acquiring
+    again.
+    :param events: (EVENT_DTYPE) the events, ordered by sync, as returned by
+      decode_hh_t3(). The first pixel starts at the first pixel marker.
+    :param npixels: number of pixels. Photons after the last pixel are discarded.
+    :param nbins: number of time bins of each histogram. Photons later than the
+      last bin are discarded.
+    :param pixel_marker: bitmask of the marker(s) indicating a new pixel
+    :param channel: input channel of the photons to use. If None, all are used.
+    :param rebin: number of dtime units merged in each time bin
+    :return: (uint32 array of shape npixels, nbins) the count of photons
+    """
+    is_marker = events["marker"]
+    pixel_starts = events["sync"][is_marker & ((events["channel"] & pixel_marker) != 0)]
+
+    photons = ~is_marker
+    if channel is not None:
+        photons &= events["channel"] == channel
+    pidx = numpy.searchsorted(pixel_starts, events["sync"][photons], side="right") - 1
+    tbin = events["dtime"][photons] // rebin
+
+    valid = (pidx >= 0) & (pidx < npixels) & (tbin < nbins)
+    flat_idx = pidx[valid] * nbins + tbin[valid]
+    hist = numpy.bincount(flat_idx, minlength=npixels * nbins)
+    return hist.astype(numpy.uint32).reshape(npixels, nbins)